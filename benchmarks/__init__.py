@@ -0,0 +1,5 @@
+"""
+Offline micro-benchmarks of the bot's and web app's hot paths
+
+Run with `python -m benchmarks`, see benchmarks/__main__.py for the options.
+"""
@@ -0,0 +1,142 @@
+"""
+Run the hot-path benchmarks and compare against a saved baseline
+
+    python -m benchmarks                 # run all, compare with benchmarks/baseline.json
+    python -m benchmarks --save          # run all and make the results the new baseline
+    python -m benchmarks -k decode       # only benchmarks whose name contains "decode"
+    python -m benchmarks --check         # exit 1 if anything regressed past --threshold
+    python -m benchmarks --capture session.jsonl.gz -k capture   # over a recorded session
+
+Every benchmark is calibrated to run for at least --min-time seconds per
+repeat; the reported time per call is the median of the repeats, the minimum
+is kept next to it because it's the least noisy number on a busy machine.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from benchmarks.suite import BENCHMARKS, Skipped
+
+BASELINE = pathlib.Path(__file__).parent.joinpath('baseline.json')
+
+
+def measure(func, repeat=5, min_time=0.2):
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        # Jump close to the target instead of doubling from 1 for fast functions
+        estimate = int(number * min_time / elapsed * 1.2) if elapsed > 0 else number * 10
+        number = max(number * 2, estimate)
+    times = [elapsed / number] + [t / number for t in timer.repeat(repeat - 1, number)]
+    return {
+        'median_us': round(statistics.median(times) * 1e6, 3),
+        'min_us': round(min(times) * 1e6, 3),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=pathlib.Path(__file__).parent.parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def format_time(microseconds):
+    if microseconds >= 1000:
+        return f'{microseconds / 1000:.2f} ms'
+    return f'{microseconds:.2f} µs'
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Hot-path micro-benchmarks')
+    parser.add_argument('-k', '--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--baseline', default=str(BASELINE), help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per repeat')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent slower that counts as a regression')
+    parser.add_argument('--check', action='store_true', help='exit 1 on regressions')
+    parser.add_argument('--capture', help='recorded session for the capture_* benchmarks, '
+                                          'compare only against a baseline made from the same capture')
+    args = parser.parse_args()
+    if args.capture:
+        os.environ['LOKBOT_CAPTURE'] = args.capture
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+
+    results = {}
+    regressions = []
+    print(f'{"benchmark":<32} {"median":>12} {"min":>12} {"baseline":>12} {"change":>9}')
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        try:
+            func = setup()
+        except Skipped as e:
+            print(f'{name:<32} skipped: {e}')
+            continue
+
+        result = measure(func, repeat=args.repeat, min_time=args.min_time)
+        results[name] = result
+
+        previous = baseline.get(name)
+        change = ''
+        if previous:
+            percent = (result['median_us'] - previous['median_us']) / previous['median_us'] * 100
+            change = f'{percent:+.1f}%'
+            if percent > args.threshold:
+                change += ' !'
+                regressions.append(name)
+        print(f'{name:<32} {format_time(result["median_us"]):>12} {format_time(result["min_us"]):>12} '
+              f'{format_time(previous["median_us"]) if previous else "-":>12} {change:>9}')
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'capture': os.getenv('LOKBOT_CAPTURE'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        if args.filter and os.path.exists(args.baseline):
+            # Partial run, keep the other baseline entries
+            with open(args.baseline) as f:
+                saved = json.load(f)
+            saved['results'].update(results)
+            saved['meta'] = report['meta']
+            report = saved
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+    if regressions:
+        print(f'Slower than baseline by more than {args.threshold:g}%: {", ".join(regressions)}')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+"""
+Local stand-in for the game servers, for end-to-end load tests
+
+Serves the HTTP API LokBotApi talks to (with the lstProtect XOR encoding and
+isPacked responses) and three socket.io servers for the kingdom, field and
+chat connections, all from one asyncio loop:
+
+    python -m benchmarks.fake_server --port 8090
+
+    LOKBOT_API_BASE_URL=http://127.0.0.1:8090/api/ \\
+    LOKBOT_AUTH_BASE_URL=http://127.0.0.1:8090/api/ \\
+    python -m lokbot "$(python -m benchmarks.fake_server --print-token bot1)"
+
+Any JWT-shaped token is accepted and every token gets its own kingdom.  The
+field server answers zone enters with synthetic /field/objects/v4 packs and
+pushes /march/objects; the kingdom server pushes /buff/list and
+/task/update, all at configurable rates.  Endpoints without a handler answer
+{"result": true}.  GET /stats returns request counts and handling times per
+endpoint and the number of socket events sent.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import gzip
+import json
+import random
+import time
+import logging
+
+from benchmarks import fixtures
+
+logger = logging.getLogger(__name__)
+
+# Paths the real server wants XOR-encoded, handed to the client in lstProtect
+PROTECTED_APIS = [
+    'field/march/info',
+    'field/march/start',
+    'field/march/return',
+    'field/rally/start',
+    'field/rally/join',
+    'alliance/battle/list/v2',
+]
+TROOP_CODES = [50100301, 50100302, 50100303, 50100304, 50100305]
+
+
+def make_token(user_id):
+    """Unsigned JWT-shaped token, the bot only reads _id from the payload"""
+    def encode(document):
+        return base64.urlsafe_b64encode(json.dumps(document).encode()).decode().rstrip('=')
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'_id': user_id})}.fake"
+
+
+def token_user(token):
+    try:
+        body = token.split('.')[1]
+        return json.loads(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))).get('_id')
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def iso(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+class Kingdom:
+    """Per-token game state the handlers read and change"""
+
+    def __init__(self, user_id, rng):
+        self.user_id = user_id
+        self.id = fixtures.object_id(rng)
+        self.field_object_id = fixtures.object_id(rng)
+        self.loc = [fixtures.WORLD_ID, rng.randrange(64, 1984), rng.randrange(64, 1984)]
+        self.resources = [rng.randrange(10 ** 6, 10 ** 8) for _ in range(4)]
+        self.marches = {}  # march id -> march
+        self.buffs = []
+        self.troops = [{'code': code, 'amount': rng.randrange(10 ** 4, 10 ** 6)} for code in TROOP_CODES]
+
+    def document(self):
+        return {
+            '_id': self.id,
+            'name': f'fake_{self.user_id}',
+            'level': 30,
+            'worldId': fixtures.WORLD_ID,
+            'loc': self.loc,
+            'fieldObjectId': self.field_object_id,
+            'resources': self.resources,
+            'vip': {'level': 8},
+            'dragoActionPoint': {'value': 50},
+            'allianceId': None,
+            'buildings': [],
+        }
+
+    def expire_marches(self, now):
+        for march_id in [i for i, march in self.marches.items() if march['endTime'] <= now]:
+            del self.marches[march_id]
+
+
+class FakeGameServer:
+    def __init__(self, host='127.0.0.1', port=8090, objects_per_zone=30, march_rate=1.0, buff_interval=120,
+                 task_rate=0.1, chat_rate=0.0, zone_delay=0.2, latency=0.0, error_rate=0.0,
+                 packed_threshold=4096, respawn_interval=300, seed=0):
+        self.host = host
+        self.port = port
+        self.objects_per_zone = objects_per_zone
+        self.march_rate = march_rate  # /march/objects pushes per second per field connection
+        self.buff_interval = buff_interval
+        self.task_rate = task_rate  # /task/update pushes per second per kingdom connection
+        self.chat_rate = chat_rate
+        self.zone_delay = zone_delay  # seconds before a zone enter is answered
+        self.latency = latency  # added to every HTTP response
+        self.error_rate = error_rate  # share of HTTP requests answered with err.code=duplicated
+        self.packed_threshold = packed_threshold  # responses larger than this are sent gzip packed
+        self.respawn_interval = respawn_interval
+        self.rng = random.Random(seed)
+
+        self.kingdoms = {}  # user id -> Kingdom
+        self.sessions = {}  # (role, sid) -> Kingdom
+        self.requests = collections.Counter()
+        self.handling_time = collections.defaultdict(float)
+        self.errors = collections.Counter()
+        self.emitted = collections.Counter()
+        self.started = time.time()
+
+        self.routes = {
+            'auth/connect': self.auth_connect,
+            'auth/login': self.auth_login,
+            'kingdom/enter': self.kingdom_enter,
+            'kingdom/profile/troops': self.profile_troops,
+            'field/march/info': self.march_info,
+            'field/march/start': self.march_start,
+            'field/march/return': self.march_return,
+            'field/rally/start': self.march_start,
+            'field/rally/join': self.march_start,
+            'alliance/battle/list/v2': self.battle_list,
+            'item/list': self.item_list,
+            'drago/lair/list': lambda kingdom, data: {'dragos': []},
+            'kingdom/task/all': lambda kingdom, data: {'kingdomTasks': []},
+            'chat/logs': lambda kingdom, data: {'chats': []},
+        }
+
+    def kingdom_for(self, token):
+        user_id = token_user(token) or 'anonymous'
+        kingdom = self.kingdoms.get(user_id)
+        if kingdom is None:
+            kingdom = self.kingdoms[user_id] = Kingdom(user_id, self.rng)
+        return kingdom
+
+    def url(self, path='', port=None):
+        return f'http://{self.host}:{port or self.port}{path}'
+
+    # region HTTP API
+
+    def auth_connect(self, kingdom, data):
+        region_hash = f'fake-{fixtures.XOR_PASSWORD}-region'
+        return {
+            'token': make_token(kingdom.user_id),
+            'lstProtect': base64.b64encode(json.dumps([self.url(f'/api/{path}') for path in PROTECTED_APIS]).encode()).decode(),
+            'regionHash': base64.b64encode(json.dumps(region_hash).encode()).decode(),
+        }
+
+    def auth_login(self, kingdom, data):
+        user_id = data.get('email') or fixtures.object_id(self.rng)
+        return {'token': make_token(user_id)}
+
+    def kingdom_enter(self, kingdom, data):
+        return {
+            'kingdom': kingdom.document(),
+            'networks': {
+                'kingdoms': [self.url(port=self.port + 1)],
+                'fields': [self.url(port=self.port + 2)],
+                'chats': [self.url(port=self.port + 3)],
+            },
+        }
+
+    def profile_troops(self, kingdom, data):
+        kingdom.expire_marches(time.time())
+        return {'troops': {'field': list(kingdom.marches.values()), 'info': {'marchLimit': 5, 'marchSize': 200000}}}
+
+    def march_info(self, kingdom, data):
+        kingdom.expire_marches(time.time())
+        return {
+            'troops': kingdom.troops,
+            'saveTroops': [],
+            'numMarch': len(kingdom.marches),
+            'limitMarch': 5,
+            'fo': {'_id': fixtures.object_id(self.rng), 'loc': data.get('toLoc'), 'occupied': None},
+        }
+
+    def march_start(self, kingdom, data):
+        now = time.time()
+        kingdom.expire_marches(now)
+        if len(kingdom.marches) >= 5:
+            return None, 'full_march'
+        duration = self.rng.uniform(60, 600)
+        march = {
+            '_id': fixtures.object_id(self.rng),
+            'fromId': kingdom.field_object_id,
+            'fromLoc': kingdom.loc,
+            'toId': data.get('toId') or data.get('rallyMoId'),
+            'toLoc': data.get('toLoc') or kingdom.loc,
+            'state': 1,
+            'marchType': data.get('marchType', 1),
+            'startTime': iso(now),
+            'endTime': now + duration,
+            'troops': data.get('marchTroops', []),
+        }
+        kingdom.marches[march['_id']] = march
+        return {'newMarch': dict(march, endTime=iso(march['endTime']))}
+
+    def march_return(self, kingdom, data):
+        kingdom.marches.pop(data.get('moId'), None)
+        return {}
+
+    def battle_list(self, kingdom, data):
+        battles = []
+        for _ in range(self.rng.randrange(0, 6)):
+            monster = self.rng.choice(fixtures.load_asset('field_monster.json'))
+            battles.append({
+                '_id': fixtures.object_id(self.rng),
+                'rallyMoId': fixtures.object_id(self.rng),
+                'targetMonster': {'code': monster['code'], 'level': monster.get('level') or 1},
+                'state': 1,
+                'numMarch': self.rng.randrange(1, 9),
+                'maxMarch': 10,
+                'endTime': iso(time.time() + self.rng.uniform(60, 600)),
+                'toLoc': fixtures.random_loc(self.rng, kingdom.loc[1:]),
+            })
+        return {'battles': battles}
+
+    def item_list(self, kingdom, data):
+        items = fixtures.load_asset('item.json')
+        return {'items': [{'code': item['code'], 'amount': 10} for item in items[:200] if 'code' in item]}
+
+    def encode_response(self, path, protected, document):
+        if self.packed_threshold and path != 'auth/connect':
+            raw = json.dumps(document, separators=(',', ':')).encode()
+            if len(raw) > self.packed_threshold:
+                document = {'result': True, 'isPacked': True, 'payload': list(gzip.compress(raw))}
+        if protected:
+            return fixtures.b64xor_enc(document)
+        return json.dumps(document, separators=(',', ':'))
+
+    async def handle_api(self, request):
+        from aiohttp import web
+
+        started = time.perf_counter()
+        path = request.match_info['path']
+        protected = path in PROTECTED_APIS
+        form = await request.post()
+        raw = form.get('json') or '{}'
+        try:
+            data = fixtures.b64xor_dec(raw) if protected and not raw.startswith('{') else json.loads(raw)
+        except ValueError:
+            data = {}
+
+        kingdom = self.kingdom_for(request.headers.get('X-Access-Token') or data.get('token'))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            document = {'result': False, 'err': {'code': 'duplicated'}}
+        else:
+            handler = self.routes.get(path)
+            result = handler(kingdom, data) if handler else {}
+            if isinstance(result, tuple):
+                document = {'result': False, 'err': {'code': result[1]}}
+            else:
+                document = dict(result, result=True)
+
+        if not document['result']:
+            self.errors[path] += 1
+        self.requests[path] += 1
+        self.handling_time[path] += time.perf_counter() - started
+        return web.Response(text=self.encode_response(path, protected, document), content_type='application/json')
+
+    async def handle_stats(self, request):
+        from aiohttp import web
+
+        elapsed = time.time() - self.started
+        return web.json_response({
+            'uptime': round(elapsed, 1),
+            'kingdoms': len(self.kingdoms),
+            'connections': collections.Counter(role for role, _ in self.sessions),
+            'requests_per_second': round(sum(self.requests.values()) / elapsed, 2) if elapsed else 0,
+            'endpoints': {
+                path: {
+                    'requests': count,
+                    'errors': self.errors[path],
+                    'avg_ms': round(self.handling_time[path] / count * 1000, 3),
+                }
+                for path, count in self.requests.most_common()
+            },
+            'emitted': dict(self.emitted),
+        })
+
+    # endregion
+
+    # region socket.io
+
+    def socket_server(self, role):
+        import socketio
+
+        sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*', logger=False, engineio_logger=False)
+
+        @sio.on('connect')
+        async def connect(sid, environ):
+            query = dict(part.split('=', 1) for part in environ.get('QUERY_STRING', '').split('&') if '=' in part)
+            self.sessions[(role, sid)] = self.kingdom_for(query.get('token'))
+
+        @sio.on('disconnect')
+        async def disconnect(sid):
+            self.sessions.pop((role, sid), None)
+
+        return sio
+
+    async def emit(self, sio, event, data, sid):
+        await sio.emit(event, data, room=sid)
+        self.emitted[event] += 1
+
+    def kingdom_socket(self):
+        sio = self.socket_server('kingdom')
+
+        @sio.on('/kingdom/enter')
+        async def kingdom_enter(sid, data):
+            sio.start_background_task(self.push_kingdom_events, sio, sid)
+
+        return sio
+
+    async def push_kingdom_events(self, sio, sid):
+        next_buffs = 0
+        while ('kingdom', sid) in self.sessions:
+            kingdom = self.sessions[('kingdom', sid)]
+            now = time.time()
+            if now >= next_buffs:
+                kingdom.buffs = [
+                    {'_id': fixtures.object_id(self.rng), 'buffType': 1, 'param': {'itemCode': code},
+                     'ability': [], 'expiredDate': iso(now + self.rng.uniform(600, 7200))}
+                    for code in (10101008, 10101009)
+                ]
+                await self.emit(sio, '/buff/list', kingdom.buffs, sid)
+                next_buffs = now + self.buff_interval
+            if self.task_rate and self.rng.random() < self.task_rate:
+                await self.emit(sio, '/task/update', {
+                    '_id': fixtures.object_id(self.rng),
+                    'code': self.rng.choice([1, 3, 6, 8]),
+                    'status': self.rng.choice([2, 3]),
+                }, sid)
+            await asyncio.sleep(1)
+
+    def field_socket(self):
+        sio = self.socket_server('field')
+
+        @sio.on('/field/enter/v3')
+        async def field_enter(sid, data):
+            kingdom = self.sessions.get(('field', sid))
+            if kingdom is None:
+                return
+            await self.emit(sio, '/field/enter/v3', fixtures.b64xor_enc({'loc': kingdom.loc}), sid)
+            sio.start_background_task(self.push_march_objects, sio, sid)
+
+        @sio.on('/zone/enter/list/v4')
+        async def zone_enter(sid, data):
+            try:
+                zones = json.loads(fixtures.b64xor_dec(data).get('zones', '[]'))
+            except (ValueError, TypeError):
+                return
+            await asyncio.sleep(self.zone_delay)
+            epoch = int(time.time() // self.respawn_interval)
+            objects = [obj for zone_id in zones for obj in fixtures.zone_objects(zone_id, self.objects_per_zone, epoch)]
+            await self.emit(sio, '/field/objects/v4', {'packs': fixtures.encode_pack({'objects': objects})}, sid)
+
+        @sio.on('/zone/leave/list/v2')
+        async def zone_leave(sid, data):
+            pass
+
+        return sio
+
+    async def push_march_objects(self, sio, sid):
+        while self.march_rate and ('field', sid) in self.sessions:
+            kingdom = self.sessions[('field', sid)]
+            kingdom.expire_marches(time.time())
+            marches = fixtures.march_objects(self.rng.randrange(20, 80), seed=self.rng.random(), center=kingdom.loc[1:])
+            marches.extend(dict(march, endTime=iso(march['endTime'])) for march in kingdom.marches.values())
+            await self.emit(sio, '/march/objects', {'packs': fixtures.encode_pack({'objects': marches})}, sid)
+            await asyncio.sleep(1 / self.march_rate)
+
+    def chat_socket(self):
+        sio = self.socket_server('chat')
+
+        @sio.on('/chat/enter')
+        async def chat_enter(sid, data):
+            sio.start_background_task(self.push_chat, sio, sid)
+
+        return sio
+
+    async def push_chat(self, sio, sid):
+        while self.chat_rate and ('chat', sid) in self.sessions:
+            await self.emit(sio, '/chat/message', {
+                'from': f'player{self.rng.randrange(1000)}',
+                'text': 'hello',
+                'chatChannel': f'w{fixtures.WORLD_ID}',
+            }, sid)
+            await asyncio.sleep(1 / self.chat_rate)
+
+    # endregion
+
+    async def start(self):
+        from aiohttp import web
+
+        api = web.Application()
+        api.router.add_post('/api/{path:.*}', self.handle_api)
+        api.router.add_get('/stats', self.handle_stats)
+        applications = [api]
+        for sio in (self.kingdom_socket(), self.field_socket(), self.chat_socket()):
+            app = web.Application()
+            sio.attach(app)
+            applications.append(app)
+
+        for offset, app in enumerate(applications):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, self.port + offset).start()
+        logger.info(f'Fake game server: API on {self.url()}, sockets on ports {self.port + 1}-{self.port + 3}')
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start())
+        loop.run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.fake_server', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090, help='API port, sockets use the next three')
+    parser.add_argument('--objects-per-zone', type=int, default=30)
+    parser.add_argument('--march-rate', type=float, default=1.0, help='/march/objects per second per field connection')
+    parser.add_argument('--task-rate', type=float, default=0.1, help='/task/update per second per kingdom connection')
+    parser.add_argument('--buff-interval', type=float, default=120, help='seconds between /buff/list pushes')
+    parser.add_argument('--chat-rate', type=float, default=0.0, help='/chat/message per second per chat connection')
+    parser.add_argument('--zone-delay', type=float, default=0.2, help='seconds before a zone enter is answered')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every HTTP response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered "duplicated"')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--print-token', metavar='USER_ID', help='print a token for USER_ID and exit')
+    args = parser.parse_args()
+
+    if args.print_token:
+        print(make_token(args.print_token))
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    FakeGameServer(
+        host=args.host, port=args.port, objects_per_zone=args.objects_per_zone, march_rate=args.march_rate,
+        buff_interval=args.buff_interval, task_rate=args.task_rate, chat_rate=args.chat_rate,
+        zone_delay=args.zone_delay, latency=args.latency, error_rate=args.error_rate, seed=args.seed,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
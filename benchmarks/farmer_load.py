@@ -0,0 +1,141 @@
+"""
+Run N real bots against the fake game server and report their cost
+
+    python -m benchmarks.farmer_load --bots 20 --duration 300
+
+Starts benchmarks.fake_server in a subprocess (unless --server points at one
+already running), launches `python -m lokbot` once per bot with the API base
+URLs pointed at it, then samples every bot's CPU and RSS from /proc until
+--duration is over.  The report has per-bot averages, the server's request
+counts and the socket events it pushed.
+"""
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fake_server import make_token
+from lokbot.proc_telemetry import read_process
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return json.load(response)
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not answer within {timeout}s')
+
+
+def launch_bots(count, server, config_file, log_directory):
+    bots = []
+    for index in range(count):
+        env = dict(os.environ)
+        env.update({
+            'LOKBOT_API_BASE_URL': f'{server}/api/',
+            'LOKBOT_AUTH_BASE_URL': f'{server}/api/',
+            'LOKBOT_CONFIG': config_file,
+            'LOKBOT_INSTANCE_ID': f'load_{index}',
+        })
+        log = open(os.path.join(log_directory, f'bot_{index}.log'), 'wb')
+        process = subprocess.Popen([sys.executable, '-m', 'lokbot', make_token(f'load{index:04d}')],
+                                   cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        bots.append((process, log))
+    return bots
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.farmer_load', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bots', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=120, help='seconds to run after the last bot started')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between samples')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--server', help='URL of an already running fake server, e.g. http://127.0.0.1:8090')
+    parser.add_argument('--config', default=str(ROOT.joinpath('config.example.json')), help='bot config file')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    parser.add_argument('--keep-logs', action='store_true', help="don't delete the bot logs")
+    args, server_args = parser.parse_known_args()
+
+    server_process = None
+    server = args.server
+    if not server:
+        server = f'http://127.0.0.1:{args.port}'
+        server_process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.fake_server', '--port', str(args.port)] + server_args, cwd=ROOT)
+    wait_for(f'{server}/stats')
+
+    log_directory = tempfile.mkdtemp(prefix='lokbot-load-')
+    bots = launch_bots(args.bots, server, args.config, log_directory)
+    samples = {process.pid: [] for process, _ in bots}
+    started = time.time()
+    try:
+        while time.time() - started < args.duration:
+            time.sleep(args.interval)
+            now = time.time()
+            for process, _ in bots:
+                counters = read_process(process.pid)
+                if counters is not None and process.poll() is None:
+                    samples[process.pid].append((now, counters))
+            alive = sum(process.poll() is None for process, _ in bots)
+            print(f'{now - started:6.0f}s  {alive}/{len(bots)} bots running', flush=True)
+        stats = wait_for(f'{server}/stats')
+    finally:
+        for process, log in bots:
+            process.terminate()
+        for process, log in bots:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait(timeout=10)
+
+    per_bot = []
+    for pid, points in samples.items():
+        if len(points) < 2:
+            continue
+        (first_time, first), (last_time, last) = points[0], points[-1]
+        per_bot.append({
+            'cpu_percent': (last['cpu_seconds'] - first['cpu_seconds']) / (last_time - first_time) * 100,
+            'rss_mb': last['rss_mb'],
+            'peak_rss_mb': last['peak_rss_mb'] or last['rss_mb'],
+            'threads': last['threads'],
+        })
+
+    report = {
+        'bots': args.bots,
+        'bots_sampled': len(per_bot),
+        'exited_early': [process.args[-1] for process, _ in bots if process.returncode not in (None, -15)],
+        'duration': args.duration,
+        'server': stats,
+    }
+    if per_bot:
+        for field in ('cpu_percent', 'rss_mb', 'peak_rss_mb', 'threads'):
+            values = [bot[field] for bot in per_bot]
+            report[field] = {'mean': round(statistics.mean(values), 2), 'max': round(max(values), 2)}
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.keep_logs:
+        print(f'Bot logs in {log_directory}')
+    else:
+        shutil.rmtree(log_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Deterministic fixtures for the benchmarks
+
+Socket packs are generated from the game's own asset tables
+(lokbot/assets/field_object.json and field_monster.json) with a seeded RNG,
+then encoded the way the server sends them: JSON, XOR with the session key,
+base64, gzip.  No recorded traffic, tokens or account data is needed, and
+every run sees the same input.
+"""
+import base64
+import gzip
+import json
+import pathlib
+import random
+
+ASSETS = pathlib.Path(__file__).parent.parent.joinpath('lokbot', 'assets')
+
+# The real key is handed out by the server per session, any string works for decoding speed
+XOR_PASSWORD = 'benchmark-xor-password'
+WORLD_ID = 1
+MAP_SIZE = 2048
+
+
+def load_asset(name):
+    with open(ASSETS.joinpath(name)) as f:
+        return json.load(f)
+
+
+def object_id(rng):
+    return ''.join(rng.choice('0123456789abcdef') for _ in range(24))
+
+
+def random_loc(rng, center=None, spread=256):
+    if center is None:
+        return [WORLD_ID, rng.randrange(MAP_SIZE), rng.randrange(MAP_SIZE)]
+    return [
+        WORLD_ID,
+        min(max(center[0] + rng.randint(-spread, spread), 0), MAP_SIZE - 1),
+        min(max(center[1] + rng.randint(-spread, spread), 0), MAP_SIZE - 1),
+    ]
+
+
+_kinds = None
+
+
+def object_kinds():
+    """Every mine and monster the field can show"""
+    global _kinds
+    if _kinds is None:
+        _kinds = load_asset('field_object.json') + load_asset('field_monster.json')
+    return _kinds
+
+
+def field_object(rng, loc):
+    kind = rng.choice(object_kinds())
+    return {
+        '_id': object_id(rng),
+        'code': kind['code'],
+        'level': kind.get('level') or rng.randint(1, 5),
+        'loc': loc,
+        'state': 1 if rng.random() < 0.9 else 2,
+        'expired': '2030-01-01T00:00:00.000Z',
+    }
+
+
+def field_objects(count=500, seed=1, center=(1024, 1024)):
+    """Objects as in a decoded /field/objects/v4 pack: mines, monsters, about 10% not in state 1"""
+    rng = random.Random(seed)
+    return [field_object(rng, random_loc(rng, center)) for _ in range(count)]
+
+
+def zone_objects(zone_id, count=30, seed=0):
+    """Objects inside one 32x32 zone"""
+    rng = random.Random(f'{zone_id}:{seed}')
+    zone_x, zone_y = zone_id % 64 * 32, zone_id // 64 * 32
+    return [
+        field_object(rng, [WORLD_ID, zone_x + rng.randrange(32), zone_y + rng.randrange(32)])
+        for _ in range(count)
+    ]
+
+
+def march_objects(count=200, seed=2, center=(1024, 1024)):
+    """Marches as in a decoded /march/objects pack"""
+    rng = random.Random(seed)
+    marches = []
+    for _ in range(count):
+        marches.append({
+            '_id': object_id(rng),
+            'fromId': object_id(rng),
+            'toId': object_id(rng),
+            'fromLoc': random_loc(rng, center),
+            'toLoc': random_loc(rng, center),
+            'state': rng.choice([1, 2, 7]),
+            'marchType': rng.choice([1, 2, 5]),
+        })
+    return marches
+
+
+def socf_targets(seed=3, count=6):
+    """socf_thread targets entries in config format, a handful of codes with a few levels each"""
+    rng = random.Random(seed)
+    codes = sorted({kind['code'] for kind in object_kinds()})
+    return [
+        {'code': code, 'level': sorted(rng.sample(range(1, 6), 2)), 'enabled': True}
+        for code in rng.sample(codes, count)
+    ]
+
+
+def xor(data, password=XOR_PASSWORD):
+    key = password.encode()
+    return bytes(byte ^ key[index % len(key)] for index, byte in enumerate(data))
+
+
+def b64xor_enc(document, password=XOR_PASSWORD):
+    return base64.b64encode(xor(json.dumps(document, separators=(',', ':')).encode(), password)).decode()
+
+
+def b64xor_dec(text, password=XOR_PASSWORD):
+    return json.loads(xor(base64.b64decode(text), password))
+
+
+def encode_pack(document, password=XOR_PASSWORD):
+    """gzip(base64(xor(json))) - the bytes found in data['packs']"""
+    return gzip.compress(b64xor_enc(document, password).encode())
@@ -0,0 +1,304 @@
+"""
+Hot-path benchmarks
+
+Each benchmark is a setup function registered with @benchmark; it builds its
+inputs and returns the zero-argument callable that is timed, or raises
+Skipped when something it needs isn't available.  Setup runs once, outside
+the timing.  The capture_* benchmarks run over the socket packs of a recorded
+session (lokbot.recorder) named by LOKBOT_CAPTURE, and are skipped without one.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import time
+import types
+
+from benchmarks import fixtures
+
+BENCHMARKS = {}
+_devnull = open(os.devnull, 'w')
+
+
+class Skipped(Exception):
+    pass
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _require(module_name):
+    """Import a module of the bot, Skipped if one of its dependencies isn't installed"""
+    import importlib
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise Skipped(f'{module_name} needs {e.name}')
+    quiet_logging()
+    return module
+
+
+def _temp_directory():
+    directory = tempfile.mkdtemp(prefix='lokbot-bench-')
+    atexit.register(shutil.rmtree, directory, True)
+    return directory
+
+
+def quiet_logging():
+    """Keep the cost of formatting log records but don't print them"""
+    import logging
+    from loguru import logger
+    logger.remove()
+    logger.add(lambda message: None, level='INFO')
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream is not _devnull:
+            handler.setStream(_devnull)
+
+
+def _api():
+    client = _require('lokbot.client')
+    api = client.LokBotApi.__new__(client.LokBotApi)
+    api.xor_password = fixtures.XOR_PASSWORD
+    return api
+
+
+def _farmer():
+    """LokFarmer with just the state the benchmarked methods use, no login or sockets"""
+    farmer_module = _require('lokbot.farmer')
+    farmer = farmer_module.LokFarmer.__new__(farmer_module.LokFarmer)
+    farmer.api = _api()
+    return farmer_module, farmer
+
+
+# region decoding
+
+@benchmark('xor_1k')
+def xor_1k():
+    api = _api()
+    data = os.urandom(1024)
+    return lambda: api.xor(data)
+
+
+@benchmark('xor_64k')
+def xor_64k():
+    api = _api()
+    data = os.urandom(64 * 1024)
+    return lambda: api.xor(data)
+
+
+@benchmark('b64xor_dec_field_objects')
+def b64xor_dec_field_objects():
+    import gzip
+    api = _api()
+    payload = gzip.decompress(fixtures.encode_pack({'objects': fixtures.field_objects(500)}))
+    return lambda: api.b64xor_dec(payload)
+
+
+@benchmark('decode_field_objects_pack')
+def decode_field_objects_pack():
+    """What on_field_objects does before filtering: gzip, base64, XOR, JSON"""
+    import gzip
+    api = _api()
+    packs = fixtures.encode_pack({'objects': fixtures.field_objects(500)})
+    return lambda: api.b64xor_dec(gzip.decompress(bytearray(packs)))
+
+
+@benchmark('decode_march_objects_pack')
+def decode_march_objects_pack():
+    import gzip
+    api = _api()
+    packs = fixtures.encode_pack({'objects': fixtures.march_objects(200)})
+    return lambda: api.b64xor_dec(gzip.decompress(bytearray(packs)))
+
+# endregion
+
+
+# region farmer
+
+@benchmark('field_objects_target_filter')
+def field_objects_target_filter():
+    farmer_module, _ = _farmer()
+    from lokbot.config_watcher import CompiledConfig
+    target_levels = CompiledConfig.compile_targets(fixtures.socf_targets())
+    objects = fixtures.field_objects(500)
+    return lambda: list(farmer_module.iter_target_objects(objects, target_levels))
+
+
+@benchmark('nearest_zone_ng')
+def nearest_zone_ng():
+    _, farmer = _farmer()
+    return lambda: farmer._get_nearest_zone_ng(1024, 1024, radius=8)
+
+
+@benchmark('is_object_being_marched')
+def is_object_being_marched():
+    """Lookup of a location no march targets, every march is compared; the 3.5 s wait is skipped"""
+    farmer_module, farmer = _farmer()
+    from lokbot.health import TimedLock
+
+    farmer.march_objects_lock = TimedLock('march_objects_lock')
+    farmer.march_objects_data = {'objects': fixtures.march_objects(200)}
+    farmer.march_objects_last_update = time.time()
+    farmer.max_march_data_age = 3600
+    farmer.march_data_by_zone = {}
+    farmer.march_data_validation_errors = 0
+    target_loc = [fixtures.WORLD_ID, 5, 5]
+
+    no_wait = types.ModuleType('time')
+    no_wait.__dict__.update(time.__dict__)
+    no_wait.sleep = lambda seconds: None
+
+    def run():
+        farmer_module.time = no_wait
+        try:
+            return farmer._is_object_being_marched(target_loc, 'f' * 24)
+        finally:
+            farmer_module.time = time
+
+    return run
+
+
+@benchmark('eligible_researches')
+def eligible_researches():
+    """Every research checked against a mid-game kingdom"""
+    planner_module = _require('lokbot.upgrade_planner')
+    enum = _require('lokbot.enum')
+    state = _require('lokbot.kingdom_state').KingdomState()
+    state.load_kingdom({'buildings': [{'position': 1, 'code': enum.BUILDING_CODE_MAP['academy'], 'level': 15}]})
+    planner = planner_module.UpgradePlanner(state)
+    planner.load_researches([
+        {'code': code, 'level': 3} for category in enum.RESEARCH_CODE_MAP.values() for code in category.values()
+    ])
+    resources = [10 ** 7] * 4
+    return lambda: planner.eligible_researches(resources, to_max_level=True)
+
+
+@benchmark('plan_speedups')
+def plan_speedups():
+    """Exact plan for a 3 day task over a large universal speedup stock"""
+    speedup = _require('lokbot.speedup')
+    stock = {code: (seconds, 50 + index * 7) for index, (code, seconds)
+             in enumerate(_require('lokbot.enum').ITEM_CODE_SPEEDUP_MAP['universal'].items())}
+    return lambda: speedup.plan_speedups(3 * 86400 + 1234, stock)
+
+# endregion
+
+
+# region web app and config
+
+@benchmark('add_notification')
+def add_notification():
+    """add_notification into fresh stores and a temporary database, not the real ones"""
+    web_app = _require('web_app')
+    from lokbot.notification_broker import NotificationBroker
+    from lokbot.notification_db import NotificationDatabase
+    from lokbot.notification_store import NotificationStore
+
+    directory = _temp_directory()
+    web_app.notification_broker = NotificationBroker(log_size=200)
+    web_app.notification_store = NotificationStore(capacity=150, dedup_window=30, retention=7 * 24 * 3600)
+    web_app.notification_db = NotificationDatabase(os.path.join(directory, 'notifications.db'))
+
+    counter = iter(range(10 ** 9))
+
+    def run():
+        # Distinct messages, so none are dropped as duplicates
+        web_app.add_notification('benchmark', 'gathering', 'Gathering Started', f'march {next(counter)}',
+                                 account_name='Benchmark', instance_id='benchmark_1')
+
+    return run
+
+
+def _config_copy():
+    """ConfigHelper and a scratch copy of config.example.json"""
+    config_helper = _require('lokbot.config_helper')
+    path = os.path.join(_temp_directory(), 'config.json')
+    shutil.copy(fixtures.ASSETS.parent.parent.joinpath('config.example.json'), path)
+    return config_helper.ConfigHelper, path
+
+
+@benchmark('config_load')
+def config_load():
+    """load_config of an unchanged file (served from the config store cache)"""
+    helper, path = _config_copy()
+    return lambda: helper.load_config(path)
+
+
+@benchmark('config_load_changed')
+def config_load_changed():
+    """load_config after the file changed on disk, parsed again every time"""
+    helper, path = _config_copy()
+
+    def run():
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        return helper.load_config(path)
+
+    return run
+
+
+@benchmark('config_save')
+def config_save():
+    helper, path = _config_copy()
+    document = helper.load_config(path)
+    return lambda: helper.save_config(document, path)
+
+# endregion
+
+
+# region recorded session
+
+def _capture_packs(event):
+    """API with the capture's XOR key, and the packs of every recorded `event`"""
+    path = os.getenv('LOKBOT_CAPTURE')
+    if not path:
+        raise Skipped('no LOKBOT_CAPTURE')
+    import base64
+    import json
+    recorder = _require('lokbot.recorder')
+    records = recorder.read_capture(path)
+
+    api = _api()
+    for record in records:
+        if record.get('k') == 'api' and record['p'] == 'auth/connect' and record['r'].get('regionHash'):
+            api.xor_password = json.loads(base64.b64decode(record['r']['regionHash']).decode()).split('-')[1]
+    packs = [
+        bytearray(record['d']['packs']) for record in records
+        if record.get('k') == 'in' and record['e'] == event and isinstance(record.get('d'), dict)
+        and record['d'].get('packs')
+    ]
+    if not packs:
+        raise Skipped(f'no {event} packs in {path}')
+    return api, packs
+
+
+@benchmark('capture_decode_field_objects')
+def capture_decode_field_objects():
+    """Decoding every /field/objects/v4 pack of the capture"""
+    import gzip
+    api, packs = _capture_packs('/field/objects/v4')
+    return lambda: [api.b64xor_dec(gzip.decompress(pack)) for pack in packs]
+
+
+@benchmark('capture_field_objects_filter')
+def capture_field_objects_filter():
+    """Target filtering of every decoded /field/objects/v4 pack of the capture"""
+    import gzip
+    api, packs = _capture_packs('/field/objects/v4')
+    farmer_module, _ = _farmer()
+    from lokbot.config_watcher import CompiledConfig
+    target_levels = CompiledConfig.compile_targets(fixtures.socf_targets())
+    decoded = [api.b64xor_dec(gzip.decompress(pack)).get('objects') or [] for pack in packs]
+    return lambda: [list(farmer_module.iter_target_objects(objects, target_levels)) for objects in decoded]
+
+
+@benchmark('capture_decode_march_objects')
+def capture_decode_march_objects():
+    import gzip
+    api, packs = _capture_packs('/march/objects')
+    return lambda: [api.b64xor_dec(gzip.decompress(pack)) for pack in packs]
+
+# endregion
@@ -0,0 +1,377 @@
+"""
+Load generator for the web app
+
+    python -m benchmarks.web_load --url http://127.0.0.1:5000 --username load --password secret \\
+        --bots 50 --browsers 20 --duration 120
+
+Simulates N bot instances sending /api/march_status_update,
+/api/object_notification and /api/rally_notification events, and M
+logged-in browser sessions that poll /api/status (revalidating with
+If-None-Match like the dashboard) and hold the notification stream open.
+The stream is opened at whatever /api/notifications/stream_url hands out,
+so the evented stream server is measured when it's running.
+
+By default (--mode channel) every simulated bot is an EventEmitter connected
+to the web app's unix socket event channel, the way real bots report; the
+per-endpoint numbers are then the time to queue an event, and the delivery
+latency covers the whole path through EventChannelServer and
+dispatch_bot_event.  --mode http posts every event over HTTP instead, the
+fallback bots use when the channel is unavailable.
+
+Reports p50/p95/p99 latency and error rate per endpoint, stream connect time
+and notification delivery latency (from a bot's post to the event arriving on
+a stream), and the server's RSS, threads and open files sampled from /proc.
+With --start the web app is started on a free port for the run; otherwise
+pass --server-pid to get the resource samples.  Only standard library HTTP is
+used, so the tool runs wherever the web app does.
+"""
+import argparse
+import collections
+import http.cookiejar
+import json
+import os
+import pathlib
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from lokbot.event_channel import EventEmitter, EVENT_SOCKET_ENV, DEFAULT_EVENT_SOCKET
+from lokbot.proc_telemetry import read_process
+
+ROOT = pathlib.Path(__file__).parent.parent
+BOT_ENDPOINTS = ('/api/march_status_update', '/api/object_notification', '/api/rally_notification')
+SENT_MARKER = re.compile(r'\[load sent=(\d+\.\d+)\]')
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.error_samples = {}
+        self.stream_connects = []
+        self.stream_events = 0
+        self.stream_drops = 0
+        self.delivery = []
+        self.resources = []
+        self.emitters = []
+
+    def request(self, name, seconds, error=None):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if error is not None:
+                self.errors[name] += 1
+                self.error_samples.setdefault(name, str(error)[:200])
+
+    def summary(self, duration):
+        def stats(values):
+            if not values:
+                return None
+            return {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(max(values) * 1000, 1),
+            }
+
+        with self.lock:
+            endpoints = {}
+            for name, values in sorted(self.latencies.items()):
+                endpoints[name] = dict(stats(values), errors=self.errors[name],
+                                       error_rate=round(self.errors[name] / len(values), 4),
+                                       per_second=round(len(values) / duration, 1))
+                if name in self.error_samples:
+                    endpoints[name]['first_error'] = self.error_samples[name]
+            total = sum(len(values) for values in self.latencies.values())
+            report = {
+                'requests': total,
+                'requests_per_second': round(total / duration, 1),
+                'error_rate': round(sum(self.errors.values()) / total, 4) if total else None,
+                'endpoints': endpoints,
+                'streams': {
+                    'connect': stats(self.stream_connects),
+                    'events': self.stream_events,
+                    'dropped': self.stream_drops,
+                    'delivery': stats(self.delivery),
+                },
+            }
+            if self.emitters:
+                report['channel'] = {
+                    'connected': sum(emitter.connected.is_set() for emitter in self.emitters),
+                    'sent': sum(emitter.sent_count for emitter in self.emitters),
+                    'dropped': sum(emitter.dropped_count for emitter in self.emitters),
+                }
+            if self.resources:
+                rss = [sample['rss_mb'] for sample in self.resources]
+                report['server'] = {
+                    'rss_start_mb': rss[0],
+                    'rss_end_mb': rss[-1],
+                    'rss_peak_mb': max(rss),
+                    'threads_peak': max(sample['threads'] for sample in self.resources),
+                    'fds_peak': max(sample['fds'] or 0 for sample in self.resources),
+                    'cpu_percent': round((self.resources[-1]['cpu_seconds'] - self.resources[0]['cpu_seconds'])
+                                         / duration * 100, 1),
+                }
+        return report
+
+
+class LoadRun:
+    def __init__(self, args, results):
+        self.args = args
+        self.results = results
+        self.stop = threading.Event()
+
+    def timed(self, name, opener, request, timeout=30):
+        started = time.perf_counter()
+        try:
+            with opener.open(request, timeout=timeout) as response:
+                body = response.read()
+                self.results.request(name, time.perf_counter() - started)
+                return response, body
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                self.results.request(name, time.perf_counter() - started)
+                return e, b''
+            self.results.request(name, time.perf_counter() - started, f'HTTP {e.code}')
+        except (OSError, ValueError) as e:
+            self.results.request(name, time.perf_counter() - started, e)
+        return None, None
+
+    # region bots
+
+    def bot_payload(self, endpoint, index, rng):
+        instance_id = f'load_{index}'
+        common = {'user_id': self.args.username, 'instance_id': instance_id, 'account_name': f'Load {index}'}
+        if endpoint == '/api/march_status_update':
+            return dict(common, current_marches=rng.randint(0, 5), march_limit=5, march_size=200000,
+                        timestamp=time.time())
+        message = f'Load test event from {instance_id} [load sent={time.time():.6f}]'
+        if endpoint == '/api/object_notification':
+            return dict(common, object_name=rng.choice(['Crystal Mine', 'Dragon Soul', 'Gold Mine']),
+                        level=rng.randint(1, 5), loc=[1, rng.randrange(2048), rng.randrange(2048)],
+                        formatted_message=message)
+        return dict(common, notification_type=rng.choice(['rally_join', 'rally_start', 'rally_alert']),
+                    formatted_message=message)
+
+    def bot(self, index):
+        rng = random.Random(index)
+        interval = 1 / self.args.bot_rate
+        if self.args.mode == 'channel':
+            send = self.channel_sender(index)
+        else:
+            opener = urllib.request.build_opener()
+
+            def send(endpoint, payload):
+                request = urllib.request.Request(
+                    self.args.url + endpoint, data=json.dumps(payload).encode(),
+                    headers={'Content-Type': 'application/json'}, method='POST')
+                self.timed(endpoint, opener, request)
+
+        self.stop.wait(rng.uniform(0, interval))
+        while not self.stop.is_set():
+            endpoint = rng.choice(BOT_ENDPOINTS)
+            send(endpoint, self.bot_payload(endpoint, index, rng))
+            self.stop.wait(rng.expovariate(1 / interval))
+
+    def channel_sender(self, index):
+        """send(endpoint, payload) over an event channel connection of its own, like a bot process"""
+        emitter = EventEmitter(self.args.event_socket, {
+            'user_id': self.args.username, 'instance_id': f'load_{index}',
+            'account_name': f'Load {index}', 'pid': os.getpid(),
+        })
+        with self.results.lock:
+            self.results.emitters.append(emitter)
+        emitter.connected.wait(10)
+
+        def send(endpoint, payload):
+            started = time.perf_counter()
+            queued = emitter.emit(endpoint, payload)
+            self.results.request(endpoint, time.perf_counter() - started,
+                                 None if queued else 'not connected or queue full')
+
+        return send
+
+    # endregion
+
+    # region browsers
+
+    def login(self):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        form = urllib.parse.urlencode({'username': self.args.username, 'password': self.args.password}).encode()
+        response, _ = self.timed('/login', opener, urllib.request.Request(self.args.url + '/login', data=form))
+        if response is None:
+            return None
+        probe, _ = self.timed('/api/status', opener, urllib.request.Request(self.args.url + '/api/status'))
+        return opener if probe is not None else None
+
+    def browser(self, index):
+        rng = random.Random(f'browser{index}')
+        opener = self.login()
+        if opener is None:
+            return
+        threading.Thread(target=self.stream, args=(opener,), daemon=True, name=f'stream-{index}').start()
+        etag = None
+        while not self.stop.wait(rng.uniform(0.8, 1.2) * self.args.poll_interval):
+            headers = {'If-None-Match': etag} if etag else {}
+            response, _ = self.timed('/api/status', opener,
+                                     urllib.request.Request(self.args.url + '/api/status', headers=headers))
+            if response is not None:
+                etag = response.headers.get('ETag') or etag
+
+    def stream(self, opener):
+        while not self.stop.is_set():
+            response, body = self.timed('/api/notifications/stream_url', opener,
+                                        urllib.request.Request(self.args.url + '/api/notifications/stream_url'))
+            if response is None:
+                self.stop.wait(5)
+                continue
+            url = urllib.parse.urljoin(self.args.url + '/', json.loads(body)['url'])
+            started = time.perf_counter()
+            try:
+                with opener.open(url, timeout=60) as stream:
+                    connected = False
+                    for line in stream:
+                        if not connected:
+                            with self.results.lock:
+                                self.results.stream_connects.append(time.perf_counter() - started)
+                            connected = True
+                        if self.stop.is_set():
+                            return
+                        if line.startswith(b'data:'):
+                            self.stream_event(line[5:])
+            except (OSError, ValueError):
+                if not self.stop.is_set():
+                    with self.results.lock:
+                        self.results.stream_drops += 1
+                    self.stop.wait(1)
+
+    def stream_event(self, data):
+        received = time.time()
+        match = SENT_MARKER.search(data.decode(errors='replace'))
+        with self.results.lock:
+            self.results.stream_events += 1
+            if match:
+                self.results.delivery.append(received - float(match.group(1)))
+
+    # endregion
+
+    def sample_server(self, pid):
+        while not self.stop.is_set():
+            counters = read_process(pid)
+            if counters is not None:
+                with self.results.lock:
+                    self.results.resources.append(counters)
+            self.stop.wait(self.args.sample_interval)
+
+    def run(self, pid=None):
+        threads = [threading.Thread(target=self.browser, args=(index,), daemon=True)
+                   for index in range(self.args.browsers)]
+        threads += [threading.Thread(target=self.bot, args=(index,), daemon=True) for index in range(self.args.bots)]
+        if pid:
+            threading.Thread(target=self.sample_server, args=(pid,), daemon=True).start()
+        for thread in threads:
+            thread.start()
+
+        started = time.time()
+        while time.time() - started < self.args.duration:
+            time.sleep(min(10, self.args.duration - (time.time() - started)))
+            with self.results.lock:
+                count = sum(len(values) for values in self.results.latencies.values())
+                errors = sum(self.results.errors.values())
+            print(f'{time.time() - started:6.0f}s  {count} requests, {errors} errors', flush=True)
+        self.stop.set()
+        if pid:
+            # One last sample with the load still applied
+            counters = read_process(pid)
+            if counters is not None:
+                self.results.resources.append(counters)
+        return time.time() - started
+
+
+def start_web_app(event_socket):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, PORT=str(port), **{EVENT_SOCKET_ENV: event_socket})
+    process = subprocess.Popen([sys.executable, 'web_app.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'web_app.py exited with {process.returncode}')
+        try:
+            urllib.request.urlopen(url + '/health', timeout=1).close()
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('web_app.py did not answer /health within 60s')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.web_load', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--start', action='store_true', help='start web_app.py on a free port for the run')
+    parser.add_argument('--server-pid', type=int, help='sample this process for RSS and CPU')
+    parser.add_argument('--username', required=True, help='web app user the browsers log in as and bots post for')
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--mode', choices=('channel', 'http'), default='channel',
+                        help='how the bots report: over the event channel (default) or HTTP posts')
+    parser.add_argument('--event-socket', help='event channel socket of the web app, '
+                                               f'default ${EVENT_SOCKET_ENV} or {DEFAULT_EVENT_SOCKET}')
+    parser.add_argument('--bots', type=int, default=20)
+    parser.add_argument('--bot-rate', type=float, default=0.5, help='events per second per bot')
+    parser.add_argument('--browsers', type=int, default=10)
+    parser.add_argument('--poll-interval', type=float, default=5, help='seconds between /api/status polls')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--sample-interval', type=float, default=1, help='seconds between server samples')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    server = None
+    pid = args.server_pid
+    if args.start and not args.event_socket:
+        # A socket of its own, so the run doesn't take over a web app already running here
+        args.event_socket = os.path.join(tempfile.mkdtemp(prefix='web_load'), 'events.sock')
+    args.event_socket = os.path.abspath(
+        args.event_socket or os.environ.get(EVENT_SOCKET_ENV) or ROOT / DEFAULT_EVENT_SOCKET)
+    if args.start:
+        server, args.url = start_web_app(args.event_socket)
+        pid = server.pid
+    args.url = args.url.rstrip('/')
+
+    results = Results()
+    try:
+        duration = LoadRun(args, results).run(pid)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = dict(results.summary(duration), mode=args.mode, bots=args.bots, bot_rate=args.bot_rate, browsers=args.browsers,
+                  duration=round(duration, 1))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if not results.latencies:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
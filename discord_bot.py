@@ -5,7 +5,10 @@ import json
 import os
 import logging
 import subprocess
+import lokbot
 from lokbot.config_helper import ConfigHelper
+from lokbot.config_store import config_store
+from lokbot.output_reactor import get_reactor
 
 # Note: This bot provides multiple commands for configuration, 
 # but the recommended way to configure is through the unified
@@ -21,10 +24,11 @@ import http.server
 import threading
 import platform
 
-# Set up logging
+# Set up logging; the lokbot modules log through loguru into data/logs/discord/
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+lokbot.setup_logging('discord')
 
 # Load environment variables
 load_dotenv()
@@ -171,12 +175,10 @@ async def start_bot(interaction: discord.Interaction, config_file: str = None):
                 # Check if user already has a configuration
                 if os.path.exists(config_path):
                     logger.info(f"User {user_id}: Using existing user config")
-                    with open(config_path, "r") as f:
-                        config_data = json.load(f)
+                    config_data = config_store.load(config_path)
                 else:
                     logger.info(f"User {user_id}: Creating new config from main template")
-                    with open(source_config_path, "r") as f:
-                        config_data = json.load(f)
+                    config_data = config_store.load(source_config_path)
 
                 # Add captcha solver config if not present
                 if "captcha_solver_config" not in config_data:
@@ -220,8 +222,7 @@ async def start_bot(interaction: discord.Interaction, config_file: str = None):
                     del config_data["rally_start"]
                     logger.info(f"User {user_id}: Migrated rally_start to rally.start")
 
-                with open(config_path, "w") as f:
-                    json.dump(config_data, f)
+                config_store.save(config_path, config_data)
 
                 # Log the token length for debugging (without revealing the actual token)
                 logger.info(f"User {user_id}: Starting bot with token length: {len(token)}")
@@ -490,6 +491,9 @@ async def status(interaction: discord.Interaction):
 async def monitor_logs(user, process):
     """Monitor bot status and display only essential status updates"""
     user_id = str(user.id)
+    # Cleared when this loop stops reading, the reactor keeps draining the pipes
+    # so the bot never blocks on a full pipe, but the lines are dropped
+    monitoring = threading.Event()
     try:
         # Add error handling for sending DMs
         try:
@@ -506,38 +510,52 @@ async def monitor_logs(user, process):
         output_buffer = []
         critical_error_count = 0
 
-        # Set subprocess pipes to non-blocking mode
-        import fcntl
-        import os
-
-        # Set stdout to non-blocking
-        stdout_fd = process.stdout.fileno()
-        fl = fcntl.fcntl(stdout_fd, fcntl.F_GETFL)
-        fcntl.fcntl(stdout_fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
-        # Set stderr to non-blocking
-        stderr_fd = process.stderr.fileno()
-        fl = fcntl.fcntl(stderr_fd, fcntl.F_GETFL)
-        fcntl.fcntl(stderr_fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        # The shared output reactor reads both pipes, lines come back to this loop through a queue
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        reactor = get_reactor()
+        key = f"discord_{user_id}_{process.pid}"
+
+        def deliver(name, line):
+            if monitoring.is_set():
+                loop.call_soon_threadsafe(lines.put_nowait, (name, line))
+
+        monitoring.set()
+        for stream_name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+            reactor.watch(
+                key, stream,
+                lambda line, name=stream_name: deliver(name, line),
+                on_close=lambda name=stream_name: deliver(name, None),
+            )
+        open_streams = 2
 
         # Add timeout for startup to prevent hanging
         start_time = discord.utils.utcnow()
         timeout = 300  # 5 minutes timeout
 
         while True:
-            # Check for timeout during startup
+            # Wait for output, but never past the startup timeout
+            wait = None
             if not startup_complete:
                 elapsed = (discord.utils.utcnow() - start_time).total_seconds()
-                if elapsed > timeout:
-                    logger.warning(f"Startup timeout for user {user_id} after {elapsed} seconds")
-                    try:
-                        await user.send("❌ LokBot startup timed out. The process is still running but not responding as expected.")
-                    except:
-                        pass
-                    break
+                wait = timeout - elapsed
+            try:
+                if wait is not None and wait <= 0:
+                    raise asyncio.TimeoutError()
+                stream_name, line = await asyncio.wait_for(lines.get(), wait)
+            except asyncio.TimeoutError:
+                logger.warning(f"Startup timeout for user {user_id} after {timeout} seconds")
+                try:
+                    await user.send("❌ LokBot startup timed out. The process is still running but not responding as expected.")
+                except:
+                    pass
+                break
 
-            # Check if process has ended
-            if process.poll() is not None:
+            # Both pipes closed, the process has ended
+            if line is None:
+                open_streams -= 1
+                if open_streams > 0:
+                    continue
                 # Process ended - check if we have an error message
                 if not startup_complete and output_buffer:
                     error_message = "❌ LokBot failed to start properly. Possible issues:\n"
@@ -556,82 +574,69 @@ async def monitor_logs(user, process):
                     pass
                 break
 
-            # Try to read output without blocking
-            try:
-                output = process.stdout.readline()
-                if output:
-                    stripped_output = output.strip()
-                    logger.info(f"User {user_id} LokBot Output: {stripped_output}")
-
-                    # Store recent outputs for error analysis
-                    output_buffer.append(stripped_output)
-                    if len(output_buffer) > 10:  # Keep only the last 10 messages
-                        output_buffer.pop(0)
-
-                    # Check for successful startup
-                    if "kingdom/enter" in stripped_output and "result\": true" in stripped_output:
-                        if not startup_complete:
-                            startup_complete = True
-                            try:
-                                await user.send("✅ LokBot has successfully connected to the game server!")
-                            except:
-                                logger.error(f"Failed to send success message to user {user_id}")
-            except (BlockingIOError, IOError):
-                # No data available right now, continue
-                pass
-            except Exception as e:
-                logger.error(f"Error processing stdout for user {user_id}: {str(e)}")
-
-            # Try to read errors without blocking
-            try:
-                error = process.stderr.readline()
-                if error:
-                    stripped_error = error.strip()
-                    logger.error(f"User {user_id} LokBot Error: {stripped_error}")
-
-                    # Detect auth errors
-                    if "NoAuthException" in stripped_error or "auth/connect" in stripped_error:
-                        auth_error_detected = True
-                        # Send auth error message
+            if stream_name == "stdout":
+                stripped_output = line.strip()
+                if not stripped_output:
+                    continue
+                logger.info(f"User {user_id} LokBot Output: {stripped_output}")
+
+                # Store recent outputs for error analysis
+                output_buffer.append(stripped_output)
+                if len(output_buffer) > 10:  # Keep only the last 10 messages
+                    output_buffer.pop(0)
+
+                # Check for successful startup
+                if "kingdom/enter" in stripped_output and "result\": true" in stripped_output:
+                    if not startup_complete:
+                        startup_complete = True
                         try:
-                            await user.send("❌ Authentication failed! Your token appears to be invalid or expired. Please get a new token and try again.")
+                            await user.send("✅ LokBot has successfully connected to the game server!")
                         except:
-                            pass
-                        return
+                            logger.error(f"Failed to send success message to user {user_id}")
+                continue
+
+            stripped_error = line.strip()
+            if not stripped_error:
+                continue
+            logger.error(f"User {user_id} LokBot Error: {stripped_error}")
+
+            # Detect auth errors
+            if "NoAuthException" in stripped_error or "auth/connect" in stripped_error:
+                auth_error_detected = True
+                # Send auth error message
+                try:
+                    await user.send("❌ Authentication failed! Your token appears to be invalid or expired. Please get a new token and try again.")
+                except:
+                    pass
+                return
 
-                    # Only send critical errors to Discord (limit to prevent spam)
-                    if "CRITICAL" in stripped_error or "ERROR" in stripped_error or "FATAL" in stripped_error:
-                        critical_error_count += 1
-                        if critical_error_count <= 3:  # Limit to 3 critical errors
-                            try:
-                                # Extract the actual error message for better clarity
-                                error_message = "❌ Critical error detected: "
-                                if "CRITICAL" in stripped_error:
-                                    error_message += stripped_error.split("CRITICAL")[-1].strip()
-                                elif "ERROR" in stripped_error:
-                                    error_message += stripped_error.split("ERROR")[-1].strip()
-                                elif "FATAL" in stripped_error:
-                                    error_message += stripped_error.split("FATAL")[-1].strip()
-                                else:
-                                    error_message += "Check logs for details."
-
-                                await user.send(error_message[:1900] + "..." if len(error_message) > 1900 else error_message)
-                            except discord.errors.HTTPException as e:
-                                logger.error(f"Failed to send Discord error message to user {user_id}: {str(e)}")
-            except (BlockingIOError, IOError):
-                # No data available right now, continue
-                pass
-            except Exception as e:
-                logger.error(f"Error processing stderr for user {user_id}: {str(e)}")
+            # Only send critical errors to Discord (limit to prevent spam)
+            if "CRITICAL" in stripped_error or "ERROR" in stripped_error or "FATAL" in stripped_error:
+                critical_error_count += 1
+                if critical_error_count <= 3:  # Limit to 3 critical errors
+                    try:
+                        # Extract the actual error message for better clarity
+                        error_message = "❌ Critical error detected: "
+                        if "CRITICAL" in stripped_error:
+                            error_message += stripped_error.split("CRITICAL")[-1].strip()
+                        elif "ERROR" in stripped_error:
+                            error_message += stripped_error.split("ERROR")[-1].strip()
+                        elif "FATAL" in stripped_error:
+                            error_message += stripped_error.split("FATAL")[-1].strip()
+                        else:
+                            error_message += "Check logs for details."
 
-            # Wait a bit before checking again
-            await asyncio.sleep(0.1)
+                        await user.send(error_message[:1900] + "..." if len(error_message) > 1900 else error_message)
+                    except discord.errors.HTTPException as e:
+                        logger.error(f"Failed to send Discord error message to user {user_id}: {str(e)}")
     except Exception as e:
         logger.error(f"Error in status monitoring for user {user_id}: {str(e)}")
         try:
             await user.send("❌ Error monitoring LokBot status. Check server logs for details.")
         except:
             logger.error(f"Failed to send error message to user {user_id}")
+    finally:
+        monitoring.clear()
 
 
 @tree.command(name="login_with_token", description="Start the bot using a token")
@@ -713,12 +718,10 @@ async def start_bot_with_token(interaction, token, config_file=None, account_nam
         # Check if user already has a configuration
         if os.path.exists(config_path):
             logger.info(f"User {user_id}: Using existing user config")
-            with open(config_path, "r") as f:
-                config_data = json.load(f)
+            config_data = config_store.load(config_path)
         else:
             logger.info(f"User {user_id}: Creating new config from main template")
-            with open(source_config_path, "r") as f:
-                config_data = json.load(f)
+            config_data = config_store.load(source_config_path)
 
         # Add captcha solver config if not present
         if "captcha_solver_config" not in config_data:
@@ -762,8 +765,7 @@ async def start_bot_with_token(interaction, token, config_file=None, account_nam
             del config_data["rally_start"]
             logger.info(f"User {user_id}: Migrated rally_start to rally.start")
 
-        with open(config_path, "w") as f:
-            json.dump(config_data, f)
+        config_store.save(config_path, config_data)
 
         # Log the token length for debugging (without revealing the actual token)
         logger.info(f"Starting bot with token length: {len(token)}")
@@ -917,12 +919,10 @@ async def start_bot_with_email(interaction, email, password, account_name, confi
             # Check if user already has a configuration
             if os.path.exists(config_path):
                 logger.info(f"User {user_id}: Using existing user config")
-                with open(config_path, "r") as f:
-                    config_data = json.load(f)
+                config_data = config_store.load(config_path)
             else:
                 logger.info(f"User {user_id}: Creating new config from main template")
-                with open(source_config_path, "r") as f:
-                    config_data = json.load(f)
+                config_data = config_store.load(source_config_path)
 
             # Add captcha solver config if not present
             if "captcha_solver_config" not in config_data:
@@ -966,8 +966,7 @@ async def start_bot_with_email(interaction, email, password, account_name, confi
                 del config_data["rally_start"]
                 logger.info(f"User {user_id}: Migrated rally_start to rally.start")
 
-            with open(config_path, "w") as f:
-                json.dump(config_data, f)
+            config_store.save(config_path, config_data)
 
             # Get user ID from token and save token to file
             _id = decode_jwt(token).get('_id')
@@ -1169,8 +1168,7 @@ except Exception as e:
         config_file = f"data/config_{str(interaction.user.id)}.json"
         try:
             # Load the configuration
-            with open(config_file, "r") as f:
-                config = json.load(f)
+            config = config_store.load(config_file)
 
             # Parse the config section path (e.g., rally.join, features.discord, etc.)
             parts = config_section.split('.')
@@ -1237,8 +1235,7 @@ except Exception as e:
                             logger.info(f"Updating rally {rally_type} enabled state to: {new_state}")
 
                             # Save the updated configuration
-                            with open(config_file, "w") as f:
-                                json.dump(config, f, indent=2)
+                            config_store.save(config_file, config, indent=2)
 
                             await button_interaction.response.edit_message(
                                 content=f"Rally {rally_type.capitalize()} {'enabled' if new_state else 'disabled'}!",
@@ -1299,8 +1296,7 @@ except Exception as e:
                     logger.info(f"Updating job {feature} enabled state to: {new_state}")
 
                     # Save the updated configuration
-                    with open(config_file, "w") as f:
-                        json.dump(config, f, indent=2)
+                    config_store.save(config_file, config, indent=2)
 
                     await interaction.response.send_message(
                         f"Job {feature} {'enabled' if new_state else 'disabled'}!",
@@ -1344,8 +1340,7 @@ except Exception as e:
                     logger.info(f"Updating thread {feature} enabled state to: {new_state}")
 
                     # Save the updated configuration
-                    with open(config_file, "w") as f:
-                        json.dump(config, f, indent=2)
+                    config_store.save(config_file, config, indent=2)
 
                     await interaction.response.send_message(
                         f"Thread {feature} {'enabled' if new_state else 'disabled'}!",
@@ -1458,8 +1453,7 @@ except Exception as e:
                     logger.info(f"Updating feature {feature} enabled state to: {new_state}")
 
                     # Save the updated configuration
-                    with open(config_file, "w") as f:
-                        json.dump(config, f, indent=2)
+                    config_store.save(config_file, config, indent=2)
 
                     await interaction.response.send_message(
                         f"Feature {feature} {'enabled' if new_state else 'disabled'}!",
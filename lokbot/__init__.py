@@ -11,7 +11,7 @@ project_root = pathlib.Path(__file__).parent.parent
 project_root.joinpath('data').mkdir(exist_ok=True)
 
 
-def load_config(config_name=None):
+def find_config_path(config_name=None):
     os.chdir(project_root)
     
     # First check environment variable for config
@@ -30,7 +30,7 @@ def load_config(config_name=None):
         if os.path.exists(config_path):
             logger.debug(f"Found config file in root directory: {config_path}")
             logger.info(f"Loading config from {config_path}")
-            return json.load(open(config_path))
+            return config_path
             
         # Check in configs directory
         configs_path = os.path.join(project_root, 'configs', f"{config_name}.json")
@@ -38,7 +38,7 @@ def load_config(config_name=None):
         if os.path.exists(configs_path):
             logger.debug(f"Found config file in configs directory")
             logger.info(f"Loading config from configs directory: {configs_path}")
-            return json.load(open(configs_path))
+            return configs_path
             
         logger.warning(f"Specified config {config_name} not found in any location")
         logger.debug(f"Searched locations:\n- {config_path}\n- {configs_path}")
@@ -46,18 +46,31 @@ def load_config(config_name=None):
     # Fallback to default config
     if os.path.exists('config.json'):
         logger.info("Loading default config.json")
-        return json.load(open('config.json'))
+        return 'config.json'
 
     # Last resort - example config
     if os.path.exists('config.example.json'):
         logger.warning("Using example config as fallback")
-        return json.load(open('config.example.json'))
+        return 'config.example.json'
 
     logger.error("No valid config file found")
-    return {}
+    return None
+
+
+def load_config(config_name=None):
+    path = find_config_path(config_name)
+    if path is None:
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
 
-config = load_config()
+# The file `config` was loaded from, watched for live reloads (see lokbot.config_watcher)
+config_path = find_config_path()
+config = {}
+if config_path is not None:
+    with open(config_path) as f:
+        config = json.load(f)
 
 # Disable socket.io and engineio logging completely
 logging.getLogger('socketio').setLevel(logging.CRITICAL)
@@ -105,6 +118,21 @@ if config.get('socketio', {}).get('debug', False):
 
 # endregion
 
-logger.remove()
-logger.add(project_root.joinpath('data/main.log'), rotation='1 hour', retention=48)
-logger.add(sys.stdout, colorize=True)
+def setup_logging(process=None):
+    """
+    Log to stdout and to this instance's indexed segments in data/logs/<instance>/
+
+    Called again in forked bot processes, whose instance id is only known after the fork,
+    and by the processes that aren't bot instances (web app, fork server template, discord
+    bot) with their own directory name, every directory has exactly one writing process.
+    """
+    from lokbot.log_store import IndexedLogSink, instance_directory
+
+    instance = process or os.environ.get('LOKBOT_INSTANCE_ID') or 'main'
+    logger.remove()
+    logger.add(IndexedLogSink(instance_directory(str(project_root.joinpath('data/logs')), instance),
+                              rotation=3600, retention=48))
+    logger.add(sys.stdout, colorize=True)
+
+
+setup_logging()
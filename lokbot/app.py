@@ -1,6 +1,7 @@
 import asyncio
 import functools
 import os
+import queue
 import threading
 import time
 
@@ -9,8 +10,12 @@ import schedule
 import lokbot.util
 from lokbot import project_root, logger, config
 from lokbot.async_farmer import AsyncLokFarmer
+from lokbot.config_watcher import get_watcher
+from lokbot.event_channel import get_emitter
 from lokbot.exceptions import NoAuthException
 from lokbot.farmer import LokFarmer
+from lokbot.health import health
+from lokbot.profiler import get_profiler
 
 
 def find_alliance(farmer: LokFarmer):
@@ -26,16 +31,153 @@ def find_alliance(farmer: LokFarmer):
 
 thread_map = {}
 
+# Work handed to the main loop by other threads, schedule itself isn't thread safe
+main_loop_tasks = queue.SimpleQueue()
+
 
 def run_threaded(name, job_func):
     if name in thread_map and thread_map[name].is_alive():
         return
 
-    job_thread = threading.Thread(target=job_func, name=name, daemon=True)
+    job_thread = threading.Thread(target=health.track(name, job_func), name=name, daemon=True)
     thread_map[name] = job_thread
     job_thread.start()
 
 
+def schedule_jobs(farmer: LokFarmer, jobs):
+    """(Re)create the schedule for enabled jobs, returns the names scheduled"""
+    schedule.clear('config')
+    scheduled = set()
+    for job in jobs:
+        if not job.get('enabled'):
+            continue
+
+        name = job.get('name')
+
+        schedule.every(
+            job.get('interval').get('start')
+        ).to(
+            job.get('interval').get('end')
+        ).minutes.do(run_threaded, name, functools.partial(getattr(farmer, name), **job.get('kwargs', {}))).tag('config', name)
+        scheduled.add(name)
+    return scheduled
+
+
+def start_threads(farmer: LokFarmer, threads):
+    """Start enabled threads that aren't running yet"""
+    for thread in threads:
+        if not thread.get('enabled'):
+            continue
+
+        thread_name = thread.get('name')
+        if thread_name in thread_map and thread_map[thread_name].is_alive():
+            continue
+
+        # Use the recovery wrapper for socf_thread
+        if thread_name == 'socf_thread':
+            target = farmer.socf_thread_with_recovery
+        else:
+            target = getattr(farmer, thread_name)
+        thread_map[thread_name] = threading.Thread(target=target, kwargs=thread.get('kwargs', {}), name=thread_name, daemon=True)
+        thread_map[thread_name].start()
+
+
+def watch_config(farmer: LokFarmer):
+    """Apply config edits without restarting the bot"""
+    watcher = get_watcher()
+
+    def reschedule(old, new):
+        old_main, new_main = old.get('main', {}), new.get('main', {})
+        if old_main.get('jobs') != new_main.get('jobs'):
+            previous = {job.get('name') for job in old_main.get('jobs', []) if job.get('enabled')}
+            scheduled = schedule_jobs(farmer, new_main.get('jobs', []))
+            logger.info(f'Jobs rescheduled after config change: {", ".join(sorted(scheduled)) or "none"}')
+            # Newly enabled jobs run right away, like at startup
+            for job in schedule.get_jobs('config'):
+                if job.tags & (scheduled - previous):
+                    job.run()
+
+        if old_main.get('threads') != new_main.get('threads'):
+            start_threads(farmer, new_main.get('threads', []))
+            stopped = {t.get('name') for t in old_main.get('threads', []) if t.get('enabled')} - \
+                      {t.get('name') for t in new_main.get('threads', []) if t.get('enabled')}
+            if stopped:
+                logger.warning(f'Disabled threads keep running until the bot restarts: {", ".join(sorted(stopped))}')
+
+    @watcher.on_change
+    def on_config_change(old, new, changed):
+        if 'main' in changed:
+            main_loop_tasks.put(functools.partial(reschedule, old, new))
+        if 'buff_management' in changed:
+            # Wakes the buff management thread with the new lead times
+            farmer.buff_scheduler.configure(new.get('buff_management', {}))
+
+    emitter = get_emitter()
+    if emitter is not None:
+        # The web app pushes a nudge on save, the poll interval is only the fallback
+        emitter.on_command('config_changed', lambda **args: watcher.check())
+
+    watcher.start()
+
+
+def serve_profiler():
+    """Let the web app start and stop the sampling profiler over the event channel"""
+    emitter = get_emitter()
+    if emitter is None:
+        return
+
+    profiler = get_profiler()
+
+    def start(rate=100, duration=None, **_):
+        if not profiler.start(rate, duration, on_finish=lambda result: emitter.send_now('profile_result', result)):
+            logger.warning('Profile requested while one is already running')
+
+    emitter.on_command('profile_start', start)
+    # The sampler thread reports the result when it exits, don't wait for it here
+    emitter.on_command('profile_stop', lambda **args: profiler.stop(timeout=0))
+
+
+def publish_health(farmer: LokFarmer, interval=5):
+    """Send a health report to the web app every few seconds"""
+    emitter = get_emitter()
+
+    health.register_queue('main_loop_tasks', main_loop_tasks.qsize)
+    health.register_queue('marches', lambda: len(farmer.troop_queue))
+    health.register_queue('kingdom_tasks', lambda: len(farmer.kingdom_tasks))
+    if emitter is not None:
+        health.register_queue('event_channel', emitter.events.qsize)
+    def scheduled_jobs():
+        jobs = {}
+        for job in schedule.get_jobs('config'):
+            name = next(iter(job.tags - {'config'}), str(job))
+            jobs[name] = {
+                'next_run': job.next_run.timestamp() if job.next_run else None,
+                'last_run': job.last_run.timestamp() if job.last_run else None,
+                'running': name in thread_map and thread_map[name].is_alive(),
+            }
+        return jobs
+
+    health.register_section('schedule', scheduled_jobs)
+
+    def publish():
+        stalled = set()
+        while True:
+            try:
+                report = health.report()
+                newly_stalled = set(report['stalled']) - stalled
+                if newly_stalled:
+                    for name, stack in health.format_stacks(newly_stalled).items():
+                        logger.warning(f'Thread {name} stalled, no heartbeat in time. Stack:\n{stack}')
+                stalled = set(report['stalled'])
+                if emitter is not None:
+                    emitter.emit('health_report', report)
+            except Exception as e:
+                logger.error(f'Error publishing health report: {e}')
+            time.sleep(interval)
+
+    threading.Thread(target=publish, name='health_publisher', daemon=True).start()
+
+
 def async_main(token):
     async_farmer = AsyncLokFarmer(token)
 
@@ -102,6 +244,9 @@ def main(token=None, captcha_solver_config=None, config_file=None):
     config = ConfigHelper.load_config(config_file)
     logger.info(f"Successfully loaded config: {config_file}")
 
+    # Connect to the web app event channel early so the first events don't fall back to HTTP
+    get_emitter()
+
     # First try to use provided token if any
     if token:
         logger.info("Using provided token")
@@ -154,17 +299,7 @@ def main(token=None, captcha_solver_config=None, config_file=None):
     if not jobs:
         logger.warning("No jobs found in configuration")
 
-    for job in jobs:
-        if not job.get('enabled'):
-            continue
-
-        name = job.get('name')
-
-        schedule.every(
-            job.get('interval').get('start')
-        ).to(
-            job.get('interval').get('end')
-        ).minutes.do(run_threaded, name, functools.partial(getattr(farmer, name), **job.get('kwargs', {})))
+    schedule_jobs(farmer, jobs)
 
     schedule.run_all()
 
@@ -173,17 +308,17 @@ def main(token=None, captcha_solver_config=None, config_file=None):
     if not threads:
         logger.warning("No threads found in configuration")
 
-    for thread in threads:
-        if not thread.get('enabled'):
-            continue
+    start_threads(farmer, threads)
 
-        thread_name = thread.get('name')
-        # Use the recovery wrapper for socf_thread
-        if thread_name == 'socf_thread':
-            threading.Thread(target=farmer.socf_thread_with_recovery, kwargs=thread.get('kwargs', {}), daemon=True).start()
-        else:
-            threading.Thread(target=getattr(farmer, thread_name), kwargs=thread.get('kwargs', {}), daemon=True).start()
+    watch_config(farmer)
+    serve_profiler()
+    publish_health(farmer)
 
     while True:
+        while not main_loop_tasks.empty():
+            try:
+                main_loop_tasks.get_nowait()()
+            except Exception as e:
+                logger.error(f'Error applying config change: {e}')
         schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+        time.sleep(1)
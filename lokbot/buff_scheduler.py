@@ -0,0 +1,130 @@
+"""
+Buff renewal timing from an expiry heap
+
+Every monitored buff of the buff_management config has one entry in a
+min-heap keyed by the moment it needs renewing: the end of its longest
+running buff minus the configured lead time (min_duration_minutes), or now
+when none of its items is running.  The heap is rebuilt from the expiry times
+the kingdom state parsed when /buff/list arrived, and the buff management
+thread sleeps on a condition until the top entry is due, so a renewal
+happens on time and nothing is polled or parsed in between.
+"""
+import heapq
+import math
+import threading
+import time
+
+DEFAULT_LEAD_MINUTES = 20
+RECONCILE_SECONDS = 6 * 3600  # longest sleep without news, then the heap is rebuilt from the state once
+
+
+class MonitoredBuff:
+    __slots__ = ('key', 'name', 'item_codes', 'lead_seconds')
+
+    def __init__(self, name, item_codes, lead_seconds):
+        self.key = f"{name}_{':'.join(map(str, item_codes))}"
+        self.name = name
+        self.item_codes = tuple(item_codes)
+        self.lead_seconds = lead_seconds
+
+    @classmethod
+    def from_config(cls, entry):
+        return cls(entry.get('name', 'Unknown'), entry.get('item_codes', []),
+                   entry.get('min_duration_minutes', DEFAULT_LEAD_MINUTES) * 60)
+
+    def __eq__(self, other):
+        return isinstance(other, MonitoredBuff) and \
+            (self.key, self.lead_seconds) == (other.key, other.lead_seconds)
+
+    def __repr__(self):
+        return f'MonitoredBuff(name={self.name}, item_codes={self.item_codes}, lead_seconds={self.lead_seconds})'
+
+
+class BuffScheduler:
+    def __init__(self):
+        self.enabled = False
+        self.monitored = {}  # key -> MonitoredBuff
+        self.expiry = {}  # key -> end of its longest running buff, 0 when none runs, inf when it never ends
+        self.not_before = {}  # key -> earliest next attempt after an activation or a failed one
+        self._buffs = ()
+        self._heap = []  # (due, key)
+        self._condition = threading.Condition()
+
+    # region updates
+
+    def configure(self, buff_config):
+        """The buff_management section, at startup and after every config reload"""
+        monitored = {}
+        if buff_config.get('enabled', False):
+            for entry in buff_config.get('buffs', []):
+                if entry.get('enabled', True) and entry.get('item_codes'):
+                    buff = MonitoredBuff.from_config(entry)
+                    monitored[buff.key] = buff
+        with self._condition:
+            enabled = bool(buff_config.get('enabled', False))
+            if enabled == self.enabled and monitored == self.monitored:
+                return
+            self.enabled = enabled
+            self.monitored = monitored
+            self._rebuild()
+
+    def refresh(self, buffs):
+        """The kingdom state's Buff records, after /buff/list or kingdom/enter replaced them"""
+        with self._condition:
+            self._buffs = tuple(buffs)
+            self._rebuild()
+
+    def defer(self, key, until):
+        """Don't try key again before until (epoch seconds), whatever the buff list says"""
+        with self._condition:
+            self.not_before[key] = until
+            self._rebuild()
+
+    def _rebuild(self):
+        ends = {}
+        for buff in self._buffs:
+            end = math.inf if buff.expires_at is None else buff.expires_at
+            if end > ends.get(buff.item_code, 0):
+                ends[buff.item_code] = end
+
+        heap = []
+        for key, monitored in self.monitored.items():
+            expiry = max((ends.get(code, 0) for code in monitored.item_codes), default=0)
+            self.expiry[key] = expiry
+            if expiry != math.inf:
+                heap.append((max(expiry - monitored.lead_seconds, self.not_before.get(key, 0)), key))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._condition.notify_all()
+
+    # endregion
+
+    def remaining(self, key, now=None):
+        """Seconds its longest running buff has left, 0 when none runs"""
+        return max(self.expiry.get(key, 0) - (now or time.time()), 0)
+
+    def next_due(self):
+        with self._condition:
+            return self._heap[0][0] if self._heap else None
+
+    def wait_due(self, timeout=RECONCILE_SECONDS):
+        """
+        Block until monitored buffs are due or timeout passes, and take them off the heap
+
+        Returns the due MonitoredBuff records, empty on timeout.  A taken buff
+        comes back with the next refresh() or defer(), so the caller defers
+        every buff it didn't renew.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                if self.enabled and self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due.append(self.monitored[heapq.heappop(self._heap)[1]])
+                    return due
+                if now >= deadline:
+                    return []
+                wake = min(self._heap[0][0], deadline) if self.enabled and self._heap else deadline
+                self._condition.wait(wake - now)
@@ -9,6 +9,7 @@ import ratelimit
 import tenacity
 
 import lokbot.enum
+import lokbot.recorder
 import lokbot.util
 from lokbot.exceptions import *
 from lokbot import logger, project_root
@@ -35,7 +36,8 @@ class LokBotApi:
             headers=headers,
             http2=True,
             base_url=lokbot.enum.API_BASE_URL,
-            timeout=30.0  # 30 second timeout
+            timeout=30.0,  # 30 second timeout
+            transport=lokbot.recorder.api_transport()
         )
         self.token = token
         self.request_callback = request_callback
@@ -120,6 +122,10 @@ class LokBotApi:
         if json_response.get('isPacked') is True:
             json_response = json.loads(gzip.decompress(bytearray(json_response.get('payload'))))
 
+        recorder = lokbot.recorder.get_recorder()
+        if recorder:
+            recorder.api(api_path, json_response, log_data['elapsed'])
+
         log_data.update({'res': json_response})
 
         logger.debug(json.dumps(log_data))
@@ -188,7 +194,7 @@ class LokBotApi:
             json_data = {"deviceInfo": {"build": "global"}}
 
         try:
-            res = self.post('https://lok-api-live.leagueofkingdoms.com/api/auth/connect', json_data)
+            res = self.post(f'{lokbot.enum.AUTH_BASE_URL}auth/connect', json_data)
             if not res.get('result'):
                 raise NoAuthException()
 
@@ -221,7 +227,7 @@ class LokBotApi:
             "deviceInfo": device_info
         }
 
-        res = self.post('https://lok-api-live.leagueofkingdoms.com/api/auth/login', data)
+        res = self.post(f'{lokbot.enum.AUTH_BASE_URL}auth/login', data)
         if res.get('result'):
             self.token = res.get('token')
             self.opener.headers['X-Access-Token'] = self.token
@@ -411,7 +417,7 @@ class LokBotApi:
         获取基础信息
         :return:
         """
-        res = self.post('https://lok-api-live.leagueofkingdoms.com/api/kingdom/enter')
+        res = self.post(f'{lokbot.enum.AUTH_BASE_URL}kingdom/enter')
 
         captcha = res.get('captcha')
         if captcha and captcha.get('next'):
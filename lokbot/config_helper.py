@@ -7,6 +7,8 @@ import logging
 import discord
 from typing import Dict, Any, List, Optional, Tuple
 
+from lokbot.config_store import config_store
+
 # To run this code, you need to install the discord.py library:
 # pip install discord.py
 
@@ -34,8 +36,7 @@ class ConfigHelper:
         if config_type in ConfigHelper.simplified_configs:
             config_file = ConfigHelper.simplified_configs[config_type]
             try:
-                with open(config_file, 'r') as f:
-                    return json.load(f)
+                return config_store.load(config_file)
             except FileNotFoundError:
                 logger.warning(f"Simplified config file {config_file} not found, using defaults")
                 return ConfigHelper._get_default_config(config_type)
@@ -80,15 +81,15 @@ class ConfigHelper:
         config_file = ConfigHelper.current_config_file
         logger.info(f"Loading config from: {config_file}")
         try:
-            with open(config_file, "r") as f:
-                loaded_config = json.load(f)
-                # If numMarch is specified in the loaded config, use that value
-                if 'rally' in loaded_config:
-                    if 'join' in loaded_config['rally'] and loaded_config['rally']['join'].get('numMarch') is not None:
-                        logger.info(f"Using numMarch={loaded_config['rally']['join']['numMarch']} from config for rally join")
-                    if 'start' in loaded_config['rally'] and loaded_config['rally']['start'].get('numMarch') is not None:
-                        logger.info(f"Using numMarch={loaded_config['rally']['start']['numMarch']} from config for rally start")
-                return loaded_config
+            # Cached by mtime, only a changed file is parsed again
+            loaded_config = config_store.load(config_file)
+            # If numMarch is specified in the loaded config, use that value
+            if 'rally' in loaded_config:
+                if 'join' in loaded_config['rally'] and loaded_config['rally']['join'].get('numMarch') is not None:
+                    logger.info(f"Using numMarch={loaded_config['rally']['join']['numMarch']} from config for rally join")
+                if 'start' in loaded_config['rally'] and loaded_config['rally']['start'].get('numMarch') is not None:
+                    logger.info(f"Using numMarch={loaded_config['rally']['start']['numMarch']} from config for rally start")
+            return loaded_config
         except FileNotFoundError:
             logger.warning(f"Config file {config_file} not found, creating default")
             default_config = {
@@ -137,13 +138,28 @@ class ConfigHelper:
                     "webhook_url": ""
                 }
             }
-            with open(config_file, "w") as f:
-                json.dump(default_config, f, indent=2, sort_keys=False, separators=(',', ': '))
+            config_store.save(config_file, default_config, indent=2, sort_keys=False, separators=(',', ': '))
             return default_config
         except json.JSONDecodeError:
             logger.error(f"Error parsing {config_file}, file may be corrupted")
             raise
 
+    @staticmethod
+    def _sync_toggles(entries: List[Dict[str, Any]], toggles: Dict[str, bool]):
+        """Copy each job/thread enabled flag into toggles and back, in one pass over each"""
+        first_by_name = {}
+        for entry in entries:
+            name = entry.get("name")
+            if name:
+                toggles[name] = entry.get("enabled", False)
+                first_by_name.setdefault(name, entry)
+
+        # Also sync from toggles to the first entry with that name (bidirectional)
+        for name, enabled in toggles.items():
+            entry = first_by_name.get(name)
+            if entry is not None:
+                entry["enabled"] = enabled
+
     @staticmethod
     def save_config(config: Dict[str, Any], config_file=None) -> bool:
         """Save configuration to file with error handling and sync toggles structure"""
@@ -155,41 +171,10 @@ class ConfigHelper:
             if "toggles" not in config:
                 config["toggles"] = {"jobs": {}, "threads": {}, "features": {}}
 
-            # Sync job toggles
-            if "main" in config and "jobs" in config["main"]:
-                for job in config["main"]["jobs"]:
-                    job_name = job.get("name")
-                    if job_name:
-                        if "jobs" not in config["toggles"]:
-                            config["toggles"]["jobs"] = {}
-                        config["toggles"]["jobs"][job_name] = job.get("enabled", False)
-
-                # Also sync from toggles to main jobs (bidirectional)
-                if "jobs" in config["toggles"]:
-                    for job_name, enabled in config["toggles"]["jobs"].items():
-                        # Find the job in main.jobs
-                        for job in config["main"]["jobs"]:
-                            if job.get("name") == job_name:
-                                job["enabled"] = enabled
-                                break
-
-            # Sync thread toggles
-            if "main" in config and "threads" in config["main"]:
-                for thread in config["main"]["threads"]:
-                    thread_name = thread.get("name")
-                    if thread_name:
-                        if "threads" not in config["toggles"]:
-                            config["toggles"]["threads"] = {}
-                        config["toggles"]["threads"][thread_name] = thread.get("enabled", False)
-
-                # Also sync from toggles to main threads (bidirectional)
-                if "threads" in config["toggles"]:
-                    for thread_name, enabled in config["toggles"]["threads"].items():
-                        # Find the thread in main.threads
-                        for thread in config["main"]["threads"]:
-                            if thread.get("name") == thread_name:
-                                thread["enabled"] = enabled
-                                break
+            # Sync job and thread toggles
+            for section in ("jobs", "threads"):
+                if "main" in config and section in config["main"]:
+                    ConfigHelper._sync_toggles(config["main"][section], config["toggles"].setdefault(section, {}))
 
             # Sync feature toggles
             if "features" not in config["toggles"]:
@@ -230,9 +215,8 @@ class ConfigHelper:
                 if "discord" in config["toggles"]["features"]:
                     config["discord"]["enabled"] = config["toggles"]["features"]["discord"]
 
-            # Save the file
-            with open(config_file, "w") as f:
-                json.dump(config, f, indent=2, sort_keys=False, separators=(',', ': '))
+            # Save the file (atomic, notifies running bots through the config store)
+            config_store.save(config_file, config, indent=2, sort_keys=False, separators=(',', ': '))
             return True
         except Exception as e:
             logger.error(f"Error saving config: {str(e)}")
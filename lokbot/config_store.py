@@ -0,0 +1,285 @@
+"""
+Shared access to JSON config files
+
+Parsed documents are cached by path and re-read only when the file's mtime
+or size changes.  Writes go through a per-file lock and an atomic temp file +
+rename, so readers never see a half-written config and concurrent
+read-modify-write cycles don't lose updates.  Subscribers are told about
+every change, which is how running bots and the Discord commands learn that
+a config they use was edited.
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ConfigPatchError(ValueError):
+    pass
+
+
+# region JSON patch
+
+def _parse_pointer(pointer):
+    """RFC 6901 JSON pointer to a list of reference tokens"""
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ConfigPatchError(f'invalid JSON pointer: {pointer}')
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _resolve_parent(doc, tokens):
+    target = doc
+    for token in tokens[:-1]:
+        if isinstance(target, list):
+            try:
+                target = target[int(token)]
+            except (ValueError, IndexError):
+                raise ConfigPatchError(f'path not found: /{"/".join(tokens)}')
+        elif isinstance(target, dict) and token in target:
+            target = target[token]
+        else:
+            raise ConfigPatchError(f'path not found: /{"/".join(tokens)}')
+    return target
+
+
+def _get(doc, tokens):
+    if not tokens:
+        return doc
+    parent = _resolve_parent(doc, tokens)
+    key = tokens[-1]
+    try:
+        return parent[int(key)] if isinstance(parent, list) else parent[key]
+    except (KeyError, ValueError, IndexError, TypeError):
+        raise ConfigPatchError(f'path not found: /{"/".join(tokens)}')
+
+
+def apply_patch(doc, operations):
+    """
+    Apply RFC 6902 style operations to doc in place
+
+    Supports add, replace, remove, move, copy and test.  A missing
+    intermediate object on add/replace is an error, like in the RFC.
+    """
+    for operation in operations:
+        op = operation.get('op')
+        tokens = _parse_pointer(operation.get('path', ''))
+        if not tokens:
+            raise ConfigPatchError('patching the document root is not supported')
+
+        if op in ('move', 'copy'):
+            value = _get(doc, _parse_pointer(operation.get('from', '')))
+            if op == 'move':
+                apply_patch(doc, [{'op': 'remove', 'path': operation['from']}])
+            else:
+                value = copy.deepcopy(value)
+            op = 'add'
+        else:
+            value = operation.get('value')
+
+        if op == 'test':
+            if _get(doc, tokens) != value:
+                raise ConfigPatchError(f'test failed at {operation["path"]}')
+            continue
+
+        parent = _resolve_parent(doc, tokens)
+        key = tokens[-1]
+        if isinstance(parent, list):
+            if key == '-' and op == 'add':
+                parent.append(value)
+                continue
+            try:
+                index = int(key)
+            except ValueError:
+                raise ConfigPatchError(f'invalid list index: {key}')
+            if not 0 <= index <= len(parent) - (0 if op == 'add' else 1):
+                raise ConfigPatchError(f'list index out of range: {operation["path"]}')
+            if op == 'add':
+                parent.insert(index, value)
+            elif op == 'replace':
+                parent[index] = value
+            elif op == 'remove':
+                del parent[index]
+            else:
+                raise ConfigPatchError(f'unsupported op: {op}')
+        elif isinstance(parent, dict):
+            if op == 'add':
+                parent[key] = value
+            elif op == 'replace':
+                if key not in parent:
+                    raise ConfigPatchError(f'path not found: {operation["path"]}')
+                parent[key] = value
+            elif op == 'remove':
+                if key not in parent:
+                    raise ConfigPatchError(f'path not found: {operation["path"]}')
+                del parent[key]
+            else:
+                raise ConfigPatchError(f'unsupported op: {op}')
+        else:
+            raise ConfigPatchError(f'path not found: {operation["path"]}')
+    return doc
+
+# endregion
+
+
+class ConfigStore:
+    """Cached, lock-protected JSON documents with atomic writes and change callbacks"""
+
+    def __init__(self):
+        self._documents = {}  # abspath -> ((mtime_ns, size), parsed document)
+        self._locks = {}  # abspath -> RLock
+        self._locks_guard = threading.Lock()
+        self._subscribers = []
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def lock(self, path):
+        """Per-file lock, hold it across a read-modify-write cycle"""
+        key = self._key(path)
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+            return lock
+
+    @staticmethod
+    def _signature(key):
+        stat = os.stat(key)
+        return stat.st_mtime_ns, stat.st_size
+
+    # region reads
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read(self, path, default=_MISSING):
+        """
+        Shared parsed document, don't modify it
+
+        Raises FileNotFoundError (or returns default) if the file is missing
+        and json.JSONDecodeError if it doesn't parse.
+        """
+        key = self._key(path)
+        try:
+            signature = self._signature(key)
+        except FileNotFoundError:
+            self._documents.pop(key, None)
+            if default is _MISSING:
+                raise
+            return default
+
+        cached = self._documents.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with self.lock(path):
+            with open(key, 'r', encoding='utf-8') as f:
+                document = json.load(f)
+            self._documents[key] = (signature, document)
+            return document
+
+    def load(self, path, default=_MISSING):
+        """Private deep copy of the document, safe to modify and save()"""
+        document = self.read(path, default)
+        return copy.deepcopy(document)
+
+    # endregion
+
+    # region writes
+
+    def save(self, path, document, source=None, **dump_kwargs):
+        """
+        Atomically write document to path and notify subscribers
+
+        dump_kwargs go to json.dump, the default is indent=2.
+        """
+        dump_kwargs.setdefault('indent', 2)
+        key = self._key(path)
+        with self.lock(path):
+            directory = os.path.dirname(key)
+            fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(key)}.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(document, f, **dump_kwargs)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # mkstemp creates the file 0600, keep the mode of the file we replace
+                try:
+                    os.chmod(temp_path, os.stat(key).st_mode & 0o777)
+                except FileNotFoundError:
+                    os.chmod(temp_path, 0o644)
+                os.replace(temp_path, key)
+            except BaseException:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                raise
+
+            # Cache our own copy so later changes by the caller don't leak in
+            self._documents[key] = (self._signature(key), copy.deepcopy(document))
+
+        self._notify(path, source)
+        return document
+
+    def update(self, path, mutate, default=_MISSING, source=None, **dump_kwargs):
+        """
+        Read-modify-write under the file lock
+
+        mutate(document) edits the document in place (or returns a
+        replacement); the result is saved and returned.
+        """
+        with self.lock(path):
+            document = self.load(path, default)
+            result = mutate(document)
+            if result is not None:
+                document = result
+            return self.save(path, document, source=source, **dump_kwargs)
+
+    def patch(self, path, operations, source=None, **dump_kwargs):
+        """Apply JSON-patch operations to a config file, atomically"""
+        return self.update(path, lambda document: apply_patch(document, operations), source=source, **dump_kwargs)
+
+    def invalidate(self, path=None):
+        """Forget cached documents, e.g. after a file was renamed or deleted"""
+        if path is None:
+            self._documents.clear()
+        else:
+            self._documents.pop(self._key(path), None)
+
+    # endregion
+
+    # region change notifications
+
+    def subscribe(self, callback):
+        """callback(path, source) is called after every save through this store"""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            pass
+
+    def _notify(self, path, source):
+        for callback in list(self._subscribers):
+            try:
+                callback(path, source)
+            except Exception as e:
+                logger.error(f"Error in config change subscriber for {path}: {e}")
+
+    # endregion
+
+
+# Process-wide store shared by the web app, ConfigHelper and the Discord bot
+config_store = ConfigStore()
@@ -0,0 +1,265 @@
+"""
+Live config reload for a running bot
+
+The farmer reads the `lokbot.config` dict everywhere, so a reload has to keep
+that object and swap its contents.  A watcher thread polls the config file
+(mtime + size through the config store, so an unchanged file costs one stat),
+validates the new document and replaces the top-level sections in place; each
+section is a single dict assignment, so a reader sees either the old or the
+new section, never a half-edited one.  Structures derived from the config
+(area restriction rectangles, the allowed zone mask, the socf and rally join
+target indexes) are compiled once per version instead of on every call, and
+listeners are told which sections changed so jobs can be rescheduled.
+"""
+import copy
+import threading
+import time
+
+import lokbot
+from lokbot import config, logger
+from lokbot.config_store import config_store
+
+MAP_SIZE = 2048
+ZONE_SIZE = 32
+ZONES_PER_ROW = MAP_SIZE // ZONE_SIZE
+
+
+# region compiled config
+
+class CompiledConfig:
+    """Lookup structures derived from one version of the config"""
+
+    def __init__(self, document, version=0):
+        self.version = version
+        main = document.get('main', {})
+
+        # Area restrictions as (min_x, max_x, min_y, max_y) tuples, empty when unrestricted
+        restrictions = main.get('object_scanning', {}).get('area_restrictions', {})
+        self.areas = ()
+        if restrictions.get('enabled', False):
+            self.areas = tuple(
+                (area.get('min_x', 0), area.get('max_x', MAP_SIZE - 1),
+                 area.get('min_y', 0), area.get('max_y', MAP_SIZE - 1))
+                for area in restrictions.get('allowed_areas', [])
+            )
+        self.allowed_zones = self._compile_zone_mask() if self.areas else None
+
+        self.jobs = {job['name']: job for job in main.get('jobs', []) if job.get('name')}
+        self.threads = {thread['name']: thread for thread in main.get('threads', []) if thread.get('name')}
+
+        # socf targets: code -> frozenset of levels (empty = any level)
+        socf = self.threads.get('socf_thread') or self.jobs.get('socf_thread')
+        self.socf_targets = None
+        if socf is not None:
+            self.socf_targets = self.compile_targets(socf.get('kwargs', {}).get('targets', []))
+
+        # rally join targets: monster code -> target entry, the first entry per code wins like before
+        rally_join = document.get('rally', {}).get('join', {})
+        self.rally_join_enabled = bool(rally_join.get('enabled', False))
+        self.rally_join_level_based = bool(rally_join.get('level_based_troops', False))
+        self.rally_join_max_rallies = rally_join.get('numMarch', 9)
+        self.rally_join_targets = {}
+        for target in rally_join.get('targets', []):
+            self.rally_join_targets.setdefault(target.get('monster_code'), target)
+        self.rally_join_targets.pop(None, None)
+
+    def is_coordinate_allowed(self, x, y):
+        if not self.areas:
+            return True
+        for min_x, max_x, min_y, max_y in self.areas:
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                return True
+        return False
+
+    def _compile_zone_mask(self):
+        """Zones with a corner or their center inside an allowed area"""
+        allowed = set()
+        for zone_id in range(ZONES_PER_ROW * ZONES_PER_ROW):
+            zone_x = zone_id % ZONES_PER_ROW * ZONE_SIZE
+            zone_y = zone_id // ZONES_PER_ROW * ZONE_SIZE
+            points = (
+                (zone_x, zone_y), (zone_x, zone_y + ZONE_SIZE - 1),
+                (zone_x + ZONE_SIZE - 1, zone_y), (zone_x + ZONE_SIZE - 1, zone_y + ZONE_SIZE - 1),
+                (zone_x + ZONE_SIZE // 2, zone_y + ZONE_SIZE // 2),
+            )
+            if any(self.is_coordinate_allowed(x, y) for x, y in points):
+                allowed.add(zone_id)
+        return frozenset(allowed)
+
+    def filter_zones(self, zone_ids):
+        if self.allowed_zones is None:
+            return list(zone_ids)
+        return [zone_id for zone_id in zone_ids if zone_id in self.allowed_zones]
+
+    def rally_join_target(self, monster_code, monster_level=None):
+        """The rally.join target a rally on this monster matches, None to leave it alone"""
+        target = self.rally_join_targets.get(monster_code)
+        if target is None or not self.rally_join_level_based or monster_level is None:
+            return target
+        monster_level = int(monster_level)
+        for level_range in target.get('level_ranges', []):
+            if level_range.get('min_level', 0) <= monster_level <= level_range.get('max_level', 0):
+                return target
+        return None
+
+    @staticmethod
+    def compile_targets(targets):
+        """[{'code', 'level', 'enabled'}] -> {code: frozenset(levels)}, levels merged per code"""
+        levels_by_code = {}
+        enabled_codes = set()
+        for target in targets:
+            code = target.get('code')
+            levels_by_code.setdefault(code, set()).update(target.get('level') or ())
+            if target.get('enabled', True):
+                enabled_codes.add(code)
+        return {code: frozenset(levels_by_code[code]) for code in enabled_codes}
+
+
+_compiled = None
+_compiled_lock = threading.Lock()
+
+
+def compiled_config():
+    """CompiledConfig for the current contents of lokbot.config"""
+    global _compiled
+    if _compiled is None:
+        with _compiled_lock:
+            if _compiled is None:
+                _compiled = CompiledConfig(config)
+    return _compiled
+
+# endregion
+
+
+def validate_config(document):
+    """List of problems that make a config unusable, empty if it's fine"""
+    if not isinstance(document, dict):
+        return ['config must be a JSON object']
+
+    errors = []
+    main = document.get('main', {})
+    if not isinstance(main, dict):
+        return ['main must be an object']
+
+    for section in ('jobs', 'threads'):
+        entries = main.get(section, [])
+        if not isinstance(entries, list):
+            errors.append(f'main.{section} must be a list')
+            continue
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+                errors.append(f'main.{section}[{index}] needs a name')
+                continue
+            if not isinstance(entry.get('kwargs', {}), dict):
+                errors.append(f'main.{section}[{index}].kwargs must be an object')
+            if section == 'jobs' and entry.get('enabled'):
+                interval = entry.get('interval')
+                if not isinstance(interval, dict) or not all(
+                        isinstance(interval.get(key), (int, float)) for key in ('start', 'end')):
+                    errors.append(f'main.jobs[{index}] ({entry["name"]}) needs a numeric interval start/end')
+                elif interval['start'] > interval['end']:
+                    errors.append(f'main.jobs[{index}] ({entry["name"]}) interval start is after end')
+
+    for rally_type in ('join', 'start'):
+        rally = document.get('rally', {}).get(rally_type, {})
+        if not isinstance(rally, dict):
+            errors.append(f'rally.{rally_type} must be an object')
+        elif not isinstance(rally.get('targets', []), list):
+            errors.append(f'rally.{rally_type}.targets must be a list')
+
+    return errors
+
+
+class ConfigWatcher:
+    """Polls the bot's config file and swaps new versions into lokbot.config"""
+
+    def __init__(self, path=None, interval=2.0):
+        self.path = path or lokbot.config_path
+        self.interval = interval
+        self.version = 0
+        self._document = None  # last document seen in the store, valid or not
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def on_change(self, callback):
+        """callback(old_config, new_config, changed_sections) after every reload"""
+        self._listeners.append(callback)
+        return callback
+
+    def start(self):
+        if self._started or not self.path:
+            return
+        self._started = True
+        self._document = config_store.read(self.path, default=None)
+        threading.Thread(target=self._watch_loop, name='config_watcher', daemon=True).start()
+        logger.info(f"Watching {self.path} for config changes")
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error checking {self.path} for changes: {e}")
+
+    def check(self):
+        """Reload if the file changed, returns whether a new config was applied"""
+        with self._lock:
+            try:
+                document = config_store.read(self.path)
+            except FileNotFoundError:
+                return False
+            except ValueError as e:
+                # Half-written by an editor that doesn't replace atomically, try again next round
+                logger.warning(f"Config {self.path} doesn't parse, keeping the current one: {e}")
+                return False
+
+            if document is self._document:
+                return False
+            self._document = document
+
+            errors = validate_config(document)
+            if errors:
+                logger.error(f"Rejected config change in {self.path}: {'; '.join(errors)}")
+                return False
+
+            self.apply(copy.deepcopy(document))
+            return True
+
+    def apply(self, document):
+        """Swap document into lokbot.config section by section and rebuild derived state"""
+        global _compiled
+
+        old = dict(config)
+        changed = {key for key in set(old) | set(document) if old.get(key) != document.get(key)}
+        if not changed:
+            return
+
+        for key in changed:
+            if key in document:
+                config[key] = document[key]
+            else:
+                config.pop(key, None)
+
+        self.version += 1
+        with _compiled_lock:
+            _compiled = CompiledConfig(config, self.version)
+
+        logger.info(f"Applied config version {self.version} from {self.path}, changed: {', '.join(sorted(changed))}")
+        for callback in list(self._listeners):
+            try:
+                callback(old, config, changed)
+            except Exception as e:
+                logger.error(f"Error in config reload listener: {e}")
+
+
+_watcher = None
+
+
+def get_watcher():
+    """Process-wide watcher for the bot's config file"""
+    global _watcher
+    if _watcher is None:
+        _watcher = ConfigWatcher()
+    return _watcher
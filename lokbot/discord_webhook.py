@@ -445,7 +445,7 @@ def send_rally_to_discord_by_code(embed, code, config=None):
 def send_notification_to_web(user_id, notification_type, title, message):
     """Send notification to web interface"""
     try:
-        import requests
+        from lokbot.event_channel import send_to_web
         notification_data = {
             'user_id': user_id,
             'type': notification_type,
@@ -454,26 +454,21 @@ def send_notification_to_web(user_id, notification_type, title, message):
             'timestamp': datetime.now().isoformat()
         }
 
-        # Try to send to web app notification endpoint
-        try:
-            if notification_type == 'gathering':
-                requests.post('http://localhost:5000/api/gathering_notification', 
-                            json=notification_data, timeout=1)
-            else:
-                requests.post('http://localhost:5000/api/object_notification', 
-                            json=notification_data, timeout=1)
-        except requests.exceptions.RequestException:
-            # Web app might not be running, just log it
-            logger.debug(f"Could not send web notification for {user_id}: {message}")
+        # Try to send to web app notification endpoint (event channel first, then HTTP)
+        if notification_type == 'gathering':
+            delivered = send_to_web('/api/gathering_notification', notification_data, timeout=1)
+        else:
+            delivered = send_to_web('/api/object_notification', notification_data, timeout=1)
 
-        # Also write to file as backup
-        try:
-            notification_file = f'data/notifications_{user_id}.json'
-            with open(notification_file, 'a') as f:
-                import json
-                f.write(json.dumps(notification_data) + '\n')
-        except:
-            pass
+        # Only write to file as backup when the web app couldn't be reached
+        if not delivered:
+            logger.debug(f"Could not send web notification for {user_id}: {message}")
+            try:
+                notification_file = f'data/notifications_{user_id}.json'
+                with open(notification_file, 'a') as f:
+                    f.write(json.dumps(notification_data) + '\n')
+            except:
+                pass
 
     except Exception as e:
         logger.debug(f"Error sending web notification: {str(e)}")
\ No newline at end of file
@@ -1,8 +1,11 @@
 import json
+import os
 
 from lokbot import project_root
 
-API_BASE_URL = 'https://api-lok-live.leagueofkingdoms.com/api/'
+# Overridable to point bots at a local stand-in (see benchmarks/fake_server.py)
+API_BASE_URL = os.environ.get('LOKBOT_API_BASE_URL', 'https://api-lok-live.leagueofkingdoms.com/api/')
+AUTH_BASE_URL = os.environ.get('LOKBOT_AUTH_BASE_URL', 'https://lok-api-live.leagueofkingdoms.com/api/')
 
 # 刚进游戏
 TUTORIAL_CODE_INTRO = 'Intro'
@@ -0,0 +1,406 @@
+"""
+Typed event channel between bot processes and the web app
+
+Bots used to report to the web app with one blocking HTTP request per event
+and the web app scraped their stdout for the rest.  Here every bot keeps one
+unix socket connection to the web app and sends length-prefixed frames:
+
+    +----------------+--------+-----------------------------+
+    | length (4, BE) | kind 1 | compact JSON payload        |
+    +----------------+--------+-----------------------------+
+
+Events are queued without blocking, batched by a sender thread and dropped
+(and counted) when the queue is full, so a slow web app can never stall the
+farmer.  When the web app goes away the sender reconnects and the queue holds
+the events meanwhile.  The same connection carries commands from the web app
+to the bot.
+"""
+import json
+import os
+import queue
+import select
+import selectors
+import socket
+import struct
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_SOCKET_ENV = 'LOKBOT_EVENT_SOCKET'
+DEFAULT_EVENT_SOCKET = 'data/events.sock'
+WEB_APP_URL = os.environ.get('LOKBOT_WEB_APP_URL', 'http://localhost:5000')
+
+FRAME_HEADER = struct.Struct('>IB')
+FRAME_HELLO = 1  # bot -> web: instance identity
+FRAME_EVENTS = 2  # bot -> web: batch of [event_type, payload, timestamp]
+FRAME_COMMAND = 3  # web -> bot: {'command': name, 'args': {...}}
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+_WAKE = object()  # put on an emitter's queue to get the sender reconnecting
+
+
+def encode_frame(kind, payload):
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    return FRAME_HEADER.pack(len(body), kind) + body
+
+
+def decode_frames(buffer):
+    """Pop every complete frame from a bytearray, returns [(kind, payload)]"""
+    frames = []
+    while len(buffer) >= FRAME_HEADER.size:
+        length, kind = FRAME_HEADER.unpack_from(buffer)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f'frame too large: {length}')
+        end = FRAME_HEADER.size + length
+        if len(buffer) < end:
+            break
+        payload = json.loads(bytes(buffer[FRAME_HEADER.size:end]))
+        del buffer[:end]
+        frames.append((kind, payload))
+    return frames
+
+
+# region bot side
+
+class EventEmitter:
+    """Non-blocking, batching event sender used inside a bot process"""
+
+    def __init__(self, socket_path, hello, max_queue=1000, batch_size=200, batch_window=0.05):
+        self.socket_path = socket_path
+        self.hello = hello
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.events = queue.Queue(maxsize=max_queue)
+        self.command_handlers = {}
+        self.connected = threading.Event()
+        self.sent_count = 0
+        self.dropped_count = 0
+        self._sock = None
+        self._reconnecting = False  # the connection dropped, events queue up until it's back
+        self._send_lock = threading.Lock()
+
+        threading.Thread(target=self._sender_loop, name='event_channel_sender', daemon=True).start()
+
+    def emit(self, event_type, payload):
+        """Queue an event, returns False if the channel can't take it right now"""
+        if not self.connected.is_set() and not self._reconnecting:
+            return False
+
+        try:
+            self.events.put_nowait((event_type, payload, time.time()))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            if self.dropped_count % 100 == 1:
+                logger.warning(f"Event channel queue full, dropped {self.dropped_count} events so far")
+            return False
+
+    def on_command(self, command, handler):
+        """Register a handler for commands sent by the web app"""
+        self.command_handlers[command] = handler
+
+    def send_now(self, event_type, payload):
+        """Send a single event immediately, bypassing the queue (for replies to commands)"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._send_lock:
+                sock.sendall(encode_frame(FRAME_EVENTS, [[event_type, payload, time.time()]]))
+            return True
+        except OSError:
+            return False
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        sock.sendall(encode_frame(FRAME_HELLO, self.hello))
+        self._sock = sock
+        self._reconnecting = False
+        self.connected.set()
+        threading.Thread(target=self._reader_loop, args=(sock,), name='event_channel_reader', daemon=True).start()
+        logger.info(f"Connected to web app event channel at {self.socket_path}")
+
+    def _disconnect(self):
+        self.connected.clear()
+        self._reconnecting = True
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _wake(self):
+        try:
+            self.events.put_nowait(_WAKE)
+        except queue.Full:
+            pass  # The sender has events to take anyway
+
+    def _sender_loop(self):
+        retry_delay = 1
+        batch = []
+        while True:
+            if self._sock is None:
+                try:
+                    self._connect()
+                    retry_delay = 1
+                except OSError:
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, 30)
+                    continue
+
+            if not batch:
+                event = self.events.get()
+                if event is not _WAKE:
+                    batch.append(event)
+                deadline = time.monotonic() + self.batch_window
+                while batch and len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        event = self.events.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if event is not _WAKE:
+                        batch.append(event)
+
+            # Woken up, or the reader lost the connection meanwhile; the batch goes out after reconnecting
+            sock = self._sock
+            if not batch or sock is None:
+                continue
+
+            try:
+                # Blocks when the web app stops reading, the queue absorbs the burst
+                with self._send_lock:
+                    sock.sendall(encode_frame(FRAME_EVENTS, batch))
+                self.sent_count += len(batch)
+                batch = []
+            except OSError as e:
+                logger.debug(f"Event channel send failed, reconnecting: {e}")
+                if self._sock is sock:
+                    self._disconnect()
+
+    def _reader_loop(self, sock):
+        buffer = bytearray()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                for kind, payload in decode_frames(buffer):
+                    if kind == FRAME_COMMAND:
+                        self._handle_command(payload)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Event channel reader stopped: {e}")
+        finally:
+            if self._sock is sock:
+                self._disconnect()
+                self._wake()
+
+    def _handle_command(self, payload):
+        command = payload.get('command')
+        handler = self.command_handlers.get(command)
+        if handler is None:
+            logger.warning(f"Unknown command from web app: {command}")
+            return
+        try:
+            handler(**payload.get('args', {}))
+        except Exception as e:
+            logger.error(f"Error handling command {command}: {e}")
+
+
+_emitter = None
+_emitter_lock = threading.Lock()
+
+
+def get_emitter():
+    """Emitter for this bot process, None if the web app didn't give us a socket"""
+    global _emitter
+    socket_path = os.environ.get(EVENT_SOCKET_ENV)
+    if not socket_path or not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    with _emitter_lock:
+        if _emitter is None:
+            _emitter = EventEmitter(socket_path, {
+                'user_id': os.environ.get('LOKBOT_USER_ID'),
+                'instance_id': os.environ.get('LOKBOT_INSTANCE_ID'),
+                'account_name': os.environ.get('LOKBOT_ACCOUNT_NAME'),
+                'pid': os.getpid(),
+            })
+        return _emitter
+
+
+_http_session = None
+
+
+def send_to_web(endpoint, payload, timeout=2):
+    """
+    Deliver a bot event to a web app endpoint such as '/api/rally_notification'
+
+    Uses the event channel when connected and falls back to an HTTP POST over a
+    pooled keep-alive session otherwise.
+    """
+    global _http_session
+
+    emitter = get_emitter()
+    if emitter is not None and emitter.emit(endpoint, payload):
+        return True
+
+    try:
+        import requests
+        if _http_session is None:
+            _http_session = requests.Session()
+        response = _http_session.post(f'{WEB_APP_URL}{endpoint}', json=payload, timeout=timeout)
+        return response.status_code == 200
+    except Exception as e:
+        logger.debug(f"Could not deliver {endpoint} to web app: {e}")
+        return False
+
+# endregion
+
+
+# region web app side
+
+class EventChannelServer:
+    """Single-threaded reactor accepting bot connections on a unix socket"""
+
+    def __init__(self, socket_path, dispatch, max_pending_batches=1000):
+        self.socket_path = os.path.abspath(socket_path)
+        self.dispatch = dispatch  # dispatch(hello, event_type, payload, timestamp)
+        self.connections = {}  # instance_id -> socket
+        self.stats = {}  # instance_id -> {'events': n, 'bytes': n, 'connected_at': ts}
+        self._pending = queue.Queue(maxsize=max_pending_batches)
+        self._selector = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.socket_path)
+            listener.listen(128)
+            listener.setblocking(False)
+
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(listener, selectors.EVENT_READ, None)
+
+            threading.Thread(target=self._reactor_loop, name='event_channel_reactor', daemon=True).start()
+            threading.Thread(target=self._dispatch_loop, name='event_channel_dispatch', daemon=True).start()
+            self._started = True
+            logger.info(f"Event channel listening on {self.socket_path}")
+
+    def is_connected(self, instance_id):
+        return instance_id in self.connections
+
+    def send_command(self, instance_id, command, **args):
+        """Send a command to a connected bot, returns False if it isn't connected"""
+        conn = self.connections.get(instance_id)
+        if conn is None:
+            return False
+
+        # The reactor owns the non-blocking socket, wait for writability instead of blocking it
+        data = memoryview(encode_frame(FRAME_COMMAND, {'command': command, 'args': args}))
+        deadline = time.monotonic() + 5
+        try:
+            while data:
+                try:
+                    sent = conn.send(data)
+                    data = data[sent:]
+                except BlockingIOError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError('bot is not reading commands')
+                    select.select([], [conn], [], remaining)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not send {command} to {instance_id}: {e}")
+            return False
+
+    def _reactor_loop(self):
+        while True:
+            for key, _ in self._selector.select(timeout=1):
+                if key.data is None:
+                    self._accept(key.fileobj)
+                else:
+                    self._read(key.fileobj, key.data)
+
+    def _accept(self, listener):
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, {'buffer': bytearray(), 'hello': {}})
+
+    def _read(self, conn, state):
+        try:
+            data = conn.recv(262144)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._close(conn, state)
+            return
+
+        state['buffer'] += data
+        try:
+            frames = decode_frames(state['buffer'])
+        except ValueError as e:
+            logger.error(f"Dropping event channel connection: {e}")
+            self._close(conn, state)
+            return
+
+        instance_id = state['hello'].get('instance_id')
+        if instance_id in self.stats:
+            self.stats[instance_id]['bytes'] += len(data)
+
+        for kind, payload in frames:
+            if kind == FRAME_HELLO:
+                state['hello'] = payload
+                instance_id = payload.get('instance_id')
+                if instance_id:
+                    self.connections[instance_id] = conn
+                    self.stats[instance_id] = {'events': 0, 'bytes': len(data), 'connected_at': time.time()}
+                self._pending.put((state['hello'], '__connected__', payload, time.time()))
+            elif kind == FRAME_EVENTS:
+                if instance_id in self.stats:
+                    self.stats[instance_id]['events'] += len(payload)
+                # Blocks when dispatch falls behind, which stops reads and pushes back on the bots
+                self._pending.put((state['hello'], None, payload, None))
+
+    def _close(self, conn, state):
+        try:
+            self._selector.unregister(conn)
+        except (KeyError, ValueError):
+            pass
+        conn.close()
+
+        instance_id = state['hello'].get('instance_id')
+        if instance_id and self.connections.get(instance_id) is conn:
+            del self.connections[instance_id]
+            self._pending.put((state['hello'], '__disconnected__', {}, time.time()))
+
+    def _dispatch_loop(self):
+        while True:
+            hello, event_type, payload, timestamp = self._pending.get()
+            events = [(event_type, payload, timestamp)] if event_type else payload
+            for event_type, event_payload, event_timestamp in events:
+                try:
+                    self.dispatch(hello, event_type, event_payload, event_timestamp)
+                except Exception as e:
+                    logger.error(f"Error dispatching event {event_type}: {e}")
+
+# endregion
@@ -10,14 +10,22 @@ import json
 
 import arrow
 import numpy
-import socketio
 import tenacity
 
+import lokbot.buff_scheduler
+import lokbot.rally_pipeline
+import lokbot.recorder
+import lokbot.speedup
 import lokbot.util
 from lokbot import logger, config
 from lokbot.client import LokBotApi
+from lokbot.config_watcher import CompiledConfig, compiled_config
 from lokbot.enum import *
+from lokbot.event_channel import send_to_web
 from lokbot.exceptions import OtherException, FatalApiException, NotOnlineException
+from lokbot.health import health
+from lokbot.kingdom_state import KingdomState
+from lokbot.upgrade_planner import UpgradePlanner
 
 # Placeholder for project_root if not defined globally
 try:
@@ -46,6 +54,14 @@ ws_headers = {
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0'
 }
 
+# Seconds an item/list result is trusted for speedup planning
+INVENTORY_MAX_AGE = 300
+
+# Seconds before a farmer looks at a queue again when nothing could be started in it
+QUEUE_IDLE_RECHECK = 900
+# Seconds between checks of a task that is past its expectedEnded without an event
+QUEUE_OVERDUE_RECHECK = 60
+
 
 # Ref: https://stackoverflow.com/a/16858283/6266737
 def blockshaped(arr, nrows, ncols):
@@ -87,10 +103,24 @@ def neighbors(a, radius, row_number, column_number):
     ] for i in range(row_number - 1 - radius, row_number + radius)]
 
 
+def iter_target_objects(objects, target_levels):
+    """(object, allowed levels) for field objects in a normal state whose code is a target"""
+    for each_obj in objects:
+        if each_obj.get('state', 1) != 1:
+            continue
+        allowed_levels = target_levels.get(each_obj.get('code'))
+        if allowed_levels is not None:
+            yield each_obj, allowed_levels
+
+
 class LokFarmer:
 
     def __init__(self, token, captcha_solver_config):
         self.kingdom_enter = None
+        # Typed state, kept current by socket events and _request_callback
+        self.state = KingdomState()
+        self.buff_scheduler = lokbot.buff_scheduler.BuffScheduler()
+        self.rally_pipeline = lokbot.rally_pipeline.RallyJoinPipeline(self.join_rally)
         self.token = token
         self.api = LokBotApi(token, captcha_solver_config,
                              self._request_callback)
@@ -151,11 +181,10 @@ class LokFarmer:
         # Skills are now handled by the dedicated skills management thread
         # This prevents conflicts with the periodic activation system
 
-        # [food, lumber, stone, gold]
-        self.resources = self.kingdom_enter.get('kingdom').get('resources')
-        self.buff_item_use_lock = threading.Lock()
-        self.hospital_recover_lock = threading.Lock()
-        self.active_buffs = []  # Store active buffs for new buff management system
+        self.state.load_kingdom(self.kingdom_enter.get('kingdom', {}))
+        self.planner = UpgradePlanner(self.state)
+        self.buff_item_use_lock = health.timed_lock('buff_item_use_lock')
+        self.hospital_recover_lock = health.timed_lock('hospital_recover_lock')
         self.has_additional_building_queue = self.kingdom_enter.get(
             'kingdom').get('vip', {}).get('level') >= 5
         self.troop_queue = []
@@ -166,7 +195,7 @@ class LokFarmer:
         # Initialize march objects tracking with high-frequency update support
         self.march_objects_data = {}
         self.march_objects_last_update = 0
-        self.march_objects_lock = threading.Lock()  # Thread safety
+        self.march_objects_lock = health.timed_lock('march_objects_lock')  # Thread safety
         self.march_data_validation_errors = 0
         self.max_march_data_age = 300  # 5 minutes max age for march data
         self.march_data_update_count = 0  # Track frequency of updates
@@ -303,10 +332,12 @@ class LokFarmer:
         """Periodically update march status"""
         while True:
             try:
+                health.heartbeat(timeout=180)
                 time.sleep(30)  # Update every 30 seconds
                 self._update_march_limit()
             except Exception as e:
                 logger.error(f"Error in march status update thread: {str(e)}")
+                health.record_error(error=e)
                 time.sleep(60)  # Wait longer on error
 
     def _reconnect_kingdom(self):
@@ -441,7 +472,9 @@ class LokFarmer:
                     logger.warning(f"Error re-initializing skills: {e}")
 
             # Step 7: Update all internal state variables
-            self.resources = self.kingdom_enter.get('kingdom').get('resources')
+            self.state.load_kingdom(self.kingdom_enter.get('kingdom', {}))
+            self.buff_scheduler.refresh(self.state.snapshot().buffs.values())
+            self.planner.invalidate_researches()
             self.level = self.kingdom_enter.get('kingdom').get('level')
             self.has_additional_building_queue = self.kingdom_enter.get('kingdom').get('vip', {}).get('level') >= 5
 
@@ -461,9 +494,8 @@ class LokFarmer:
             self.research_queue_available.clear()
             self.train_queue_available.clear()
 
-            # Step 11: Reset buff management tracking
+            # Step 11: Reset buff management tracking, the buffs themselves came with kingdom/enter
             self.buff_last_activation = {}
-            self.active_buffs = []
 
             # Step 12: Update kingdom tasks
             self.kingdom_tasks = []
@@ -509,89 +541,7 @@ class LokFarmer:
         if building.get('code') == BUILDING_CODE_MAP['hall_of_alliance']:
             return False
 
-        building_level = building.get('level')
-        current_building_json = building_json.get(building.get('code'))
-
-        if not current_building_json:
-            return False
-
-        next_level_building_json = current_building_json.get(
-            str(building_level + 1))
-        for requirement in next_level_building_json.get('requirements'):
-            req_level = requirement.get('level')
-            req_type = requirement.get('type')
-            req_code = BUILDING_CODE_MAP.get(req_type)
-
-            if not [
-                    b for b in buildings if b.get('code') == req_code
-                    and b.get('level') >= req_level
-            ]:
-                return False
-
-        for res_requirement in next_level_building_json.get('resources'):
-            req_value = res_requirement.get('value')
-            req_type = res_requirement.get('type')
-
-            if self.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
-                return False
-
-        return True
-
-    def _is_researchable(self,
-                         academy_level,
-                         category_name,
-                         research_name,
-                         exist_researches,
-                         to_max_level=False):
-        research_category = RESEARCH_CODE_MAP.get(category_name)
-        research_code = research_category.get(research_name)
-
-        exist_research = [
-            each for each in exist_researches
-            if each.get('code') == research_code
-        ]
-        current_research_json = research_json.get(research_code)
-
-        # already finished
-        if exist_research and exist_research[0].get('level') >= int(
-                current_research_json[-1].get('level')):
-            return False
-
-        # minimum required level only
-        if not to_max_level and \
-                exist_research and \
-                exist_research[0].get('level') >= RESEARCH_MINIMUM_LEVEL_MAP.get(category_name).get(research_name, 0):
-            return False
-
-        next_level_research_json = current_research_json[0]
-        if exist_research:
-            next_level_research_json = current_research_json[
-                exist_research[0].get('level')]
-
-        for requirement in next_level_research_json.get('requirements'):
-            req_level = int(requirement.get('level'))
-            req_type = requirement.get('type')
-
-            # 判断学院等级
-            if req_type == 'academy' and req_level > academy_level:
-                return False
-
-            # 判断前置研究是否完成
-            if req_type != 'academy' and not [
-                    each for each in exist_researches
-                    if each.get('code') == research_category.get(req_type)
-                    and each.get('level') >= req_level
-            ]:
-                return False
-
-        for res_requirement in next_level_research_json.get('resources'):
-            req_value = int(res_requirement.get('value'))
-            req_type = res_requirement.get('type')
-
-            if self.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
-                return False
-
-        return True
+        return self.planner.building_eligible(building.get('code'), building.get('level'), self.resources)
 
     def _update_kingdom_enter_building(self, building):
         if building.get('code') == BUILDING_CODE_MAP['hospital']:
@@ -607,21 +557,43 @@ class LokFarmer:
             b
             for b in buildings if b.get('position') != building.get('position')
         ] + [building]
+        self.state.apply_building(building)
+
+    # [food, lumber, stone, gold]
+    @property
+    def resources(self):
+        return self.state.resources
+
+    @resources.setter
+    def resources(self, resources):
+        self.state.apply_resources(resources)
+
+    @property
+    def active_buffs(self):
+        """Buff dicts as the server sent them, for the buff management code"""
+        return [buff.data for buff in self.state.snapshot().buffs.values()]
 
     def _request_callback(self, json_response):
         resources = json_response.get('resources')
 
         if resources and len(resources) == 4:
             logger.info(f'resources updated: {resources}')
-            self.resources = resources
+
+        self.state.apply_response(json_response)
 
         # Check for crystal limit error
         error = json_response.get('err')
         if error and error.get('code') == 'exceed_crystal_daily_quota':
             self._handle_crystal_limit_error()
 
+    def _get_inventory(self, max_age=INVENTORY_MAX_AGE):
+        """Item amounts from item/list, reused for max_age seconds and kept current as items are used"""
+        if self.state.inventory is None or time.time() - self.state.inventory_updated_at > max_age:
+            self.state.load_inventory(self.api.item_list().get('items', []))
+        return self.state.snapshot().inventory or {}
+
     def _get_optimal_speedups(self, need_seconds, speedup_type):
-        current_map = ITEM_CODE_SPEEDUP_MAP.get(speedup_type)
+        current_map = dict(ITEM_CODE_SPEEDUP_MAP.get(speedup_type) or {})
 
         # Only for hospital recovery, don't use universal speedups
         if speedup_type != 'recover':
@@ -629,112 +601,85 @@ class LokFarmer:
 
         assert current_map, f'invalid speedup type: {speedup_type}'
 
-        items = self.api.item_list().get('items', [])
-        items = [
-            item for item in items if item.get('code') in current_map.keys()
-        ]
+        inventory = self._get_inventory()
+        stock = {
+            code: (seconds, inventory.get(code, 0))
+            for code, seconds in current_map.items() if inventory.get(code)
+        }
 
-        if not items:
+        if not stock:
             logger.info(f'no speedup item found for {speedup_type}')
             return False
 
-        # build `{code, amount, second}` map
-        speedups = []
-        for item in items:
-            speedups.append({
-                'code': item.get('code'),
-                'amount': item.get('amount'),
-                'second': current_map.get(item.get('code'))
-            })
-
-        # sort by speedup second desc
-        speedups = sorted(speedups,
-                          key=lambda x: x.get('second'),
-                          reverse=True)
+        # Recovery has to cover the whole time, other tasks never waste seconds past the end
+        plan = lokbot.speedup.plan_speedups(need_seconds, stock, overshoot=speedup_type == 'recover')
 
-        counts = {each.get('code'): 0 for each in speedups}
+        if not plan:
+            logger.info(f'cannot find optimal speedups for {speedup_type}')
+            return False
 
-        remaining_seconds = need_seconds
-        used_seconds = 0
-        for each in speedups:
-            while remaining_seconds >= each.get('second') and counts.get(
-                    each.get('code')) < each.get('amount'):
-                remaining_seconds -= each.get('second')
-                counts[each.get('code')] += 1
-                used_seconds += each.get('second')
+        return plan
 
+    def _use_speedup(self, task_id, code, count, speedup_type):
         if speedup_type == 'recover':
-            # greedy mode
-            speedups_asc = sorted(speedups, key=lambda x: x.get('second'))
-            for each in speedups_asc:
-                while remaining_seconds >= 0 and counts.get(
-                        each.get('code')) < each.get('amount'):
-                    remaining_seconds -= each.get('second')
-                    counts[each.get('code')] += 1
-                    used_seconds += each.get('second')
-
-        counts = {k: v for k, v in counts.items() if v > 0}
-
-        if not counts:
-            logger.info(f'cannot find optimal speedups for {speedup_type}')
-            return False
+            item_type = "recovery" if code in ITEM_CODE_SPEEDUP_MAP.get(
+                'recover', {}) else "universal"
+            logger.info(
+                f'Using {count}x speedup item (code: {code}, type: {item_type})'
+            )
 
-        return {'counts': counts, 'used_seconds': used_seconds}
+        try:
+            if speedup_type == 'recover':
+                self.api.kingdom_heal_speedup(code, count)
+            else:
+                self.api.kingdom_task_speedup(task_id, code, count)
+        except OtherException:
+            # Most likely the cached amounts are off, read them again next time
+            self.state.invalidate_inventory()
+            raise
+
+        self.state.use_items(code, count)
 
     def do_speedup(self, expected_ended, task_id, speedup_type):
         need_seconds = self.calc_time_diff_in_seconds(expected_ended)
 
-        if need_seconds > 60 * 5 or speedup_type == 'recover':
+        if not (need_seconds > 60 * 5 or speedup_type == 'recover'):
             # try speedup only when need_seconds > 5 minutes
-            speedups = self._get_optimal_speedups(need_seconds, speedup_type)
-            if speedups:
-                counts = speedups.get('counts')
-                used_seconds = speedups.get('used_seconds')
+            return
 
-                # using speedup items
-                logger.info(
-                    f'need_seconds: {need_seconds}, using speedups: {counts}, saved {used_seconds} seconds'
-                )
+        speedups = self._get_optimal_speedups(need_seconds, speedup_type)
+        if not speedups:
+            return
 
-                # Better logging for hospital recovery
-                if speedup_type == 'recover':
-                    logger.info(
-                        'Hospital recovery using ONLY recovery-specific speedups'
-                    )
+        logger.info(
+            f'need_seconds: {need_seconds}, using speedups: {speedups["counts"]}, '
+            f'saved {speedups["used_seconds"]} seconds'
+        )
 
-                for code, count in counts.items():
-                    # Check if task is still active for building/research/training speedups
-                    if speedup_type != 'recover':
-                        # Check task status before applying speedup
-                        try:
-                            tasks = self.api.kingdom_task_all().get(
-                                'kingdomTasks', [])
-                            active_task = next(
-                                (t for t in tasks if t.get('_id') == task_id
-                                 and t.get('status') == 1), None)
-                            if not active_task:
-                                logger.info(
-                                    f'Task {task_id} is no longer active, skipping remaining speedups'
-                                )
-                                break
-                        except Exception as e:
-                            logger.warning(
-                                f'Failed to check task status: {e}, continuing with speedup'
-                            )
+        # Better logging for hospital recovery
+        if speedup_type == 'recover':
+            logger.info(
+                'Hospital recovery using ONLY recovery-specific speedups'
+            )
 
-                    # Apply the speedup
-                    if speedup_type == 'recover':
-                        item_type = "recovery" if code in ITEM_CODE_SPEEDUP_MAP.get(
-                            'recover', {}) else "universal"
-                        logger.info(
-                            f'Using {count}x speedup item (code: {code}, type: {item_type})'
-                        )
-                        self.api.kingdom_heal_speedup(code, count)
-                    else:
-                        self.api.kingdom_task_speedup(task_id, code, count)
+        # One call per item code.  Whether the task is still running comes from /task/update
+        # events instead of a kingdom/task/all request before every code
+        pending = list(speedups['counts'].items())
+        update = self.state.tasks.get(task_id)
+        for index, (code, count) in enumerate(pending):
+            if index:
+                # Short pause between calls
+                time.sleep(random.uniform(1, 2))
+
+                latest = self.state.tasks.get(task_id)
+                if speedup_type != 'recover' and latest is not update and (
+                        latest is None or latest.status != STATUS_PENDING):
+                    logger.info(
+                        f'Task {task_id} finished early, skipping remaining speedups: {dict(pending[index:])}'
+                    )
+                    break
 
-                    # Add longer delay between speedups to allow task status to update
-                    time.sleep(random.randint(2, 4))
+            self._use_speedup(task_id, code, count, speedup_type)
 
     def _upgrade_building(self, building, buildings, speedup):
         if not self._is_building_upgradeable(building, buildings):
@@ -1091,34 +1036,8 @@ class LokFarmer:
         Returns:
             bool: True if coordinates are allowed, False otherwise
         """
-        from lokbot import config
-        
-        # Get area restrictions from config
-        restrictions = config.get('main', {}).get('object_scanning', {}).get('area_restrictions', {})
-        
-        # If restrictions are not enabled, allow all areas
-        if not restrictions.get('enabled', False):
-            return True
-            
-        allowed_areas = restrictions.get('allowed_areas', [])
-        
-        # If no areas defined, allow all (safety fallback)
-        if not allowed_areas:
-            return True
-            
-        # Check if coordinates fall within any allowed rectangular area
-        for area in allowed_areas:
-            min_x = area.get('min_x', 0)
-            max_x = area.get('max_x', 2047)
-            min_y = area.get('min_y', 0)
-            max_y = area.get('max_y', 2047)
-            
-            if min_x <= x <= max_x and min_y <= y <= max_y:
-                logger.debug(f"Coordinates [{x}, {y}] allowed in area: {area.get('name', 'Unnamed')}")
-                return True
-                
-        logger.debug(f"Coordinates [{x}, {y}] outside all allowed areas")
-        return False
+        # Rectangles are compiled once per config version, see lokbot.config_watcher
+        return compiled_config().is_coordinate_allowed(x, y)
 
     def _filter_zones_by_area_restrictions(self, zone_ids):
         """
@@ -1130,47 +1049,9 @@ class LokFarmer:
         Returns:
             list: Filtered list of zone IDs that are within allowed areas
         """
-        from lokbot import config
-        
-        restrictions = config.get('main', {}).get('object_scanning', {}).get('area_restrictions', {})
-        
-        # If restrictions are not enabled, return all zones
-        if not restrictions.get('enabled', False):
-            return zone_ids
-            
-        allowed_zones = []
-        
-        for zone_id in zone_ids:
-            # Convert zone ID to zone coordinates
-            zone_y = zone_id // 64
-            zone_x = zone_id % 64
-            
-            # Convert zone coordinates to tile coordinate boundaries
-            zone_min_x = zone_x * 32
-            zone_max_x = zone_x * 32 + 31
-            zone_min_y = zone_y * 32
-            zone_max_y = zone_y * 32 + 31
-            
-            # Check if any part of the zone overlaps with allowed areas
-            zone_allowed = False
-            for corner_x in [zone_min_x, zone_max_x]:
-                for corner_y in [zone_min_y, zone_max_y]:
-                    if self._is_coordinate_in_allowed_areas(corner_x, corner_y):
-                        zone_allowed = True
-                        break
-                if zone_allowed:
-                    break
-                    
-            # Also check zone center
-            if not zone_allowed:
-                zone_center_x = zone_x * 32 + 16
-                zone_center_y = zone_y * 32 + 16
-                if self._is_coordinate_in_allowed_areas(zone_center_x, zone_center_y):
-                    zone_allowed = True
-            
-            if zone_allowed:
-                allowed_zones.append(zone_id)
-                
+        # The allowed zone mask (corners or center inside an area) is precomputed per config version
+        allowed_zones = compiled_config().filter_zones(zone_ids)
+
         if len(allowed_zones) != len(zone_ids):
             logger.info(f"Area restrictions filtered {len(zone_ids)} zones down to {len(allowed_zones)} allowed zones")
             
@@ -1182,6 +1063,7 @@ class LokFarmer:
             self.troop_queue = troops.get('field', [])
             self.march_limit = troops.get('info').get('marchLimit')
             self.march_size = troops.get('info').get('marchSize')
+            self.state.load_marches(self.troop_queue, self.march_limit, self.march_size)
 
             # Send updated march status to web app
             self._send_march_status_update()
@@ -1192,7 +1074,6 @@ class LokFarmer:
     def _send_march_status_update(self):
         """Send march status update to web app"""
         try:
-            import requests
             import os
 
             user_id = os.getenv('LOKBOT_USER_ID', 'web_user')
@@ -1218,8 +1099,8 @@ class LokFarmer:
                 'timestamp': time.time()
             }
 
-            response = requests.post('http://localhost:5000/api/march_status_update',
-                json=march_data, timeout=2)
+            send_to_web('/api/march_status_update',
+                march_data, timeout=2)
 
         except Exception as e:
             logger.debug(f"Could not send march status update: {str(e)}")
@@ -1709,7 +1590,6 @@ class LokFarmer:
 
                 # Send to web app notification system
                 try:
-                    import requests
                     import os
                     import time
                     user_id = os.getenv('LOKBOT_USER_ID', 'web_user')
@@ -1725,8 +1605,8 @@ Location: {to_loc}
 Started: {started_time}
 Expected End: {ended_time}"""
 
-                    response = requests.post('http://localhost:5000/api/gathering_notification',
-                        json={
+                    send_to_web('/api/gathering_notification',
+                        {
                             'resource_type': resource_type,
                             'resource_code': resource_code,
                             'level': resource_level,
@@ -1991,7 +1871,6 @@ Expected End: {ended_time}"""
             # Send notification to web app
             try:
                 import os
-                import requests
                 user_id = os.getenv('LOKBOT_USER_ID', 'web_user')
 
                 # Generate instance_id and account_name based on current process
@@ -2002,8 +1881,8 @@ Expected End: {ended_time}"""
 
                 crystal_message = "🚨 **CRYSTAL LIMIT REACHED** - Your Daily Crystal Limit is Over, Please Stop the Bot"
 
-                response = requests.post('http://localhost:5000/api/crystal_limit_notification',
-                    json={
+                send_to_web('/api/crystal_limit_notification',
+                    {
                         'user_id': user_id,
                         'instance_id': instance_id,
                         'account_name': account_name,
@@ -2333,7 +2212,6 @@ Expected End: {ended_time}"""
             message: Notification message
         """
         try:
-            import requests
             import os
             
             # Get proper instance context like object notifications do
@@ -2354,15 +2232,14 @@ Expected End: {ended_time}"""
             
             # Send to appropriate web app notification endpoint based on type
             if notification_type == 'monster_attack':
-                endpoint = 'http://localhost:5000/api/monster_attack_notification'
+                endpoint = '/api/monster_attack_notification'
             else:
-                endpoint = 'http://localhost:5000/api/skills_notification'
+                endpoint = '/api/skills_notification'
                 
-            response = requests.post(endpoint, json=notification_data, timeout=5)
-            if response.status_code == 200:
+            if send_to_web(endpoint, notification_data, timeout=5):
                 logger.debug(f"Notification sent successfully: {notification_type} for {account_name} (instance: {instance_id})")
             else:
-                logger.warning(f"Failed to send notification: {response.status_code}")
+                logger.warning(f"Failed to send notification: {notification_type}")
                 
         except Exception as e:
             logger.debug(f"Error sending notification: {str(e)}")
@@ -3276,7 +3153,6 @@ Expected End: {ended_time}"""
 
             # Send web app notification
             try:
-                import requests
                 import os
 
                 # Get user ID and instance info from environment
@@ -3309,8 +3185,8 @@ Troops Sent: {total_troops} {troop_type}
 Rally ID: {rally_id}"""
 
                 # Send to web app notification system
-                response = requests.post('http://localhost:5000/api/rally_notification',
-                    json={
+                send_to_web('/api/rally_notification',
+                    {
                         'user_id': user_id,
                         'notification_type': 'rally_join',
                         'monster_code': monster_code,
@@ -3411,9 +3287,7 @@ Rally ID: {rally_id}"""
         """
         url = self.kingdom_enter.get('networks').get('kingdoms')[0]
 
-        sio = socketio.Client(reconnection=False,
-                              logger=False,
-                              engineio_logger=False)
+        sio = lokbot.recorder.socket_client('kingdoms')
 
         @sio.on('/building/update')
         def on_building_update(data):
@@ -3423,7 +3297,7 @@ Rally ID: {rally_id}"""
         @sio.on('/resource/upgrade')
         def on_resource_update(data):
             logger.debug(data)
-            self.resources[data.get('resourceIdx')] = data.get('value')
+            self.state.apply_resource(data.get('resourceIdx'), data.get('value'))
 
         @sio.on('/buff/list')
         def on_buff_list(data):
@@ -3453,11 +3327,13 @@ Rally ID: {rally_id}"""
                 logger.debug(f'on_buff_list: received buff data: {data}')
 
                 # Store active buffs for buff management system - this is the primary source
-                self.active_buffs = data if data else []
+                self.state.apply_buffs(data if isinstance(data, list) else [])
+                self.buff_scheduler.refresh(self.state.snapshot().buffs.values())
 
                 # Log currently active buffs to console with enhanced parsing
                 if data:
                     logger.info("=== ACTIVE BUFFS (from socc_thread /buff/list) ===")
+                    parsed_buffs = self.state.snapshot().buffs
                     for i, buff in enumerate(data):
                         # Handle both itemCode and code structures
                         item_code = buff.get('param', {}).get('itemCode')
@@ -3467,24 +3343,17 @@ Rally ID: {rally_id}"""
                         buff_type_num = buff.get('buffType', 'Unknown')
                         ability = buff.get('ability', [])
 
-                        # Calculate remaining time from expiredDate if available
+                        # Remaining time from the expiry the kingdom state parsed
                         remaining_time = "Unknown"
-                        if expired_date != 'Unknown':
-                            try:
-                                import arrow
-                                expired_arrow = arrow.get(expired_date)
-                                current_time = arrow.utcnow()
-                                if expired_arrow > current_time:
-                                    diff = expired_arrow - current_time
-                                    total_seconds = int(diff.total_seconds())
-                                    hours = total_seconds // 3600
-                                    minutes = (total_seconds % 3600) // 60
-                                    remaining_time = f"{hours}h {minutes}m"
-                                else:
-                                    remaining_time = "Expired"
-                            except Exception as time_error:
-                                logger.debug(f"Error calculating remaining time: {time_error}")
-                                remaining_time = "Parse Error"
+                        parsed = parsed_buffs.get(buff_id) or parsed_buffs.get(item_code or param_code)
+                        if parsed is not None and parsed.expires_at is not None:
+                            total_seconds = int(parsed.expires_at - time.time())
+                            if total_seconds > 0:
+                                hours = total_seconds // 3600
+                                minutes = (total_seconds % 3600) // 60
+                                remaining_time = f"{hours}h {minutes}m"
+                            else:
+                                remaining_time = "Expired"
 
                         # Determine buff type name
                         buff_type = "Unknown"
@@ -3544,17 +3413,15 @@ Rally ID: {rally_id}"""
             level = data.get('level', 'Unknown')
             location = data.get('loc', [])
 
-            # Just log the rally notification, but don't try to join
-            # Joining will be handled by the _check_rallies_thread instead
             logger.info(
                 f'Received new rally notification for monster code: {code}, ID: {rally_mo_id}'
             )
-            logger.info(
-                'Rally joining will be handled by the periodic check thread')
+            # Straight into the join pipeline, the battle list pass only catches what events miss
+            if self.alliance_id:
+                self.rally_pipeline.submit(lokbot.rally_pipeline.battle_from_event(data))
 
             # Send web app notification for rally alert
             try:
-                import requests
                 import os
                 import time
 
@@ -3578,8 +3445,8 @@ Location: {location}
 Status: Available to join"""
 
                 # Send to web app notification system
-                response = requests.post('http://localhost:5000/api/rally_notification',
-                    json={
+                send_to_web('/api/rally_notification',
+                    {
                         'user_id': user_id,
                         'notification_type': 'rally_alert',
                         'monster_code': code,
@@ -3599,6 +3466,8 @@ Status: Available to join"""
         @sio.on('/task/update')
         def on_task_update(data):
             logger.debug(data)
+            self.state.apply_task(data, claimed_status=STATUS_CLAIMED)
+
             if data.get('status') == STATUS_FINISHED:
                 if data.get('code') in (TASK_CODE_SILVER_HAMMER,
                                         TASK_CODE_GOLD_HAMMER):
@@ -3606,6 +3475,7 @@ Status: Available to join"""
 
             if data.get('status') == STATUS_CLAIMED:
                 if data.get('code') == TASK_CODE_ACADEMY:
+                    self.planner.finish_research(data.get('_id'))
                     self.research_queue_available.set()
                 if data.get('code') == TASK_CODE_CAMP:
                     self.train_queue_available.set()
@@ -3733,6 +3603,9 @@ Status: Available to join"""
         # Set a flag to track thread status
         self.socf_thread_active = True
 
+        # Fallback target index when the config has no socf_thread entry (targets passed in directly)
+        thread_target_levels = CompiledConfig.compile_targets(targets)
+
         # Watchdog timer thread
         def watchdog():
             while self.socf_thread_active:
@@ -3743,6 +3616,7 @@ Status: Available to join"""
                 ) - self.last_socf_activity > 300:  # 5 minutes timeout
                     logger.error(
                         "SOCF thread appears stuck - forcing reconnection")
+                    health.record_error('socf_thread', 'no activity for 5 minutes')
                     try:
                         self.socf_thread_active = False
                         raise tenacity.TryAgain()
@@ -3824,9 +3698,7 @@ Status: Available to join"""
                 self.zones = self._get_nearest_zone_ng(from_loc[1],
                                                        from_loc[2], radius)
 
-            sio = socketio.Client(reconnection=False,
-                                  logger=False,
-                                  engineio_logger=False)
+            sio = lokbot.recorder.socket_client('fields')
 
             @sio.on('/march/objects')
             def on_march_objects(data):
@@ -3955,41 +3827,21 @@ Status: Available to join"""
                     sio.disconnect()
                     return
 
+                health.heartbeat('socf_thread', timeout=90, detail='field objects')
                 packs = data.get('packs')
                 gzip_decompress = gzip.decompress(bytearray(packs))
                 data_decoded = self.api.b64xor_dec(gzip_decompress)
                 objects = data_decoded.get('objects')
-                # Only include enabled targets
-                target_code_set = set([
-                    target['code'] for target in targets
-                    if target.get('enabled', True)
-                ])
+                # Enabled target codes -> allowed levels, from the live config when it has socf targets
+                target_levels = compiled_config().socf_targets
+                if target_levels is None:
+                    target_levels = thread_target_levels
 
                 logger.debug(f'Processing {len(objects)} objects')
-                for each_obj in objects:
+                for each_obj, allowed_levels in iter_target_objects(objects, target_levels):
                     code = each_obj.get('code')
                     level = each_obj.get('level')
                     loc = each_obj.get('loc')
-                    state = each_obj.get('state', 1)
-
-                    # Skip if object is not in valid state
-                    if state != 1:
-                        continue
-
-                    # Check if object is in our targets
-                    if code not in target_code_set:
-                        continue
-
-                    # Get all level lists for this monster code
-                    level_lists = [
-                        target['level'] for target in targets
-                        if target['code'] == code
-                    ]
-
-                    # Flatten the level lists into a single list of allowed levels
-                    allowed_levels = [
-                        level for sublist in level_lists for level in sublist
-                    ]
 
                     # If allowed_levels is empty or the monster's level is in allowed_levels, process it
                     if not allowed_levels or level in allowed_levels:
@@ -4501,10 +4353,8 @@ Status: Available to join"""
 
                     logger.debug(f"Gather enabled: {enable_gathering}, Monster attack enabled: {enable_monster_attack}")
 
-                    # Find matching target and check if it's enabled
-                    target = next(
-                        (t for t in targets if t.get('code') == code), None)
-                    if not target or target.get('enabled', True) is False:
+                    # Only enabled targets of the live config are in the compiled index
+                    if code not in target_levels:
                         logger.info(
                             f"Target {code} is disabled or not found, skipping"
                         )
@@ -4513,21 +4363,21 @@ Status: Available to join"""
                     # Check object type and process accordingly
                     if code in OBJECT_MINE_CODE_LIST:
                         # Only call gather if gathering is enabled and target is in our code set
-                        if enable_gathering and code in target_code_set:
+                        if enable_gathering and code in target_levels:
                             logger.debug(f"Attempting to gather from resource code {code} at {each_obj.get('loc')}")
                             self._on_field_objects_gather(each_obj)
                         else:
-                            logger.debug(f"Skipping gather - enable_gathering: {enable_gathering}, code_in_target: {code in target_code_set}")
+                            logger.debug(f"Skipping gather - enable_gathering: {enable_gathering}, code_in_target: {code in target_levels}")
                     elif code in OBJECT_MONSTER_CODE_LIST:
                         # Only call monster attack if monster attack is enabled and target is in our code set
-                        if enable_monster_attack and code in target_code_set:
+                        if enable_monster_attack and code in target_levels:
                             logger.debug(f"Attempting to attack monster code {code} at {each_obj.get('loc')}")
                             self._on_field_objects_monster(each_obj)
                         else:
-                            logger.debug(f"Skipping monster attack - enable_monster_attack: {enable_monster_attack}, code_in_target: {code in target_code_set}")
+                            logger.debug(f"Skipping monster attack - enable_monster_attack: {enable_monster_attack}, code_in_target: {code in target_levels}")
 
-                    if code in set(OBJECT_MINE_CODE_LIST).intersection(target_code_set) or \
-                       code in set(OBJECT_MONSTER_CODE_LIST).intersection(target_code_set):
+                    if code in set(OBJECT_MINE_CODE_LIST).intersection(target_levels) or \
+                       code in set(OBJECT_MONSTER_CODE_LIST).intersection(target_levels):
                         obj_type = "Resource" if code in OBJECT_MINE_CODE_LIST else "Monster"
 
                         # Map object codes to friendly names
@@ -4561,7 +4411,6 @@ Status: {status}"""
 
                         # Send to web app notification system once
                         try:
-                            import requests
                             import os
                             import time
                             user_id = os.getenv('LOKBOT_USER_ID', 'web_user')
@@ -4571,8 +4420,8 @@ Status: {status}"""
                             instance_id = os.getenv('LOKBOT_INSTANCE_ID', f"{user_id}_{timestamp}")
                             account_name = os.getenv('LOKBOT_ACCOUNT_NAME', 'Bot Instance')
 
-                            response = requests.post('http://localhost:5000/api/object_notification',
-                                json={
+                            send_to_web('/api/object_notification',
+                                {
                                     'object_type': obj_type,
                                     'object_name': object_name,
                                     'code': code,
@@ -4657,6 +4506,7 @@ Status: {status}"""
             grace = 7  # 9 times enter-leave action will cause ban
             index = 0
             while self.zones:
+                health.heartbeat('socf_thread', timeout=90, detail='entering zones')
                 if index >= grace:
                     logger.info('socf_thread grace exceeded, break')
                     break
@@ -4762,9 +4612,7 @@ Status: {status}"""
         """
         url = self.kingdom_enter.get('networks').get('chats')[0]
 
-        sio = socketio.Client(reconnection=False,
-                              logger=False,
-                              engineio_logger=False)
+        sio = lokbot.recorder.socket_client('chats')
 
         @sio.on('/chat/message')
         def on_chat_message(data):
@@ -4990,44 +4838,80 @@ Status: {status}"""
 
         return False
 
+    def _wait_for_queue(self, event, task_codes, idle=QUEUE_IDLE_RECHECK):
+        """
+        Block until sock_thread reports the queue free or its task's expectedEnded passes
+
+        The end comes from the tasks the kingdom state indexed from the last
+        kingdom/task/all or newTask, so a missed socket event costs at most a
+        second.  With no running task, nothing could be started, and the
+        queue is looked at again after `idle` seconds.
+        """
+        now = time.time()
+        ends = [task.expected_ended for task in self.state.snapshot().tasks_with_code(*task_codes)
+                if task.status == STATUS_PENDING and task.expected_ended]
+        if ends:
+            timeout = min(ends) - now + 1 if min(ends) > now else QUEUE_OVERDUE_RECHECK
+        else:
+            timeout = idle
+        health.heartbeat(timeout=timeout + 300, detail=f'waiting {timeout:.0f}s for the queue')
+        woke = event.wait(timeout)
+        event.clear()
+        return woke
+
     def building_farmer_thread(self, speedup=False):
         """
-        building farmer
+        building farmer, refills the building queues as they free up
         :param speedup:
         :return:
         """
-        self.kingdom_tasks = self.api.kingdom_task_all().get(
-            'kingdomTasks', [])
+        building_tasks = (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER)
+        while True:
+            try:
+                health.heartbeat()
+                self.kingdom_tasks = self.api.kingdom_task_all().get(
+                    'kingdomTasks', [])
 
-        silver_in_use = [
-            t for t in self.kingdom_tasks
-            if t.get('code') == TASK_CODE_SILVER_HAMMER
-        ]
-        gold_in_use = [
-            t for t in self.kingdom_tasks
-            if t.get('code') == TASK_CODE_GOLD_HAMMER
-        ]
+                silver_in_use = [
+                    t for t in self.kingdom_tasks
+                    if t.get('code') == TASK_CODE_SILVER_HAMMER
+                ]
+                gold_in_use = [
+                    t for t in self.kingdom_tasks
+                    if t.get('code') == TASK_CODE_GOLD_HAMMER
+                ]
 
-        if not silver_in_use or (self.has_additional_building_queue
-                                 and not gold_in_use):
-            if not self._building_farmer_worker(speedup):
-                logger.info('no building to upgrade, sleep for 2h')
-                threading.Timer(7200, self.building_farmer_thread).start()
-                return
+                if not silver_in_use or (self.has_additional_building_queue
+                                         and not gold_in_use):
+                    if self._building_farmer_worker(speedup):
+                        # The other queue may be free as well
+                        continue
+                    logger.info(f'no building to upgrade, check again in {QUEUE_IDLE_RECHECK // 60}m')
 
-        self.building_queue_available.wait(
-        )  # wait for building queue available from `sock_thread`
-        self.building_queue_available.clear()
-        threading.Thread(target=self.building_farmer_thread,
-                         args=[speedup]).start()
+                # wait for building queue available from `sock_thread`
+                self._wait_for_queue(self.building_queue_available, building_tasks)
+            except Exception as e:
+                logger.error(f'building_farmer: {e}, retry in 60s')
+                health.record_error(error=e)
+                time.sleep(60)
 
     def academy_farmer_thread(self, to_max_level=False, speedup=False):
         """
-        research farmer
+        research farmer, starts the next research as soon as the academy is free
         :param to_max_level:
         :param speedup:
         :return:
         """
+        while True:
+            try:
+                health.heartbeat()
+                self._academy_farmer_step(to_max_level, speedup)
+            except Exception as e:
+                logger.error(f'academy_farmer: {e}, retry in 60s')
+                health.record_error(error=e)
+                time.sleep(60)
+
+    def _academy_farmer_step(self, to_max_level, speedup):
         self.kingdom_tasks = self.api.kingdom_task_all().get(
             'kingdomTasks', [])
 
@@ -5036,79 +4920,60 @@ Status: {status}"""
         ]
 
         if worker_used:
-            if worker_used[0].get('status') == STATUS_CLAIMED:
+            if worker_used[0].get('status') == STATUS_PENDING:
+                # wait for research queue available from `sock_thread`
+                self._wait_for_queue(self.research_queue_available, (TASK_CODE_ACADEMY,))
+                return
+
+            if worker_used[0].get('status') != STATUS_CLAIMED:
+                # 如果已完成, 则领取奖励并继续
                 self.api.kingdom_task_claim(
                     self._random_choice_building(
                         BUILDING_CODE_MAP['academy'])['position'])
-                logger.info(
-                    f'train_troop: one loop completed, sleep for {interval} seconds'
-                )
-                threading.Timer(interval, self.train_troop_thread,
-                                [troop_code, speedup, interval]).start()
-                return
-
-            if worker_used[0].get('status') == STATUS_PENDING:
-                self.research_queue_available.wait(
-                )  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread,
-                                 args=[to_max_level, speedup]).start()
+                self.planner.finish_research(worker_used[0].get('_id'))
                 return
 
-            # 如果已完成, 则领取奖励并继续
-            self.api.kingdom_task_claim(
-                self._random_choice_building(
-                    BUILDING_CODE_MAP['academy'])['position'])
-            threading.Thread(target=self.academy_farmer_thread,
-                             args=[to_max_level, speedup]).start()
-            return
-
+        # No running academy task, so a research the index still counts as running is stale
+        if not self.planner.researches_loaded or self.planner.pending_research is not None:
+            self.planner.load_researches(
+                self.api.kingdom_academy_research_list().get('researches', []))
 
-        exist_researches = self.api.kingdom_academy_research_list().get(
-            'researches', [])
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        academy_level = [
-            b for b in buildings
-            if b.get('code') == BUILDING_CODE_MAP['academy']
-        ][0].get('level')
+        maxed_categories = set()
+        for category_name, research_name, research_code in self.planner.eligible_researches(
+                self.resources, to_max_level):
+            if category_name in maxed_categories:
+                continue
 
-        for category_name, each_category in RESEARCH_CODE_MAP.items():
-            for research_name, research_code in each_category.items():
-                if not self._is_researchable(academy_level, category_name,
-                                             research_name, exist_researches,
-                                             to_max_level):
+            try:
+                res = self.api.kingdom_academy_research(
+                    {'code': research_code})
+            except OtherException as error_code:
+                # The index thought this was possible, read the research list again next time
+                self.planner.invalidate_researches()
+                if str(error_code) == 'not_enough_condition':
+                    logger.warning(
+                        f'category {category_name} reached max level')
+                    maxed_categories.add(category_name)
                     continue
 
-                try:
-                    res = self.api.kingdom_academy_research(
-                        {'code': research_code})
-                except OtherException as error_code:
-                    if str(error_code) == 'not_enough_condition':
-                        logger.warning(
-                            f'category {category_name} reached max level')
-                        break
+                logger.info(
+                    f'research failed, try next one, current: {research_name}({research_code})'
+                )
+                continue
 
-                    logger.info(
-                        f'research failed, try next one, current: {research_name}({research_code})'
-                    )
-                    continue
+            self.planner.start_research(research_code)
 
-                if speedup:
-                    self.do_speedup(
-                        res.get('newTask').get('expectedEnded'),
-                        res.get('newTask').get('_id'), 'research')
+            if speedup:
+                self.do_speedup(
+                    res.get('newTask').get('expectedEnded'),
+                    res.get('newTask').get('_id'), 'research')
 
-                self.research_queue_available.wait(
-                )  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread,
-                                 args=[to_max_level, speedup]).start()
-                return
+            # wait for research queue available from `sock_thread`
+            self._wait_for_queue(self.research_queue_available, (TASK_CODE_ACADEMY,))
+            return
 
-        logger.info('academy_farmer: no research to do, sleep for 2h')
-        threading.Timer(2 * 3600, self.academy_farmer_thread,
-                        [to_max_level]).start()
-        return
+        logger.info(f'academy_farmer: no research to do, check again in {QUEUE_IDLE_RECHECK // 60}m')
+        self._wait_for_queue(self.research_queue_available, (TASK_CODE_ACADEMY,))
 
     def _troop_training_capacity(self):
         """
@@ -5169,12 +5034,22 @@ Status: {status}"""
 
     def train_troop_thread(self, troop_code, speedup=False, interval=3600):
         """
-        train troop
-        :param interval:
+        train troop, refills the barracks as soon as a training is claimed
+        :param interval: seconds before trying again when nothing can be trained
         :param troop_code:
         :param speedup:
         :return:
         """
+        while True:
+            try:
+                health.heartbeat(timeout=interval + 300)
+                self._train_troop_step(troop_code, speedup, interval)
+            except Exception as e:
+                logger.error(f'train_troop: {e}, retry in 60s')
+                health.record_error(error=e)
+                time.sleep(60)
+
+    def _train_troop_step(self, troop_code, speedup, interval):
         while self.api.last_requested_at + 16 > time.time():
             # attempt to prevent `insufficient_resources` due to race conditions
             logger.info(
@@ -5189,26 +5064,21 @@ Status: {status}"""
             t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_CAMP
         ]
 
-        troop_training_capacity = self._troop_training_capacity
         if worker_used:
-            if worker_used[0].get('status') == STATUS_CLAIMED:
+            if worker_used[0].get('status') == STATUS_PENDING:
+                # wait for train queue available from `sock_thread`
+                self._wait_for_queue(self.train_queue_available, (TASK_CODE_CAMP,), interval)
+                return
+
+            if worker_used[0].get('status') != STATUS_CLAIMED:
+                # Trained troops wait in the barracks until claimed
                 self.api.kingdom_task_claim(
                     self._random_choice_building(
                         BUILDING_CODE_MAP['barrack'])['position'])
-                logger.info(
-                    f'train_troop: one loop completed, sleep for {interval} seconds'
-                )
-                threading.Timer(interval, self.train_troop_thread,
-                                [troop_code, speedup, interval]).start()
+                logger.info('train_troop: one loop completed')
                 return
 
-            if worker_used[0].get('status') == STATUS_PENDING:
-                self.train_queue_available.wait(
-                )  # wait for train queue available from `sock_thread`
-                self.train_queue_available.clear()
-                threading.Thread(target=self.train_troop_thread,
-                                 args=[troop_code, speedup, interval]).start()
-                return
+        troop_training_capacity = self._troop_training_capacity()
 
         # if there are not enough resources, train how much possible
         total_troops_capacity_according_to_resources = self._total_troops_capacity_according_to_resources(
@@ -5217,17 +5087,15 @@ Status: {status}"""
             troop_training_capacity = total_troops_capacity_according_to_resources
 
         if not troop_training_capacity:
-            logger.info('train_troop: no resource, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread,
-                            [troop_code, speedup, interval]).start()
+            logger.info(f'train_troop: no resource, sleep for {interval}s')
+            self._wait_for_queue(self.train_queue_available, (TASK_CODE_CAMP,), interval)
             return
 
         try:
             res = self.api.train_troop(troop_code, troop_training_capacity)
         except OtherException as error_code:
-            logger.info(f'train_troop: {error_code}, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread,
-                            [troop_code, speedup, interval]).start()
+            logger.info(f'train_troop: {error_code}, sleep for {interval}s')
+            self._wait_for_queue(self.train_queue_available, (TASK_CODE_CAMP,), interval)
             return
 
         if speedup:
@@ -5235,11 +5103,8 @@ Status: {status}"""
                 res.get('newTask').get('expectedEnded'),
                 res.get('newTask').get('_id'), 'train')
 
-        self.train_queue_available.wait(
-        )  # wait for train queue available from `sock_thread`
-        self.train_queue_available.clear()
-        threading.Thread(target=self.train_troop_thread,
-                         args=[troop_code, speedup, interval]).start()
+        # wait for train queue available from `sock_thread`
+        self._wait_for_queue(self.train_queue_available, (TASK_CODE_CAMP,), interval)
 
     def free_chest_farmer_thread(self, _type=0):
         """
@@ -5706,7 +5571,7 @@ Status: {status}"""
                         logger.info(f'✅ Bought {purchased_count}x {item_name} from caravan')
                         
                         # Update resource count for next calculations
-                        self.resources[resource_index] -= (cost * purchased_count)
+                        self.state.spend(resource_index, cost * purchased_count)
 
                 except Exception as e:
                     logger.error(f'Error purchasing caravan item {item_code}: {str(e)}')
@@ -5892,87 +5757,26 @@ Status: {status}"""
             return None
 
     def _get_current_active_buffs(self):
-        """Get current active buffs with enhanced validation - prioritizing socc_thread data"""
+        """Active buffs from the kingdom state, kept current by /buff/list from socc_thread"""
         try:
-            # First priority: Use active_buffs from socc_thread /buff/list WebSocket events
-            if hasattr(self, 'active_buffs') and self.active_buffs:
-                # Validate and filter expired buffs from socc_thread data
-                valid_buffs = []
-                current_time = arrow.utcnow()
-                
-                for buff in self.active_buffs:
-                    expired_date = buff.get('expiredDate')
-                    if expired_date:
-                        try:
-                            expired_arrow = arrow.get(expired_date)
-                            # Only include buffs that are still active (not expired)
-                            if expired_arrow > current_time:
-                                valid_buffs.append(buff)
-                            else:
-                                logger.debug(f"Filtering out expired buff: {buff.get('param', {}).get('itemCode', 'Unknown')}")
-                        except Exception as date_error:
-                            logger.debug(f"Error parsing buff expiry date, including anyway: {date_error}")
-                            valid_buffs.append(buff)
-                    else:
-                        # If no expiry date available, include it anyway
-                        valid_buffs.append(buff)
-                
-                logger.debug(f"Using socc_thread buff data: {len(valid_buffs)} active buffs (filtered from {len(self.active_buffs)})")
-                return valid_buffs
-
-            # Fallback: Try to get fresh buff data from the kingdom enter response
-            logger.debug("No socc_thread buff data available, trying kingdom_enter API...")
-            kingdom_response = self.api.kingdom_enter()
-            if kingdom_response and 'kingdom' in kingdom_response:
-                buffs = kingdom_response.get('kingdom', {}).get('buffs', [])
-                if buffs:
-                    # Also validate kingdom_enter buff data for expired buffs
-                    valid_buffs = []
-                    current_time = arrow.utcnow()
-                    
-                    for buff in buffs:
-                        remaining_time = buff.get('remainingTime', 0)
-                        if remaining_time > 0:
-                            valid_buffs.append(buff)
-                        else:
-                            logger.debug(f"Filtering out expired buff from kingdom_enter: {buff.get('param', {}).get('itemCode', 'Unknown')}")
-                    
-                    logger.debug(f"Retrieved {len(valid_buffs)} active buffs from kingdom_enter (filtered from {len(buffs)})")
-                    return valid_buffs
-
-            # Final fallback: empty list
-            logger.debug("No buff data available from any source")
-            return []
+            if not self.state.buffs_loaded:
+                # Nothing from kingdom/enter or /buff/list yet, ask once
+                logger.debug("No buff data in the kingdom state yet, trying kingdom_enter API...")
+                kingdom = self.api.kingdom_enter().get('kingdom', {})
+                self.state.apply_buffs(kingdom.get('buffs') or [])
+                self.buff_scheduler.refresh(self.state.snapshot().buffs.values())
+
+            snapshot = self.state.snapshot()
+            valid_buffs = [buff.data for buff in snapshot.active_buffs()]
+            logger.debug(f"Using kingdom state buff data (version {snapshot.version}): "
+                         f"{len(valid_buffs)} active buffs (filtered from {len(snapshot.buffs)})")
+            return valid_buffs
 
         except Exception as e:
             logger.debug(f"Failed to get buff data: {e}")
             # Return existing active_buffs if available, otherwise empty list
             return getattr(self, 'active_buffs', [])
 
-    def _calculate_buff_remaining_time(self, buff):
-        """Calculate remaining time for a buff in minutes"""
-        try:
-            # Try remainingTime field first (from kingdom_enter API)
-            remaining_time = buff.get('remainingTime', 0)
-            if remaining_time > 0:
-                return remaining_time / 60
-            
-            # Calculate from expiredDate if remainingTime not available (from socc_thread)
-            expired_date = buff.get('expiredDate')
-            if expired_date:
-                expired_arrow = arrow.get(expired_date)
-                current_time = arrow.utcnow()
-                if expired_arrow > current_time:
-                    diff = expired_arrow - current_time
-                    return diff.total_seconds() / 60
-                else:
-                    return 0  # Expired
-                    
-            return 0  # No time data available
-        except Exception as e:
-            logger.debug(f"Error calculating buff remaining time: {e}")
-            return 0
-
     def _alliance_help_thread(self):
         """Thread to periodically help alliance members"""
         from lokbot import config
@@ -6130,266 +5934,172 @@ Status: {status}"""
         self._buff_management_thread()
     
     def _buff_management_thread(self):
-        """Thread to monitor and automatically reactivate buffs based on configuration"""
-        logger.info("Buff management thread started - checking every 10 minutes")
+        """Thread to renew buffs at their configured lead time before expiry, woken by the buff scheduler"""
+        logger.info("Buff management thread started - renewing from the buff expiry heap")
 
         # Track last activation times to prevent over-activation
         self.buff_last_activation = {}
         # Minimum cooldown between activations (in seconds) - 30 minutes default
         self.buff_activation_cooldown = 1800
 
+        # Wait for initial startup before activating buffs
+        while self.started_at + 10 > time.time():
+            logger.info(
+                f'started at {arrow.get(self.started_at).humanize()}, wait 10 seconds to activate buffs'
+            )
+            time.sleep(4)
+
+        scheduler = self.buff_scheduler
+        scheduler.configure(config.get('buff_management', {}))
+        self._get_current_active_buffs()
+        scheduler.refresh(self.state.snapshot().buffs.values())
+
         while True:
             try:
-                # Get buff management configuration
-                buff_config = config.get('buff_management', {})
-
-                if not buff_config.get('enabled', False):
+                # The scheduler wakes this thread, the heartbeat only has to outlast its longest sleep
+                health.heartbeat(timeout=lokbot.buff_scheduler.RECONCILE_SECONDS + 900)
+                next_due = scheduler.next_due()
+                if not scheduler.enabled:
                     logger.debug("Buff management is disabled in config")
-                    time.sleep(120)  # Sleep for 2 minutes
-                    continue
+                elif next_due is not None:
+                    logger.debug(f"Next buff renewal due in {max(next_due - time.time(), 0) / 60:.1f} minutes")
 
-                # Get configured buffs to monitor
-                monitored_buffs = buff_config.get('buffs', [])
-                if not monitored_buffs:
-                    logger.debug("No buffs configured for monitoring")
-                    time.sleep(120)
+                due = scheduler.wait_due()
+                if not due:
+                    # Nothing came due for hours, make sure the heap still matches the state
+                    scheduler.refresh(self.state.snapshot().buffs.values())
                     continue
 
-                logger.info("Checking buff status and reactivating if needed (using socc_thread data)...")
-
-                # Wait for initial startup before activating buffs
-                while self.started_at + 10 > time.time():
-                    logger.info(
-                        f'started at {arrow.get(self.started_at).humanize()}, wait 10 seconds to activate buffs'
-                    )
-                    time.sleep(4)
-
-                # Get fresh active buffs data with enhanced validation (prioritizes socc_thread data)
-                current_active_buffs = self._get_current_active_buffs()
-                logger.debug(f"Buff management using data source: {'socc_thread' if hasattr(self, 'active_buffs') and self.active_buffs else 'API fallback'}")
-                
-                # Add detailed logging for debugging
-                logger.debug(f"Current active buffs count: {len(current_active_buffs)}")
-                for i, buff in enumerate(current_active_buffs):
-                    item_code = buff.get('param', {}).get('itemCode', 'N/A')
-                    expired_date = buff.get('expiredDate', 'N/A')
-                    logger.debug(f"Active buff {i+1}: itemCode={item_code}, expiredDate={expired_date}")
-
-                # Get available items in inventory
-                item_list = self.api.item_list().get('items', [])
-
-                for buff_config_item in monitored_buffs:
-                    if not buff_config_item.get('enabled', True):
-                        continue
-
-                    buff_name = buff_config_item.get('name', 'Unknown')
-                    item_codes = buff_config_item.get('item_codes', [])
-                    min_duration_minutes = buff_config_item.get('min_duration_minutes', 20)
+                for monitored in due:
+                    try:
+                        self._renew_buff(monitored)
+                    except Exception as e:
+                        logger.error(f"Error renewing {monitored.name} buff: {str(e)}")
+                        scheduler.defer(monitored.key, time.time() + 300)
 
-                    if not item_codes:
-                        logger.warning(f"No item codes configured for buff: {buff_name}")
-                        continue
+            except Exception as e:
+                logger.error(f"Error in buff management thread: {str(e)}")
+                health.record_error(error=e)
+                time.sleep(60)
 
-                    # Check cooldown to prevent over-activation
-                    buff_key = f"{buff_name}_{':'.join(map(str, item_codes))}"
-                    last_activation_time = self.buff_last_activation.get(buff_key, 0)
-                    current_time = time.time()
+    def _renew_buff(self, monitored):
+        """Use an item for a monitored buff the scheduler says is due, defer it again otherwise"""
+        scheduler = self.buff_scheduler
+        buff_name = monitored.name
+        item_codes = monitored.item_codes
+        current_time = time.time()
+
+        # Check cooldown to prevent over-activation
+        last_activation_time = self.buff_last_activation.get(monitored.key, 0)
+        if current_time - last_activation_time < self.buff_activation_cooldown:
+            remaining_cooldown = self.buff_activation_cooldown - (current_time - last_activation_time)
+            logger.info(f"{buff_name} is in cooldown, {remaining_cooldown/60:.1f} minutes remaining")
+            scheduler.defer(monitored.key, last_activation_time + self.buff_activation_cooldown)
+            return
 
-                    if current_time - last_activation_time < self.buff_activation_cooldown:
-                        remaining_cooldown = self.buff_activation_cooldown - (current_time - last_activation_time)
-                        logger.info(f"{buff_name} is in cooldown, {remaining_cooldown/60:.1f} minutes remaining")
-                        continue
+        remaining_minutes = scheduler.remaining(monitored.key, current_time) / 60
+        if remaining_minutes <= 0:
+            activation_reason = "Buff not active"
+        else:
+            activation_reason = f"Low remaining time: {remaining_minutes:.1f}min < {monitored.lead_seconds / 60:.0f}min threshold"
+
+        # Check if we have the buff items in inventory
+        inventory = self._get_inventory()
+        available_codes = [code for code in item_codes if inventory.get(code, 0) > 0]
+        if not available_codes:
+            logger.info(f"No {buff_name} items available in inventory")
+            scheduler.defer(monitored.key, current_time + self.buff_activation_cooldown)
+            return
 
-                    # Check if buff is currently active with enhanced validation
-                    active_buff = None
-                    active_buff_count = 0
-                    all_matching_buffs = []
+        if self.buff_item_use_lock.locked():
+            logger.debug("Buff lock is active, retrying this buff in a minute")
+            scheduler.defer(monitored.key, current_time + 60)
+            return
 
-                    for buff in current_active_buffs:
-                        buff_item_code = buff.get('param', {}).get('itemCode')
-                        buff_param_code = buff.get('param', {}).get('code')  # Alternative field
-                        
-                        # Check both itemCode and code fields for thorough matching
-                        if buff_item_code in item_codes or buff_param_code in item_codes:
-                            all_matching_buffs.append(buff)
-                            active_buff_count += 1
-                            
-                            # Choose the buff with the most remaining time as the primary active buff
-                            if active_buff is None:
-                                active_buff = buff
-                            else:
-                                # Compare remaining times to pick the best one
-                                current_remaining = self._calculate_buff_remaining_time(active_buff)
-                                new_remaining = self._calculate_buff_remaining_time(buff)
-                                if new_remaining > current_remaining:
-                                    active_buff = buff
-
-                    # Enhanced logging for multiple active buffs
-                    if active_buff_count > 1:
-                        logger.warning(f"Found {active_buff_count} active {buff_name} buffs - potential over-activation detected")
-                        for i, buff in enumerate(all_matching_buffs):
-                            remaining = self._calculate_buff_remaining_time(buff)
-                            item_code = buff.get('param', {}).get('itemCode') or buff.get('param', {}).get('code')
-                            logger.warning(f"  Buff {i+1}: itemCode={item_code}, remaining={remaining:.1f} minutes")
-                    elif active_buff_count == 1:
-                        remaining = self._calculate_buff_remaining_time(active_buff)
-                        item_code = active_buff.get('param', {}).get('itemCode') or active_buff.get('param', {}).get('code')
-                        logger.debug(f"Found 1 active {buff_name} buff: itemCode={item_code}, remaining={remaining:.1f} minutes")
-
-                    should_activate = False
-                    activation_reason = ""
-
-                    if active_buff:
-                        # Use enhanced remaining time calculation
-                        remaining_minutes = self._calculate_buff_remaining_time(active_buff)
-
-                        # Additional safety checks before activation
-                        if remaining_minutes > 480:  # > 8 hours (suspicious)
-                            logger.warning(f"{buff_name} has {remaining_minutes:.1f} minutes remaining (>8h) - skipping activation (possible data error)")
-                            continue
-                            
-                        # Double-check that the buff is actually still active (not expired)
-                        if remaining_minutes <= 0:
-                            logger.info(f"{buff_name} buff has expired (remaining: {remaining_minutes:.1f} minutes) - will activate")
-                            should_activate = True
-                            activation_reason = "Buff has expired"
-                        elif remaining_minutes < min_duration_minutes:
-                            should_activate = True
-                            activation_reason = f"Low remaining time: {remaining_minutes:.1f}min < {min_duration_minutes}min threshold"
-                        else:
-                            logger.info(f"{buff_name} buff still active with {remaining_minutes:.1f} minutes remaining (threshold: {min_duration_minutes} min) - skipping activation")
+        try:
+            with self.buff_item_use_lock:
+                # Final validation: a buff may have started since the heap was built
+                now = time.time()
+                for buff in self.state.snapshot().active_buffs(now):
+                    if buff.item_code in item_codes and \
+                            (buff.expires_at is None or buff.expires_at - now >= monitored.lead_seconds):
+                        logger.info(f"Buff {buff_name} became active during processing - skipping activation")
+                        scheduler.refresh(self.state.snapshot().buffs.values())
+                        return
+
+                item_code = available_codes[0]
+                logger.info(f"Activating {buff_name} buff with item code: {item_code} - Reason: {activation_reason}")
+                self.api.item_use(item_code)
+                self.state.use_items(item_code, 1)
+
+                # Record activation time to prevent over-activation, /buff/list reschedules it
+                self.buff_last_activation[monitored.key] = current_time
+                scheduler.defer(monitored.key, current_time + self.buff_activation_cooldown)
+
+                # Update Golden Hammer status
+                if item_code == ITEM_CODE_GOLDEN_HAMMER:
+                    self.has_additional_building_queue = True
+
+                # Send buff activation notification
+                try:
+                    # Create specific title based on buff type
+                    buff_display_name = buff_name.replace("_", " ").title()
+                    if "production" in buff_name.lower():
+                        title_icon = "🏭"
+                    elif "shield" in buff_name.lower() or "anti" in buff_name.lower():
+                        title_icon = "🛡️"
+                    elif "gathering" in buff_name.lower():
+                        title_icon = "⛏️"
                     else:
-                        should_activate = True
-                        activation_reason = "Buff not active"
-
-                    if should_activate:
-                        # Check if we have the buff items in inventory
-                        available_items = [
-                            item for item in item_list
-                            if item.get('code') in item_codes and item.get('amount', 0) > 0
-                        ]
-
-                        if not available_items:
-                            logger.info(f"No {buff_name} items available in inventory")
-                            continue
-
-                        if self.buff_item_use_lock.locked():
-                            logger.debug("Buff lock is active, skipping this buff")
-                            continue
-
-                        try:
-                            with self.buff_item_use_lock:
-                                # Final validation: Re-check active buffs just before activation to prevent race conditions
-                                final_check_buffs = self._get_current_active_buffs()
-                                final_active_buff = None
-                                
-                                for buff in final_check_buffs:
-                                    buff_item_code = buff.get('param', {}).get('itemCode')
-                                    buff_param_code = buff.get('param', {}).get('code')
-                                    if buff_item_code in item_codes or buff_param_code in item_codes:
-                                        final_remaining = self._calculate_buff_remaining_time(buff)
-                                        if final_remaining >= min_duration_minutes:
-                                            logger.info(f"Buff {buff_name} became active during processing ({final_remaining:.1f} min remaining) - skipping activation")
-                                            final_active_buff = buff
-                                            break
-                                
-                                # Only proceed if final check confirms activation is still needed
-                                if final_active_buff:
-                                    continue  # Skip activation, buff is now active with sufficient time
-                                
-                                # Use the first available item
-                                item_to_use = available_items[0]
-                                item_code = item_to_use.get('code')
+                        title_icon = "✨"
 
-                                logger.info(f"Activating {buff_name} buff with item code: {item_code} - Reason: {activation_reason}")
-                                self.api.item_use(item_code)
+                    # Clean up activation reason for user-friendly notification
+                    clean_reason = activation_reason
+                    if activation_reason == "Buff not active":
+                        clean_reason = "Buff activated"
 
-                                # Record activation time to prevent over-activation
-                                self.buff_last_activation[buff_key] = current_time
-
-                                # Update Golden Hammer status
-                                if item_code == ITEM_CODE_GOLDEN_HAMMER:
-                                    self.has_additional_building_queue = True
-
-                                # Send buff activation notification
-                                try:
-                                    # Create specific title based on buff type
-                                    buff_display_name = buff_name.replace("_", " ").title()
-                                    if "production" in buff_name.lower():
-                                        title_icon = "🏭"
-                                    elif "shield" in buff_name.lower() or "anti" in buff_name.lower():
-                                        title_icon = "🛡️"
-                                    elif "gathering" in buff_name.lower():
-                                        title_icon = "⛏️"
-                                    else:
-                                        title_icon = "✨"
-                                    
-                                    # Clean up activation reason for user-friendly notification
-                                    clean_reason = activation_reason
-                                    if activation_reason == "Buff not active":
-                                        clean_reason = "Buff activated"
-                                    
-                                    self._send_notification(
-                                        'buff_activated',
-                                        f'{title_icon} {buff_display_name} Activated',
-                                        f'Successfully activated {buff_display_name} buff (Code: {item_code}) - {clean_reason}'
-                                    )
-                                except Exception as notif_error:
-                                    logger.debug(f"Failed to send buff notification: {notif_error}")
-
-                                # Add delay between buff activations
-                                time.sleep(random.uniform(3, 8))
-
-                                # Log activation for monitoring
-                                logger.info(f"Successfully activated {buff_name} - Next activation allowed after: {arrow.get(current_time + self.buff_activation_cooldown).format('YYYY-MM-DD HH:mm:ss')}")
-
-                        except Exception as e:
-                            logger.error(f"Failed to activate {buff_name} buff: {str(e)}")
+                    self._send_notification(
+                        'buff_activated',
+                        f'{title_icon} {buff_display_name} Activated',
+                        f'Successfully activated {buff_display_name} buff (Code: {item_code}) - {clean_reason}'
+                    )
+                except Exception as notif_error:
+                    logger.debug(f"Failed to send buff notification: {notif_error}")
 
-                logger.info("Buff management cycle completed")
+                # Add delay between buff activations
+                time.sleep(random.uniform(3, 8))
 
-            except Exception as e:
-                logger.error(f"Error in buff management thread: {str(e)}")
+                # Log activation for monitoring
+                logger.info(f"Successfully activated {buff_name} - Next activation allowed after: {arrow.get(current_time + self.buff_activation_cooldown).format('YYYY-MM-DD HH:mm:ss')}")
 
-            # Sleep for 10 minutes before next check
-            time.sleep(600)
+        except Exception as e:
+            logger.error(f"Failed to activate {buff_name} buff: {str(e)}")
+            self.state.invalidate_inventory()
+            scheduler.defer(monitored.key, time.time() + 300)
 
     def _check_rallies_thread(self):
-        """Thread to periodically check for new rallies using alliance_battle_list_v2"""
+        """Thread to reconcile the rally join pipeline with alliance_battle_list_v2, /alliance/rally/new feeds it first"""
         while True:
             try:
                 # Get the rally configuration from config (new structure)
                 rally_config = config.get('rally', {}).get('join', {})
+                interval = rally_config.get('reconcile_seconds', lokbot.rally_pipeline.RECONCILE_SECONDS)
+                health.heartbeat(timeout=interval + 300)
+                compiled = compiled_config()
 
                 # Check if rally join is enabled
-                if not rally_config.get('enabled', False):
+                if not compiled.rally_join_enabled:
                     logger.info(
                         'Rally join is disabled in config, skipping check')
                     time.sleep(60)
                     continue
-                else:
-                    logger.info(
-                        'Rally join is enabled, checking for available rallies'
-                    )
-
-                # Get target monster codes from config
-                target_codes = [
-                    target.get('monster_code')
-                    for target in rally_config.get('targets', [])
-                ]
 
-                if not target_codes:
+                if not compiled.rally_join_targets:
                     logger.info('No rally targets configured, skipping check')
                     time.sleep(60)
                     continue
 
-                # Get maximum number of rallies to join from config
-                max_rallies = rally_config.get('numMarch', 9)
-
-                # Check for available rallies using alliance_battle_list_v2
-                logger.info(
-                    'Checking for available rallies via alliance_battle_list_v2'
-                )
+                # Rallies the events missed, and which ones are joined
                 try:
                     battle_response = self.api.alliance_battle_list_v2()
                     if not isinstance(battle_response, dict):
@@ -6404,113 +6114,14 @@ Status: {status}"""
                     time.sleep(60)
                     continue
 
-                # Log the number of active rallies found
-                logger.info(f'Found {len(battles)} active rallies')
-
-                # Count rallies already joined
-                joined_rallies = [b for b in battles if b.get('isJoined')]
-                logger.info(f'Already joined {len(joined_rallies)} rallies')
-
-                # Skip if we've already joined max rallies
-                if len(joined_rallies) >= max_rallies:
-                    logger.info(
-                        f'Already joined maximum number of rallies ({max_rallies}), skipping check'
-                    )
-                    time.sleep(60)
-                    continue
-
-                # Process unjoined rallies
-                for battle in battles:
-                    # Skip if already joined
-                    if battle.get('isJoined'):
-                        continue
-
-                    rally_id = battle.get('_id')
-                    if not rally_id:
-                        logger.warning(
-                            'Found battle without rally ID, skipping')
-                        continue
-
-                    # Get monster code and level from battle info
-                    monster_code = None
-                    monster_level = None
-
-                    # Try both data structures
-                    if 'targetMonster' in battle and 'code' in battle.get(
-                            'targetMonster', {}):
-                        monster_code = battle.get('targetMonster',
-                                                  {}).get('code')
-                        monster_level = battle.get('targetMonster',
-                                                   {}).get('level')
-                    else:
-                        # Try alternative data structure
-                        target_monster = battle.get('target',
-                                                    {}).get('monster', {})
-                        if target_monster and 'code' in target_monster:
-                            monster_code = target_monster.get('code')
-                            monster_level = target_monster.get('level')
-
-                    # Skip if no monster code found
-                    if not monster_code:
-                        logger.debug(
-                            f"No monster code found for rally {rally_id}, skipping")
-                        continue
-
-                    # Check if monster code is in our target list
-                    if monster_code in target_codes:
-                        # If we're using level-based troops, check if we have a configuration for this level
-                        if rally_config.get(
-                                'level_based_troops',
-                                False) and monster_level is not None:
-                            monster_level = int(monster_level)
-
-                            # Find target configuration for this monster code
-                            target_config = next((
-                                target
-                                for target in rally_config.get('targets', [])
-                                if target.get('monster_code') == monster_code),
-                                                 None)
-
-                            if target_config:
-                                # Check if we have a level range that matches this monster's level
-                                level_range_match = any(
-                                    level_range.get('min_level', 0) <=
-                                    monster_level <= level_range.get(
-                                        'max_level', 0)
-                                    for level_range in target_config.get(
-                                        'level_ranges', []))
-
-                                if not level_range_match:
-                                    logger.info(
-                                        f"No matching level range for monster level {monster_level}, skipping rally {rally_id}"
-                                    )
-                                    continue
-                            else:
-                                logger.info(
-                                    f"No target configuration for monster code {monster_code}, skipping rally {rally_id}"
-                                )
-                                continue
-
-                        logger.info(
-                            f"Found unjoined rally for monster code {monster_code}, level {monster_level}: {rally_id}"
-                        )
-
-                        # Pass the battle data directly to join_rally to avoid an extra API call
-                        if self.join_rally(rally_id, battle_data=battle):
-                            logger.info(
-                                f"Successfully joined rally {rally_id}")
-
-                            # Discord notification is already handled in join_rally method
-                            logger.info(
-                                "Discord notification will be sent by the join_rally method"
-                            )
-                        else:
-                            logger.error(f"Failed to join rally {rally_id} - checking if reconnection is needed")
-                            # Add a small delay before trying next rally to avoid rapid failures
-                            time.sleep(random.uniform(3, 6))
+                queued = self.rally_pipeline.reconcile(battles)
+                logger.info(
+                    f'Rally reconciliation: {len(battles)} active, {len(self.rally_pipeline.joined)} joined, '
+                    f'{queued} queued, next pass within {interval}s'
+                )
 
-                # Check every 30 seconds
-                time.sleep(30)
+                self.rally_pipeline.wait_reconcile(interval)
             except Exception as e:
                 logger.error(f'Error checking rallies: {e}')
-                time.sleep(60)  # Wait longer if there's an error
\ No newline at end of file
+                health.record_error(error=e)
+                time.sleep(60)  # Wait longer if there's an error
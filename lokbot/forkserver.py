@@ -0,0 +1,455 @@
+"""
+Warm fork server for launching bot instances
+
+A template process imports lokbot and its heavy dependencies once and then
+forks a child for every bot instance, so starting a bot no longer pays for
+interpreter start-up and imports.  The web app talks to the template over a
+unix socket and gets back a Popen-like handle for each child.
+"""
+import importlib
+import json
+import os
+import random
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from lokbot import logger
+
+FORKSERVER_SOCKET = os.environ.get('LOKBOT_FORKSERVER_SOCKET', 'data/forkserver.sock')
+
+# Modules imported by the template before it starts forking
+PRELOAD_MODULES = (
+    'numpy',
+    'httpx',
+    'socketio',
+    'arrow',
+    'tenacity',
+    'fire',
+    'lokbot.enum',
+    'lokbot.client',
+    'lokbot.farmer',
+    'lokbot.app',
+)
+
+
+class ForkServerError(Exception):
+    pass
+
+
+def is_supported():
+    """Check if the platform can run the fork server"""
+    return (
+        hasattr(os, 'fork')
+        and hasattr(socket, 'AF_UNIX')
+        and hasattr(socket, 'send_fds')
+        and os.environ.get('LOKBOT_FORKSERVER', '1') != '0'
+    )
+
+
+# region template process
+
+def _preload():
+    for module_name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            logger.warning(f"Fork server could not preload {module_name}: {e}")
+
+    # Warm up the lru_cached map arrays so every child shares them copy-on-write
+    try:
+        from lokbot.farmer import LokFarmer
+        LokFarmer._get_land_array()
+        LokFarmer._get_zone_array()
+    except Exception as e:
+        logger.warning(f"Fork server could not warm up map arrays: {e}")
+
+
+def _run_child(argv, env, out_fd):
+    """Body of a forked bot instance, never returns"""
+    exit_code = 0
+    try:
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(out_fd, 1)
+        os.dup2(out_fd, 2)
+        os.close(out_fd)
+        sys.stdout.reconfigure(line_buffering=True)
+        sys.stderr.reconfigure(line_buffering=True)
+
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        # The per-instance environment only exists after the fork
+        os.environ.clear()
+        os.environ.update(env)
+        random.seed()
+
+        # lokbot.config was loaded in the template, reload it in place so every
+        # module holding a reference sees this instance's config
+        import lokbot
+        lokbot.config_path = lokbot.find_config_path()
+        fresh_config = lokbot.load_config()
+        lokbot.config.clear()
+        lokbot.config.update(fresh_config)
+        lokbot.setup_logging()
+
+        import fire
+        import lokbot.app
+        sys.argv = ['lokbot', *argv]
+        fire.Fire(lokbot.app.main)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            # os._exit skips atexit, so the log sink's queued lines (a crash's traceback
+            # among them) have to be written here
+            from lokbot import logger
+            from lokbot.log_store import IndexedLogSink
+            logger.complete()
+            IndexedLogSink.flush_all()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def serve(socket_path=FORKSERVER_SOCKET, parent_pid=None):
+    """Run the template process: preload, then fork a child per request"""
+    _preload()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(64)
+    listener.setblocking(False)
+
+    # SIGCHLD wakes the selector through a self-pipe
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, 'accept')
+    selector.register(wakeup_r, selectors.EVENT_READ, 'sigchld')
+
+    children = {}  # pid -> client connection waiting for the exit status
+
+    def close_all_in_child():
+        selector.close()
+        listener.close()
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+        for conn in children.values():
+            conn.close()
+
+    def handle_request(conn):
+        try:
+            conn.setblocking(True)
+            conn.settimeout(10)
+            msg, fds, _, _ = socket.recv_fds(conn, 1 << 20, 1)
+            request = json.loads(msg.decode())
+            if not fds:
+                raise ForkServerError('no output fd received')
+        except Exception as e:
+            logger.error(f"Fork server got an invalid request: {e}")
+            conn.close()
+            return
+
+        out_fd = fds[0]
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            close_all_in_child()
+            _run_child(request.get('argv', []), request.get('env', {}), out_fd)
+
+        os.close(out_fd)
+        children[pid] = conn
+        try:
+            conn.sendall(json.dumps({'pid': pid}).encode() + b'\n')
+        except OSError:
+            children.pop(pid, None)
+            conn.close()
+
+    def reap_children():
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            conn = children.pop(pid, None)
+            if conn is None:
+                continue
+            try:
+                returncode = os.waitstatus_to_exitcode(status)
+                conn.sendall(json.dumps({'returncode': returncode}).encode() + b'\n')
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    logger.info(f"Fork server ready on {socket_path} (pid {os.getpid()})")
+
+    while True:
+        # Exit together with the web app that started us
+        if parent_pid and os.getppid() != parent_pid:
+            logger.info("Fork server parent exited, shutting down")
+            break
+
+        for key, _ in selector.select(timeout=1):
+            if key.data == 'accept':
+                try:
+                    conn, _ = listener.accept()
+                except BlockingIOError:
+                    continue
+                handle_request(conn)
+            elif key.data == 'sigchld':
+                try:
+                    while os.read(wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                reap_children()
+
+        # Signals may be coalesced, reap on every turn
+        reap_children()
+
+    try:
+        os.unlink(socket_path)
+    except OSError:
+        pass
+
+# endregion
+
+
+# region web app side
+
+class ForkedProcess:
+    """Subset of subprocess.Popen for a bot instance forked by the fork server"""
+
+    def __init__(self, args, pid, conn, stdout):
+        self.args = args
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = None
+        self.returncode = None
+        self._conn = conn
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    def _read_status(self, timeout):
+        """Read the exit status sent by the fork server, returns True once known"""
+        with self._lock:
+            if self.returncode is not None:
+                return True
+
+            if self._conn is None:
+                # Fork server is gone, fall back to probing the pid
+                try:
+                    os.kill(self.pid, 0)
+                except ProcessLookupError:
+                    self.returncode = -1
+                    return True
+                except PermissionError:
+                    pass
+                if timeout:
+                    time.sleep(min(timeout, 0.5))
+                return False
+
+            self._conn.settimeout(timeout)
+            try:
+                data = self._conn.recv(4096)
+            except (BlockingIOError, socket.timeout):
+                return False
+            except OSError:
+                data = b''
+
+            if not data:
+                self._conn.close()
+                self._conn = None
+                return False
+
+            self._buffer += data
+            if b'\n' in self._buffer:
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                self.returncode = json.loads(line.decode()).get('returncode', -1)
+                self._conn.close()
+                self._conn = None
+                return True
+            return False
+
+    def poll(self):
+        if self.returncode is None:
+            self._read_status(0)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.returncode is None:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            self._read_status(remaining if remaining is not None else 1.0)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self, input=None, timeout=None):
+        output = self.stdout.read() if self.stdout and not self.stdout.closed else None
+        self.wait(timeout)
+        return output, None
+
+
+class ForkServerClient:
+    """Starts the template process on demand and asks it for new bot instances"""
+
+    def __init__(self, socket_path=FORKSERVER_SOCKET):
+        self.socket_path = os.path.abspath(socket_path)
+        self.server_process = None
+        self._lock = threading.Lock()
+
+    def _is_running(self):
+        return self.server_process is not None and self.server_process.poll() is None
+
+    def ensure_started(self, timeout=60):
+        with self._lock:
+            if self._is_running():
+                return
+
+            logger.info("Starting bot fork server")
+            self.server_process = subprocess.Popen(
+                [sys.executable, '-m', 'lokbot.forkserver', self.socket_path, str(os.getpid())],
+                stdin=subprocess.DEVNULL,
+            )
+
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if self.server_process.poll() is not None:
+                    raise ForkServerError(f'fork server exited with code {self.server_process.returncode}')
+                try:
+                    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    probe.connect(self.socket_path)
+                    probe.close()
+                    logger.info("Bot fork server is ready")
+                    return
+                except OSError:
+                    time.sleep(0.1)
+
+            raise ForkServerError('fork server did not become ready in time')
+
+    def spawn(self, argv, env):
+        self.ensure_started()
+
+        read_fd, write_fd = os.pipe()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.settimeout(10)
+            conn.connect(self.socket_path)
+            socket.send_fds(conn, [json.dumps({'argv': list(argv), 'env': dict(env)}).encode()], [write_fd])
+            os.close(write_fd)
+            write_fd = None
+
+            reply = b''
+            while b'\n' not in reply:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    raise ForkServerError('fork server closed the connection')
+                reply += chunk
+            line, rest = reply.split(b'\n', 1)
+            pid = json.loads(line.decode())['pid']
+        except Exception:
+            conn.close()
+            os.close(read_fd)
+            if write_fd is not None:
+                os.close(write_fd)
+            raise
+
+        stdout = os.fdopen(read_fd, 'r', buffering=1, encoding='utf-8', errors='replace')
+        process = ForkedProcess(['python', '-m', 'lokbot', *argv], pid, conn, stdout)
+        process._buffer = rest
+        return process
+
+    def shutdown(self):
+        with self._lock:
+            if self._is_running():
+                self.server_process.terminate()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ForkServerClient()
+        return _client
+
+
+def launch_bot(token, env):
+    """
+    Start a bot instance, forked from the warm template when possible
+
+    Returns a Popen-like object whose stdout yields the combined text output,
+    falling back to a cold `python -m lokbot` subprocess if the fork server is
+    unavailable.
+    """
+    if is_supported():
+        try:
+            return get_client().spawn([token], env)
+        except Exception as e:
+            logger.warning(f"Fork server launch failed, falling back to subprocess: {e}")
+
+    return subprocess.Popen(
+        ["python", "-m", "lokbot", token],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=env,
+        bufsize=1,
+        universal_newlines=True
+    )
+
+# endregion
+
+
+if __name__ == '__main__':
+    # The template's own lines, children switch to their instance directory after the fork
+    import lokbot
+    lokbot.setup_logging('forkserver')
+    serve(
+        sys.argv[1] if len(sys.argv) > 1 else FORKSERVER_SOCKET,
+        int(sys.argv[2]) if len(sys.argv) > 2 else None,
+    )
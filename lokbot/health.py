@@ -0,0 +1,254 @@
+"""
+Thread, job and lock health of a bot process
+
+Long-running threads call heartbeat() once per loop iteration and
+record_error() when an iteration fails; scheduled jobs are wrapped with
+track().  The farmer's shared locks are TimedLocks, which remember who holds
+them, since when, and how long acquisitions waited and held.  report() puts
+this together with every live thread's current state (running, sleeping,
+waiting or blocked on one of the timed locks, read from its top stack frame)
+and the registered queue depths.  A thread whose heartbeat is older than its
+timeout is reported as stalled, which the web app shows within seconds
+instead of waiting for a thread's own watchdog.
+"""
+import linecache
+import os
+import sys
+import threading
+import time
+import traceback
+
+from lokbot import logger
+
+DEFAULT_TIMEOUT = 120
+
+# Top frames that mean a thread is parked waiting for something
+_WAITING_FILES = ('threading.py', 'queue.py', 'selectors.py', 'socket.py', 'ssl.py', 'connection.py')
+
+
+class TimedLock:
+    """threading.Lock that records holder, wait and hold times"""
+
+    def __init__(self, name, registry=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._registry = registry
+        self.holder = None  # thread name
+        self.acquired_at = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_max = 0.0
+        self.hold_max = 0.0
+        self.hold_total = 0.0
+        self.last_hold = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            waited = 0.0
+        else:
+            if not blocking:
+                return False
+            started = time.monotonic()
+            if self._registry is not None:
+                self._registry._blocked[threading.get_ident()] = (self.name, started)
+            try:
+                if not self._lock.acquire(True, timeout):
+                    return False
+            finally:
+                if self._registry is not None:
+                    self._registry._blocked.pop(threading.get_ident(), None)
+            waited = time.monotonic() - started
+            self.contended += 1
+
+        self.holder = threading.current_thread().name
+        self.acquired_at = time.monotonic()
+        self.acquisitions += 1
+        self.wait_max = max(self.wait_max, waited)
+        return True
+
+    def release(self):
+        held = time.monotonic() - self.acquired_at if self.acquired_at is not None else 0.0
+        self.holder = None
+        self.acquired_at = None
+        self.last_hold = held
+        self.hold_total += held
+        self.hold_max = max(self.hold_max, held)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        acquired_at = self.acquired_at
+        return {
+            'held': acquired_at is not None,
+            'holder': self.holder,
+            'held_for': round(time.monotonic() - acquired_at, 3) if acquired_at is not None else None,
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'wait_max': round(self.wait_max, 3),
+            'hold_max': round(self.hold_max, 3),
+            'hold_avg': round(self.hold_total / self.acquisitions, 4) if self.acquisitions else 0,
+            'last_hold': round(self.last_hold, 3),
+        }
+
+
+class HealthRegistry:
+    """Heartbeats, errors, job runs, queues and locks of this process"""
+
+    def __init__(self):
+        self._heartbeats = {}  # name -> {'time', 'timeout', 'detail'}
+        self._errors = {}  # name -> {'time', 'message', 'count'}
+        self._jobs = {}  # name -> {'runs', 'running', 'last_start', 'last_duration'}
+        self._queues = {}  # name -> callable returning a depth
+        self._sections = {}  # name -> callable returning extra report data
+        self._locks = {}  # name -> TimedLock
+        self._blocked = {}  # thread ident -> (lock name, since), set while waiting on a TimedLock
+
+    # region instrumentation
+
+    def heartbeat(self, name=None, timeout=DEFAULT_TIMEOUT, detail=None):
+        """Mark a thread (the current one by default) alive; stalled after `timeout` seconds without one"""
+        name = name or threading.current_thread().name
+        self._heartbeats[name] = {'time': time.time(), 'timeout': timeout, 'detail': detail}
+
+    def record_error(self, name=None, error=None):
+        name = name or threading.current_thread().name
+        previous = self._errors.get(name)
+        self._errors[name] = {
+            'time': time.time(),
+            'message': f'{type(error).__name__}: {error}' if isinstance(error, BaseException) else str(error),
+            'count': (previous['count'] if previous else 0) + 1,
+        }
+
+    def track(self, name, func):
+        """Wrap a job so its runs, duration and failures are recorded, its heartbeat ends with each run"""
+        def tracked(*args, **kwargs):
+            job = self._jobs.setdefault(name, {'runs': 0, 'running': False, 'last_start': None, 'last_duration': None})
+            job['running'] = True
+            job['last_start'] = time.time()
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                self.record_error(name, e)
+                raise
+            finally:
+                # Between runs the job's thread is gone on purpose, don't report it as dead
+                self._heartbeats.pop(name, None)
+                job['running'] = False
+                job['runs'] += 1
+                job['last_duration'] = round(time.monotonic() - started, 3)
+
+        return tracked
+
+    def timed_lock(self, name):
+        lock = TimedLock(name, self)
+        self._locks[name] = lock
+        return lock
+
+    def register_queue(self, name, depth):
+        """depth() -> current number of queued items"""
+        self._queues[name] = depth
+
+    def register_section(self, name, provider):
+        """provider() -> JSON-serializable data added to the report under name"""
+        self._sections[name] = provider
+
+    # endregion
+
+    # region report
+
+    def _thread_state(self, ident, frame):
+        blocked = self._blocked.get(ident)
+        if blocked is not None:
+            return 'blocked', blocked[0]
+        if frame is None:
+            return 'unknown', None
+
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        if filename in _WAITING_FILES:
+            return 'waiting', None
+        # time.sleep is a C call, so the Python frame on top is the line calling it
+        if 'sleep(' in linecache.getline(code.co_filename, frame.f_lineno):
+            return 'sleeping', None
+        return 'running', None
+
+    def report(self):
+        now = time.time()
+        frames = sys._current_frames()
+        threads = []
+        seen = set()
+        for thread in threading.enumerate():
+            state, blocked_on = self._thread_state(thread.ident, frames.get(thread.ident))
+            threads.append(self._thread_entry(thread.name, now, alive=True, state=state, blocked_on=blocked_on))
+            seen.add(thread.name)
+        del frames
+
+        # Threads that sent heartbeats but are gone
+        for name in self._heartbeats:
+            if name not in seen:
+                threads.append(self._thread_entry(name, now, alive=False, state='dead', blocked_on=None))
+
+        queues = {}
+        for name, depth in list(self._queues.items()):
+            try:
+                queues[name] = depth()
+            except Exception as e:
+                queues[name] = None
+                logger.debug(f"Could not read depth of queue {name}: {e}")
+
+        report = {
+            'time': now,
+            'pid': os.getpid(),
+            'threads': threads,
+            'stalled': [thread['name'] for thread in threads if thread['stalled']],
+            'jobs': {name: dict(job, last_error=self._errors.get(name)) for name, job in list(self._jobs.items())},
+            'queues': queues,
+            'locks': {name: lock.stats() for name, lock in list(self._locks.items())},
+        }
+        for name, provider in list(self._sections.items()):
+            try:
+                report[name] = provider()
+            except Exception as e:
+                logger.debug(f"Could not build health section {name}: {e}")
+        return report
+
+    def _thread_entry(self, name, now, alive, state, blocked_on):
+        heartbeat = self._heartbeats.get(name)
+        age = round(now - heartbeat['time'], 1) if heartbeat else None
+        return {
+            'name': name,
+            'alive': alive,
+            'state': state,
+            'blocked_on': blocked_on,
+            'last_heartbeat': heartbeat['time'] if heartbeat else None,
+            'heartbeat_age': age,
+            'detail': heartbeat['detail'] if heartbeat else None,
+            # A thread that never sent a heartbeat isn't monitored
+            'stalled': heartbeat is not None and (not alive or age > heartbeat['timeout']),
+            'last_error': self._errors.get(name),
+        }
+
+    def format_stacks(self, names):
+        """Current stack of the named threads, for logging a stall"""
+        frames = sys._current_frames()
+        stacks = {}
+        for thread in threading.enumerate():
+            if thread.name in names and thread.ident in frames:
+                stacks[thread.name] = ''.join(traceback.format_stack(frames[thread.ident]))
+        return stacks
+
+    # endregion
+
+
+# Process-wide registry, the farmer's locks and threads report here
+health = HealthRegistry()
@@ -0,0 +1,127 @@
+"""
+Translation catalog for the web app templates
+
+Language files are loaded once into flat dot-key dictionaries with the
+default language merged in underneath, so a lookup is a single dict access
+and a missing key falls back to English without touching the disk.  Files
+are reloaded when their mtime changes, which keeps editing translations in
+development working.
+"""
+import json
+import os
+import string
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Used when even the default language file can't be loaded
+MINIMAL_CATALOG = {"login": {"title": "Login"}, "common": {"save": "Save", "cancel": "Cancel"}}
+
+_formatter = string.Formatter()
+
+
+def flatten(tree, prefix='', into=None):
+    """{'a': {'b': 'x'}} -> {'a': {...}, 'a.b': 'x'}, keeping subtrees for partial keys"""
+    into = {} if into is None else into
+    for key, value in tree.items():
+        path = f'{prefix}{key}'
+        into[path] = value
+        if isinstance(value, dict):
+            flatten(value, f'{path}.', into)
+    return into
+
+
+def has_fields(value):
+    """Whether a translation is a str.format template"""
+    try:
+        return any(field is not None for _, field, _, _ in _formatter.parse(value))
+    except ValueError:
+        return False
+
+
+class TranslationCatalog:
+    """Flattened, fallback-resolved translations per language"""
+
+    def __init__(self, directory='languages', default_language='en', check_interval=2.0):
+        self.directory = directory
+        self.default_language = default_language
+        self.check_interval = check_interval
+
+        self._catalogs = {}  # lang_code -> {key: (value, is_template)}
+        self._signatures = {}  # lang_code -> (own mtime, default mtime)
+        self._last_check = {}  # lang_code -> monotonic time of the last mtime check
+        self._lock = threading.Lock()
+
+    def _path(self, lang_code):
+        return os.path.join(self.directory, f'{lang_code}.json')
+
+    def _mtime(self, lang_code):
+        try:
+            return os.stat(self._path(lang_code)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self, lang_code):
+        try:
+            with open(self._path(lang_code), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading language file {lang_code}.json: {e}")
+            return None
+
+    def _build(self, lang_code):
+        default_tree = self._read(self.default_language)
+        if default_tree is None:
+            default_tree = MINIMAL_CATALOG
+
+        # Fallback chain: language -> default language -> the key itself
+        flat = flatten(default_tree)
+        if lang_code != self.default_language:
+            tree = self._read(lang_code)
+            if tree is not None:
+                flat.update(flatten(tree))
+
+        return {
+            key: (value, isinstance(value, str) and has_fields(value))
+            for key, value in flat.items()
+        }
+
+    def catalog(self, lang_code):
+        """Translations for a language, reloaded if its file or the default one changed"""
+        now = time.monotonic()
+        catalog = self._catalogs.get(lang_code)
+        if catalog is not None and now - self._last_check.get(lang_code, 0) < self.check_interval:
+            return catalog
+
+        with self._lock:
+            self._last_check[lang_code] = now
+            signature = (self._mtime(lang_code), self._mtime(self.default_language))
+            if catalog is None or signature != self._signatures.get(lang_code):
+                catalog = self._catalogs[lang_code] = self._build(lang_code)
+                self._signatures[lang_code] = signature
+            return catalog
+
+    def load_language(self, lang_code):
+        """Nested dict for a language, for callers that want the raw tree"""
+        tree = self._read(lang_code)
+        if tree is None:
+            tree = self._read(self.default_language)
+        return tree if tree is not None else MINIMAL_CATALOG
+
+    def translate(self, lang_code, key_path, **kwargs):
+        entry = self.catalog(lang_code).get(key_path)
+        if entry is None:
+            # Return key if translation not found
+            return key_path
+
+        value, is_template = entry
+        if kwargs and is_template:
+            try:
+                return value.format(**kwargs)
+            except (KeyError, IndexError, ValueError):
+                return value
+        return value
@@ -0,0 +1,322 @@
+"""
+Typed kingdom state, applied incrementally from socket events and API responses
+
+KingdomState holds the buildings, tasks, buffs, marching troops, inventory
+and resources of one kingdom in small __slots__ records indexed by their
+natural key.  Every change bumps `version`; snapshot() hands out an
+immutable view of one version, built once per version, so a job can read a
+consistent picture without locking and without another kingdom/enter.
+"""
+import threading
+import time
+import types
+
+import arrow
+
+RESOURCE_COUNT = 4  # food, lumber, stone, gold
+
+
+def _timestamp(value):
+    """Epoch seconds of an ISO date or epoch value, None if missing or unreadable"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return arrow.get(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class Building:
+    __slots__ = ('position', 'code', 'level', 'state')
+
+    def __init__(self, position, code, level, state):
+        self.position = position
+        self.code = code
+        self.level = level
+        self.state = state
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('position'), data.get('code'), data.get('level') or 0, data.get('state'))
+
+    def __repr__(self):
+        return f'Building(position={self.position}, code={self.code}, level={self.level}, state={self.state})'
+
+
+class Task:
+    __slots__ = ('id', 'code', 'status', 'expected_ended', 'position')
+
+    def __init__(self, id, code, status, expected_ended, position):
+        self.id = id
+        self.code = code
+        self.status = status
+        self.expected_ended = expected_ended
+        self.position = position
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('_id'), data.get('code'), data.get('status'),
+                   _timestamp(data.get('expectedEnded')), data.get('position'))
+
+    def __repr__(self):
+        return f'Task(id={self.id}, code={self.code}, status={self.status})'
+
+
+class Buff:
+    __slots__ = ('id', 'item_code', 'buff_type', 'expires_at', 'data')
+
+    def __init__(self, id, item_code, buff_type, expires_at, data):
+        self.id = id
+        self.item_code = item_code
+        self.buff_type = buff_type
+        self.expires_at = expires_at  # epoch seconds, None when the server gave no end
+        self.data = data  # the payload as received, for code that still reads buff dicts
+
+    @classmethod
+    def from_dict(cls, data, now=None):
+        param = data.get('param') or {}
+        expires_at = _timestamp(data.get('expiredDate'))
+        if expires_at is None and data.get('remainingTime'):
+            # kingdom/enter sends the seconds left instead of an end date, which goes stale
+            expires_at = (now or time.time()) + data.get('remainingTime')
+            data = {key: value for key, value in data.items() if key != 'remainingTime'}
+            data['expiredDate'] = arrow.get(expires_at).isoformat()
+        return cls(data.get('_id'), param.get('itemCode') or param.get('code'), data.get('buffType'),
+                   expires_at, data)
+
+    def active(self, now):
+        return self.expires_at is None or self.expires_at > now
+
+    def __repr__(self):
+        return f'Buff(item_code={self.item_code}, expires_at={self.expires_at})'
+
+
+class March:
+    __slots__ = ('id', 'march_type', 'state', 'end_time', 'to_loc')
+
+    def __init__(self, id, march_type, state, end_time, to_loc):
+        self.id = id
+        self.march_type = march_type
+        self.state = state
+        self.end_time = end_time
+        self.to_loc = to_loc
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('_id'), data.get('marchType'), data.get('state'),
+                   _timestamp(data.get('endTime') or data.get('expectedEnded')), data.get('toLoc'))
+
+    def __repr__(self):
+        return f'March(id={self.id}, march_type={self.march_type}, state={self.state})'
+
+
+class KingdomSnapshot:
+    """One version of the state; the collections are read-only views that never change"""
+    __slots__ = ('version', 'resources', 'buildings', 'building_levels', 'tasks', 'buffs', 'marches',
+                 'march_limit', 'march_size', 'inventory')
+
+    def __init__(self, state):
+        self.version = state.version
+        self.resources = state.resources
+        self.buildings = types.MappingProxyType(dict(state.buildings))
+        self.building_levels = types.MappingProxyType(dict(state.building_levels))
+        self.tasks = types.MappingProxyType(dict(state.tasks))
+        self.buffs = types.MappingProxyType(dict(state.buffs))
+        self.marches = types.MappingProxyType(dict(state.marches))
+        self.march_limit = state.march_limit
+        self.march_size = state.march_size
+        self.inventory = types.MappingProxyType(dict(state.inventory)) if state.inventory is not None else None
+
+    def tasks_with_code(self, *codes):
+        return [task for task in self.tasks.values() if task.code in codes]
+
+    def active_buffs(self, now=None):
+        now = now or time.time()
+        return [buff for buff in self.buffs.values() if buff.active(now)]
+
+    def building_level(self, code):
+        return self.building_levels.get(code, 0)
+
+
+class KingdomState:
+    __slots__ = ('version', 'resources', 'buildings', 'building_levels', 'tasks', 'buffs', 'buffs_loaded',
+                 'marches', 'march_limit', 'march_size', 'inventory', 'inventory_updated_at',
+                 '_lock', '_snapshot')
+
+    def __init__(self):
+        self.version = 0
+        self.resources = (0,) * RESOURCE_COUNT
+        self.buildings = {}  # position -> Building
+        self.building_levels = {}  # building code -> highest level
+        self.tasks = {}  # task id -> Task
+        self.buffs = {}  # buff id (or item code) -> Buff
+        self.buffs_loaded = False
+        self.marches = {}  # march id -> March
+        self.march_limit = 0
+        self.march_size = 0
+        self.inventory = None  # item code -> amount, None until item/list was read
+        self.inventory_updated_at = 0
+        self._lock = threading.RLock()
+        self._snapshot = None
+
+    def _changed(self):
+        self.version += 1
+        self._snapshot = None
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = KingdomSnapshot(self)
+            return self._snapshot
+
+    # region kingdom/enter
+
+    def load_kingdom(self, kingdom):
+        """Replace everything kingdom/enter describes"""
+        with self._lock:
+            if kingdom.get('resources'):
+                self.resources = tuple(kingdom.get('resources'))
+            self.buildings = {}
+            for data in kingdom.get('buildings') or []:
+                building = Building.from_dict(data)
+                self.buildings[building.position] = building
+            self._reindex_buildings()
+            if 'buffs' in kingdom:
+                self._load_buffs(kingdom.get('buffs') or [])
+            self._changed()
+
+    # endregion
+
+    # region events
+
+    def apply_resources(self, resources):
+        with self._lock:
+            resources = tuple(resources)
+            if len(resources) == RESOURCE_COUNT and resources != self.resources:
+                self.resources = resources
+                self._changed()
+
+    def apply_resource(self, index, value):
+        """/resource/upgrade: one resource changed"""
+        with self._lock:
+            if index is None or not 0 <= index < RESOURCE_COUNT or value is None:
+                return
+            resources = list(self.resources)
+            resources[index] = value
+            self.resources = tuple(resources)
+            self._changed()
+
+    def spend(self, index, amount):
+        """Take amount off a resource right away, the server's numbers follow with the response"""
+        with self._lock:
+            self.apply_resource(index, max(self.resources[index] - amount, 0))
+
+    def apply_building(self, data):
+        """/building/update and the building of an upgrade response"""
+        with self._lock:
+            building = Building.from_dict(data)
+            self.buildings[building.position] = building
+            self._reindex_buildings()
+            self._changed()
+
+    def _reindex_buildings(self):
+        levels = {}
+        for building in self.buildings.values():
+            if building.level > levels.get(building.code, -1):
+                levels[building.code] = building.level
+        self.building_levels = levels
+
+    def load_tasks(self, tasks):
+        """kingdom/task/all"""
+        with self._lock:
+            self.tasks = {task.id: task for task in map(Task.from_dict, tasks)}
+            self._changed()
+
+    def apply_task(self, data, claimed_status=None):
+        """/task/update and newTask of a response; a claimed task is done with and leaves the index"""
+        with self._lock:
+            task = Task.from_dict(data)
+            if task.id is None:
+                return
+            previous = self.tasks.get(task.id)
+            if previous is not None:
+                # Updates may carry only the changed fields
+                task.code = task.code if task.code is not None else previous.code
+                task.expected_ended = task.expected_ended or previous.expected_ended
+                task.position = task.position if task.position is not None else previous.position
+            if claimed_status is not None and task.status == claimed_status:
+                self.tasks.pop(task.id, None)
+            else:
+                self.tasks[task.id] = task
+            self._changed()
+
+    def apply_buffs(self, buffs):
+        """/buff/list, the full list of active buffs"""
+        with self._lock:
+            self._load_buffs(buffs)
+            self._changed()
+
+    def _load_buffs(self, buffs):
+        now = time.time()
+        self.buffs = {}
+        for data in buffs:
+            if isinstance(data, dict):
+                buff = Buff.from_dict(data, now)
+                self.buffs[buff.id or buff.item_code] = buff
+        self.buffs_loaded = True
+
+    def load_marches(self, marches, march_limit=None, march_size=None):
+        """kingdom/profile/troops"""
+        with self._lock:
+            self.marches = {march.id: march for march in map(March.from_dict, marches)}
+            if march_limit is not None:
+                self.march_limit = march_limit
+            if march_size is not None:
+                self.march_size = march_size
+            self._changed()
+
+    def apply_march(self, data):
+        with self._lock:
+            march = March.from_dict(data)
+            self.marches[march.id] = march
+            self._changed()
+
+    def load_inventory(self, items):
+        """item/list"""
+        with self._lock:
+            self.inventory = {item.get('code'): item.get('amount', 0) for item in items}
+            self.inventory_updated_at = time.time()
+            self._changed()
+
+    def use_items(self, code, amount):
+        with self._lock:
+            if self.inventory is not None:
+                self.inventory[code] = max(self.inventory.get(code, 0) - amount, 0)
+                self._changed()
+
+    def invalidate_inventory(self):
+        with self._lock:
+            self.inventory = None
+            self._changed()
+
+    def apply_response(self, response):
+        """Whatever an API response tells about the kingdom"""
+        with self._lock:
+            if response.get('resources'):
+                self.apply_resources(response.get('resources'))
+            for key in ('updateBuilding', 'newBuilding'):
+                if isinstance(response.get(key), dict):
+                    self.apply_building(response.get(key))
+            new_task = response.get('newTask')
+            if isinstance(new_task, dict) and new_task.get('_id'):
+                # field/march/start answers with the march as newTask
+                if 'marchType' in new_task:
+                    self.apply_march(new_task)
+                else:
+                    self.apply_task(new_task)
+            if isinstance(response.get('kingdomTasks'), list):
+                self.load_tasks(response.get('kingdomTasks'))
+
+    # endregion
@@ -0,0 +1,418 @@
+"""
+Per-instance, indexed bot logs
+
+Every bot process writes its own directory, data/logs/<instance>/, instead of
+all of them appending to and rotating the shared data/main.log.  Logging only
+puts the formatted line on a queue; a writer thread appends batches to hourly
+segments and records (timestamp, level, byte offset) for every line in a
+small binary index next to the segment.  Closed segments are compressed as a
+series of independent gzip members with a block table, so a line can still be
+reached by decompressing one ~64 KiB block.
+
+The web app reads the same files with LogStore: tail, time range and level
+queries go through the index and seek straight to the matching lines instead
+of scanning whole log files.
+"""
+import atexit
+import bisect
+import gzip
+import heapq
+import json
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOG_ROOT = 'data/logs'
+# timestamp (float seconds), level number, byte offset of the line in the uncompressed segment
+INDEX_RECORD = struct.Struct('<dBQ')
+BLOCK_SIZE = 64 * 1024
+SEGMENT_SUFFIXES = ('.log', '.log.gz', '.idx', '.blocks')
+OWNER_FILE = 'owner'  # web app user the instance was started for
+LEVELS = {'TRACE': 5, 'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+_unsafe_chars = re.compile(r'[^A-Za-z0-9_.@-]')
+
+
+def instance_directory(root, instance):
+    return os.path.join(root, _unsafe_chars.sub('_', instance) or 'default')
+
+
+def level_number(level):
+    """'WARNING' or 30 -> 30, None for no filter"""
+    if level is None or level == '':
+        return None
+    if isinstance(level, int):
+        return level
+    if str(level).isdigit():
+        return int(level)
+    return LEVELS.get(str(level).upper())
+
+
+# region writing
+
+def compress_segment(log_path):
+    """Compress a closed segment into gzip members of BLOCK_SIZE lines-aligned bytes plus a block table"""
+    gz_path = log_path + '.gz'
+    blocks = []  # [uncompressed_start, compressed_start]
+    with open(log_path, 'rb') as source, open(gz_path + '.tmp', 'wb') as target:
+        uncompressed_start = 0
+        while True:
+            chunk = source.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            # Keep lines whole inside a block
+            if not chunk.endswith(b'\n'):
+                chunk += source.readline()
+            blocks.append([uncompressed_start, target.tell()])
+            target.write(gzip.compress(chunk, compresslevel=6))
+            uncompressed_start += len(chunk)
+        blocks.append([uncompressed_start, target.tell()])
+
+    with open(log_path[:-len('.log')] + '.blocks', 'w') as f:
+        json.dump(blocks, f)
+    os.replace(gz_path + '.tmp', gz_path)
+    os.remove(log_path)
+
+
+class IndexedLogSink:
+    """
+    loguru sink writing hourly indexed segments from a background thread
+
+    Calls from logging threads only enqueue; the sink is fork-aware, a forked
+    child gets a fresh queue and writer.
+    """
+
+    _sinks = weakref.WeakSet()
+
+    def __init__(self, directory, rotation=3600, retention=48, max_queue=10000):
+        IndexedLogSink._sinks.add(self)
+        self.directory = directory
+        self.rotation = rotation
+        self.retention = retention  # segments kept per instance and hours an idle instance is kept
+        self.max_queue = max_queue
+        self.dropped_count = 0
+        self._pid = None
+        self._queue = None
+        self._start_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The writer thread didn't survive the fork and another thread may have held the lock
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._writer_loop, args=(self._queue,), name='log_writer', daemon=True).start()
+        atexit.register(self.flush)
+
+        # Segments left uncompressed by a previous process of this instance
+        current, _ = self._segment_name(time.time())
+        for entry in os.listdir(self.directory):
+            if entry.endswith('.log') and not entry.startswith(current):
+                self._close_segment(os.path.join(self.directory, entry))
+
+    def __call__(self, message):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        record = message.record
+        try:
+            self._queue.put_nowait((record['time'].timestamp(), record['level'].no, str(message)))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def flush(self, timeout=5):
+        """Wait until queued lines are written, used at exit"""
+        if self._pid != os.getpid() or self._queue is None:
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+            done.wait(timeout)
+        except queue.Full:
+            pass
+
+    @classmethod
+    def flush_all(cls, timeout=5):
+        """Flush every sink of this process, for exits that skip atexit (os._exit)"""
+        for sink in list(cls._sinks):
+            sink.flush(timeout)
+
+    def _segment_name(self, timestamp):
+        start = int(timestamp // self.rotation * self.rotation)
+        return time.strftime('%Y%m%d-%H%M%S', time.localtime(start)), start
+
+    def _writer_loop(self, lines):
+        log_file = index_file = None
+        segment_start = None
+        offset = 0
+
+        while True:
+            batch = [lines.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(lines.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        if log_file is not None:
+                            log_file.flush()
+                            index_file.flush()
+                        item.set()
+                        continue
+
+                    timestamp, level_no, text = item
+                    if segment_start is None or timestamp >= segment_start + self.rotation:
+                        if log_file is not None:
+                            log_file.close()
+                            index_file.close()
+                            self._close_segment(log_file.name)
+                        name, segment_start = self._segment_name(timestamp)
+                        base = os.path.join(self.directory, name)
+                        log_file = open(base + '.log', 'ab')
+                        index_file = open(base + '.idx', 'ab')
+                        offset = log_file.tell()
+
+                    data = text.encode('utf-8', 'replace')
+                    log_file.write(data)
+                    index_file.write(INDEX_RECORD.pack(timestamp, level_no, offset))
+                    offset += len(data)
+
+                if log_file is not None:
+                    log_file.flush()
+                    index_file.flush()
+            except Exception as e:
+                # Never let logging take the bot down; stdlib logging, loguru would feed this sink again
+                logger.error(f"Log writer error in {self.directory}: {e}")
+
+    def _close_segment(self, log_path):
+        """Compress the finished segment and apply retention, off the writer thread"""
+        def close():
+            try:
+                compress_segment(log_path)
+            except Exception as e:
+                logger.error(f"Could not compress log segment {log_path}: {e}")
+            self.prune()
+
+        threading.Thread(target=close, name='log_compress', daemon=True).start()
+
+    def prune(self):
+        """Drop segments beyond retention and instance directories idle for longer than that"""
+        names = sorted({entry.split('.', 1)[0] for entry in os.listdir(self.directory)
+                        if entry.endswith(SEGMENT_SUFFIXES)})
+        for name in names[:-self.retention]:
+            for suffix in SEGMENT_SUFFIXES:
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+        root = os.path.dirname(self.directory)
+        cutoff = time.time() - self.retention * self.rotation
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.path != self.directory and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+# endregion
+
+
+# region reading
+
+class _SegmentIndex:
+    """Parsed index of one segment, extended incrementally while the segment grows"""
+
+    def __init__(self):
+        self.consumed = 0
+        self.timestamps = []
+        self.levels = bytearray()
+        self.offsets = []
+
+    def refresh(self, path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        # Only whole records, the writer may be in the middle of one
+        size -= (size - self.consumed) % INDEX_RECORD.size
+        if size <= self.consumed:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self.consumed)
+            data = f.read(size - self.consumed)
+        for timestamp, level_no, offset in INDEX_RECORD.iter_unpack(data):
+            self.timestamps.append(timestamp)
+            self.levels.append(level_no)
+            self.offsets.append(offset)
+        self.consumed = size
+
+
+class LogStore:
+    """Index-backed queries over the per-instance log directories"""
+
+    def __init__(self, root=LOG_ROOT):
+        self.root = root
+        self._indexes = {}  # idx path -> _SegmentIndex
+        self._lock = threading.Lock()
+
+    def instances(self):
+        try:
+            return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def set_owner(self, instance, user_id):
+        """Record which user started an instance, log access is decided from this and not the id"""
+        directory = instance_directory(self.root, instance)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, OWNER_FILE + '.tmp'), 'w') as f:
+            f.write(user_id)
+        os.replace(os.path.join(directory, OWNER_FILE + '.tmp'), os.path.join(directory, OWNER_FILE))
+
+    def owner(self, instance):
+        try:
+            with open(os.path.join(instance_directory(self.root, instance), OWNER_FILE)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _segments(self, instance):
+        """[(name, base path)] oldest first"""
+        directory = instance_directory(self.root, instance)
+        try:
+            names = {entry.split('.', 1)[0] for entry in os.listdir(directory) if entry.endswith('.idx')}
+        except FileNotFoundError:
+            return []
+        return [(name, os.path.join(directory, name)) for name in sorted(names)]
+
+    def _index(self, base):
+        path = base + '.idx'
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is None:
+                index = self._indexes[path] = _SegmentIndex()
+            index.refresh(path)
+            return index
+
+    def forget(self, instance=None):
+        """Drop cached indexes, e.g. after an instance's logs were deleted"""
+        with self._lock:
+            if instance is None:
+                self._indexes.clear()
+                return
+            prefix = instance_directory(self.root, instance) + os.sep
+            for path in [p for p in self._indexes if p.startswith(prefix)]:
+                del self._indexes[path]
+
+    @staticmethod
+    def _read_lines(base, offsets):
+        """Lines starting at the given uncompressed offsets"""
+        if os.path.exists(base + '.log'):
+            with open(base + '.log', 'rb') as f:
+                lines = []
+                for offset in offsets:
+                    f.seek(offset)
+                    lines.append(f.readline())
+                return lines
+
+        with open(base + '.blocks') as f:
+            blocks = json.load(f)
+        starts = [block[0] for block in blocks]
+        decompressed = {}
+        lines = []
+        with open(base + '.log.gz', 'rb') as f:
+            for offset in offsets:
+                block_no = bisect.bisect_right(starts, offset) - 1
+                if block_no not in decompressed:
+                    f.seek(blocks[block_no][1])
+                    decompressed[block_no] = gzip.decompress(f.read(blocks[block_no + 1][1] - blocks[block_no][1]))
+                data = decompressed[block_no]
+                position = offset - starts[block_no]
+                end = data.find(b'\n', position)
+                lines.append(data[position:] if end == -1 else data[position:end + 1])
+        return lines
+
+    def _query_instance(self, instance, min_level, since, until, contains, limit):
+        """Newest matching records of one instance, newest first"""
+        results = []
+        for name, base in reversed(self._segments(instance)):
+            index = self._index(base)
+            if not index.timestamps:
+                continue
+            if since is not None and index.timestamps[-1] < since:
+                break  # Older segments only get older
+
+            start = bisect.bisect_left(index.timestamps, since) if since is not None else 0
+            end = bisect.bisect_right(index.timestamps, until) if until is not None else len(index.timestamps)
+
+            position = end
+            while position > start and len(results) < limit:
+                # Collect a batch of candidate records walking backwards, then read them in one go
+                candidates = []
+                while position > start and len(candidates) < max(limit - len(results), 50):
+                    position -= 1
+                    if min_level is None or index.levels[position] >= min_level:
+                        candidates.append(position)
+                if not candidates:
+                    break
+
+                try:
+                    lines = self._read_lines(base, [index.offsets[i] for i in candidates])
+                except (OSError, ValueError, IndexError) as e:
+                    logger.warning(f"Could not read log segment {base}: {e}")
+                    break
+
+                for i, raw in zip(candidates, lines):
+                    line = raw.decode('utf-8', 'replace').rstrip('\n')
+                    if contains and contains not in line.lower():
+                        continue
+                    results.append({
+                        'instance': instance,
+                        'timestamp': index.timestamps[i],
+                        'level': index.levels[i],
+                        'line': line,
+                    })
+                    if len(results) >= limit:
+                        break
+
+            if len(results) >= limit:
+                break
+        return results
+
+    def query(self, instances=None, level=None, since=None, until=None, contains=None, limit=200):
+        """
+        Newest `limit` records matching the filters, returned oldest first
+
+        level is a minimum level name or number, since/until are unix
+        timestamps and contains is a case-insensitive substring.
+        """
+        if instances is None:
+            instances = self.instances()
+        min_level = level_number(level)
+        contains = contains.lower() if contains else None
+
+        per_instance = [
+            self._query_instance(instance, min_level, since, until, contains, limit)
+            for instance in instances
+        ]
+        newest = heapq.merge(*per_instance, key=lambda record: record['timestamp'], reverse=True)
+        records = [record for _, record in zip(range(limit), newest)]
+        records.reverse()
+        return records
+
+# endregion
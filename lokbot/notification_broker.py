@@ -0,0 +1,170 @@
+"""
+Publish/subscribe broker for live notification streams
+
+Every published notification is appended to a bounded per-user event log with
+a monotonically increasing id.  Stream connections don't consume from a shared
+queue; each one keeps its own cursor into the log, so every open tab sees every
+event and a reconnecting client resumes from its Last-Event-ID.
+
+Consumers can wait either on a thread (the Flask fallback route) or on an
+asyncio loop (the evented SSE server), publishing wakes both.
+"""
+import asyncio
+import collections
+import json
+import threading
+import time
+
+
+def format_sse(data, event_id=None):
+    """Encode one server-sent event"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class NotificationBroker:
+    """Per-user event logs with independent per-connection cursors"""
+
+    def __init__(self, log_size=200):
+        self.log_size = log_size
+
+        # Ids start at the current time in ms so they keep increasing across restarts,
+        # a Last-Event-ID from before a restart then simply replays the new log
+        self._next_id = int(time.time() * 1000)
+        self._logs = {}  # user_id -> deque of (event_id, data)
+        self._subscribers = collections.Counter()  # user_id -> open connections
+        self._async_waiters = {}  # user_id -> set of (loop, asyncio.Event)
+        self._condition = threading.Condition()
+
+    # region publishing
+
+    def publish(self, user_id, data):
+        """Append an event to the user's log and wake its streams, returns the event id"""
+        with self._condition:
+            self._next_id += 1
+            event_id = self._next_id
+            log = self._logs.get(user_id)
+            if log is None:
+                log = self._logs[user_id] = collections.deque(maxlen=self.log_size)
+            log.append((event_id, data))
+            self._condition.notify_all()
+            waiters = list(self._async_waiters.get(user_id, ()))
+
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed
+                pass
+        return event_id
+
+    def clear(self, user_id, predicate=None):
+        """Drop logged events for a user, or only those matching predicate(data)"""
+        with self._condition:
+            log = self._logs.get(user_id)
+            if log is None:
+                return
+            if predicate is None:
+                log.clear()
+            else:
+                kept = [(event_id, data) for event_id, data in log if not predicate(data)]
+                log.clear()
+                log.extend(kept)
+
+    def remove_user(self, user_id):
+        with self._condition:
+            self._logs.pop(user_id, None)
+
+    # endregion
+
+    # region reading
+
+    def latest_id(self, user_id):
+        with self._condition:
+            log = self._logs.get(user_id)
+            return log[-1][0] if log else self._next_id
+
+    def events_after(self, user_id, last_event_id):
+        """Events newer than last_event_id, oldest first"""
+        with self._condition:
+            log = self._logs.get(user_id)
+            if not log or log[-1][0] <= last_event_id:
+                return []
+            return [(event_id, data) for event_id, data in log if event_id > last_event_id]
+
+    def start_cursor(self, user_id, last_event_id=None):
+        """Cursor for a new connection: resume after last_event_id or start at the live tail"""
+        if last_event_id is None:
+            return self.latest_id(user_id)
+        return last_event_id
+
+    def wait(self, user_id, last_event_id, timeout):
+        """Block the calling thread until there are events after last_event_id or timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = self.events_after(user_id, last_event_id)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._condition.wait(remaining)
+
+    async def wait_async(self, user_id, last_event_id, timeout):
+        """Await events after last_event_id or timeout without holding a thread"""
+        events = self.events_after(user_id, last_event_id)
+        if events:
+            return events
+
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            self._async_waiters.setdefault(user_id, set()).add(waiter)
+        try:
+            # Re-check after registering so an event published in between isn't missed
+            events = self.events_after(user_id, last_event_id)
+            if events:
+                return events
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            return self.events_after(user_id, last_event_id)
+        finally:
+            with self._condition:
+                waiters = self._async_waiters.get(user_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._async_waiters[user_id]
+
+    # endregion
+
+    # region connection bookkeeping
+
+    def subscribe(self, user_id):
+        with self._condition:
+            self._subscribers[user_id] += 1
+
+    def unsubscribe(self, user_id):
+        with self._condition:
+            self._subscribers[user_id] -= 1
+            if self._subscribers[user_id] <= 0:
+                del self._subscribers[user_id]
+
+    def stats(self, user_id):
+        with self._condition:
+            return {
+                'log_size': len(self._logs.get(user_id, ())),
+                'subscribers': self._subscribers.get(user_id, 0),
+            }
+
+    # endregion
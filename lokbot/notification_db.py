@@ -0,0 +1,231 @@
+"""
+Persistent notification history backed by SQLite
+
+Notifications are written by a background thread in batches, expired by a
+retention policy and read back with cursor-based pagination, so history
+survives web app restarts and loading a page costs the same no matter how
+many notifications are stored.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    notification_id TEXT,
+    user_id TEXT NOT NULL,
+    account_name TEXT NOT NULL,
+    instance_id TEXT,
+    type TEXT,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    UNIQUE (user_id, notification_id)
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_time
+    ON notifications (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_account_time
+    ON notifications (user_id, account_name, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_lookup
+    ON notifications (user_id, account_name, instance_id, type, created_at);
+CREATE INDEX IF NOT EXISTS idx_notifications_created
+    ON notifications (created_at);
+"""
+
+
+def parse_timestamp(timestamp):
+    """ISO timestamp (as stored in notifications) to epoch seconds"""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (AttributeError, ValueError):
+        return time.time()
+
+
+def encode_cursor(created_at, row_id):
+    return f'{created_at!r}:{row_id}'
+
+
+def decode_cursor(cursor):
+    created_at, row_id = cursor.rsplit(':', 1)
+    return float(created_at), int(row_id)
+
+
+class NotificationDatabase:
+    """SQLite (WAL) notification store with a batching writer thread"""
+
+    def __init__(self, path='data/notifications.db', retention=7 * 24 * 3600, batch_size=500, flush_interval=0.5):
+        self.path = path
+        self.retention = retention
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue()
+        self._local = threading.local()
+
+        conn = self._connect()
+        self._migrate(conn)
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+        threading.Thread(target=self._writer_loop, name='notification_db_writer', daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @staticmethod
+    def _migrate(conn):
+        """Databases from before the per-user key had notification_id unique on its own, which
+        dropped the copies of a notification meant for a second user; rebuild the table with the new key"""
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'notifications'").fetchone()
+        if row is None or 'notification_id TEXT UNIQUE' not in row[0]:
+            return
+        logger.info("Migrating notification history to the per-user notification key")
+        with conn:
+            conn.execute('ALTER TABLE notifications RENAME TO notifications_old')
+            # The old indexes moved with the renamed table, drop them so the schema can create them again
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                        "AND tbl_name = 'notifications_old' AND sql IS NOT NULL").fetchall():
+                conn.execute(f'DROP INDEX "{name}"')
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(
+                'INSERT OR IGNORE INTO notifications '
+                '(id, notification_id, user_id, account_name, instance_id, type, created_at, payload) '
+                'SELECT id, notification_id, user_id, account_name, instance_id, type, created_at, payload '
+                'FROM notifications_old'
+            )
+            conn.execute('DROP TABLE notifications_old')
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # region writes
+
+    def insert(self, user_id, notification):
+        """Queue a notification for the next batch, never blocks"""
+        self._pending.put((
+            notification.get('id'),
+            user_id,
+            notification.get('account_name') or 'General',
+            notification.get('instance_id'),
+            notification.get('type'),
+            parse_timestamp(notification.get('timestamp')),
+            json.dumps(notification, default=str),
+        ))
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO notifications '
+                        '(notification_id, user_id, account_name, instance_id, type, created_at, payload) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        batch
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error writing {len(batch)} notifications: {e}")
+
+    def expire(self, now=None):
+        """Delete notifications older than the retention period, returns how many"""
+        cutoff = (now or time.time()) - self.retention
+        conn = self._reader()
+        with conn:
+            return conn.execute('DELETE FROM notifications WHERE created_at < ?', (cutoff,)).rowcount
+
+    def delete(self, user_id, account_name=None):
+        conn = self._reader()
+        with conn:
+            if account_name is None:
+                conn.execute('DELETE FROM notifications WHERE user_id = ?', (user_id,))
+            else:
+                conn.execute('DELETE FROM notifications WHERE user_id = ? AND account_name = ?', (user_id, account_name))
+
+    # endregion
+
+    # region reads
+
+    def has_user(self, user_id):
+        row = self._reader().execute('SELECT 1 FROM notifications WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()
+        return row is not None
+
+    def accounts(self, user_id):
+        rows = self._reader().execute(
+            'SELECT DISTINCT account_name FROM notifications WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def page(self, user_id, account_name=None, instance_id=None, notification_type=None,
+             since=None, cursor=None, limit=50):
+        """
+        Newest-first page of notifications
+
+        Returns (notifications, next_cursor); pass next_cursor back to get the
+        following page, it is None on the last page.
+        """
+        clauses = ['user_id = ?']
+        params = [user_id]
+        if account_name is not None:
+            clauses.append('account_name = ?')
+            params.append(account_name)
+        if instance_id is not None:
+            clauses.append('instance_id = ?')
+            params.append(instance_id)
+        if notification_type is not None:
+            clauses.append('type = ?')
+            params.append(notification_type)
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(since)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            clauses.append('(created_at < ? OR (created_at = ? AND id < ?))')
+            params.extend((created_at, created_at, row_id))
+
+        rows = self._reader().execute(
+            f'SELECT id, account_name, created_at, payload FROM notifications '
+            f'WHERE {" AND ".join(clauses)} ORDER BY created_at DESC, id DESC LIMIT ?',
+            (*params, limit + 1)
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+
+        notifications = []
+        for _, row_account_name, _, payload in rows:
+            notification = json.loads(payload)
+            notification['account_name'] = row_account_name
+            notifications.append(notification)
+        return notifications, next_cursor
+
+    # endregion
@@ -0,0 +1,148 @@
+"""
+In-memory notification history for the web app
+
+Each (user, account) pair keeps a fixed-capacity ring of notifications, and
+duplicates are detected with a time-windowed set of (user, instance, type,
+message) keys, so adding a notification costs O(1) no matter how many
+instances are reporting.
+"""
+import collections
+import threading
+import time
+
+# Game user IDs (24 hex chars) that bots report under are also shown to this web user
+GAME_USER_ALIAS = 'admin'
+
+
+def is_game_user_id(user_id):
+    return len(user_id) == 24 and all(c in '0123456789abcdef' for c in user_id.lower())
+
+
+class NotificationStore:
+    """Per-account ring buffers with hash-based duplicate suppression"""
+
+    def __init__(self, capacity=150, dedup_window=30, retention=7 * 24 * 3600):
+        self.capacity = capacity
+        self.dedup_window = dedup_window
+        self.retention = retention
+
+        self._rings = {}  # user_id -> {account_name: deque of (created_at, notification)}
+        self._recent = {}  # dedup key -> expiry (monotonic)
+        self._recent_order = collections.deque()  # (expiry, key) in insertion order
+        self._game_user_ids = set()
+        self._aliases = {}  # user_id -> tuple of user IDs the notification is stored under
+        self._lock = threading.RLock()
+
+    # region aliases
+
+    def aliases_for(self, user_id):
+        """User IDs that receive a notification addressed to user_id"""
+        aliases = self._aliases.get(user_id)
+        if aliases is None:
+            if is_game_user_id(user_id):
+                # Bots use the game user ID while the web session uses a username
+                aliases = (user_id, GAME_USER_ALIAS)
+                self._game_user_ids.add(user_id)
+                self._aliases.pop(GAME_USER_ALIAS, None)
+            elif user_id == GAME_USER_ALIAS:
+                aliases = (user_id, *sorted(self._game_user_ids))
+            else:
+                aliases = (user_id,)
+            self._aliases[user_id] = aliases
+        return aliases
+
+    # endregion
+
+    def _expire_recent(self, now):
+        while self._recent_order and self._recent_order[0][0] <= now:
+            expiry, key = self._recent_order.popleft()
+            if self._recent.get(key) == expiry:
+                del self._recent[key]
+
+    def _ring(self, user_id, account_name):
+        accounts = self._rings.setdefault(user_id, {})
+        ring = accounts.get(account_name)
+        if ring is None:
+            ring = accounts[account_name] = collections.deque(maxlen=self.capacity)
+        return ring
+
+    def add(self, user_id, notification):
+        """
+        Store a notification under user_id and its aliases
+
+        Returns the user IDs it was stored for, or an empty tuple if it is a
+        duplicate of one seen within the dedup window.
+        """
+        now = time.monotonic()
+        key = hash((
+            user_id,
+            notification.get('instance_id'),
+            notification.get('type'),
+            notification.get('message'),
+        ))
+        account_name = notification.get('account_name')
+
+        with self._lock:
+            self._expire_recent(now)
+            if key in self._recent:
+                return ()
+
+            expiry = now + self.dedup_window
+            self._recent[key] = expiry
+            self._recent_order.append((expiry, key))
+
+            created_at = time.time()
+            cutoff = created_at - self.retention
+            targets = self.aliases_for(user_id)
+            for target_user_id in targets:
+                ring = self._ring(target_user_id, account_name)
+                # Appending to a full deque drops the oldest entry
+                ring.append((created_at, notification))
+                while ring and ring[0][0] < cutoff:
+                    ring.popleft()
+            return targets
+
+    def append(self, user_id, account_name, notification):
+        """Store a notification without dedup or aliasing (migrated or system entries)"""
+        with self._lock:
+            self._ring(user_id, account_name).append((time.time(), notification))
+
+    def get_user_history(self, user_id):
+        """{account_name: [notification, ...]} oldest first"""
+        with self._lock:
+            return {
+                account_name: [notification for _, notification in ring]
+                for account_name, ring in self._rings.get(user_id, {}).items()
+            }
+
+    def get_account_history(self, user_id, account_name):
+        with self._lock:
+            return [notification for _, notification in self._rings.get(user_id, {}).get(account_name, ())]
+
+    def has_user(self, user_id):
+        return bool(self._rings.get(user_id))
+
+    def clear_user(self, user_id):
+        with self._lock:
+            if user_id in self._rings:
+                self._rings[user_id] = {}
+
+    def clear_account(self, user_id, account_name):
+        with self._lock:
+            self._rings.get(user_id, {}).pop(account_name, None)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._rings.pop(user_id, None)
+
+    def expire(self, now=None):
+        """Drop notifications older than the retention period, returns how many"""
+        cutoff = (now or time.time()) - self.retention
+        removed = 0
+        with self._lock:
+            for accounts in self._rings.values():
+                for ring in accounts.values():
+                    while ring and ring[0][0] < cutoff:
+                        ring.popleft()
+                        removed += 1
+        return removed
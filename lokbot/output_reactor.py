@@ -0,0 +1,239 @@
+"""
+One reactor for the output of every bot process
+
+Instead of a blocking readline() thread per bot (web app) or non-blocking
+pipes polled every 100 ms (Discord bot), a single selector thread waits on
+all child stdout/stderr pipes at once, reads whatever is available, splits it
+into lines and hands them to a small worker pool.  Lines of one instance are
+processed in order, by one worker at a time, so parsers keep the sequential
+view they had with a dedicated thread.  Per-instance byte and line counters
+are kept for the status pages.
+"""
+import collections
+import os
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_LINE = 1024 * 1024  # a line longer than this is delivered in pieces
+
+
+class _Stream:
+    __slots__ = ('key', 'fd', 'file', 'on_line', 'on_close', 'buffer')
+
+    def __init__(self, key, file, on_line, on_close):
+        self.key = key
+        self.file = file
+        self.fd = file.fileno()
+        self.on_line = on_line
+        self.on_close = on_close
+        self.buffer = bytearray()
+
+
+class _InstanceState:
+    __slots__ = ('pending', 'scheduled', 'streams', 'bytes', 'lines', 'last_output')
+
+    def __init__(self):
+        self.pending = collections.deque()  # (callback, argument) run in order
+        self.scheduled = False
+        self.streams = 0
+        self.bytes = 0
+        self.lines = 0
+        self.last_output = None
+
+
+class OutputReactor:
+    """Reads every watched pipe from one selector thread and dispatches lines to workers"""
+
+    def __init__(self, workers=4):
+        self._selector = selectors.DefaultSelector()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='output_worker')
+        self._instances = {}
+        self._lock = threading.Lock()
+        self._registrations = collections.deque()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._reactor_loop, name='output_reactor', daemon=True).start()
+
+    def watch(self, key, file, on_line, on_close=None):
+        """
+        Read lines from a child's pipe until EOF
+
+        on_line(line) gets each line without the trailing newline, on_close()
+        runs once after the last line.  Streams sharing a key (stdout and
+        stderr of one bot) are processed in one ordered sequence.
+        """
+        self.start()
+        stream = _Stream(key, file, on_line, on_close)
+        os.set_blocking(stream.fd, False)
+        with self._lock:
+            self._instances.setdefault(key, _InstanceState()).streams += 1
+        self._registrations.append(stream)
+        self._wake()
+
+    def stats(self):
+        """{key: {'bytes', 'lines', 'streams', 'last_output'}} for watched instances"""
+        with self._lock:
+            return {
+                key: {'bytes': state.bytes, 'lines': state.lines,
+                      'streams': state.streams, 'last_output': state.last_output}
+                for key, state in self._instances.items()
+            }
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b'\0')
+        except BlockingIOError:
+            pass  # Already woken
+
+    # region reactor thread
+
+    def _reactor_loop(self):
+        while True:
+            try:
+                events = self._selector.select()
+            except Exception as e:
+                logger.error(f"Output reactor select failed: {e}")
+                time.sleep(1)
+                continue
+
+            for selector_key, _ in events:
+                if selector_key.fd == self._wake_read:
+                    self._drain_wakeups()
+                else:
+                    self._read(selector_key.data)
+
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self._registrations:
+            stream = self._registrations.popleft()
+            try:
+                try:
+                    self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+                except KeyError:
+                    # The fd number was reused after someone else closed a watched pipe
+                    self._selector.unregister(stream.fd)
+                    self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+            except (ValueError, OSError) as e:
+                logger.error(f"Could not watch output of {stream.key}: {e}")
+                self._close(stream)
+
+    def _read(self, stream):
+        try:
+            data = os.read(stream.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            if stream.buffer:
+                self._dispatch(stream, [bytes(stream.buffer)], 0)
+                stream.buffer.clear()
+            self._close(stream)
+            return
+
+        buffer = stream.buffer
+        buffer += data
+        lines = []
+        end = buffer.rfind(b'\n')
+        if end != -1:
+            lines = bytes(buffer[:end]).split(b'\n')
+            del buffer[:end + 1]
+        if len(buffer) > MAX_LINE:
+            lines.append(bytes(buffer))
+            buffer.clear()
+        self._dispatch(stream, lines, len(data))
+
+    def _close(self, stream):
+        try:
+            self._selector.unregister(stream.fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            stream.file.close()
+        except OSError:
+            pass
+
+        with self._lock:
+            state = self._instances.get(stream.key)
+            if state is not None:
+                state.streams -= 1
+                if state.streams <= 0:
+                    del self._instances[stream.key]
+        if stream.on_close is not None:
+            self._enqueue(stream.key, stream.on_close, None, state)
+
+    def _dispatch(self, stream, lines, byte_count):
+        with self._lock:
+            state = self._instances.get(stream.key)
+            if state is None:
+                return
+            state.bytes += byte_count
+            state.lines += len(lines)
+            state.last_output = time.time()
+        for line in lines:
+            self._enqueue(stream.key, stream.on_line, line.decode('utf-8', 'replace').rstrip('\r'), state)
+
+    # endregion
+
+    # region ordered dispatch
+
+    def _enqueue(self, key, callback, argument, state):
+        if state is None:
+            return
+        with self._lock:
+            state.pending.append((callback, argument))
+            if state.scheduled:
+                return
+            state.scheduled = True
+        self._executor.submit(self._drain, key, state)
+
+    def _drain(self, key, state):
+        """Run one instance's pending callbacks in order on this worker"""
+        while True:
+            with self._lock:
+                if not state.pending:
+                    state.scheduled = False
+                    return
+                callback, argument = state.pending.popleft()
+            try:
+                if argument is None:
+                    callback()
+                else:
+                    callback(argument)
+            except Exception as e:
+                logger.error(f"Error handling output of {key}: {e}")
+
+    # endregion
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def get_reactor():
+    """Process-wide output reactor"""
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = OutputReactor()
+        return _reactor
@@ -0,0 +1,161 @@
+"""
+Resource telemetry for bot processes from /proc
+
+A sampler thread reads /proc/<pid>/stat, /proc/<pid>/status and
+/proc/<pid>/fd for every running instance and keeps a short time series per
+instance (RSS, CPU %, threads, open FDs).  Soft limits are checked on every
+sample; a limit has to be exceeded for several samples in a row before the
+callback fires, so a single spike doesn't restart a bot.
+"""
+import collections
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROC_ROOT = '/proc'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Limit name -> sample field it applies to
+LIMIT_FIELDS = {
+    'rss_mb': 'rss_mb',
+    'cpu_percent': 'cpu_percent',
+    'threads': 'threads',
+    'fds': 'fds',
+}
+
+
+def is_supported():
+    return os.path.isdir(os.path.join(PROC_ROOT, 'self'))
+
+
+def read_process(pid):
+    """Raw counters of one process, None if it's gone"""
+    base = os.path.join(PROC_ROOT, str(pid))
+    try:
+        with open(os.path.join(base, 'stat'), 'rb') as f:
+            stat = f.read()
+        # The command name can contain spaces and parentheses, fields start after the last ')'
+        fields = stat[stat.rindex(b')') + 2:].split()
+        cpu_ticks = int(fields[11]) + int(fields[12])  # utime + stime
+        threads = int(fields[17])
+        rss_pages = int(fields[21])
+
+        vm_hwm_kb = None
+        with open(os.path.join(base, 'status'), 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    vm_hwm_kb = int(line.split()[1])
+                    break
+
+        try:
+            fds = len(os.listdir(os.path.join(base, 'fd')))
+        except PermissionError:
+            fds = None
+    except (FileNotFoundError, ProcessLookupError, ValueError, IndexError):
+        return None
+
+    return {
+        'cpu_seconds': cpu_ticks / CLOCK_TICKS,
+        'threads': threads,
+        'rss_mb': round(rss_pages * PAGE_SIZE / (1024 * 1024), 1),
+        'peak_rss_mb': round(vm_hwm_kb / 1024, 1) if vm_hwm_kb is not None else None,
+        'fds': fds,
+    }
+
+
+class ProcessTelemetry:
+    """Samples processes returned by targets() and keeps a bounded history per key"""
+
+    def __init__(self, targets, interval=10, history=60, limits=None, sustain=3, on_limit=None):
+        self.targets = targets  # targets() -> {key: pid}
+        self.interval = interval
+        self.history = history
+        self.limits = dict(limits or {})  # limit name -> threshold, see LIMIT_FIELDS
+        self.sustain = sustain
+        self.on_limit = on_limit  # on_limit(key, limit_name, value, threshold)
+
+        self._series = {}  # key -> deque of samples
+        self._previous = {}  # key -> (pid, monotonic time, cpu_seconds)
+        self._over = collections.Counter()  # (key, limit name) -> consecutive samples over the limit
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started or not is_supported():
+                return
+            self._started = True
+        threading.Thread(target=self._sample_loop, name='proc_telemetry', daemon=True).start()
+
+    def set_limits(self, limits):
+        with self._lock:
+            self.limits = {name: value for name, value in limits.items() if name in LIMIT_FIELDS and value}
+            self._over.clear()
+
+    def latest(self, key):
+        with self._lock:
+            series = self._series.get(key)
+            return dict(series[-1]) if series else None
+
+    def series(self, key=None):
+        """{key: [samples]} oldest first, or the samples of one key"""
+        with self._lock:
+            if key is not None:
+                return [dict(sample) for sample in self._series.get(key, ())]
+            return {k: [dict(sample) for sample in samples] for k, samples in self._series.items()}
+
+    def _sample_loop(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Error sampling process telemetry: {e}")
+            time.sleep(self.interval)
+
+    def sample(self):
+        """Take one sample of every target, then check the soft limits"""
+        targets = self.targets()
+        now = time.monotonic()
+        samples = {}
+        for key, pid in targets.items():
+            counters = read_process(pid)
+            if counters is None:
+                continue
+
+            previous = self._previous.get(key)
+            cpu_percent = None
+            if previous is not None and previous[0] == pid and now > previous[1]:
+                cpu_percent = round(100 * (counters['cpu_seconds'] - previous[2]) / (now - previous[1]), 1)
+            self._previous[key] = (pid, now, counters['cpu_seconds'])
+
+            samples[key] = {'time': time.time(), 'pid': pid, 'cpu_percent': cpu_percent, **counters}
+
+        with self._lock:
+            for key, sample in samples.items():
+                self._series.setdefault(key, collections.deque(maxlen=self.history)).append(sample)
+            # Forget instances that stopped
+            for key in [k for k in self._series if k not in targets]:
+                del self._series[key]
+                self._previous.pop(key, None)
+            limits = dict(self.limits)
+
+        for key, sample in samples.items():
+            self._check_limits(key, sample, limits)
+
+    def _check_limits(self, key, sample, limits):
+        for name, threshold in limits.items():
+            value = sample.get(LIMIT_FIELDS[name])
+            if value is None or value <= threshold:
+                self._over.pop((key, name), None)
+                continue
+
+            self._over[(key, name)] += 1
+            if self._over[(key, name)] == self.sustain and self.on_limit is not None:
+                try:
+                    self.on_limit(key, name, value, threshold)
+                except Exception as e:
+                    logger.error(f"Error handling soft limit {name} for {key}: {e}")
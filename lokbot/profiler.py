@@ -0,0 +1,192 @@
+"""
+On-demand sampling profiler for a running bot
+
+While a profile is running, a sampler thread snapshots the stack of every
+other thread with sys._current_frames() at a fixed rate and counts identical
+stacks.  Nothing is installed into the interpreter (no settrace/setprofile),
+so threads run at full speed between samples, and when no profile is running
+there is no sampler thread at all.  A finished profile is reported as
+collapsed stacks ("thread;outer;...;inner count", the input format of
+flamegraph.pl and speedscope) plus a table of the hottest functions per
+thread.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+from lokbot import logger
+
+MIN_RATE = 1
+MAX_RATE = 1000
+MAX_DURATION = 600
+MAX_DEPTH = 128
+MAX_STACKS = 5000  # distinct stacks kept in a report, the rest are rare tails
+
+
+def frame_label(code):
+    """'function (file.py:first line)', safe to use in a collapsed stack"""
+    label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    return label.replace(';', ':')
+
+
+class SamplingProfiler:
+    """Counts thread stacks sampled from sys._current_frames() between start() and stop()"""
+
+    def __init__(self, max_depth=MAX_DEPTH):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._stop = None  # Event of the running profile, None when idle
+        self._result = None
+
+    @property
+    def running(self):
+        return self._stop is not None
+
+    def start(self, rate=100, duration=None, on_finish=None):
+        """
+        Start sampling `rate` times per second, returns False if already running
+
+        The profile stops by itself after `duration` seconds (capped at
+        MAX_DURATION so a forgotten profile doesn't run forever) and
+        on_finish(result) is called with the report.
+        """
+        rate = min(max(int(rate), MIN_RATE), MAX_RATE)
+        duration = min(float(duration or MAX_DURATION), MAX_DURATION)
+        with self._lock:
+            if self._stop is not None:
+                return False
+            self._stop = threading.Event()
+            stop = self._stop
+
+        threading.Thread(
+            target=self._sample_loop, args=(stop, rate, duration, on_finish), name='sampling_profiler', daemon=True
+        ).start()
+        logger.info(f'Sampling profiler started at {rate} Hz for up to {duration:g}s')
+        return True
+
+    def stop(self, timeout=5):
+        """Stop the running profile and return its report (the last report when idle)"""
+        with self._lock:
+            stop = self._stop
+        if stop is not None:
+            stop.set()
+            deadline = time.monotonic() + timeout
+            while self._stop is stop and time.monotonic() < deadline:
+                time.sleep(0.01)
+        return self._result
+
+    @property
+    def result(self):
+        return self._result
+
+    def _sample_loop(self, stop, rate, duration, on_finish):
+        interval = 1 / rate
+        own_ident = threading.get_ident()
+        stacks = collections.Counter()  # (thread name, (code, ...) outermost first) -> samples
+        started = time.monotonic()
+        deadline = started + duration
+        sample_count = 0
+        sampling_time = 0.0
+
+        try:
+            while not stop.is_set() and time.monotonic() < deadline:
+                sample_started = time.perf_counter()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    codes = []
+                    while frame is not None and len(codes) < self.max_depth:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    codes.reverse()
+                    stacks[(names.get(ident, f'thread-{ident}'), tuple(codes))] += 1
+                frame = None
+                sample_count += 1
+                sampling_time += time.perf_counter() - sample_started
+                stop.wait(interval)
+        except Exception as e:
+            logger.error(f'Sampling profiler failed: {e}')
+
+        elapsed = time.monotonic() - started
+        result = self._report(stacks, sample_count, rate, elapsed, sampling_time)
+        with self._lock:
+            self._result = result
+            self._stop = None
+        logger.info(f'Sampling profiler stopped after {elapsed:.1f}s, {sample_count} samples')
+
+        if on_finish is not None:
+            try:
+                on_finish(result)
+            except Exception as e:
+                logger.error(f'Error delivering profile: {e}')
+
+    @staticmethod
+    def _report(stacks, sample_count, rate, elapsed, sampling_time, top=25):
+        labels = {}
+
+        def label(code):
+            text = labels.get(code)
+            if text is None:
+                text = labels[code] = frame_label(code)
+            return text
+
+        collapsed = collections.Counter()
+        threads = {}
+        for (thread_name, codes), count in stacks.items():
+            collapsed[';'.join([thread_name.replace(';', ':')] + [label(code) for code in codes])] += count
+
+            thread = threads.setdefault(thread_name, {
+                'samples': 0, 'self': collections.Counter(), 'total': collections.Counter()
+            })
+            thread['samples'] += count
+            if codes:
+                thread['self'][label(codes[-1])] += count
+                # A recursive function still counts once per sample
+                for text in {label(code) for code in codes}:
+                    thread['total'][text] += count
+
+        hot = {}
+        for thread_name, thread in threads.items():
+            hot[thread_name] = {
+                'samples': thread['samples'],
+                'functions': [
+                    {
+                        'function': function,
+                        'self': thread['self'][function],
+                        'total': total,
+                        'self_percent': round(100 * thread['self'][function] / thread['samples'], 1),
+                        'total_percent': round(100 * total / thread['samples'], 1),
+                    }
+                    for function, total in sorted(
+                        thread['total'].items(), key=lambda item: (thread['self'][item[0]], item[1]), reverse=True
+                    )[:top]
+                ],
+            }
+
+        return {
+            'finished': time.time(),
+            'rate': rate,
+            'duration': round(elapsed, 2),
+            'samples': sample_count,
+            # Share of the profiled time the sampler itself spent walking stacks
+            'overhead_percent': round(100 * sampling_time / elapsed, 2) if elapsed else 0,
+            'distinct_stacks': len(collapsed),
+            'collapsed': dict(collapsed.most_common(MAX_STACKS)),
+            'threads': hot,
+        }
+
+
+def collapsed_text(result):
+    """Collapsed stacks as the text flamegraph.pl and speedscope read"""
+    return ''.join(f'{stack} {count}\n' for stack, count in result.get('collapsed', {}).items())
+
+
+_profiler = SamplingProfiler()
+
+
+def get_profiler():
+    """Process-wide profiler"""
+    return _profiler
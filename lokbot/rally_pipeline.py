@@ -0,0 +1,137 @@
+"""
+Rally join pipeline fed by /alliance/rally/new
+
+New rallies from sock_thread go into one queue the moment they are announced;
+a low-frequency pass over alliance_battle_list_v2 only reconciles, queueing
+rallies the events missed and refreshing which ones the kingdom has joined.
+A single worker takes the queue in order, drops rallies it already handled,
+filters them against the compiled rally.join targets, applies the numMarch
+limit and hands the rest to the farmer's join_rally, which prepares the
+troops and joins.  One worker keeps two joins from racing for a march slot.
+A target rally turned away by the limit asks for an early pass, so a slot
+freed by a finished rally is found within MIN_RECONCILE_SECONDS.
+"""
+import queue
+import random
+import threading
+import time
+
+from lokbot import logger
+from lokbot.config_watcher import compiled_config
+
+RECONCILE_SECONDS = 300
+MIN_RECONCILE_SECONDS = 30  # early passes asked for by the numMarch limit come at most this often
+SEEN_TTL = 3600  # a rally is long over after an hour, forget it
+
+
+def rally_monster(battle):
+    """(monster code, level) of a battle list entry or a rally/new event turned into one"""
+    target_monster = battle.get('targetMonster') or {}
+    if 'code' not in target_monster:
+        target_monster = battle.get('target', {}).get('monster') or {}
+    return target_monster.get('code'), target_monster.get('level')
+
+
+def battle_from_event(data):
+    """The battle list shape of a /alliance/rally/new event, as far as join_rally reads it"""
+    return {
+        '_id': data.get('_id'),
+        'targetMonster': {'code': data.get('code'), 'level': data.get('level'), 'loc': data.get('loc')},
+        'toLoc': data.get('loc') or [],
+    }
+
+
+class RallyJoinPipeline:
+    def __init__(self, join):
+        self.join = join  # join(rally_id, battle_data=battle) -> bool, the farmer's join_rally
+        self.joined = set()  # rally ids the kingdom has a march in
+        self.seen = {}  # rally id -> when it was joined or turned down for good
+        self._queued = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._reconcile_requested = threading.Event()
+        self._last_reconcile = 0
+
+    def submit(self, battle, source='event'):
+        """Queue a rally for the worker, returns whether it was new to the pipeline"""
+        rally_id = battle.get('_id')
+        if not rally_id:
+            return False
+        with self._lock:
+            if rally_id in self._queued or rally_id in self.seen or rally_id in self.joined:
+                return False
+            self._queued.add(rally_id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name='rally_join_pipeline', daemon=True)
+                self._worker.start()
+        self._queue.put((rally_id, battle, source, time.time()))
+        return True
+
+    def reconcile(self, battles):
+        """
+        alliance_battle_list_v2 battles: take the joined set from the server and queue what was missed
+
+        Returns how many rallies were queued.
+        """
+        now = time.time()
+        self._last_reconcile = now
+        self._reconcile_requested.clear()
+        with self._lock:
+            self.joined = {battle.get('_id') for battle in battles if battle.get('isJoined')}
+            self.seen = {rally_id: at for rally_id, at in self.seen.items() if now - at < SEEN_TTL}
+        return sum(self.submit(battle, 'reconcile') for battle in battles if not battle.get('isJoined'))
+
+    def wait_reconcile(self, timeout):
+        """Sleep until the next reconciliation pass, earlier when the limit turned a target rally away"""
+        self._reconcile_requested.wait(timeout)
+        delay = self._last_reconcile + MIN_RECONCILE_SECONDS - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _work(self):
+        while True:
+            rally_id, battle, source, queued_at = self._queue.get()
+            try:
+                self._process(rally_id, battle, source, queued_at)
+            except Exception as e:
+                logger.error(f'Error processing rally {rally_id}: {e}')
+            finally:
+                with self._lock:
+                    self._queued.discard(rally_id)
+
+    def _process(self, rally_id, battle, source, queued_at):
+        compiled = compiled_config()
+        if not compiled.rally_join_enabled:
+            logger.debug(f'Rally join is disabled, leaving rally {rally_id}')
+            return
+
+        monster_code, monster_level = rally_monster(battle)
+        if not monster_code:
+            logger.debug(f'No monster code found for rally {rally_id}, skipping')
+            return
+        if compiled.rally_join_target(monster_code, monster_level) is None:
+            logger.info(f'Rally {rally_id} on monster {monster_code} level {monster_level} is not a target, skipping')
+            with self._lock:
+                self.seen[rally_id] = time.time()
+            return
+
+        # The joined set may hold rallies that are over, an early pass refreshes it
+        # and brings the rallies turned away here back
+        if len(self.joined) >= compiled.rally_join_max_rallies:
+            logger.info(f'Already joined maximum number of rallies ({compiled.rally_join_max_rallies}), '
+                        f'leaving rally {rally_id} for the next reconciliation pass')
+            self._reconcile_requested.set()
+            return
+
+        logger.info(f'Joining rally {rally_id} for monster code {monster_code}, level {monster_level} '
+                    f'({source}, queued {time.time() - queued_at:.1f}s ago)')
+        if self.join(rally_id, battle_data=battle):
+            logger.info(f'Successfully joined rally {rally_id}')
+            with self._lock:
+                self.joined.add(rally_id)
+                self.seen[rally_id] = time.time()
+        else:
+            logger.error(f'Failed to join rally {rally_id}, the next reconciliation pass tries again')
+            # Avoid rapid failures on the next rally
+            time.sleep(random.uniform(3, 6))
@@ -0,0 +1,444 @@
+"""
+Record and replay a bot session
+
+With LOKBOT_RECORD set (a directory, or a file ending in .jsonl/.jsonl.gz),
+every API response LokBotApi gets and every socket event the kingdom, field
+and chat connections receive is appended to a gzip'd JSON-lines capture,
+one record per line:
+
+    {"k": "session", "v": 1, "started": ..., "instance": ...}
+    {"t": 0.41, "k": "api", "p": "kingdom/enter", "r": {...}, "ms": 93.1}
+    {"t": 2.03, "k": "connect", "c": "fields"}
+    {"t": 2.31, "k": "in", "c": "fields", "e": "/field/objects/v4", "d": {"packs": {"$b": "..."}}}
+    {"t": 2.30, "k": "out", "c": "fields", "e": "/zone/enter/list/v4"}
+
+API bodies are stored decoded; socket payloads are stored as received so a
+replay goes through the same decoding, bytes as {"$b": base64}.  Tokens in
+auth responses are replaced with REPLAY_TOKEN and outgoing payloads are not
+stored, but a capture still holds kingdom data, keep it with the token files.
+
+With LOKBOT_REPLAY set to a capture the bot talks to no server: LokBotApi
+gets its responses from an httpx transport serving the recorded ones per
+endpoint in order, and every socket connection plays back the events of the
+matching recorded connection, at LOKBOT_REPLAY_SPEED (1, N or "max").
+
+    python -m lokbot.recorder summary capture.jsonl.gz
+    python -m lokbot.recorder replay capture.jsonl.gz --speed max --output after.json --compare before.json
+"""
+import base64
+import collections
+import gzip
+import json
+import os
+import pathlib
+import threading
+import time
+
+import httpx
+
+from lokbot import logger
+
+FORMAT_VERSION = 1
+FLUSH_INTERVAL = 1.0
+# Unsigned JWT for user "replay", stands in for every recorded token
+REPLAY_TOKEN = 'eyJhbGciOiAibm9uZSJ9.eyJfaWQiOiAicmVwbGF5In0.replay'
+
+
+def _encode_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'$b': base64.b64encode(value).decode()}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode_hook(document):
+    if len(document) == 1 and '$b' in document:
+        return base64.b64decode(document['$b'])
+    return document
+
+
+def read_capture(path):
+    """Records of a capture in order; a capture cut off by a crash ends at its last complete line"""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    records = []
+    with opener(path, 'rt') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line, object_hook=_decode_hook))
+        except (EOFError, ValueError) as e:
+            logger.warning(f'{path} ends early ({e}), using the {len(records)} complete records')
+    return records
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+# region recording
+
+class Recorder:
+    def __init__(self, path):
+        self.path = str(path)
+        opener = gzip.open if self.path.endswith('.gz') else open
+        self._file = opener(self.path, 'at')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_flush = 0.0
+        self._write({
+            'k': 'session',
+            'v': FORMAT_VERSION,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'instance': os.getenv('LOKBOT_INSTANCE_ID'),
+        })
+        logger.info(f'Recording session to {self.path}')
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=_encode_default)
+        with self._lock:
+            self._file.write(line + '\n')
+            now = time.monotonic()
+            # A gzip flush costs compression, so flush at most once a second
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def _elapsed(self):
+        return round(time.monotonic() - self._started, 4)
+
+    def api(self, path, response, elapsed):
+        # Request bodies stay out of the capture, auth/login's carries the password
+        if 'token' in response:
+            response = dict(response, token=REPLAY_TOKEN)
+        self._write({'t': self._elapsed(), 'k': 'api', 'p': path, 'r': response, 'ms': round(elapsed * 1000, 1)})
+
+    def connect(self, channel):
+        self._write({'t': self._elapsed(), 'k': 'connect', 'c': channel})
+
+    def inbound(self, channel, event, data):
+        self._write({'t': self._elapsed(), 'k': 'in', 'c': channel, 'e': event, 'd': data})
+
+    def outbound(self, channel, event):
+        self._write({'t': self._elapsed(), 'k': 'out', 'c': channel, 'e': event})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """The process-wide Recorder when LOKBOT_RECORD is set, else None"""
+    global _recorder
+    target = os.getenv('LOKBOT_RECORD')
+    if not target:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            path = pathlib.Path(target)
+            if not path.name.endswith(('.jsonl', '.jsonl.gz')):
+                path.mkdir(parents=True, exist_ok=True)
+                name = os.getenv('LOKBOT_INSTANCE_ID') or f'pid{os.getpid()}'
+                path = path.joinpath(f'{name}-{time.strftime("%Y%m%d-%H%M%S")}.jsonl.gz')
+            _recorder = Recorder(path)
+        return _recorder
+
+
+_recording_client = None
+
+
+def _recording_client_class():
+    global _recording_client
+    if _recording_client is None:
+        import socketio
+
+        class RecordingClient(socketio.Client):
+            def __init__(self, channel, recorder, **kwargs):
+                super().__init__(**kwargs)
+                self.channel = channel
+                self.recorder = recorder
+
+            def connect(self, *args, **kwargs):
+                self.recorder.connect(self.channel)
+                return super().connect(*args, **kwargs)
+
+            def emit(self, event, *args, **kwargs):
+                self.recorder.outbound(self.channel, event)
+                return super().emit(event, *args, **kwargs)
+
+            def _trigger_event(self, event, namespace, *args):
+                if event not in ('connect', 'disconnect', 'connect_error'):
+                    self.recorder.inbound(self.channel, event, args[0] if args else None)
+                return super()._trigger_event(event, namespace, *args)
+
+        _recording_client = RecordingClient
+    return _recording_client
+
+# endregion
+
+
+# region replay
+
+class ReplayTransport(httpx.BaseTransport):
+    """httpx transport answering every request with the next recorded response of its endpoint"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def handle_request(self, request):
+        path = str(request.url).split('/api/').pop()
+        response, elapsed = self.replay.next_response(path)
+        if elapsed and self.replay.speed:
+            time.sleep(elapsed / 1000 / self.replay.speed)
+        return httpx.Response(200, json=response)
+
+
+class ReplayClient:
+    """Stands in for socketio.Client: each connect plays back the next recorded connection of its channel"""
+
+    def __init__(self, channel, replay):
+        self.channel = channel
+        self.replay = replay
+        self.handlers = {}
+        self.connected = False
+        self._done = threading.Event()
+
+    def on(self, event, handler=None):
+        def register(func):
+            self.handlers[event] = func
+            return func
+        return register(handler) if handler else register
+
+    def connect(self, *args, **kwargs):
+        segment = self.replay.next_segment(self.channel)
+        if segment is None:
+            # Session over for this channel, park the thread like an idle connection
+            threading.Event().wait()
+        self.connected = True
+        threading.Thread(target=self._play, args=(segment,), daemon=True,
+                         name=f'replay-{self.channel}').start()
+
+    def _play(self, segment):
+        start_time, events = segment
+        started = time.monotonic()
+        for offset, event, data in events:
+            if not self.connected:
+                break
+            if self.replay.speed:
+                delay = (offset - start_time) / self.replay.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            handler = self.handlers.get(event)
+            if handler is None:
+                continue
+            handler_started = time.perf_counter()
+            try:
+                handler(data)
+            except Exception as e:
+                logger.error(f'Replay handler for {event} failed: {e}')
+            self.replay.record_handler(event, time.perf_counter() - handler_started)
+        self.connected = False
+        self.replay.segment_done(self.channel)
+        self._done.set()
+
+    def emit(self, event, data=None, *args, **kwargs):
+        self.replay.emitted[event] += 1
+
+    def wait(self):
+        self._done.wait()
+
+    def disconnect(self):
+        self.connected = False
+
+
+class Replay:
+    def __init__(self, path, speed=1.0):
+        self.path = str(path)
+        self.speed = speed  # 0 replays as fast as the bot takes it
+        self.responses = collections.defaultdict(collections.deque)
+        self.last_response = {}
+        self.segments = collections.defaultdict(collections.deque)
+        self.emitted = collections.Counter()
+        self.handler_times = collections.defaultdict(list)
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+        self._playing = collections.Counter()
+        self._started = time.monotonic()
+
+        for record in read_capture(path):
+            kind = record.get('k')
+            if kind == 'api':
+                self.responses[record['p']].append((record['r'], record.get('ms')))
+            elif kind == 'connect':
+                self.segments[record['c']].append((record['t'], []))
+            elif kind == 'in' and self.segments[record['c']]:
+                self.segments[record['c']][-1][1].append((record['t'], record['e'], record.get('d')))
+        logger.info(f'Replaying {self.path}: {sum(map(len, self.responses.values()))} responses, '
+                    f'{sum(map(len, self.segments.values()))} connections')
+
+    def next_response(self, path):
+        """Recorded responses in order; the last one repeats once they run out, unknown endpoints succeed"""
+        with self._lock:
+            queue = self.responses.get(path)
+            if queue:
+                self.last_response[path] = queue.popleft()
+            return self.last_response.get(path, ({'result': True}, None))
+
+    def next_segment(self, channel):
+        with self._lock:
+            queue = self.segments.get(channel)
+            if not queue:
+                return None
+            self._playing[channel] += 1
+            return queue.popleft()
+
+    def segment_done(self, channel):
+        with self._lock:
+            self._playing[channel] -= 1
+            if not any(self.segments.values()) and not any(self._playing.values()):
+                self.finished.set()
+
+    def record_handler(self, event, seconds):
+        with self._lock:
+            self.handler_times[event].append(seconds)
+
+    def report(self):
+        with self._lock:
+            handlers = {
+                event: {
+                    'events': len(times),
+                    'total_ms': round(sum(times) * 1000, 3),
+                    'mean_ms': round(sum(times) / len(times) * 1000, 3),
+                    'p95_ms': round(_percentile(times, 95) * 1000, 3),
+                }
+                for event, times in sorted(self.handler_times.items())
+            }
+        return {
+            'capture': self.path,
+            'speed': self.speed or 'max',
+            'wall_seconds': round(time.monotonic() - self._started, 3),
+            'handlers': handlers,
+            'emitted': dict(self.emitted),
+        }
+
+
+_replay = None
+_replay_lock = threading.Lock()
+
+
+def parse_speed(value):
+    return 0.0 if str(value).lower() == 'max' else float(value)
+
+
+def get_replay():
+    """The process-wide Replay when LOKBOT_REPLAY is set, else None"""
+    global _replay
+    path = os.getenv('LOKBOT_REPLAY')
+    if not path:
+        return None
+    with _replay_lock:
+        if _replay is None:
+            _replay = Replay(path, parse_speed(os.getenv('LOKBOT_REPLAY_SPEED', '1')))
+        return _replay
+
+# endregion
+
+
+def api_transport():
+    """httpx transport for LokBotApi, None for the default network one"""
+    replay = get_replay()
+    return ReplayTransport(replay) if replay else None
+
+
+def socket_client(channel):
+    """socketio.Client for a kingdoms/fields/chats connection, recording or replaying when enabled"""
+    replay = get_replay()
+    if replay:
+        return ReplayClient(channel, replay)
+    recorder = get_recorder()
+    if recorder:
+        return _recording_client_class()(channel, recorder, reconnection=False, logger=False,
+                                         engineio_logger=False)
+    import socketio
+    return socketio.Client(reconnection=False, logger=False, engineio_logger=False)
+
+
+# region command line
+
+def summarize(path):
+    records = read_capture(path)
+    api = collections.Counter(record['p'] for record in records if record.get('k') == 'api')
+    events = collections.Counter((record['c'], record['e']) for record in records if record.get('k') == 'in')
+    duration = max((record.get('t', 0) for record in records), default=0)
+    print(f'{path}: {len(records)} records over {duration:.0f}s')
+    for endpoint, count in api.most_common():
+        print(f'  api  {endpoint:<40} {count:>7}')
+    for (channel, event), count in events.most_common():
+        print(f'  {channel:<8} {event:<36} {count:>7}')
+
+
+def compare(report, baseline):
+    print(f'{"handler":<28} {"events":>8} {"mean ms":>10} {"baseline":>10} {"change":>9}')
+    for event, stats in report['handlers'].items():
+        previous = baseline.get('handlers', {}).get(event)
+        change = ''
+        if previous and previous['mean_ms']:
+            change = f'{(stats["mean_ms"] - previous["mean_ms"]) / previous["mean_ms"] * 100:+.1f}%'
+        print(f'{event:<28} {stats["events"]:>8} {stats["mean_ms"]:>10.3f} '
+              f'{previous["mean_ms"] if previous else "-":>10} {change:>9}')
+
+
+def replay_main(path, speed, config_file=None, output=None, baseline=None, timeout=None):
+    os.environ['LOKBOT_REPLAY'] = str(path)
+    os.environ['LOKBOT_REPLAY_SPEED'] = str(speed)
+    os.environ.pop('LOKBOT_RECORD', None)
+    replay = get_replay()
+
+    def finish():
+        replay.finished.wait(timeout)
+        report = replay.report()
+        print(json.dumps(report, indent=2))
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+        if baseline:
+            with open(baseline) as f:
+                compare(report, json.load(f))
+        # The bot's threads never return on their own
+        os._exit(0 if replay.finished.is_set() else 1)
+
+    threading.Thread(target=finish, daemon=True).start()
+
+    from lokbot.app import main
+    main(token=REPLAY_TOKEN, config_file=config_file)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m lokbot.recorder', description='Inspect or replay a session capture')
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help='count the records of a capture')
+    summary.add_argument('capture')
+    replay = commands.add_parser('replay', help='run the bot against a capture and time the socket handlers')
+    replay.add_argument('capture')
+    replay.add_argument('--speed', default='max', help='1 for real time, N for N times faster, max')
+    replay.add_argument('--config', help='bot config file')
+    replay.add_argument('--output', help='write the handler timings to this JSON file')
+    replay.add_argument('--compare', help='handler timings of an earlier replay to compare with')
+    replay.add_argument('--timeout', type=float, help='give up after this many seconds')
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        summarize(args.capture)
+    else:
+        replay_main(args.capture, args.speed, args.config, args.output, args.compare, args.timeout)
+
+# endregion
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Exact speedup item selection
+
+A bounded knapsack over the item durations: every item code is split into
+binary pieces (1, 2, 4, ... of its amount) and the sums reachable with the
+pieces are kept as bits of one integer, in units of the durations' greatest
+common divisor, so even weeks of seconds take one shift-or per piece.
+"""
+import functools
+import math
+
+
+def _pieces(stock):
+    """(code, count, units) pieces, longest items first so backtracking keeps to few, large items"""
+    unit = functools.reduce(math.gcd, (seconds for seconds, amount in stock.values() if amount > 0), 0)
+    pieces = []
+    for code, (seconds, amount) in sorted(stock.items(), key=lambda entry: entry[1][0], reverse=True):
+        count = 1
+        while amount > 0:
+            take = min(count, amount)
+            pieces.append((code, take, take * seconds // unit))
+            amount -= take
+            count *= 2
+    return unit, pieces
+
+
+def plan_speedups(need_seconds, stock, overshoot=False):
+    """
+    Item counts for need_seconds, or None if nothing fits
+
+    stock maps item code -> (seconds per item, amount owned).  Without
+    overshoot the plan is the largest total not above need_seconds; with it,
+    the smallest total covering need_seconds, or everything when the stock
+    can't cover it.  Among plans with the same total the one found keeps to
+    the longest items, which means few items and few speedup calls.
+    """
+    stock = {code: entry for code, entry in stock.items() if entry[0] > 0 and entry[1] > 0}
+    if not stock or need_seconds <= 0:
+        return None
+    unit, pieces = _pieces(stock)
+    available = sum(units for _, _, units in pieces)
+    target = math.ceil(need_seconds / unit) if overshoot else need_seconds // unit
+    if target > available:
+        target = available
+    # Sums above target + the longest piece are never the best plan, keep the bitsets short
+    limit = (1 << (target + max(units for _, _, units in pieces) + 1)) - 1
+
+    reachable = [1]  # reachable[i]: sums reachable with the first i pieces
+    for _, _, units in pieces:
+        reachable.append((reachable[-1] | (reachable[-1] << units)) & limit)
+    sums = reachable[-1]
+
+    if overshoot:
+        candidates = sums >> target
+        if not candidates:
+            return None
+        best = target + ((candidates & -candidates).bit_length() - 1)
+    else:
+        below = sums & ((1 << (target + 1)) - 1)
+        best = below.bit_length() - 1
+    if best <= 0:
+        return None
+
+    counts = {}
+    remaining = best
+    for index in range(len(pieces), 0, -1):
+        if remaining == 0:
+            break
+        # Skip the piece whenever the earlier pieces reach the sum without it
+        if reachable[index - 1] >> remaining & 1:
+            continue
+        code, count, units = pieces[index - 1]
+        counts[code] = counts.get(code, 0) + count
+        remaining -= units
+
+    return {'counts': counts, 'used_seconds': best * unit}
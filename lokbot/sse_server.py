@@ -0,0 +1,137 @@
+"""
+Evented server for notification streams
+
+Serves server-sent events from a single asyncio loop running in a background
+thread of the web app, so open dashboards don't each hold a WSGI thread.  The
+Flask app authenticates the user and hands out a short-lived signed token that
+this server accepts in place of the session cookie.
+
+It needs a port of its own, so it only runs when LOKBOT_SSE_PORT is set;
+hosts that expose a single port keep the threaded Flask stream.
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+import logging
+
+from lokbot.notification_broker import format_sse, parse_event_id
+
+logger = logging.getLogger(__name__)
+
+SSE_PORT_ENV = 'LOKBOT_SSE_PORT'
+SSE_PUBLIC_URL_ENV = 'LOKBOT_SSE_PUBLIC_URL'
+HEARTBEAT_INTERVAL = 30
+
+
+class NotificationStreamServer:
+    """aiohttp SSE endpoint reading from a NotificationBroker"""
+
+    def __init__(self, broker, verify_token, port, host='0.0.0.0'):
+        self.broker = broker
+        self.verify_token = verify_token  # token -> user_id or None
+        self.host = host
+        self.port = port
+        self.running = False
+        self._started = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, broker, verify_token):
+        """Server configured from LOKBOT_SSE_PORT, None when it isn't set or aiohttp is missing"""
+        port = int(os.environ.get(SSE_PORT_ENV) or 0)
+        if port <= 0:
+            return None
+        if importlib.util.find_spec('aiohttp') is None:
+            logger.warning("aiohttp not installed, notification streams use the threaded fallback")
+            return None
+        return cls(broker, verify_token, port)
+
+    def public_url(self, host):
+        """Stream URL for a browser that reached the web app at host"""
+        public_url = os.environ.get(SSE_PUBLIC_URL_ENV)
+        if public_url:
+            return public_url.rstrip('/') + '/stream'
+        hostname = host.rsplit(':', 1)[0] if not host.endswith(']') else host
+        return f'//{hostname}:{self.port}/stream'
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            threading.Thread(target=self._run, name='notification_stream_server', daemon=True).start()
+
+    def _run(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/stream', self._handle_stream)
+        app.router.add_get('/health', self._handle_health)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(app, access_log=None)
+        try:
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, self.host, self.port).start())
+        except OSError as e:
+            logger.error(f"Notification stream server could not listen on port {self.port}: {e}")
+            return
+
+        self.running = True
+        logger.info(f"Notification stream server listening on port {self.port}")
+        try:
+            loop.run_forever()
+        finally:
+            self.running = False
+            loop.run_until_complete(runner.cleanup())
+
+    async def _handle_health(self, request):
+        from aiohttp import web
+        return web.json_response({'status': 'healthy'})
+
+    async def _handle_stream(self, request):
+        from aiohttp import web
+
+        user_id = self.verify_token(request.query.get('token', ''))
+        if user_id is None:
+            return web.json_response({'error': 'Invalid or expired stream token'}, status=401)
+
+        last_event_id = parse_event_id(
+            request.headers.get('Last-Event-ID', request.query.get('last_event_id'))
+        )
+        cursor = self.broker.start_cursor(user_id, last_event_id)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Access-Control-Allow-Origin': request.headers.get('Origin', '*'),
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(request)
+
+        self.broker.subscribe(user_id)
+        try:
+            await response.write(b'retry: 10000\n')
+            await response.write(format_sse({
+                'type': 'connected',
+                'message': 'Connected to notification stream',
+                'connection_id': f'{user_id}_{cursor}',
+            }).encode())
+
+            while True:
+                events = await self.broker.wait_async(user_id, cursor, HEARTBEAT_INTERVAL)
+                if not events:
+                    await response.write(format_sse({'type': 'heartbeat'}).encode())
+                    continue
+                for event_id, data in events:
+                    await response.write(format_sse(data, event_id).encode())
+                    cursor = event_id
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Error in notification stream for user {user_id}: {e}")
+        finally:
+            self.broker.unsubscribe(user_id)
+        return response
@@ -0,0 +1,92 @@
+"""
+Versioned status snapshot for the web app dashboard
+
+A monitor thread reaps exited bot processes and rebuilds the status snapshot
+when something changes.  Requests read the latest snapshot and its version,
+so serving /api/status costs the same no matter how many instances or open
+dashboards there are, and clients can revalidate with an ETag or long-poll
+for the next version.
+"""
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StatusMonitor:
+    """Keeps a snapshot built by build() up to date, bumping its version on every change"""
+
+    def __init__(self, reap, build, interval=5):
+        self.reap = reap  # reap() -> None, drops exited processes
+        self.build = build  # build() -> JSON-serialisable snapshot
+        self.interval = interval
+
+        self.version = 0
+        self._snapshot = None
+        self._fingerprint = None
+        self._dirty = True
+        self._started = False
+        self._wakeup = threading.Event()
+        self._build_lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def start(self):
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._monitor_loop, name='status_monitor', daemon=True).start()
+
+    def invalidate(self):
+        """Mark the snapshot stale after a bot was started, stopped or reported an update"""
+        self._dirty = True
+        self._wakeup.set()
+
+    def refresh(self):
+        """Reap, rebuild and bump the version if the snapshot changed"""
+        with self._build_lock:
+            self._dirty = False
+            try:
+                self.reap()
+                snapshot = self.build()
+            except Exception as e:
+                logger.error(f"Error building status snapshot: {e}")
+                return
+
+            fingerprint = json.dumps(snapshot, sort_keys=True, default=str)
+            if fingerprint == self._fingerprint:
+                return
+
+            with self._condition:
+                self._snapshot = snapshot
+                self._fingerprint = fingerprint
+                self.version += 1
+                self._condition.notify_all()
+
+    def snapshot(self):
+        """(version, snapshot), rebuilt first only if it was invalidated"""
+        self.start()
+        if self._dirty or self._snapshot is None:
+            self.refresh()
+        with self._condition:
+            return self.version, self._snapshot
+
+    def wait_for_change(self, since, timeout):
+        """Long-poll: block until the version is newer than since or timeout"""
+        self.snapshot()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.version <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self.version, self._snapshot
+
+    def _monitor_loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.refresh()
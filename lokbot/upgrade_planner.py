@@ -0,0 +1,158 @@
+"""
+Building and research eligibility from a precomputed requirement graph
+
+The asset tables are parsed once into per-level nodes: the requirements as
+(kind, code, level) edges and the resource cost as an index-aligned tuple.
+UpgradePlanner reads building levels from the kingdom state's index and
+keeps the research levels in a dict keyed by code, updated from task events,
+so an eligibility check is a handful of dict lookups instead of list scans.
+"""
+import functools
+import threading
+
+from lokbot.enum import (
+    BUILDING_CODE_MAP, RESEARCH_CODE_MAP, RESEARCH_MINIMUM_LEVEL_MAP, RESOURCE_IDX_MAP, building_json, research_json,
+)
+
+BUILDING = 'building'
+RESEARCH = 'research'
+
+
+def _cost(resources):
+    """Cost as a tuple in resource index order, None when it includes items other than the four resources"""
+    cost = [0] * len(RESOURCE_IDX_MAP)
+    for each in resources or []:
+        if each.get('type') not in RESOURCE_IDX_MAP:
+            return None
+        cost[RESOURCE_IDX_MAP[each.get('type')]] = int(each.get('value'))
+    return tuple(cost)
+
+
+@functools.lru_cache(maxsize=None)
+def requirement_graph():
+    """
+    (buildings, researches, research_order)
+
+    buildings[code][level] and researches[code][level] are (requirements, cost)
+    for reaching that level; research_order lists (category, name, code, max
+    level, minimum level) in RESEARCH_CODE_MAP order, the order the academy
+    farmer has always tried them in.
+    """
+    buildings = {}
+    for code, levels in building_json.items():
+        buildings[code] = {
+            int(level): (
+                tuple((BUILDING, BUILDING_CODE_MAP.get(each.get('type')), int(each.get('level')))
+                      for each in node.get('requirements') or []),
+                _cost(node.get('resources')),
+            )
+            for level, node in levels.items()
+        }
+
+    researches = {}
+    research_order = []
+    for category_name, category in RESEARCH_CODE_MAP.items():
+        for research_name, code in category.items():
+            levels = {}
+            for node in research_json.get(code) or []:
+                requirements = []
+                for each in node.get('requirements') or []:
+                    if each.get('type') == 'academy':
+                        requirements.append((BUILDING, BUILDING_CODE_MAP['academy'], int(each.get('level'))))
+                    else:
+                        requirements.append((RESEARCH, category.get(each.get('type')), int(each.get('level'))))
+                levels[int(node.get('level'))] = (tuple(requirements), _cost(node.get('resources')))
+            researches[code] = levels
+            research_order.append((
+                category_name, research_name, code, max(levels, default=0),
+                RESEARCH_MINIMUM_LEVEL_MAP.get(category_name, {}).get(research_name, 0),
+            ))
+    return buildings, researches, research_order
+
+
+class UpgradePlanner:
+    def __init__(self, state):
+        self.buildings, self.researches, self.research_order = requirement_graph()
+        self.state = state  # KingdomState, its building_levels index is kept current by the farmer
+        self.research_levels = {}  # research code -> level
+        self.researches_loaded = False
+        self.pending_research = None  # research code the academy is working on
+        self.finished_task = None  # id of the last academy task counted as claimed
+        self._lock = threading.Lock()
+
+    # region index updates
+
+    def load_researches(self, researches):
+        with self._lock:
+            self.research_levels = {each.get('code'): each.get('level') or 0 for each in researches}
+            self.researches_loaded = True
+            self.pending_research = None
+
+    def start_research(self, code):
+        self.pending_research = code
+
+    def finish_research(self, task_id):
+        """
+        The academy task was claimed, the research it worked on is one level up
+
+        Both the claim response and the /task/update event report a claim, the
+        second report of a task id is ignored.
+        """
+        with self._lock:
+            if task_id is not None and task_id == self.finished_task:
+                return
+            self.finished_task = task_id
+            if self.pending_research is None:
+                # Started before the index knew about it
+                self.researches_loaded = False
+                return
+            self.research_levels[self.pending_research] = self.research_levels.get(self.pending_research, 0) + 1
+            self.pending_research = None
+
+    def invalidate_researches(self):
+        """The server disagreed with the index, load the research list again before the next plan"""
+        self.researches_loaded = False
+
+    # endregion
+
+    # region checks
+
+    def _met(self, requirements):
+        building_levels = self.state.building_levels
+        for kind, code, level in requirements:
+            levels = building_levels if kind == BUILDING else self.research_levels
+            if levels.get(code, 0) < level:
+                return False
+        return True
+
+    @staticmethod
+    def affordable(cost, resources):
+        return cost is not None and all(have >= need for have, need in zip(resources, cost))
+
+    def building_eligible(self, code, level, resources):
+        """Whether the building at `level` can go to the next one with these resources"""
+        node = self.buildings.get(code, {}).get(level + 1)
+        return node is not None and self._met(node[0]) and self.affordable(node[1], resources)
+
+    def research_eligible(self, code, resources, to_max_level=False, minimum_level=0, max_level=None):
+        level = self.research_levels.get(code, 0)
+        levels = self.researches.get(code, {})
+        if max_level is None:
+            max_level = max(levels, default=0)
+        # Started researches stop at their minimum level unless to_max_level
+        if level >= max_level or (not to_max_level and level and level >= minimum_level):
+            return False
+        node = levels.get(level + 1)
+        return node is not None and self._met(node[0]) and self.affordable(node[1], resources)
+
+    def eligible_researches(self, resources, to_max_level=False):
+        """(category, name, code) of every research that can start now, in the academy farmer's order"""
+        if self.pending_research is not None:
+            return []
+        return [
+            (category_name, research_name, code)
+            for category_name, research_name, code, max_level, minimum_level in self.research_order
+            if self.research_eligible(code, resources, to_max_level, minimum_level, max_level)
+        ]
+
+    # endregion
@@ -0,0 +1,445 @@
+"""
+In-memory user and entitlement directory for the web app
+
+users.txt, user_instances.txt and user_config_assignments.txt are parsed once
+and re-parsed only when their mtime or size changes, so role checks, logins
+and config access checks are dictionary lookups.  Writes find their records
+in the file as it is under the lock, touch only the affected lines and
+replace the file atomically (temp file + rename), new records are appended.
+"""
+import os
+import tempfile
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+USERS_HEADER = (
+    "# User Management File\n"
+    "# Format: username:password:max_instances:role:start_date:end_date:created_date\n"
+)
+INSTANCES_HEADER = (
+    "# User Instance Management File\n"
+    "# Format: username:instance_name:start_date:end_date:created_date:status\n"
+)
+ADMIN_ROLES = ('admin', 'super_admin')
+
+
+def parse_date(value):
+    """ISO date/datetime string to a date, None if empty or invalid"""
+    if not value or value == 'None':
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        return None
+
+
+class RecordFile:
+    """
+    A colon-separated text file cached in memory
+
+    parse_line(parts, line_no) returns a record (or None to skip the line),
+    index(records) builds whatever lookup structure callers need.
+    """
+
+    def __init__(self, path, header=''):
+        self.path = path
+        self.header = header
+        self._signature = None
+        self._index = None
+        self._lock = threading.RLock()
+
+    def parse_line(self, parts, line_no):
+        raise NotImplementedError
+
+    def index(self, records):
+        raise NotImplementedError
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Current index, reloaded only if the file changed on disk"""
+        signature = self._stat_signature()
+        if signature == self._signature and self._index is not None:
+            return self._index
+
+        with self._lock:
+            signature = self._stat_signature()
+            if signature != self._signature or self._index is None:
+                self._index = self.index(self._load())
+                self._signature = signature
+            return self._index
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return self._parse(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading {self.path}: {e}")
+        return []
+
+    def _parse(self, lines):
+        """(key, line_no, record) of every record line"""
+        records = []
+        for line_no, line in enumerate(lines):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            record = self.parse_line(line.split(':'), line_no)
+            if record is not None:
+                records.append(record)
+        return records
+
+    # region writes
+
+    def _read_lines(self):
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return self.header.splitlines()
+
+    def _replace(self, lines):
+        """Atomically replace the file with lines"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path), dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file 0600, keep the mode of the file we replace
+            try:
+                os.chmod(temp_path, os.stat(self.path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+            self._signature = None
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def append(self, line):
+        """Add a record line at the end of the file"""
+        with self._lock:
+            if not os.path.exists(self.path) and self.header:
+                self._replace([*self.header.splitlines(), line])
+                return
+
+            with open(self.path, 'a+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1)
+                    needs_newline = f.read(1) != '\n'
+                else:
+                    needs_newline = False
+                f.write(('\n' if needs_newline else '') + line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._signature = None
+
+    def edit(self, change):
+        """
+        Replace or delete single lines and write the file atomically
+
+        change(records) gets the (key, line_no, record) tuples of the file as
+        it is under the lock and returns {line_no: new text, or None to drop
+        the line}.  Every other line, including comments, is kept as is.
+        Returns whether anything was edited.
+        """
+        with self._lock:
+            lines = self._read_lines()
+            edits = change(self._parse(lines))
+            if not edits:
+                return False
+            result = []
+            for line_no, line in enumerate(lines):
+                if line_no not in edits:
+                    result.append(line)
+                elif edits[line_no] is not None:
+                    result.append(edits[line_no])
+            self._replace(result)
+            return True
+
+    def rewrite(self, lines):
+        """Replace all records, keeping the header"""
+        with self._lock:
+            self._replace([*self.header.splitlines(), *lines])
+
+    # endregion
+
+
+class UsersFile(RecordFile):
+    """users.txt indexed by username"""
+
+    def parse_line(self, parts, line_no):
+        if len(parts) < 3:
+            return None
+        try:
+            max_instances = int(parts[2])
+        except ValueError:
+            logger.warning(f"Invalid max_instances in {self.path} at line {line_no + 1}")
+            return None
+
+        username = parts[0]
+        if len(parts) >= 4:
+            role = parts[3]
+        elif username == 'admin':
+            role = 'super_admin'  # Legacy admin becomes super_admin
+        else:
+            role = 'user'
+
+        # Optional dates (format: username:password:max_instances:role:start_date:end_date:created_date)
+        start_date = parts[4] if len(parts) >= 5 and parts[4] else None
+        end_date = parts[5] if len(parts) >= 6 and parts[5] else None
+        created_date = parts[6] if len(parts) >= 7 and parts[6] else datetime.now().isoformat()
+
+        return username, line_no, {
+            'password': parts[1],
+            'max_instances': max_instances,
+            'role': role,
+            'start_date': start_date,
+            'end_date': end_date,
+            'created_date': created_date,
+            # Precomputed for the per-request checks
+            'is_admin': role in ADMIN_ROLES,
+            'start': parse_date(start_date),
+            'end': parse_date(end_date),
+        }
+
+    def index(self, records):
+        return {username: user for username, line_no, user in records}
+
+    @staticmethod
+    def format_line(username, user):
+        return (
+            f"{username}:{user['password']}:{user['max_instances']}:{user.get('role', 'user')}:"
+            f"{user.get('start_date') or ''}:{user.get('end_date') or ''}:{user.get('created_date') or ''}"
+        )
+
+
+class InstancesFile(RecordFile):
+    """user_instances.txt indexed by username, in file order"""
+
+    def parse_line(self, parts, line_no):
+        if len(parts) < 6:
+            logger.warning(f"Invalid line format in {self.path} at line {line_no + 1}: {':'.join(parts)}")
+            return None
+        return parts[0], line_no, {
+            'instance_name': parts[1],
+            'start_date': parts[2],
+            'end_date': parts[3],
+            'created_date': parts[4],
+            'status': parts[5],
+        }
+
+    def index(self, records):
+        instances = {}
+        for username, line_no, instance in records:
+            instances.setdefault(username, []).append(instance)
+        return instances
+
+    @staticmethod
+    def format_line(username, instance):
+        return (
+            f"{username}:{instance['instance_name']}:{instance['start_date']}:{instance['end_date']}:"
+            f"{instance['created_date']}:{instance['status']}"
+        )
+
+
+class AssignmentsFile(RecordFile):
+    """user_config_assignments.txt indexed by username with the allowed config sets"""
+
+    def parse_line(self, parts, line_no):
+        if len(parts) != 2:
+            return None
+        return parts[0].strip(), line_no, parts[1].strip()
+
+    def index(self, records):
+        assignments = {}
+        allowed = {}
+        for username, line_no, config_files in records:
+            assignments[username] = config_files
+            allowed[username] = frozenset(c.strip() for c in config_files.split(','))
+        return assignments, allowed
+
+
+def record_lines(records, key):
+    """(line_no, record) of the records with key, in file order"""
+    return [(line_no, record) for record_key, line_no, record in records if record_key == key]
+
+
+class UserDirectory:
+    """Users, purchased instances and config assignments with cached lookups"""
+
+    def __init__(self, users_path='users.txt', instances_path='user_instances.txt',
+                 assignments_path='user_config_assignments.txt'):
+        self.users_file = UsersFile(users_path, USERS_HEADER)
+        self.instances_file = InstancesFile(instances_path, INSTANCES_HEADER)
+        self.assignments_file = AssignmentsFile(assignments_path)
+
+    # region users
+
+    def get_user(self, username):
+        """Cached user record or None, treat it as read-only"""
+        return self.users_file.get().get(username)
+
+    def users(self):
+        """Copy of {username: record}"""
+        return {username: dict(user) for username, user in self.users_file.get().items()}
+
+    def role(self, username):
+        user = self.get_user(username)
+        return user['role'] if user else None
+
+    def is_active(self, username, today=None):
+        """Whether the account is inside its start/end date window"""
+        user = self.get_user(username)
+        if not user:
+            return False
+        today = today or datetime.now().date()
+        if user['start'] and today < user['start']:
+            return False
+        if user['end'] and today > user['end']:
+            return False
+        return True
+
+    def add_user(self, username, password, max_instances, role='user', start_date='', end_date='', created_date=None):
+        user = {
+            'password': password,
+            'max_instances': max_instances,
+            'role': role,
+            'start_date': start_date,
+            'end_date': end_date,
+            'created_date': created_date or datetime.now().isoformat(),
+        }
+        self.users_file.append(UsersFile.format_line(username, user))
+
+    def update_user(self, username, **fields):
+        """Update fields of one user, returns False if the user doesn't exist"""
+        def change(records):
+            # The index keeps the last line of a username, so does the edit
+            lines = record_lines(records, username)
+            if not lines:
+                return {}
+            line_no, user = lines[-1]
+            return {line_no: UsersFile.format_line(username, {**user, **fields})}
+
+        return self.users_file.edit(change)
+
+    def delete_user(self, username):
+        def change(records):
+            lines = record_lines(records, username)
+            return {lines[-1][0]: None} if lines else {}
+
+        return self.users_file.edit(change)
+
+    # endregion
+
+    # region instances
+
+    def all_instances(self):
+        """Copy of {username: [instance, ...]}"""
+        return {username: [dict(i) for i in instances] for username, instances in self.instances_file.get().items()}
+
+    def user_instances(self, username):
+        return [dict(i) for i in self.instances_file.get().get(username, ())]
+
+    def active_instances(self, username, today=None):
+        """Active instance purchases whose date window includes today"""
+        today = today or datetime.now().date()
+        active = []
+        for instance in self.instances_file.get().get(username, ()):
+            if instance['status'] != 'active':
+                continue
+            start_date = parse_date(instance['start_date'])
+            end_date = parse_date(instance['end_date'])
+            if start_date and end_date and start_date <= today <= end_date:
+                active.append(dict(instance))
+        return active
+
+    def add_instance(self, username, instance):
+        if not os.path.exists(self.instances_file.path):
+            self.instances_file.rewrite([])
+        self.instances_file.append(InstancesFile.format_line(username, instance))
+
+    def update_instance(self, username, index, **fields):
+        """Update the index-th instance of a user, returns False if it doesn't exist"""
+        def change(records):
+            lines = record_lines(records, username)
+            if not 0 <= index < len(lines):
+                return {}
+            line_no, instance = lines[index]
+            return {line_no: InstancesFile.format_line(username, {**instance, **fields})}
+
+        return self.instances_file.edit(change)
+
+    def delete_instance(self, username, index):
+        def change(records):
+            lines = record_lines(records, username)
+            return {lines[index][0]: None} if 0 <= index < len(lines) else {}
+
+        return self.instances_file.edit(change)
+
+    def ensure_instances_file(self):
+        if not os.path.exists(self.instances_file.path):
+            logger.info(f"Creating new user instances file: {self.instances_file.path}")
+            self.instances_file.rewrite([])
+
+    # endregion
+
+    # region config assignments
+
+    def assignments(self):
+        """Copy of {username: 'a.json,b.json'}"""
+        return dict(self.assignments_file.get()[0])
+
+    def allowed_configs(self, username):
+        """Set of config files assigned to a user"""
+        return self.assignments_file.get()[1].get(username, frozenset())
+
+    def has_assignment(self, username):
+        return username in self.assignments_file.get()[0]
+
+    def set_assignment(self, username, config_files):
+        """Assign a comma-separated string or list of config files to a user"""
+        if not isinstance(config_files, str):
+            config_files = ','.join(config_files)
+        line = f"{username}:{config_files}"
+
+        def change(records):
+            lines = record_lines(records, username)
+            return {lines[-1][0]: line} if lines else {}
+
+        # Under the file lock, so two first assignments don't both append
+        with self.assignments_file._lock:
+            if not self.assignments_file.edit(change):
+                self.assignments_file.append(line)
+
+    def add_assignment(self, username, config_file):
+        """Append a config file to a user's assignments if it isn't there yet"""
+        if config_file in self.allowed_configs(username):
+            return
+        current = self.assignments_file.get()[0].get(username)
+        self.set_assignment(username, f"{current},{config_file}" if current else config_file)
+
+    def remove_assignment(self, username):
+        def change(records):
+            lines = record_lines(records, username)
+            return {lines[-1][0]: None} if lines else {}
+
+        return self.assignments_file.edit(change)
+
+    # endregion
@@ -0,0 +1,54 @@
+// Notification stream helper shared by the dashboard and notifications pages.
+// Asks the web app where to connect (the evented stream server when it runs,
+// the threaded Flask route otherwise) and resumes from the last event seen, so
+// reconnecting never loses or repeats notifications.
+var NOTIFICATION_STREAM_FALLBACK_URL = '/api/notifications/stream';
+var notificationStreamLastEventId = null;
+// Set when the evented server couldn't be reached, later streams use the Flask route
+var notificationStreamEventedUnreachable = false;
+
+function notificationStreamInfo() {
+    if (notificationStreamEventedUnreachable) {
+        return Promise.resolve({ url: NOTIFICATION_STREAM_FALLBACK_URL, evented: false });
+    }
+    return fetch('/api/notifications/stream_url', { credentials: 'same-origin' })
+        .then(function(response) {
+            return response.ok ? response.json() : { url: NOTIFICATION_STREAM_FALLBACK_URL, evented: false };
+        })
+        .catch(function() {
+            return { url: NOTIFICATION_STREAM_FALLBACK_URL, evented: false };
+        });
+}
+
+function openNotificationStream() {
+    return notificationStreamInfo().then(function(info) {
+        var url = info.url;
+        if (notificationStreamLastEventId) {
+            url += (url.indexOf('?') === -1 ? '?' : '&') + 'last_event_id=' + encodeURIComponent(notificationStreamLastEventId);
+        }
+
+        var source = new EventSource(url);
+        source.addEventListener('message', function(event) {
+            if (event.lastEventId) {
+                notificationStreamLastEventId = event.lastEventId;
+            }
+        });
+
+        if (info.evented) {
+            var opened = false;
+            source.addEventListener('open', function() {
+                opened = true;
+            });
+            // The token in the URL expires after a few minutes, so the browser's own
+            // reconnect would be turned away.  Close the stream instead and let the
+            // page reconnect through openNotificationStream, which fetches a new token.
+            source.addEventListener('error', function() {
+                if (!opened) {
+                    notificationStreamEventedUnreachable = true;
+                }
+                source.close();
+            });
+        }
+        return source;
+    });
+}
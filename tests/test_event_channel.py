@@ -0,0 +1,64 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from lokbot.event_channel import EventChannelServer, EventEmitter
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+class EventEmitterReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.socket_path = os.path.join(tempfile.mkdtemp(), 'events.sock')
+        self.received = []
+        self.lock = threading.Lock()
+
+    def dispatch(self, hello, event_type, payload, timestamp):
+        with self.lock:
+            self.received.append((event_type, payload))
+
+    def events(self, event_type):
+        with self.lock:
+            return [payload for received_type, payload in self.received if received_type == event_type]
+
+    def test_reconnects_after_server_restart(self):
+        server = EventChannelServer(self.socket_path, self.dispatch)
+        server.start()
+        emitter = EventEmitter(self.socket_path, {'instance_id': 'bot'}, batch_window=0.01)
+        self.assertTrue(emitter.connected.wait(5))
+        self.assertTrue(emitter.emit('ping', {'n': 1}))
+        self.assertTrue(wait_until(lambda: self.events('ping') == [{'n': 1}]))
+
+        # The web app restarts: the socket and its connections go away, a new server binds again
+        os.unlink(self.socket_path)
+        for conn in list(server.connections.values()):
+            conn.close()
+        self.assertTrue(wait_until(lambda: not emitter.connected.is_set()))
+
+        # Queued while the reconnect is pending instead of refused
+        self.assertTrue(emitter.emit('ping', {'n': 2}))
+
+        restarted = EventChannelServer(self.socket_path, self.dispatch)
+        restarted.start()
+        self.assertTrue(wait_until(lambda: restarted.is_connected('bot')))
+        self.assertTrue(wait_until(lambda: {'n': 2} in self.events('ping')))
+
+        self.assertTrue(emitter.emit('ping', {'n': 3}))
+        self.assertTrue(wait_until(lambda: {'n': 3} in self.events('ping')))
+
+    def test_refuses_events_before_the_first_connection(self):
+        emitter = EventEmitter(self.socket_path, {'instance_id': 'bot'})
+        self.assertFalse(emitter.emit('ping', {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
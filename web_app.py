@@ -1,5 +1,6 @@
 import os
 import json
+import collections
 import subprocess
 import threading
 import asyncio
@@ -13,14 +14,30 @@ import os
 from urllib.parse import urlencode
 from lokbot.client import LokBotApi
 from lokbot.config_helper import ConfigHelper
+from lokbot.config_store import config_store, ConfigPatchError
+from lokbot.event_channel import EventChannelServer, EVENT_SOCKET_ENV, DEFAULT_EVENT_SOCKET
+from lokbot.forkserver import launch_bot
+from lokbot.i18n import TranslationCatalog
+from lokbot.log_store import LogStore, instance_directory
+from lokbot.notification_broker import NotificationBroker, format_sse, parse_event_id
+from lokbot.notification_db import NotificationDatabase
+from lokbot.notification_store import NotificationStore
+from lokbot.output_reactor import OutputReactor
+from lokbot.profiler import collapsed_text
+from lokbot.proc_telemetry import ProcessTelemetry, LIMIT_FIELDS
+from lokbot.sse_server import NotificationStreamServer
+from lokbot.status_monitor import StatusMonitor
+from lokbot.user_directory import UserDirectory
+import lokbot
 import lokbot.util
-import queue
 import time
 import schedule
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+import hashlib
 import uuid
 from functools import wraps
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 # Replit environment setup
 def setup_replit_environment():
@@ -48,9 +65,10 @@ def setup_replit_environment():
 # Initialize Replit environment
 setup_replit_environment()
 
-# Set up logging
+# Set up logging; the lokbot modules log through loguru into data/logs/web/
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+lokbot.setup_logging('web')
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
@@ -59,30 +77,12 @@ app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
 LANGUAGES = {'en': 'English', 'zh': '中文', 'vi': 'Tiếng Việt'}
 DEFAULT_LANGUAGE = 'en'
 
+# Flattened, fallback-resolved catalogs; language files are re-read only when they change
+translations = TranslationCatalog('languages', DEFAULT_LANGUAGE)
+
 def load_language(lang_code):
     """Load language file"""
-    try:
-        with open(f'languages/{lang_code}.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Fallback to English if language file not found
-        try:
-            with open(f'languages/{DEFAULT_LANGUAGE}.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading language file {DEFAULT_LANGUAGE}.json: {e}")
-            # Return minimal fallback dictionary
-            return {"login": {"title": "Login"}, "common": {"save": "Save", "cancel": "Cancel"}}
-    except Exception as e:
-        logger.error(f"Error loading language file {lang_code}.json: {e}")
-        # Try fallback to English
-        try:
-            with open(f'languages/{DEFAULT_LANGUAGE}.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as fallback_e:
-            logger.error(f"Error loading fallback language file: {fallback_e}")
-            # Return minimal fallback dictionary
-            return {"login": {"title": "Login"}, "common": {"save": "Save", "cancel": "Cancel"}}
+    return translations.load_language(lang_code)
 
 def get_current_language():
     """Get current language from session"""
@@ -90,26 +90,7 @@ def get_current_language():
 
 def t(key_path, **kwargs):
     """Translation function"""
-    lang_data = load_language(get_current_language())
-    
-    # Navigate through nested keys using dot notation
-    keys = key_path.split('.')
-    value = lang_data
-    for key in keys:
-        if isinstance(value, dict) and key in value:
-            value = value[key]
-        else:
-            # Return key if translation not found
-            return key_path
-    
-    # Format with kwargs if provided
-    if kwargs:
-        try:
-            return value.format(**kwargs)
-        except:
-            return value
-    
-    return value
+    return translations.translate(get_current_language(), key_path, **kwargs)
 
 # Make translation function available in templates
 app.jinja_env.globals['t'] = t
@@ -118,16 +99,15 @@ app.jinja_env.globals['LANGUAGES'] = LANGUAGES
 
 # Bot processes dictionary to track running instances
 bot_processes = {}
+# instance_id -> bot_processes entry of bots restart_bot_gracefully is stopping
+restarting_bots = {}
 
 # Notification system
-notification_queues = {}  # user_id -> queue
-notifications_history = {}  # user_id -> {account_name: list of notifications}
+notification_broker = NotificationBroker(log_size=200)  # user_id -> event log, one cursor per stream
+notification_store = NotificationStore(capacity=150, dedup_window=30, retention=7 * 24 * 3600)  # user_id -> {account_name: ring}
+notification_db = NotificationDatabase('data/notifications.db', retention=7 * 24 * 3600)  # persistent, paginated history
 account_notifications = {}  # user_id -> {account_name: notification_queue}
 
-# Status cache variables
-statusCache = None
-lastStatusUpdate = 0
-isRefreshing = False
 
 # Scheduling system
 scheduler = BackgroundScheduler()
@@ -140,19 +120,9 @@ temp_test_accounts = {}  # test_id -> {created_at, expires_at, active_sessions}
 def cleanup_old_notifications():
     """Clean up notifications older than 7 days to prevent memory bloat"""
     try:
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=7)
-        cutoff_timestamp = cutoff_date.isoformat()
-
-        cleaned_count = 0
-        for user_id, user_notifications in notifications_history.items():
-            for account_name, notifications in user_notifications.items():
-                original_count = len(notifications)
-                # Keep only notifications from the last 7 days
-                notifications_history[user_id][account_name] = [
-                    n for n in notifications
-                    if n.get('timestamp', '') > cutoff_timestamp
-                ]
-                cleaned_count += original_count - len(notifications_history[user_id][account_name])
+        # Rings are time ordered, so this only touches the expired entries
+        cleaned_count = notification_store.expire()
+        cleaned_count += notification_db.expire()
 
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old notifications (older than 7 days)")
@@ -174,6 +144,16 @@ scheduler.add_job(
 # User management file
 USER_FILE = "users.txt"
 USER_INSTANCES_FILE = "user_instances.txt"
+USER_CONFIG_ASSIGNMENTS_FILE = "user_config_assignments.txt"
+
+# Parsed once, reloaded when a file changes on disk
+user_directory = UserDirectory(USER_FILE, USER_INSTANCES_FILE, USER_CONFIG_ASSIGNMENTS_FILE)
+
+# Per-instance bot logs written by lokbot.log_store, queried through their indexes
+log_store = LogStore('data/logs')
+
+# Single selector thread reading the output of every bot process
+output_reactor = OutputReactor(workers=4)
 
 # Login history tracking
 login_history = {}  # user_id -> list of login records
@@ -181,120 +161,16 @@ active_sessions = {}  # session_id -> session info
 
 def load_users():
     """Load users from file"""
-    users = {}
-    try:
-        if os.path.exists(USER_FILE):
-            with open(USER_FILE, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split(':')
-                        if len(parts) >= 3:
-                            username, password, max_instances = parts[0], parts[1], int(parts[2])
-                            # Default role assignment
-                            role = 'user'
-                            start_date = None
-                            end_date = None
-                            created_date = None
-
-                            if len(parts) >= 4:
-                                role = parts[3]
-                            elif username == 'admin':
-                                role = 'super_admin'  # Legacy admin becomes super_admin
-
-                            # Handle optional dates (format: username:password:max_instances:role:start_date:end_date:created_date)
-                            if len(parts) >= 5 and parts[4]:
-                                start_date = parts[4]
-                            if len(parts) >= 6 and parts[5]:
-                                end_date = parts[5]
-                            if len(parts) >= 7 and parts[6]:
-                                created_date = parts[6]
-                            elif not created_date:
-                                created_date = datetime.now().isoformat()
-
-                            users[username] = {
-                                'password': password,
-                                'max_instances': max_instances,
-                                'role': role,
-                                'start_date': start_date,
-                                'end_date': end_date,
-                                'created_date': created_date
-                            }
-    except Exception as e:
-        logger.error(f"Error loading users: {str(e)}")
-    return users
+    return user_directory.users()
 
 def load_user_instances():
     """Load user instances from file"""
-    instances = {}
-    try:
-        # Ensure the file exists
-        if not os.path.exists(USER_INSTANCES_FILE):
-            logger.info(f"Creating new user instances file: {USER_INSTANCES_FILE}")
-            with open(USER_INSTANCES_FILE, 'w') as f:
-                f.write("# User Instance Management File\n")
-                f.write("# Format: username:instance_name:start_date:end_date:created_date:status\n")
-            return instances
-
-        with open(USER_INSTANCES_FILE, 'r') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split(':')
-                    if len(parts) >= 6:
-                        username, instance_name, start_date, end_date, created_date, status = parts[0], parts[1], parts[2], parts[3], parts[4], parts[5]
-
-                        if username not in instances:
-                            instances[username] = []
-
-                        instances[username].append({
-                            'instance_name': instance_name,
-                            'start_date': start_date,
-                            'end_date': end_date,
-                            'created_date': created_date,
-                            'status': status
-                        })
-                    else:
-                        logger.warning(f"Invalid line format in {USER_INSTANCES_FILE} at line {line_num}: {line}")
-
-        logger.debug(f"Loaded instances for {len(instances)} users from {USER_INSTANCES_FILE}")
-    except Exception as e:
-        logger.error(f"Error loading user instances: {str(e)}")
-    return instances
-
-def save_user_instances(instances):
-    """Save user instances to file"""
-    try:
-        with open(USER_INSTANCES_FILE, 'w') as f:
-            f.write("# User Instance Management File\n")
-            f.write("# Format: username:instance_name:start_date:end_date:created_date:status\n")
-            for username, user_instances in instances.items():
-                for instance in user_instances:
-                    f.write(f"{username}:{instance['instance_name']}:{instance['start_date']}:{instance['end_date']}:{instance['created_date']}:{instance['status']}\n")
-    except Exception as e:
-        logger.error(f"Error saving user instances: {str(e)}")
+    user_directory.ensure_instances_file()
+    return user_directory.all_instances()
 
 def get_user_active_instances(username):
     """Get active instances for a user based on current date"""
-    instances = load_user_instances()
-    user_instances = instances.get(username, [])
-    current_date = datetime.now().date()
-
-    active_instances = []
-    for instance in user_instances:
-        if instance['status'] != 'active':
-            continue
-
-        try:
-            start_date = datetime.fromisoformat(instance['start_date']).date()
-            end_date = datetime.fromisoformat(instance['end_date']).date()
-
-            if start_date <= current_date <= end_date:
-                active_instances.append(instance)
-        except:
-            continue
-
-    return active_instances
+    return user_directory.active_instances(username)
 
 def get_user_max_instances_from_active(username):
     """Get maximum instances allowed based on active instance purchases"""
@@ -316,54 +192,31 @@ def get_user_max_instances_from_active(username):
         return total_instances
 
     # If no active instances, check legacy max_instances from user file
-    users = load_users()
-    user = users.get(username)
+    user = user_directory.get_user(username)
     if user:
         return user['max_instances']
     return 0
 
 def is_user_account_active(username):
     """Check if user account is within valid date range"""
-    users = load_users()
-    user = users.get(username)
+    user = user_directory.get_user(username)
 
     if not user:
         return False
 
     # Admin accounts are always active
-    if user.get('role') in ['admin', 'super_admin']:
+    if user['is_admin']:
         return True
 
     # Temp test accounts have their own validation
     if is_temp_test_account(username):
         return validate_temp_test_account(username)
 
-    current_date = datetime.now().date()
-
-    # Check start date
-    if user.get('start_date'):
-        try:
-            start_date = datetime.fromisoformat(user['start_date']).date()
-            if current_date < start_date:
-                return False
-        except:
-            pass
-
-    # Check end date
-    if user.get('end_date'):
-        try:
-            end_date = datetime.fromisoformat(user['end_date']).date()
-            if current_date > end_date:
-                return False
-        except:
-            pass
-
-    return True
+    return user_directory.is_active(username)
 
 def get_user_account_status(username):
     """Get detailed account status information"""
-    users = load_users()
-    user = users.get(username)
+    user = user_directory.get_user(username)
 
     if not user:
         return {'status': 'not_found'}
@@ -373,24 +226,17 @@ def get_user_account_status(username):
     days_remaining = None
 
     # Check if account is expired or not yet active
-    if user.get('start_date'):
-        try:
-            start_date = datetime.fromisoformat(user['start_date']).date()
-            if current_date < start_date:
-                status = 'not_started'
-                days_remaining = (start_date - current_date).days
-        except:
-            pass
-
-    if user.get('end_date'):
-        try:
-            end_date = datetime.fromisoformat(user['end_date']).date()
-            if current_date > end_date:
-                status = 'expired'
-            elif status == 'active':
-                days_remaining = (end_date - current_date).days
-        except:
-            pass
+    start_date = user['start']
+    if start_date and current_date < start_date:
+        status = 'not_started'
+        days_remaining = (start_date - current_date).days
+
+    end_date = user['end']
+    if end_date:
+        if current_date > end_date:
+            status = 'expired'
+        elif status == 'active':
+            days_remaining = (end_date - current_date).days
 
     return {
         'status': status,
@@ -408,11 +254,7 @@ def get_user_role(username):
     if is_temp_test_account(username):
         return 'test_user'
 
-    users = load_users()
-    user = users.get(username)
-    if user:
-        return user.get('role', 'user')
-    return 'user'
+    return user_directory.role(username) or 'user'
 
 def is_admin(username):
     """Check if user has admin privileges"""
@@ -436,8 +278,7 @@ def authenticate_user(username, password):
         return False
 
     # Regular user authentication
-    users = load_users()
-    user = users.get(username)
+    user = user_directory.get_user(username)
     if user and user['password'] == password:
         # Check if account is within valid date range
         if not is_user_account_active(username):
@@ -452,26 +293,10 @@ def get_user_max_instances(username):
 
 def load_user_config_assignments():
     """Load user config assignments from file"""
-    assignments = {}
-    try:
-        if os.path.exists("user_config_assignments.txt"):
-            with open("user_config_assignments.txt", 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split(':')
-                        if len(parts) == 2:
-                            username, config_file = parts[0].strip(), parts[1].strip()
-                            assignments[username] = config_file
-    except Exception as e:
-        logger.error(f"Error loading user config assignments: {str(e)}")
-    return assignments
+    return user_directory.assignments()
 
 def has_config_access(username, config_file):
     """Check if a user has access to a specific config file"""
-    # Load user config assignments
-    assignments = load_user_config_assignments()
-
     logger.debug(f"Config access check: user={username}, file={config_file}")
 
     # Admin has access to all config files
@@ -485,10 +310,8 @@ def has_config_access(username, config_file):
         return True
 
     # Check if user has a specific config file assigned
-    if username in assignments:
-        assigned_configs = assignments[username]
-        # Split comma-separated config files and check if requested file is in the list
-        allowed_configs = [config.strip() for config in assigned_configs.split(',')]
+    if user_directory.has_assignment(username):
+        allowed_configs = user_directory.allowed_configs(username)
         logger.debug(f"User {username} has assigned configs: {allowed_configs}")
 
         if config_file in allowed_configs:
@@ -557,6 +380,9 @@ def restart_bot_on_auth_failure(user_id, instance_id):
             env = os.environ.copy()
             env["LOKBOT_USER_ID"] = user_id
             env["LOKBOT_CONFIG"] = config_file
+            env["LOKBOT_INSTANCE_ID"] = instance_id
+            env["LOKBOT_ACCOUNT_NAME"] = account_name
+            ensure_event_channel(env)
 
             # Re-authenticate to get fresh token with complete initialization
             try:
@@ -628,16 +454,10 @@ def restart_bot_on_auth_failure(user_id, instance_id):
 
                     logger.info(f"Bot restart: Kingdom initialization complete for {account_name}")
 
-                    # Start new process with fresh token
-                    new_process = subprocess.Popen(
-                        ["python", "-m", "lokbot", fresh_token],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        env=env,
-                        bufsize=1,
-                        universal_newlines=True
-                    )
+                    # Start new process with fresh token (forked from the warm template)
+                    new_process = launch_bot(fresh_token, env)
+                    log_store.set_owner(instance_id, user_id)
+                    watch_bot_output(instance_id, user_id, account_name, new_process)
 
                     # Update bot processes with new instance
                     bot_processes[instance_id] = {
@@ -649,6 +469,7 @@ def restart_bot_on_auth_failure(user_id, instance_id):
                         "user_id": user_id,
                         "name": f"{account_name} (Restarted)"
                     }
+                    status_monitor.invalidate()
 
                     add_notification(user_id, "bot_restart", "Bot Restarted",
                                    f"Bot {account_name} automatically restarted with fresh authentication and kingdom initialization")
@@ -735,70 +556,17 @@ def add_notification(user_id, notification_type, title, message, timestamp=None,
             'count': count  # Include count for reference
         }
 
-        # Initialize user notification history structure - Create entries for both user IDs
-        # This handles the case where bot uses game user ID but web session uses username
-        user_ids_to_update = [user_id]
-        
-        # If this looks like a game user ID (long hex string), also store under session username
-        if len(user_id) == 24 and all(c in '0123456789abcdef' for c in user_id.lower()):
-            # This is likely a game/database user ID, also store under 'admin' for web interface access
-            user_ids_to_update.append('admin')
-        
-        # If this is a session username, also check if we have a game user ID mapping
-        elif user_id == 'admin':
-            # Look for any existing long user IDs and map to admin
-            for existing_user_id in list(notifications_history.keys()):
-                if len(existing_user_id) == 24 and all(c in '0123456789abcdef' for c in existing_user_id.lower()):
-                    user_ids_to_update.append(existing_user_id)
-        
-        for target_user_id in user_ids_to_update:
-            if target_user_id not in notifications_history:
-                notifications_history[target_user_id] = {}
-
-            if account_name not in notifications_history[target_user_id]:
-                notifications_history[target_user_id][account_name] = []
-
-        # Enhanced duplicate check - consider instance separation
-        current_time = datetime.now(timezone.utc)
-        account_history = notifications_history[user_id][account_name]
-
-        # Check for duplicates in the last 30 seconds for the same instance
-        is_duplicate = False
-        for existing_notif in account_history[-10:]:  # Check last 10 for better duplicate detection
-            try:
-                existing_time = datetime.fromisoformat(existing_notif['timestamp'].replace('Z', '+00:00'))
-                time_diff = abs((current_time - existing_time).total_seconds())
-
-                # More precise duplicate detection including instance_id
-                if (time_diff < 30 and
-                    existing_notif['message'] == message and
-                    existing_notif['type'] == notification_type and
-                    existing_notif.get('instance_id') == instance_id):
-                    is_duplicate = True
-                    break
-            except:
-                continue
+        # Store in the per-account rings; the store also maps game user IDs to the web
+        # session user and drops duplicates of the same instance/type/message within 30s
+        user_ids_to_update = notification_store.add(user_id, notification)
 
-        if not is_duplicate:
-            # Add notification to history for all mapped user IDs
+        if user_ids_to_update:
             for target_user_id in user_ids_to_update:
-                notifications_history[target_user_id][account_name].append(notification)
-
-                # Keep only last 150 notifications per account (increased for better history with multiple instances)
-                if len(notifications_history[target_user_id][account_name]) > 150:
-                    notifications_history[target_user_id][account_name] = notifications_history[target_user_id][account_name][-150:]
+                # Persist in batches, survives restarts
+                notification_db.insert(target_user_id, notification)
 
-                # Add to real-time queue for each mapped user ID
-                if target_user_id in notification_queues:
-                    try:
-                        notification_queues[target_user_id].put_nowait(notification)
-                    except queue.Full:
-                        # If queue is full, remove oldest and add new
-                        try:
-                            notification_queues[target_user_id].get_nowait()
-                            notification_queues[target_user_id].put_nowait(notification)
-                        except queue.Empty:
-                            pass
+                # Every open stream of this user reads it from its own cursor
+                notification_broker.publish(target_user_id, notification)
 
             logger.info(f"Added notification for user {user_id} instance {instance_id} ({account_name}): {title}")
         else:
@@ -859,6 +627,75 @@ def add_bot_update(user_id, update_type, title, message):
     instance_id, account_name = get_current_bot_instance()
     add_notification(user_id, update_type, title, message, account_name=account_name, instance_id=instance_id)
 
+# Endpoints bot processes may deliver over the event channel instead of HTTP
+BOT_EVENT_ENDPOINTS = {
+    '/api/march_status_update',
+    '/api/gathering_notification',
+    '/api/object_notification',
+    '/api/rally_notification',
+    '/api/monster_attack_notification',
+    '/api/crystal_limit_notification',
+    '/api/skills_notification',
+}
+
+# Sampling profiles requested from bots, instance_id -> {running, started, rate, duration, result}
+bot_profiles = {}
+
+# Latest thread/job/lock health report of every bot, sent every few seconds
+bot_health = {}
+HEALTH_REPORT_STALE_AFTER = 30
+
+def dispatch_bot_event(hello, event_type, payload, timestamp):
+    """Handle an event received from a bot over the event channel"""
+    instance_id = hello.get('instance_id')
+
+    if event_type == '__connected__':
+        logger.info(f"Bot instance {instance_id} connected to event channel (pid {hello.get('pid')})")
+        return
+    if event_type == '__disconnected__':
+        logger.info(f"Bot instance {instance_id} disconnected from event channel")
+        return
+
+    if event_type == 'health_report':
+        bot_health[instance_id] = dict(payload, received=time.time())
+        return
+
+    if event_type == 'profile_result':
+        profile = bot_profiles.setdefault(instance_id, {})
+        profile.update(running=False, result=payload)
+        logger.info(f"Received profile of {instance_id}: {payload.get('samples')} samples in {payload.get('duration')}s")
+        return
+
+    if event_type not in BOT_EVENT_ENDPOINTS:
+        logger.warning(f"Ignoring unknown event {event_type} from {instance_id}")
+        return
+
+    # Run the same view the HTTP endpoint uses, without the HTTP round trip
+    with app.test_request_context(event_type, method='POST', json=payload):
+        app.dispatch_request()
+
+def ensure_event_channel(env):
+    """Start the event channel if needed and point a bot environment at it"""
+    try:
+        event_server.start()
+        env[EVENT_SOCKET_ENV] = event_server.socket_path
+    except OSError as e:
+        logger.warning(f"Event channel unavailable, bot will report over HTTP: {e}")
+
+event_server = EventChannelServer(os.environ.get(EVENT_SOCKET_ENV, DEFAULT_EVENT_SOCKET), dispatch_bot_event)
+
+# Notification streams are served from an asyncio server; the browser gets a signed,
+# short-lived token from /api/notifications/stream_url instead of the session cookie
+stream_token_serializer = URLSafeTimedSerializer(app.secret_key, salt='notification-stream')
+
+def verify_stream_token(token):
+    try:
+        return stream_token_serializer.loads(token, max_age=300)
+    except BadSignature:
+        return None
+
+stream_server = NotificationStreamServer.from_env(notification_broker, verify_stream_token)
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -879,6 +716,60 @@ def notifications():
         return redirect(url_for('login'))
     return render_template('notifications.html')
 
+def visible_log_instances(user_id, username):
+    """Log directories a user may read, admins see every instance"""
+    instances = log_store.instances()
+    if is_admin(username):
+        return instances
+    # Ownership from the running process or the owner recorded at launch, never from the id's text
+    running = {instance_directory('', instance_id) for instance_id, bot_data in list(bot_processes.items())
+               if bot_data.get('user_id') == user_id}
+    return [instance for instance in instances
+            if instance in running or log_store.owner(instance) == user_id]
+
+def query_logs(args, user_id, username):
+    """Run a log query from request args: instance, level, since, until, q, limit"""
+    visible = visible_log_instances(user_id, username)
+    requested = [i for i in args.get('instance', '').split(',') if i]
+    instances = [i for i in requested if i in visible] if requested else visible
+
+    def timestamp_arg(name):
+        value = args.get(name)
+        return float(value) if value not in (None, '') else None
+
+    return log_store.query(
+        instances,
+        level=args.get('level') or None,
+        since=timestamp_arg('since'),
+        until=timestamp_arg('until'),
+        contains=args.get('q') or None,
+        limit=max(1, min(args.get('limit', 200, type=int), 1000)),
+    ), visible
+
+@app.route('/logs')
+def logs():
+    if 'authenticated' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+    records, _ = query_logs(request.args, user_id, session.get('username', user_id))
+    return render_template('logs.html', logs=[record['line'] for record in records])
+
+@app.route('/api/logs')
+@login_required
+def get_logs():
+    """Tail, time range and level/text filtered bot logs, oldest first"""
+    user_id = session['user_id']
+    try:
+        records, instances = query_logs(request.args, user_id, session.get('username', user_id))
+    except ValueError:
+        return jsonify({'error': 'since and until must be unix timestamps'}), 400
+
+    return jsonify({
+        'logs': [record['line'] for record in records],
+        'records': records,
+        'instances': instances,
+    })
+
 @app.route('/manifest.json')
 def manifest():
     """Serve PWA manifest"""
@@ -1056,13 +947,7 @@ def logout():
                 break
 
     # Clear user-specific caches
-    if user_id in notification_queues:
-        del notification_queues[user_id]
-
-    # Clear any status cache related to this user
-    global statusCache, lastStatusUpdate
-    statusCache = None
-    lastStatusUpdate = 0
+    notification_broker.remove_user(user_id)
 
     session.clear()
     return redirect(url_for('login'))
@@ -1083,53 +968,64 @@ def health_check():
         'service': 'LokBot Web App'
     }), 200
 
+@app.route('/api/notifications/stream_url')
+@login_required
+def notification_stream_url():
+    """Where the browser should open its notification EventSource"""
+    user_id = session['user_id']
+    if stream_server is not None:
+        stream_server.start()
+        if stream_server.running:
+            token = stream_token_serializer.dumps(user_id)
+            return jsonify({'url': f"{stream_server.public_url(request.host)}?{urlencode({'token': token})}", 'evented': True})
+    return jsonify({'url': url_for('notification_stream'), 'evented': False})
+
 @app.route('/api/notifications/stream')
 @login_required
 def notification_stream():
+    """Threaded SSE fallback, used when the evented stream server isn't available"""
     user_id = session['user_id']
     user_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'Unknown'))
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID', request.args.get('last_event_id')))
     logger.info(f"Starting notification stream for user: {user_id} from IP: {user_ip}")
 
     def event_stream():
-        # Create a queue for this user if it doesn't exist
-        if user_id not in notification_queues:
-            notification_queues[user_id] = queue.Queue(maxsize=25)
-            logger.info(f"Created new notification queue for user: {user_id}")
-
-        q = notification_queues[user_id]
-        connection_id = f"{user_id}_{int(time.time())}"
+        # Each connection has its own cursor, so tabs no longer steal each other's events
+        cursor = notification_broker.start_cursor(user_id, last_event_id)
+        connection_id = f"{user_id}_{cursor}"
+        notification_broker.subscribe(user_id)
 
         try:
             # Send initial connection message with retry header
             yield f"retry: 10000\n"
-            yield f"data: {json.dumps({'type': 'connected', 'message': f'Connected to notification stream', 'connection_id': connection_id})}\n\n"
+            yield format_sse({'type': 'connected', 'message': 'Connected to notification stream', 'connection_id': connection_id})
 
-            heartbeat_counter = 0
+            idle_count = 0
             while True:
-                try:
-                    # Wait for notification with longer timeout for better performance
-                    notification = q.get(timeout=30)
-                    logger.debug(f"Sending notification to user {user_id}: {notification}")
-                    yield f"data: {json.dumps(notification)}\n\n"
-                    heartbeat_counter = 0
-                except queue.Empty:
-                    # Send heartbeat every 60 seconds for better performance
-                    heartbeat_counter += 1
-                    if heartbeat_counter % 3 == 0:  # Only send every third heartbeat
-                        yield f"data: {json.dumps({'type': 'heartbeat', 'count': heartbeat_counter})}\n\n"
-
-                    # Close connection after 3 minutes of inactivity
-                    if heartbeat_counter > 6:
-                        logger.info(f"Closing inactive notification stream for user {user_id}")
-                        break
-                except GeneratorExit:
-                    break
-                except Exception as e:
-                    logger.error(f"Error in notification stream for user {user_id}: {str(e)}")
+                events = notification_broker.wait(user_id, cursor, timeout=30)
+                if events:
+                    for event_id, notification in events:
+                        logger.debug(f"Sending notification to user {user_id}: {notification}")
+                        yield format_sse(notification, event_id)
+                        cursor = event_id
+                    idle_count = 0
+                    continue
+
+                idle_count += 1
+                yield format_sse({'type': 'heartbeat', 'count': idle_count})
+
+                # This stream holds a worker thread, release it after 3 minutes of
+                # inactivity; the client reconnects and resumes from Last-Event-ID
+                if idle_count >= 6:
+                    logger.info(f"Closing inactive notification stream for user {user_id}")
                     break
+        except GeneratorExit:
+            pass
         except Exception as e:
             logger.error(f"Error in event_stream generator for user {user_id}: {str(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'message': 'Connection error'})}\n\n"
+            yield format_sse({'type': 'error', 'message': 'Connection error'})
+        finally:
+            notification_broker.unsubscribe(user_id)
 
     response = Response(event_stream(), mimetype="text/event-stream")
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -1141,14 +1037,6 @@ def notification_stream():
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx buffering
 
-    # Cleanup old queues periodically
-    import threading
-    def cleanup_old_queues():
-        for uid in list(notification_queues.keys()):
-            if notification_queues[uid].qsize() == 0:
-                # Check if queue has been inactive - implement your logic here
-                pass
-
     return response
 
 @app.route('/api/notifications/history')
@@ -1179,31 +1067,15 @@ def get_notification_history():
                                 'message': notification['message'],
                                 'timestamp': notification['timestamp'],
                                 'account_name': notification.get('account_name', 'General'),
-                                'id': notification.get('id', f"migrated_{int(time.time() * 1000000)}")
+                                'id': notification.get('id', f"migrated_{uuid.uuid4().hex}")
                             })
                     except:
                         continue
 
-            # Migrate old notifications to new structure
-            if user_id not in notifications_history:
-                notifications_history[user_id] = {}
-
+            # Migrate old notifications to the persistent store; the unique
+            # (user, notification id) key makes re-imports a no-op instead of an O(n^2) scan
             for notification in file_notifications:
-                account_name = notification.get('account_name', 'General')
-                if account_name not in notifications_history[user_id]:
-                    notifications_history[user_id][account_name] = []
-
-                # Check for duplicates before adding (more precise check)
-                existing = any(
-                    n.get('message') == notification['message'] and
-                    n.get('type') == notification['type'] and
-                    abs((datetime.fromisoformat(n['timestamp'].replace('Z', '+00:00')) -
-                         datetime.fromisoformat(notification['timestamp'].replace('Z', '+00:00'))).total_seconds()) < 1
-                    for n in notifications_history[user_id][account_name]
-                )
-
-                if not existing:
-                    notifications_history[user_id][account_name].append(notification)
+                notification_db.insert(user_id, notification)
 
             # Clean up the file after reading
             try:
@@ -1214,12 +1086,8 @@ def get_notification_history():
     except Exception as e:
         logger.debug(f"Error processing notification file: {str(e)}")
 
-    # Get user's notification history (new structure)
-    user_history = notifications_history.get(user_id, {})
-    logger.info(f"User {user_id} has notifications in {len(user_history)} accounts: {list(user_history.keys())}")
-
     # Get available accounts (sorted for consistency)
-    available_accounts = sorted(list(user_history.keys()))
+    available_accounts = notification_db.accounts(user_id)
 
     # Add current active bot instances to available accounts
     for proc_id, proc_data in bot_processes.items():
@@ -1232,7 +1100,7 @@ def get_notification_history():
     available_accounts.sort(key=lambda x: (x != 'General', x))
 
     # If no notifications exist, create a test notification to verify the system works
-    if not user_history:
+    if not notification_db.has_user(user_id) and not notification_store.has_user(user_id):
         logger.info(f"No notifications found for user {user_id}, creating test notification")
         test_notification = {
             'type': 'bot_start',
@@ -1242,89 +1110,44 @@ def get_notification_history():
             'account_name': 'General',
             'id': f"welcome_{user_id}_{int(time.time() * 1000000)}"
         }
+        notification_store.append(user_id, 'General', test_notification)
+        notification_db.insert(user_id, test_notification)
 
-        if user_id not in notifications_history:
-            notifications_history[user_id] = {}
-        if 'General' not in notifications_history[user_id]:
-            notifications_history[user_id]['General'] = []
-        notifications_history[user_id]['General'].append(test_notification)
-
-        user_history = notifications_history[user_id]
-        available_accounts = ['General']
-
-    # Filter notifications based on selected account
-    today = datetime.now().date()
-
-    if selected_account == 'all':
-        # Combine all notifications from all accounts
-        all_notifications = []
-        for account_name, notifications in user_history.items():
-            for notification in notifications:
-                # Filter by current date
-                try:
-                    notification_date = datetime.fromisoformat(notification['timestamp'].replace('Z', '+00:00')).date()
-                    if notification_date == today:
-                        # Ensure notification has account_name
-                        notification_copy = notification.copy()
-                        notification_copy['account_name'] = account_name
-                        all_notifications.append(notification_copy)
-                except:
-                    continue
-
-        # Sort by timestamp (newest first) with proper datetime parsing
-        def parse_timestamp(notif):
-            try:
-                timestamp_str = notif['timestamp']
-                if timestamp_str.endswith('Z'):
-                    timestamp_str = timestamp_str[:-1] + '+00:00'
-                elif '+' not in timestamp_str and 'T' in timestamp_str:
-                    timestamp_str += '+00:00'
-                return datetime.fromisoformat(timestamp_str)
-            except:
-                return datetime.min.replace(tzinfo=timezone.utc)
-
-        all_notifications.sort(key=parse_timestamp, reverse=True)
-
-        logger.info(f"Returning {len(all_notifications)} notifications for user {user_id} (all accounts, today only)")
         return jsonify({
-            'notifications': all_notifications[:100],  # Top 100 most recent notifications
-            'available_accounts': available_accounts,
-            'selected_account': selected_account
+            'notifications': [test_notification],
+            'available_accounts': ['General'],
+            'selected_account': selected_account,
+            'next_cursor': None
         })
-    else:
-        # Return notifications for specific account
-        account_notifications = user_history.get(selected_account, [])
-
-        # Filter by current date
-        today_notifications = []
-        for notification in account_notifications:
-            try:
-                notification_date = datetime.fromisoformat(notification['timestamp'].replace('Z', '+00:00')).date()
-                if notification_date == today:
-                    today_notifications.append(notification)
-            except:
-                continue
-
-        # Sort by timestamp (newest first)
-        def parse_timestamp(notif):
-            try:
-                timestamp_str = notif['timestamp']
-                if timestamp_str.endswith('Z'):
-                    timestamp_str = timestamp_str[:-1] + '+00:00'
-                elif '+' not in timestamp_str and 'T' in timestamp_str:
-                    timestamp_str += '+00:00'
-                return datetime.fromisoformat(timestamp_str)
-            except:
-                return datetime.min.replace(tzinfo=timezone.utc)
 
-        today_notifications.sort(key=parse_timestamp, reverse=True)
+    # Today's notifications only, newest first, one page at a time
+    today_start = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+    default_limit = 100 if selected_account == 'all' else 50
+    try:
+        limit = max(1, min(int(request.args.get('limit', default_limit)), 500))
+    except ValueError:
+        limit = default_limit
 
-        logger.info(f"Returning {len(today_notifications)} notifications for user {user_id} account {selected_account} (today only)")
-        return jsonify({
-            'notifications': today_notifications[:50],  # Top 50 notifications for this account
-            'available_accounts': available_accounts,
-            'selected_account': selected_account
-        })
+    try:
+        notifications, next_cursor = notification_db.page(
+            user_id,
+            account_name=None if selected_account == 'all' else selected_account,
+            instance_id=request.args.get('instance_id'),
+            notification_type=request.args.get('type'),
+            since=today_start,
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    logger.info(f"Returning {len(notifications)} notifications for user {user_id} account {selected_account} (today only)")
+    return jsonify({
+        'notifications': notifications,
+        'available_accounts': available_accounts,
+        'selected_account': selected_account,
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/config_files')
 @login_required
@@ -1389,8 +1212,7 @@ def get_config_summary():
         if not os.path.exists(selected_config):
             return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
-        with open(selected_config, 'r') as f:
-            config = json.load(f)
+        config = config_store.read(selected_config)
 
         # Extract enabled features
         summary = {
@@ -1659,6 +1481,161 @@ def get_config_summary():
         logger.error(f"Error generating config summary: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def handle_bot_output_line(instance_id, user_id, account_name, line):
+    """Echo one line of bot output and turn the interesting ones into notifications"""
+    if not line.strip():
+        return
+    logger.info(f"[{account_name}] {line.strip()}")
+
+    # Parse log lines for notifications with better pattern matching
+    line_lower = line.lower()
+    line_content = line.strip()
+
+    # Skip ANSI color code lines and system log messages
+    if "[0m" in line_content or "sent to discord" in line_lower or "sent to web app" in line_lower:
+        return
+
+    # Handle authentication and connection errors with auto-restart
+    if "not_online" in line_lower or "noauthexception" in line_lower or "notOnlineException" in line_content:
+        add_notification(user_id, "error", "Authentication Error",
+                       "Bot lost connection - attempting automatic restart...")
+        # Trigger automatic restart on authentication failure
+        threading.Thread(target=restart_bot_on_auth_failure, args=[user_id, instance_id], daemon=True).start()
+        return
+    elif "failed to join rally" in line_lower and "not_online" in line_content:
+        add_notification(user_id, "warning", "Rally Join Failed",
+                       "Rally join failed - bot needs to reconnect")
+        return
+
+    # Bots on the event channel report game events as typed events,
+    # only errors and the crystal quota still need the log
+    if event_server.is_connected(instance_id) and \
+            "error" not in line_lower and "failed" not in line_lower and \
+            "exceed_crystal_daily_quota" not in line_lower:
+        return
+
+    # Only capture the actual game event messages, not the log confirmations
+    # Gathering notifications - look for the specific emoji message
+    if "🚛 gathering march started!" in line_lower:
+        # Extract just the clean message part
+        if "🚛" in line_content:
+            clean_message = line_content.split("🚛")[1].strip() if "🚛" in line_content else line_content
+            clean_message = "🚛 " + clean_message
+            add_notification(user_id, "gathering", "Gathering Started", clean_message, account_name=account_name, instance_id=instance_id)
+
+    # Rally notifications
+    elif "rally joined" in line_lower and "⚔️" in line_content:
+        add_notification(user_id, "rally_join", "Rally Joined", line_content, account_name=account_name, instance_id=instance_id)
+    elif "rally started" in line_lower and "🏴" in line_content:
+        add_notification(user_id, "rally_start", "Rally Started", line_content, account_name=account_name, instance_id=instance_id)
+
+    # Resource findings - only capture the formatted messages
+    elif "crystal mine found!" in line_lower and "📢" in line_content:
+        add_notification(user_id, "crystal_mine", "Crystal Mine Found", line_content, account_name=account_name, instance_id=instance_id)
+    elif "dragon soul found!" in line_lower and "📢" in line_content:
+        add_notification(user_id, "dragon_soul", "Dragon Soul Found", line_content, account_name=account_name, instance_id=instance_id)
+
+    # Monster attacks
+    elif ("monster attack" in line_lower and "started" in line_lower) and "👹" in line_content:
+        add_notification(user_id, "monster_attack", "Monster Attack Started", line_content, account_name=account_name, instance_id=instance_id)
+
+    # Crystal limit detection with auto-termination
+    elif "exceed_crystal_daily_quota" in line_content:
+        # Send bold notification about crystal limit
+        add_notification(user_id, "error", "🚨 Crystal Limit Reached",
+                       "**Your Daily crystal limit is over, Please stop the bot**", account_name=account_name, instance_id=instance_id)
+
+        # Auto-terminate the bot process
+        try:
+            logger.info(f"Crystal limit reached for {account_name}, auto-terminating bot...")
+            if instance_id in bot_processes:
+                process = bot_processes[instance_id]["process"]
+                if process.poll() is None:
+                    process.terminate()
+                    try:
+                        process.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+                del bot_processes[instance_id]
+                status_monitor.invalidate()
+                add_notification(user_id, "bot_stop", "Bot Auto-Stopped",
+                               f"Bot {account_name} automatically stopped due to crystal limit", account_name=account_name, instance_id=instance_id)
+        except Exception as e:
+            logger.error(f"Error auto-terminating bot {instance_id}: {str(e)}")
+        return
+    # Enhanced error detection including token issues
+    elif any(token_error in line_lower for token_error in ["no_auth", "noauth", "401", "unauthorized", "token"]) and "error" in line_lower:
+        add_notification(user_id, "error", "Token Error",
+                       "Authentication token issue detected - attempting restart...", account_name=account_name, instance_id=instance_id)
+        threading.Thread(target=restart_bot_on_auth_failure, args=[user_id, instance_id], daemon=True).start()
+        return
+    elif "error" in line_lower and not any(x in line_lower for x in ["debug", "info", "lokbot"]):
+        add_notification(user_id, "error", "Bot Error", line_content, account_name=account_name, instance_id=instance_id)
+    elif "failed" in line_lower and not any(x in line_lower for x in ["debug", "info", "lokbot"]):
+        add_notification(user_id, "warning", "Bot Warning", line_content, account_name=account_name, instance_id=instance_id)
+
+def watch_bot_output(instance_id, user_id, account_name, process, recent_output=None):
+    """Hand a bot's combined output pipe to the shared output reactor"""
+    def on_line(line):
+        if recent_output is not None:
+            recent_output.append(line)
+        handle_bot_output_line(instance_id, user_id, account_name, line)
+
+    # Output ends when the process exits, have the monitor reap it now
+    output_reactor.watch(instance_id, process.stdout, on_line, on_close=status_monitor.invalidate)
+
+def build_instance_config(selected_config, user_id):
+    """Per-user bot config derived from a config template"""
+    config_data = config_store.load(selected_config)
+
+    # Update config with user ID
+    if "discord" not in config_data:
+        config_data["discord"] = {}
+    config_data["discord"]["user_id"] = user_id
+
+    # Ensure rally configurations exist
+    if "rally" not in config_data:
+        config_data["rally"] = {}
+
+    if "join" not in config_data["rally"]:
+        config_data["rally"]["join"] = {
+            "enabled": False,
+            "numMarch": 8,
+            "level_based_troops": True,
+            "targets": []
+        }
+
+    if "start" not in config_data["rally"]:
+        config_data["rally"]["start"] = {
+            "enabled": False,
+            "numMarch": 6,
+            "level_based_troops": True,
+            "targets": []
+        }
+
+    return config_data
+
+@config_store.subscribe
+def propagate_config_change(path, source):
+    """Regenerate the config of running bots whose template was saved and tell bots to reload"""
+    changed = os.path.abspath(path)
+    for instance_id, proc_data in list(bot_processes.items()):
+        config_file = proc_data.get('config_file')
+        config_path = proc_data.get('config_path')
+        if not config_path:
+            continue
+        try:
+            if os.path.abspath(config_path) == changed:
+                # Bots also poll their config file, this only makes the reload immediate
+                event_server.send_command(instance_id, 'config_changed', path=config_path)
+            elif config_file and os.path.abspath(config_file) == changed:
+                config_store.save(config_path, build_instance_config(config_file, proc_data['user_id']),
+                                  source=f'template:{config_file}')
+                logger.info(f"Config {config_file} changed, updated {config_path} for instance {instance_id}")
+        except Exception as e:
+            logger.error(f"Error propagating config change to instance {instance_id}: {e}")
+
 @app.route('/api/start_bot', methods=['POST'])
 @login_required
 def start_bot():
@@ -1756,39 +1733,10 @@ def start_bot():
         config_path = f"data/config_{user_id}.json"
 
         # Load the selected config file as template
-        if os.path.exists(selected_config):
-            with open(selected_config, "r") as f:
-                config_data = json.load(f)
-        else:
+        if not os.path.exists(selected_config):
             return jsonify({'error': f'Selected config file {selected_config} not found'}), 400
 
-        # Update config with user ID
-        if "discord" not in config_data:
-            config_data["discord"] = {}
-        config_data["discord"]["user_id"] = user_id
-
-        # Ensure rally configurations exist
-        if "rally" not in config_data:
-            config_data["rally"] = {}
-
-        if "join" not in config_data["rally"]:
-            config_data["rally"]["join"] = {
-                "enabled": False,
-                "numMarch": 8,
-                "level_based_troops": True,
-                "targets": []
-            }
-
-        if "start" not in config_data["rally"]:
-            config_data["rally"]["start"] = {
-                "enabled": False,
-                "numMarch": 6,
-                "level_based_troops": True,
-                "targets": []
-            }
-
-        with open(config_path, "w") as f:
-            json.dump(config_data, f, indent=2)
+        config_store.save(config_path, build_instance_config(selected_config, user_id), source='start_bot')
 
         # Note: The farmer will use socf_thread_with_recovery for automatic re-initialization
             # Start the bot process with proper environment variables
@@ -1797,6 +1745,7 @@ def start_bot():
         env["LOKBOT_CONFIG"] = selected_config  # Set the selected config file
         env["LOKBOT_INSTANCE_ID"] = instance_id  # Set the instance ID for notification tracking
         env["LOKBOT_ACCOUNT_NAME"] = account_name  # Set the account name
+        ensure_event_channel(env)  # Typed events instead of HTTP posts and log scraping
 
         # Ensure the bot process can identify itself properly
         logger.info(f"Setting environment variables: USER_ID={user_id}, INSTANCE_ID={instance_id}, ACCOUNT_NAME={account_name}")
@@ -1808,109 +1757,13 @@ def start_bot():
         logger.info(f"Starting bot for user {user_id} with config {selected_config}")
 
         try:
-            process = subprocess.Popen(
-                ["python", "-m", "lokbot", token],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,  # Combine stderr with stdout
-                text=True,
-                env=env,
-                bufsize=1,  # Line buffered
-                universal_newlines=True
-            )
+            # Fork from the warm template process, stdout and stderr combined, line buffered
+            process = launch_bot(token, env)
+            log_store.set_owner(instance_id, user_id)
 
-            # Start a thread to monitor and log output to console
-            def log_output(bot_process):
-                try:
-                    for line in iter(bot_process.stdout.readline, ''):
-                        if line.strip():
-                            logger.info(f"[{account_name}] {line.strip()}")
-
-                            # Parse log lines for notifications with better pattern matching
-                            line_lower = line.lower()
-                            line_content = line.strip()
-
-                            # Skip ANSI color code lines and system log messages
-                            if "[0m" in line_content or "sent to discord" in line_lower or "sent to web app" in line_lower:
-                                continue
-
-                            # Handle authentication and connection errors with auto-restart
-                            if "not_online" in line_lower or "noauthexception" in line_lower or "notOnlineException" in line_content:
-                                add_notification(user_id, "error", "Authentication Error",
-                                               "Bot lost connection - attempting automatic restart...")
-                                # Trigger automatic restart on authentication failure
-                                threading.Thread(target=restart_bot_on_auth_failure, args=[user_id, instance_id], daemon=True).start()
-                                continue
-                            elif "failed to join rally" in line_lower and "not_online" in line_content:
-                                add_notification(user_id, "warning", "Rally Join Failed",
-                                               "Rally join failed - bot needs to reconnect")
-                                continue
-
-                            # Only capture the actual game event messages, not the log confirmations
-                            # Gathering notifications - look for the specific emoji message
-                            if "🚛 gathering march started!" in line_lower:
-                                # Extract just the clean message part
-                                if "🚛" in line_content:
-                                    clean_message = line_content.split("🚛")[1].strip() if "🚛" in line_content else line_content
-                                    clean_message = "🚛 " + clean_message
-                                    add_notification(user_id, "gathering", "Gathering Started", clean_message, account_name=account_name, instance_id=instance_id)
-
-                            # Rally notifications
-                            elif "rally joined" in line_lower and "⚔️" in line_content:
-                                add_notification(user_id, "rally_join", "Rally Joined", line_content, account_name=account_name, instance_id=instance_id)
-                            elif "rally started" in line_lower and "🏴" in line_content:
-                                add_notification(user_id, "rally_start", "Rally Started", line_content, account_name=account_name, instance_id=instance_id)
-
-                            # Resource findings - only capture the formatted messages
-                            elif "crystal mine found!" in line_lower and "📢" in line_content:
-                                add_notification(user_id, "crystal_mine", "Crystal Mine Found", line_content, account_name=account_name, instance_id=instance_id)
-                            elif "dragon soul found!" in line_lower and "📢" in line_content:
-                                add_notification(user_id, "dragon_soul", "Dragon Soul Found", line_content, account_name=account_name, instance_id=instance_id)
-
-                            # Monster attacks
-                            elif ("monster attack" in line_lower and "started" in line_lower) and "👹" in line_content:
-                                add_notification(user_id, "monster_attack", "Monster Attack Started", line_content, account_name=account_name, instance_id=instance_id)
-
-                            # Crystal limit detection with auto-termination
-                            elif "exceed_crystal_daily_quota" in line_content:
-                                # Send bold notification about crystal limit
-                                add_notification(user_id, "error", "🚨 Crystal Limit Reached",
-                                               "**Your Daily crystal limit is over, Please stop the bot**", account_name=account_name, instance_id=instance_id)
-
-                                # Auto-terminate the bot process
-                                try:
-                                    logger.info(f"Crystal limit reached for {account_name}, auto-terminating bot...")
-                                    if instance_id in bot_processes:
-                                        process = bot_processes[instance_id]["process"]
-                                        if process.poll() is None:
-                                            process.terminate()
-                                            try:
-                                                process.wait(timeout=5)
-                                            except subprocess.TimeoutExpired:
-                                                process.kill()
-                                                process.wait()
-                                        del bot_processes[instance_id]
-                                        add_notification(user_id, "bot_stop", "Bot Auto-Stopped",
-                                                       f"Bot {account_name} automatically stopped due to crystal limit", account_name=account_name, instance_id=instance_id)
-                                except Exception as e:
-                                    logger.error(f"Error auto-terminating bot {instance_id}: {str(e)}")
-                                continue
-                            # Enhanced error detection including token issues
-                            elif any(token_error in line_lower for token_error in ["no_auth", "noauth", "401", "unauthorized", "token"]) and "error" in line_lower:
-                                add_notification(user_id, "error", "Token Error",
-                                               "Authentication token issue detected - attempting restart...", account_name=account_name, instance_id=instance_id)
-                                threading.Thread(target=restart_bot_on_auth_failure, args=[user_id, instance_id], daemon=True).start()
-                                continue
-                            elif "error" in line_lower and not any(x in line_lower for x in ["debug", "info", "lokbot"]):
-                                add_notification(user_id, "error", "Bot Error", line_content, account_name=account_name, instance_id=instance_id)
-                            elif "failed" in line_lower and not any(x in line_lower for x in ["debug", "info", "lokbot"]):
-                                add_notification(user_id, "warning", "Bot Warning", line_content, account_name=account_name, instance_id=instance_id)
-
-                except Exception as e:
-                    logger.error(f"Error reading output from {account_name}: {str(e)}")
-
-            import threading
-            log_thread = threading.Thread(target=log_output, args=(process,), daemon=True)
-            log_thread.start()
+            # One reactor thread reads every bot's output, lines are parsed on its worker pool
+            recent_output = collections.deque(maxlen=50)
+            watch_bot_output(instance_id, user_id, account_name, process, recent_output)
 
             # Give the process a moment to start
             import time
@@ -1919,8 +1772,8 @@ def start_bot():
             # Check if process is still running
             if process.poll() is not None:
                 # Process has already terminated
-                stdout, stderr = process.communicate()
-                error_msg = f"Bot process failed to start. Exit code: {process.returncode}. Output: {stdout}"
+                time.sleep(0.2)  # let the reactor deliver the last lines
+                error_msg = f"Bot process failed to start. Exit code: {process.returncode}. Output: {chr(10).join(recent_output)}"
                 logger.error(error_msg)
                 return jsonify({'error': error_msg}), 500
 
@@ -1944,6 +1797,7 @@ def start_bot():
                                     process.wait()
 
                             del bot_processes[instance_id]
+                            status_monitor.invalidate()
                             add_notification(user_id, "bot_stop", "Bot Auto-Stopped",
                                            f"Bot {account_name} auto-stopped after {auto_stop_duration} minutes.")
                             logger.info(f"Bot {account_name} auto-stopped after {auto_stop_duration} minutes.")
@@ -1971,10 +1825,8 @@ def start_bot():
             logger.info(f"Bot started successfully for user {user_id} as instance {instance_id}. Active instances for user: {len([p for p in bot_processes if p.startswith(user_id) and bot_processes[p]['process'].poll() is None])}")
             add_notification(user_id, "bot_start", "Bot Started", f"Bot started successfully with config {selected_config}", account_name=account_name, instance_id=instance_id)
 
-            # Clear status cache to force refresh
-            global statusCache, lastStatusUpdate
-            statusCache = None
-            lastStatusUpdate = 0
+            # Publish the new instance in the status snapshot
+            status_monitor.invalidate()
 
         except Exception as e:
             logger.error(f"Exception starting bot process: {str(e)}")
@@ -1999,18 +1851,18 @@ def stop_bot():
     user_id = session['user_id']
     username = session.get('username', user_id)
 
-    # Clear status cache FIRST to ensure fresh data
-    global statusCache, lastStatusUpdate, isRefreshing
-    statusCache = None
-    lastStatusUpdate = 0
-    isRefreshing = False
-
-    logger.info(f"Force clearing status cache for bot stop operation")
-
     stopped_count = 0
     failed_stops = []
 
     for instance_id in instance_ids:
+        restarting = restarting_bots.get(instance_id)
+        if restarting and (restarting.get('user_id') == user_id or is_admin(username)):
+            # restart_bot_gracefully is already stopping the process, keep it from starting again
+            if restarting_bots.pop(instance_id, None) is not None:
+                logger.info(f"Cancelled the restart of bot instance {instance_id} for user {username}")
+                stopped_count += 1
+            continue
+
         if instance_id in bot_processes:
             # Check if user can stop this instance
             can_stop = False
@@ -2078,6 +1930,9 @@ def stop_bot():
         else:
             logger.warning(f"Instance {instance_id} not found in bot_processes")
 
+    # Publish the stopped instances in the status snapshot
+    status_monitor.invalidate()
+
     if stopped_count > 0:
         add_notification(user_id, "bot_stop", "Bot Stopped", f"Stopped {stopped_count} bot instance(s)")
 
@@ -2094,33 +1949,21 @@ def stop_bot():
         'force_refresh': True  # Signal frontend to refresh immediately
     })
 
-@app.route('/api/status')
-@login_required
-def get_status():
-    user_id = session['user_id']
-    username = session.get('username', user_id)
-
-    # Validate session integrity
-    if not user_id or not username:
-        session.clear()
-        return jsonify({'error': 'Invalid session'}), 401
+# region status snapshot
 
+def reap_dead_processes():
+    """Drop bot processes that exited, notifying their owners"""
     # Clean up dead processes with better validation and logging
     dead_processes = []
-    for proc_id in list(bot_processes.keys()):
+    for proc_id, proc_data in list(bot_processes.items()):
         try:
-            process = bot_processes[proc_id]["process"]
+            process = proc_data["process"]
             exit_code = process.poll()
             if exit_code is not None:
                 dead_processes.append(proc_id)
                 logger.info(f"Found dead process {proc_id} with exit code {exit_code}")
 
-                # Ensure process resources are cleaned up
-                try:
-                    process.stdout.close() if process.stdout else None
-                    process.stderr.close() if process.stderr else None
-                except:
-                    pass
+                # The output reactor closes the pipes once it has read them to EOF
         except Exception as e:
             logger.error(f"Error checking process {proc_id}: {str(e)}")
             dead_processes.append(proc_id)
@@ -2139,12 +1982,15 @@ def get_status():
                                f"Bot {account_name} stopped unexpectedly", account_name=account_name)
 
             del bot_processes[proc_id]
+            bot_health.pop(proc_id, None)
 
-    # Get user's active processes with strict validation
-    user_processes = []
-    all_processes = []  # For admin view
+def build_status_snapshot():
+    """Process info for every running instance, grouped by owner"""
+    process_telemetry.start()
+    all_processes = []
+    user_processes = {}  # owner user_id -> [process_info]
 
-    for proc_id, proc_data in bot_processes.items():
+    for proc_id, proc_data in list(bot_processes.items()):
         try:
             process = proc_data["process"]
             # Double-check that process is actually running
@@ -2185,31 +2031,184 @@ def get_status():
                     else:
                         process_info['remaining_minutes'] = 0
 
+                health = bot_health.get(proc_id)
+                if health:
+                    process_info['health'] = {
+                        'stalled': health.get('stalled', []),
+                        'stale': time.time() - health['received'] > HEALTH_REPORT_STALE_AFTER,
+                    }
+
+                # Latest /proc sample, coarse so the snapshot version doesn't churn
+                resources = process_telemetry.latest(proc_id)
+                if resources:
+                    process_info['resources'] = {
+                        'rss_mb': round(resources['rss_mb']),
+                        'cpu_percent': round(resources['cpu_percent'] or 0),
+                        'threads': resources['threads'],
+                        'fds': resources['fds'],
+                    }
+
                 # Add to all processes list (always, for admin view)
                 all_processes.append(process_info)
 
-                # Add to user processes if it belongs to current user (exact match)
-                if instance_username == user_id:
-                    user_processes.append(process_info)
-                    logger.debug(f"Added user process {proc_id} for user {user_id}")
+                # Group by owner so a request only looks up its own user
+                user_processes.setdefault(instance_username, []).append(process_info)
 
         except Exception as e:
             logger.error(f"Error processing bot process {proc_id}: {str(e)}")
             continue
 
-    total_active = len(all_processes)
-    logger.debug(f"Status check: User {user_id} has {len(user_processes)} instances, total active: {total_active}")
+    return {
+        'all_processes': all_processes,
+        'user_processes': user_processes,
+    }
+
+# Rebuilt by a monitor thread and on invalidate() instead of on every request
+status_monitor = StatusMonitor(reap_dead_processes, build_status_snapshot, interval=5)
+
+def running_bot_pids():
+    return {
+        instance_id: proc_data['process'].pid
+        for instance_id, proc_data in list(bot_processes.items())
+        if proc_data['process'].poll() is None
+    }
+
+def soft_limits_from_env():
+    """LOKBOT_SOFT_LIMIT_RSS_MB, _CPU_PERCENT, _THREADS and _FDS, unset means no limit"""
+    limits = {}
+    for name in LIMIT_FIELDS:
+        value = os.environ.get(f'LOKBOT_SOFT_LIMIT_{name.upper()}')
+        if value:
+            limits[name] = float(value)
+    return limits
+
+# 'alert' only notifies the owner, 'restart' also restarts the bot with its current token
+soft_limit_action = os.environ.get('LOKBOT_SOFT_LIMIT_ACTION', 'alert')
+
+def restart_bot_gracefully(instance_id, reason):
+    """Stop a bot with SIGTERM and start it again with the same token and config"""
+    bot_data = bot_processes.get(instance_id)
+    if not bot_data:
+        return False
 
+    user_id = bot_data['user_id']
+    account_name = bot_data.get('account_name') or bot_data.get('name', instance_id)
+    config_file = bot_data.get('config_file', 'config.json')
+
+    # Out of bot_processes while it stops, so the reaper doesn't report the exit;
+    # stop_bot cancels the restart by taking it out of restarting_bots
+    bot_processes.pop(instance_id, None)
+    restarting_bots[instance_id] = bot_data
+    status_monitor.invalidate()
+
+    process = bot_data['process']
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    if restarting_bots.pop(instance_id, None) is None:
+        logger.info(f"Bot {instance_id} ({account_name}) was stopped during its restart, not starting it again")
+        return False
+
+    env = os.environ.copy()
+    env["LOKBOT_USER_ID"] = user_id
+    env["LOKBOT_CONFIG"] = config_file
+    env["LOKBOT_INSTANCE_ID"] = instance_id
+    env["LOKBOT_ACCOUNT_NAME"] = account_name
+    ensure_event_channel(env)
+
+    new_process = launch_bot(bot_data['token'], env)
+    log_store.set_owner(instance_id, user_id)
+    watch_bot_output(instance_id, user_id, account_name, new_process)
+    bot_processes[instance_id] = {**bot_data, "process": new_process, "start_time": datetime.now()}
+    status_monitor.invalidate()
+
+    logger.info(f"Restarted bot {instance_id} ({account_name}): {reason}")
+    add_notification(user_id, "bot_restart", "Bot Restarted",
+                     f"Bot {account_name} was restarted: {reason}", account_name=account_name, instance_id=instance_id)
+    return True
+
+def handle_soft_limit(instance_id, limit_name, value, threshold):
+    """Called by the telemetry sampler when a bot stays over a soft limit"""
+    bot_data = bot_processes.get(instance_id)
+    if not bot_data:
+        return
+    account_name = bot_data.get('account_name') or bot_data.get('name', instance_id)
+    reason = f"{limit_name} is {value:g}, over the soft limit of {threshold:g}"
+    logger.warning(f"Bot {instance_id} ({account_name}): {reason}")
+
+    if soft_limit_action == 'restart':
+        threading.Thread(target=restart_bot_gracefully, args=(instance_id, reason), daemon=True).start()
+    else:
+        add_notification(bot_data['user_id'], "warning", "Resource Limit", f"Bot {account_name}: {reason}",
+                         account_name=account_name, instance_id=instance_id)
+
+# Short in-memory RSS/CPU/threads/FD series per instance, sampled from /proc
+process_telemetry = ProcessTelemetry(
+    running_bot_pids,
+    interval=int(os.environ.get('LOKBOT_TELEMETRY_INTERVAL', '10')),
+    history=60,
+    limits=soft_limits_from_env(),
+    on_limit=handle_soft_limit,
+)
+
+# endregion
+
+@app.route('/api/status')
+@login_required
+def get_status():
+    """
+    Status of the user's instances, served from the versioned snapshot
+
+    Supports If-None-Match revalidation and long-polling with ?since=<version>,
+    which waits up to ?timeout= seconds (max 55) for a newer version.
+    """
+    user_id = session['user_id']
+    username = session.get('username', user_id)
+
+    # Validate session integrity
+    if not user_id or not username:
+        session.clear()
+        return jsonify({'error': 'Invalid session'}), 401
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        timeout = min(max(request.args.get('timeout', 25, type=float), 0), 55)
+        version, snapshot = status_monitor.wait_for_change(since, timeout)
+    else:
+        version, snapshot = status_monitor.snapshot()
+
+    # The body depends on who asks, a cached copy of another login must not revalidate
+    admin = is_admin(username)
+    viewer = hashlib.sha1(f'{user_id}:{admin}'.encode()).hexdigest()[:12]
+    etag = f'status-{version}-{viewer}'
+    if request.if_none_match.contains(etag) or (since is not None and version <= since):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add('Cookie')
+        return response
+
+    snapshot = snapshot or {'all_processes': [], 'user_processes': {}}
+    all_processes = snapshot['all_processes']
     response_data = {
-        'user_processes': user_processes,
-        'total_active': total_active
+        'user_processes': snapshot['user_processes'].get(user_id, []),
+        'total_active': len(all_processes),
+        'version': version
     }
 
     # If admin, include all processes
-    if is_admin(username):
+    if admin:
         response_data['all_processes'] = all_processes
 
-    return jsonify(response_data)
+    response = jsonify(response_data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/api/config/delete', methods=['DELETE'])
 @login_required
@@ -2237,7 +2236,9 @@ def delete_config():
             return jsonify({'error': f'Config file {config_file} not found'}), 404
 
         # Delete the file
-        os.remove(config_file)
+        with config_store.lock(config_file):
+            os.remove(config_file)
+        config_store.invalidate(config_file)
         logger.info(f"Config file {config_file} deleted by user {username}")
 
         return jsonify({'success': True, 'message': f'Config file {config_file} deleted successfully'})
@@ -2284,7 +2285,10 @@ def rename_config():
             pass
 
         # Rename the file
-        os.rename(current_name, new_name)
+        with config_store.lock(current_name):
+            os.rename(current_name, new_name)
+        config_store.invalidate(current_name)
+        config_store.invalidate(new_name)
         logger.info(f"Config file {current_name} renamed to {new_name} by user {username}")
 
         # Update user config assignments if applicable
@@ -2302,12 +2306,9 @@ def rename_config():
                         updated_configs.append(new_name)
                     else:
                         updated_configs.append(config)
-                assignments[username] = ','.join(updated_configs)
 
-                # Save updated assignments
-                with open("user_config_assignments.txt", 'w') as f:
-                    for user, config_files in assignments.items():
-                        f.write(f"{user}:{config_files}\n")
+                # Rewrites only this user's line
+                user_directory.set_assignment(username, updated_configs)
 
                 logger.info(f"Updated user config assignments for {username}")
         except Exception as assignment_error:
@@ -2349,8 +2350,7 @@ def handle_config():
 
             # Load the selected config file
             if os.path.exists(selected_config):
-                with open(selected_config, 'r') as f:
-                    config = json.load(f)
+                config = config_store.read(selected_config)
                 logger.info(f"Successfully loaded config {selected_config} for user {username}")
             else:
                 logger.error(f"Config file {selected_config} not found")
@@ -2390,55 +2390,14 @@ def handle_config():
             if 'discord' not in config:
                 config['discord'] = {}
 
-            # Create a backup filename for safety
-            backup_config = f"{selected_config}.backup"
-
-            # Save config with atomic write operation
-            temp_filename = f"{selected_config}.tmp"
-            try:
-                with open(temp_filename, 'w') as f:
-                    json.dump(config, f, indent=2, sort_keys=False, ensure_ascii=False)
-                    f.flush()  # Ensure data is written to disk
-                    os.fsync(f.fileno())  # Force write to disk
-
-                # Move temp file to final location (atomic operation)
-                if os.path.exists(selected_config):
-                    os.rename(selected_config, backup_config)
-                os.rename(temp_filename, selected_config)
-
-                # Verify the file was written correctly
-                with open(selected_config, 'r') as f:
-                    saved_config = json.load(f)
-                    if not saved_config:
-                        raise ValueError("Saved config is empty")
-
-                # Remove backup if verification successful
-                if os.path.exists(backup_config):
-                    os.remove(backup_config)
-
-            except Exception as save_error:
-                # Restore from backup if save failed
-                if os.path.exists(temp_filename):
-                    os.remove(temp_filename)
-                if os.path.exists(backup_config) and not os.path.exists(selected_config):
-                    os.rename(backup_config, selected_config)
-                raise save_error
+            # Atomic write (temp file + rename), the old file stays intact if it fails
+            config_store.save(selected_config, config, source=username,
+                              indent=2, sort_keys=False, ensure_ascii=False)
 
             # Auto-assign the newly created config file to the user
             try:
-                assignments = load_user_config_assignments()
-                if username not in assignments:
-                    assignments[username] = selected_config
-                else:
-                    # Append to existing assignments (comma-separated)
-                    existing_configs = assignments[username]
-                    if selected_config not in existing_configs:
-                        assignments[username] = f"{existing_configs},{selected_config}"
-
-                # Save the updated assignments
-                with open("user_config_assignments.txt", 'w') as f:
-                    for user, config_files in assignments.items():
-                        f.write(f"{user}:{config_files}\n")
+                # Appends to the user's comma-separated assignments if missing
+                user_directory.add_assignment(username, selected_config)
             except Exception as assignment_error:
                 logger.warning(f"Failed to update user assignments: {assignment_error}")
                 # Don't fail the request for assignment errors
@@ -2453,6 +2412,32 @@ def handle_config():
             logger.error(f"Error saving config: {str(e)}")
             return jsonify({'error': f'Failed to save configuration: {str(e)}'}), 500
 
+@app.route('/api/config', methods=['PATCH'])
+@login_required
+def patch_config():
+    """Apply JSON-patch operations to a config file without sending the whole document"""
+    username = session.get('username', session['user_id'])
+    data = request.json or {}
+    selected_config = data.get('config_file', 'config.json')
+    operations = data.get('operations')
+
+    if not has_config_access(username, selected_config):
+        return jsonify({'error': 'Access denied to this config file'}), 403
+    if not os.path.exists(selected_config):
+        return jsonify({'error': f'Config file {selected_config} not found'}), 404
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({'error': 'operations must be a list of JSON-patch operations'}), 400
+
+    try:
+        config_store.patch(selected_config, operations, source=username,
+                           indent=2, sort_keys=False, ensure_ascii=False)
+        return jsonify({'success': True, 'message': f'Configuration {selected_config} updated'})
+    except ConfigPatchError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error patching config {selected_config}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/rally_config', methods=['POST'])
 @login_required
 def update_rally_config():
@@ -2461,47 +2446,32 @@ def update_rally_config():
     config_file = f"data/config_{user_id}.json"
 
     try:
-        # Load existing config
-        if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                config = json.load(f)
-        else:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-
         # Update rally configuration
         rally_type = data.get('rally_type')  # 'join' or 'start'
 
         if rally_type not in ['join', 'start']:
             return jsonify({'error': 'Invalid rally type'}), 400
 
-        if 'rally' not in config:
-            config['rally'] = {}
-
-        if rally_type not in config['rally']:
-            config['rally'][rally_type] = {
-                'enabled': False,
-                'numMarch': 8 if rally_type == 'join' else 6,
-                'level_based_troops': True,
-                'targets': []
-            }
-
-        # Update specific fields
-        if 'enabled' in data:
-            config['rally'][rally_type]['enabled'] = data['enabled']
-
-        if 'numMarch' in data:
-            config['rally'][rally_type]['numMarch'] = data['numMarch']
+        def apply_rally_update(config):
+            if 'rally' not in config:
+                config['rally'] = {}
 
-        if 'level_based_troops' in data:
-            config['rally'][rally_type]['level_based_troops'] = data['level_based_troops']
+            if rally_type not in config['rally']:
+                config['rally'][rally_type] = {
+                    'enabled': False,
+                    'numMarch': 8 if rally_type == 'join' else 6,
+                    'level_based_troops': True,
+                    'targets': []
+                }
 
-        if 'targets' in data:
-            config['rally'][rally_type]['targets'] = data['targets']
+            # Update specific fields
+            for field in ('enabled', 'numMarch', 'level_based_troops', 'targets'):
+                if field in data:
+                    config['rally'][rally_type][field] = data[field]
 
-        # Save config
-        with open(config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        # Read-modify-write under the file lock, starting from the main config if the user has none yet
+        config_store.update(config_file, apply_rally_update,
+                            default=config_store.read('config.json'), source=session.get('username'))
 
         return jsonify({'success': True, 'message': f'Rally {rally_type} configuration updated'})
 
@@ -2758,6 +2728,7 @@ def crystal_limit_notification():
             bot_processes[instance_id]['crystal_limit_reached'] = True
             bot_processes[instance_id]['crystal_limit_message'] = message
             bot_processes[instance_id]['crystal_limit_time'] = datetime.now().isoformat()
+            status_monitor.invalidate()
             logger.info(f"Updated crystal limit status for instance {instance_id}")
 
         # Add to notification system with instance information
@@ -2902,8 +2873,7 @@ def manage_users():
                 return jsonify({'error': 'Super admin access required to create admin users'}), 403
 
             # Check if user already exists
-            users = load_users()
-            if new_username in users:
+            if user_directory.get_user(new_username):
                 return jsonify({'error': 'User already exists'}), 400
 
             # Validate dates if provided
@@ -2930,9 +2900,7 @@ def manage_users():
 
             # Add user to file
             try:
-                created_date = datetime.now().isoformat()
-                with open(USER_FILE, 'a') as f:
-                    f.write(f"\n{new_username}:{new_password}:{max_instances}:{new_role}:{start_date}:{end_date}:{created_date}")
+                user_directory.add_user(new_username, new_password, max_instances, new_role, start_date, end_date)
                 return jsonify({'success': True, 'message': 'User added successfully'})
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
@@ -2970,29 +2938,19 @@ def manage_users():
 
             # Update user in file
             try:
-                users = load_users()
-                if target_username not in users:
-                    return jsonify({'error': 'User not found'}), 404
-
+                changes = {}
                 if new_max_instances is not None:
-                    users[target_username]['max_instances'] = int(new_max_instances)
+                    changes['max_instances'] = int(new_max_instances)
 
                 if new_start_date is not None:
-                    users[target_username]['start_date'] = new_start_date
+                    changes['start_date'] = new_start_date
 
                 if new_end_date is not None:
-                    users[target_username]['end_date'] = new_end_date
-
-                # Rewrite file
-                with open(USER_FILE, 'w') as f:
-                    f.write("# User Management File\n")
-                    f.write("# Format: username:password:max_instances:role:start_date:end_date:created_date\n")
-                    for user, user_data in users.items():
-                        start_date = user_data.get('start_date', '')
-                        end_date = user_data.get('end_date', '')
-                        created_date = user_data.get('created_date', '')
-                        role = user_data.get('role', 'user')
-                        f.write(f"{user}:{user_data['password']}:{user_data['max_instances']}:{role}:{start_date}:{end_date}:{created_date}\n")
+                    changes['end_date'] = new_end_date
+
+                # Rewrites only this user's line
+                if not user_directory.update_user(target_username, **changes):
+                    return jsonify({'error': 'User not found'}), 404
 
                 return jsonify({'success': True, 'message': 'User updated successfully'})
             except Exception as e:
@@ -3009,25 +2967,117 @@ def manage_users():
 
             # Remove user from file
             try:
-                users = load_users()
-                if target_username not in users:
+                if not user_directory.delete_user(target_username):
                     return jsonify({'error': 'User not found'}), 404
 
-                del users[target_username]
-
-                # Rewrite file
-                with open(USER_FILE, 'w') as f:
-                    f.write("# User Management File\n")
-                    f.write("# Format: username:password:max_instances\n")
-                    for user, data in users.items():
-                        f.write(f"{user}:{data['password']}:{data['max_instances']}\n")
-
                 return jsonify({'success': True, 'message': 'User deleted successfully'})
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
 
         return jsonify({'error': 'Invalid action'}), 400
 
+@app.route('/api/admin/telemetry', methods=['GET', 'POST'])
+@login_required
+def admin_telemetry():
+    """Resource time series for every bot, and the soft limits (POST to change them)"""
+    global soft_limit_action
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            if 'limits' in data:
+                process_telemetry.set_limits({name: float(value) for name, value in data['limits'].items() if value})
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({'error': 'limits must map limit names to numbers'}), 400
+        if data.get('action') in ('alert', 'restart'):
+            soft_limit_action = data['action']
+
+    process_telemetry.start()
+    instance_id = request.args.get('instance_id')
+    return jsonify({
+        'interval': process_telemetry.interval,
+        'limits': process_telemetry.limits,
+        'limit_names': list(LIMIT_FIELDS),
+        'action': soft_limit_action,
+        'series': {instance_id: process_telemetry.series(instance_id)} if instance_id else process_telemetry.series(),
+    })
+
+@app.route('/api/bot_health/<instance_id>')
+@login_required
+def get_bot_health(instance_id):
+    """Latest health report (threads, jobs, queues, locks) of one of the user's bots"""
+    bot_data = bot_processes.get(instance_id)
+    if not bot_data:
+        return jsonify({'error': 'Instance not found'}), 404
+    if bot_data.get('user_id') != session['user_id'] and not is_admin(session.get('username')):
+        return jsonify({'error': 'Access denied'}), 403
+
+    report = bot_health.get(instance_id)
+    if not report:
+        return jsonify({'error': 'No health report from this bot yet'}), 404
+    return jsonify(dict(report, age=round(time.time() - report['received'], 1)))
+
+@app.route('/api/admin/profile/<instance_id>', methods=['GET', 'POST'])
+@login_required
+def admin_profile(instance_id):
+    """Start or stop the sampling profiler of a running bot (POST), or get its last profile"""
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    if request.method == 'POST':
+        if instance_id not in bot_processes:
+            return jsonify({'error': 'Instance not found'}), 404
+        if not event_server.is_connected(instance_id):
+            return jsonify({'error': 'Bot is not connected to the event channel'}), 409
+
+        data = request.json or {}
+        action = data.get('action', 'start')
+        if action == 'start':
+            try:
+                rate = int(data.get('rate', 100))
+                duration = float(data.get('duration', 30))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'rate and duration must be numbers'}), 400
+            event_server.send_command(instance_id, 'profile_start', rate=rate, duration=duration)
+            profile = bot_profiles.setdefault(instance_id, {})
+            profile.update(running=True, started=datetime.now().isoformat(), rate=rate, duration=duration)
+        elif action == 'stop':
+            event_server.send_command(instance_id, 'profile_stop')
+        else:
+            return jsonify({'error': 'action must be start or stop'}), 400
+
+    profile = bot_profiles.get(instance_id, {})
+    result = profile.get('result')
+    response = {key: value for key, value in profile.items() if key != 'result'}
+    if result:
+        # Collapsed stacks are served separately, they can be large
+        response['result'] = {key: value for key, value in result.items() if key != 'collapsed'}
+    return jsonify(response)
+
+@app.route('/api/admin/profile/<instance_id>/collapsed')
+@login_required
+def admin_profile_collapsed(instance_id):
+    """Last profile as collapsed stacks, for flamegraph.pl or speedscope"""
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    result = bot_profiles.get(instance_id, {}).get('result')
+    if not result:
+        return jsonify({'error': 'No profile for this instance'}), 404
+    return Response(collapsed_text(result), mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename=profile_{instance_id}.collapsed'
+    })
+
+@app.route('/api/admin/bot_output')
+@login_required
+def admin_bot_output():
+    """Bytes and lines read from each running bot's output"""
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify({'instances': output_reactor.stats()})
+
 @app.route('/api/admin/user_activity_monitor')
 @login_required
 def admin_user_activity_monitor():
@@ -3048,7 +3098,7 @@ def admin_user_activity_monitor():
             user_daily_counters = daily_counters.get(user_id, {}).get(today, {})
 
             # Get notification history (organized by account)
-            user_notification_history = notifications_history.get(user_id, {})
+            user_notification_history = notification_store.get_user_history(user_id)
 
             # Flatten all notifications from all accounts for this user
             all_user_notifications = []
@@ -3341,6 +3391,7 @@ def march_status_update():
             bot_processes[instance_id]['march_limit'] = march_limit
             bot_processes[instance_id]['march_size'] = march_size
             bot_processes[instance_id]['last_march_update'] = timestamp
+            status_monitor.invalidate()
 
             # Ensure the account name is properly set in bot_processes
             if not bot_processes[instance_id].get('account_name') and account_name != 'Bot Instance':
@@ -3404,23 +3455,9 @@ def reset_user_password(username):
         if len(new_password) < 6:
             return jsonify({'error': 'Password must be at least 6 characters long'}), 400
 
-        users = load_users()
-        if username not in users:
-            return jsonify({'error': 'User not found'}), 404
-
         # Update password
-        users[username]['password'] = new_password
-
-        # Rewrite file
-        with open(USER_FILE, 'w') as f:
-            f.write("# User Management File\n")
-            f.write("# Format: username:password:max_instances:role:start_date:end_date:created_date\n")
-            for user, user_data in users.items():
-                start_date = user_data.get('start_date', '')
-                end_date = user_data.get('end_date', '')
-                created_date = user_data.get('created_date', '')
-                role = user_data.get('role', 'user')
-                f.write(f"{user}:{user_data['password']}:{user_data['max_instances']}:{role}:{start_date}:{end_date}:{created_date}\n")
+        if not user_directory.update_user(username, password=new_password):
+            return jsonify({'error': 'User not found'}), 404
 
         logger.info(f"Password reset for user {username} by admin {current_username}")
         return jsonify({'success': True, 'message': f'Password reset successfully for user {username}'})
@@ -3445,19 +3482,9 @@ def manage_user_by_username(username):
             return jsonify({'error': 'max_instances required'}), 400
 
         try:
-            users = load_users()
-            if username not in users:
+            if not user_directory.update_user(username, max_instances=int(new_max_instances)):
                 return jsonify({'error': 'User not found'}), 404
 
-            users[username]['max_instances'] = int(new_max_instances)
-
-            # Rewrite file
-            with open(USER_FILE, 'w') as f:
-                f.write("# User Management File\n")
-                f.write("# Format: username:password:max_instances\n")
-                for user, data in users.items():
-                    f.write(f"{user}:{data['password']}:{data['max_instances']}\n")
-
             return jsonify({'success': True, 'message': 'User updated successfully'})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -3467,19 +3494,9 @@ def manage_user_by_username(username):
             return jsonify({'error': 'Cannot delete admin user'}), 400
 
         try:
-            users = load_users()
-            if username not in users:
+            if not user_directory.delete_user(username):
                 return jsonify({'error': 'User not found'}), 404
 
-            del users[username]
-
-            # Rewrite file
-            with open(USER_FILE, 'w') as f:
-                f.write("# User Management File\n")
-                f.write("# Format: username:password:max_instances\n")
-                for user, data in users.items():
-                    f.write(f"{user}:{data['password']}:{data['max_instances']}\n")
-
             return jsonify({'success': True, 'message': 'User deleted successfully'})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -3522,11 +3539,6 @@ def manage_user_instances(username):
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'}), 400
 
         try:
-            instances = load_user_instances()
-
-            if username not in instances:
-                instances[username] = []
-
             new_instance = {
                 'instance_name': instance_name,
                 'start_date': start_date,
@@ -3535,8 +3547,7 @@ def manage_user_instances(username):
                 'status': 'active'
             }
 
-            instances[username].append(new_instance)
-            save_user_instances(instances)
+            user_directory.add_instance(username, new_instance)
 
             return jsonify({'success': True, 'message': 'Instance added successfully'})
         except Exception as e:
@@ -3555,21 +3566,19 @@ def manage_user_instances(username):
             return jsonify({'error': 'instance_index is required'}), 400
 
         try:
-            instances = load_user_instances()
-
-            if username not in instances or instance_index >= len(instances[username]):
-                return jsonify({'error': 'Instance not found'}), 404
-
+            changes = {}
             if instance_name:
-                instances[username][instance_index]['instance_name'] = instance_name
+                changes['instance_name'] = instance_name
             if start_date:
-                instances[username][instance_index]['start_date'] = start_date
+                changes['start_date'] = start_date
             if end_date:
-                instances[username][instance_index]['end_date'] = end_date
+                changes['end_date'] = end_date
             if status:
-                instances[username][instance_index]['status'] = status
+                changes['status'] = status
 
-            save_user_instances(instances)
+            # Rewrites only this instance's line
+            if not user_directory.update_instance(username, instance_index, **changes):
+                return jsonify({'error': 'Instance not found'}), 404
 
             return jsonify({'success': True, 'message': 'Instance updated successfully'})
         except Exception as e:
@@ -3584,18 +3593,9 @@ def manage_user_instances(username):
             return jsonify({'error': 'instance_index is required'}), 400
 
         try:
-            instances = load_user_instances()
-
-            if username not in instances or instance_index >= len(instances[username]):
+            if not user_directory.delete_instance(username, instance_index):
                 return jsonify({'error': 'Instance not found'}), 404
 
-            del instances[username][instance_index]
-
-            if not instances[username]:
-                del instances[username]
-
-            save_user_instances(instances)
-
             return jsonify({'success': True, 'message': 'Instance deleted successfully'})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -3643,7 +3643,7 @@ def get_notification_stats():
     user_id = session['user_id']
 
     try:
-        user_notifications = notifications_history.get(user_id, {})
+        user_notifications = notification_store.get_user_history(user_id)
 
         # Calculate statistics
         total_notifications = sum(len(notifications) for notifications in user_notifications.values())
@@ -3683,7 +3683,8 @@ def get_notification_stats():
             'today_notifications': today_notifications,
             'total_accounts': total_accounts,
             'account_stats': account_stats,
-            'queue_size': notification_queues.get(user_id, queue.Queue()).qsize() if user_id in notification_queues else 0
+            'queue_size': notification_broker.stats(user_id)['log_size'],
+            'stream_connections': notification_broker.stats(user_id)['subscribers']
         })
 
     except Exception as e:
@@ -3746,43 +3747,42 @@ def get_march_status():
 
                     try:
                         if os.path.exists(config_file):
-                            with open(config_file, 'r') as f:
-                                config = json.load(f)
-
-                                # Get max marches from different configuration sources
-                                march_limits = []
-
-                                # Check rally join config
-                                rally_join_marches = config.get('rally', {}).get('join', {}).get('numMarch', 0)
-                                if rally_join_marches > 0:
-                                    march_limits.append(rally_join_marches)
-
-                                # Check rally start config
-                                rally_start_marches = config.get('rally', {}).get('start', {}).get('numMarch', 0)
-                                if rally_start_marches > 0:
-                                    march_limits.append(rally_start_marches)
-
-                                # Check object scanning max marches
-                                object_scanning_marches = config.get('main', {}).get('object_scanning', {}).get('max_marches', 0)
-                                if object_scanning_marches > 0:
-                                    march_limits.append(object_scanning_marches)
-
-                                # Check socf_thread job for object scanning
-                                for job in config.get('main', {}).get('jobs', []):
-                                    if job.get('name') == 'socf_thread' and job.get('enabled', False):
-                                        job_marches = job.get('kwargs', {}).get('max_marches', 0)
-                                        if job_marches > 0:
-                                            march_limits.append(job_marches)
-
-                                # Use the highest configured march limit
-                                if march_limits:
-                                    max_marches = max(march_limits)
-                                    config_source = config_file
-                                else:
-                                    # Fallback to cached value if available
-                                    if cached_max_marches > 0:
-                                        max_marches = cached_max_marches
-                                        config_source = 'cached'
+                            config = config_store.read(config_file)
+
+                            # Get max marches from different configuration sources
+                            march_limits = []
+
+                            # Check rally join config
+                            rally_join_marches = config.get('rally', {}).get('join', {}).get('numMarch', 0)
+                            if rally_join_marches > 0:
+                                march_limits.append(rally_join_marches)
+
+                            # Check rally start config
+                            rally_start_marches = config.get('rally', {}).get('start', {}).get('numMarch', 0)
+                            if rally_start_marches > 0:
+                                march_limits.append(rally_start_marches)
+
+                            # Check object scanning max marches
+                            object_scanning_marches = config.get('main', {}).get('object_scanning', {}).get('max_marches', 0)
+                            if object_scanning_marches > 0:
+                                march_limits.append(object_scanning_marches)
+
+                            # Check socf_thread job for object scanning
+                            for job in config.get('main', {}).get('jobs', []):
+                                if job.get('name') == 'socf_thread' and job.get('enabled', False):
+                                    job_marches = job.get('kwargs', {}).get('max_marches', 0)
+                                    if job_marches > 0:
+                                        march_limits.append(job_marches)
+
+                            # Use the highest configured march limit
+                            if march_limits:
+                                max_marches = max(march_limits)
+                                config_source = config_file
+                            else:
+                                # Fallback to cached value if available
+                                if cached_max_marches > 0:
+                                    max_marches = cached_max_marches
+                                    config_source = 'cached'
 
                     except Exception as e:
                         logger.debug(f"Could not read config {config_file}: {str(e)}")
@@ -3833,16 +3833,11 @@ def clear_notifications():
 
     try:
         # Clear notifications history
-        if user_id in notifications_history:
-            notifications_history[user_id] = {}
+        notification_store.clear_user(user_id)
+        notification_db.delete(user_id)
 
-        # Clear notification queue
-        if user_id in notification_queues:
-            try:
-                while not notification_queues[user_id].empty():
-                    notification_queues[user_id].get_nowait()
-            except:
-                pass
+        # Clear the live stream log
+        notification_broker.clear(user_id)
 
         # Clear daily counters (optional - user might want to keep these)
         # if user_id in daily_counters:
@@ -3866,35 +3861,11 @@ def clear_instance_notifications():
 
     try:
         # Clear notifications history for specific account
-        if user_id in notifications_history and account_name in notifications_history[user_id]:
-            del notifications_history[user_id][account_name]
-
-        # Clear notification queue items for this account
-        if user_id in notification_queues:
-            try:
-                # Create a new queue with notifications that don't belong to this account
-                old_queue = notification_queues[user_id]
-                new_queue = queue.Queue(maxsize=25)
+        notification_store.clear_account(user_id, account_name)
+        notification_db.delete(user_id, account_name)
 
-                temp_notifications = []
-                while not old_queue.empty():
-                    try:
-                        notification = old_queue.get_nowait()
-                        if notification.get('account_name') != account_name:
-                            temp_notifications.append(notification)
-                    except queue.Empty:
-                        break
-
-                # Put back the notifications that don't belong to the cleared account
-                for notification in temp_notifications:
-                    try:
-                        new_queue.put_nowait(notification)
-                    except queue.Full:
-                        break
-
-                notification_queues[user_id] = new_queue
-            except Exception as e:
-                logger.warning(f"Error filtering notification queue: {str(e)}")
+        # Drop this account's events from the live stream log
+        notification_broker.clear(user_id, lambda notification: notification.get('account_name') == account_name)
 
         logger.info(f"Cleared notifications for user {user_id} account {account_name}")
         return jsonify({'success': True, 'message': f'Notifications cleared for {account_name}'})
@@ -4124,8 +4095,7 @@ def handle_common_troops_config():
 
             # Load the selected config file
             if os.path.exists(selected_config):
-                with open(selected_config, 'r') as f:
-                    config = json.load(f)
+                config = config_store.read(selected_config)
             else:
                 return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
@@ -4150,21 +4120,21 @@ def handle_common_troops_config():
             if not os.path.exists(selected_config):
                 return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
-            # Load config
-            with open(selected_config, 'r') as f:
-                config = json.load(f)
+            with config_store.lock(selected_config):
+                # Load config
+                config = config_store.load(selected_config)
 
-            # Update common troops
-            if 'main' not in config:
-                config['main'] = {}
-            if 'normal_monsters' not in config['main']:
-                config['main']['normal_monsters'] = {}
+                # Update common troops
+                if 'main' not in config:
+                    config['main'] = {}
+                if 'normal_monsters' not in config['main']:
+                    config['main']['normal_monsters'] = {}
 
-            config['main']['normal_monsters']['common_troops'] = troops
+                config['main']['normal_monsters']['common_troops'] = troops
 
-            # Save config
-            with open(selected_config, 'w') as f:
-                json.dump(config, f, indent=2, sort_keys=False, separators=(',', ': '))
+                # Save config
+                config_store.save(selected_config, config, source=username,
+                                  indent=2, sort_keys=False, separators=(',', ': '))
 
             return jsonify({'success': True, 'message': 'Common troops updated successfully'})
         except Exception as e:
@@ -4185,45 +4155,44 @@ def update_alliance_farmer_config():
         if not has_config_access(username, selected_config):
             return jsonify({'error': 'Access denied to this config file'}), 403
 
-        # Load config
-        if os.path.exists(selected_config):
-            with open(selected_config, 'r') as f:
-                config = json.load(f)
-        else:
-            return jsonify({'error': f'Config file {selected_config} not found'}), 404
+        with config_store.lock(selected_config):
+            # Load config
+            if os.path.exists(selected_config):
+                config = config_store.load(selected_config)
+            else:
+                return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
-        # Find alliance_farmer job
-        alliance_job = None
-        for job in config.get('main', {}).get('jobs', []):
-            if job.get('name') == 'alliance_farmer':
-                alliance_job = job
-                break
+            # Find alliance_farmer job
+            alliance_job = None
+            for job in config.get('main', {}).get('jobs', []):
+                if job.get('name') == 'alliance_farmer':
+                    alliance_job = job
+                    break
 
-        if not alliance_job:
-            return jsonify({'error': 'Alliance farmer job not found'}), 404
-
-        # Ensure kwargs exists
-        if 'kwargs' not in alliance_job:
-            alliance_job['kwargs'] = {}
-
-        # Update specific feature
-        if feature_name == 'gift_claim':
-            alliance_job['kwargs']['gift_claim'] = enabled
-        elif feature_name == 'help_all':
-            alliance_job['kwargs']['help_all'] = enabled
-        elif feature_name == 'research_donate':
-            alliance_job['kwargs']['research_donate'] = enabled
-        elif feature_name == 'shop_auto_buy':
-            if enabled:
-                alliance_job['kwargs']['shop_auto_buy_item_code_list'] = alliance_job['kwargs'].get('shop_auto_buy_item_code_list', [10101008])
+            if not alliance_job:
+                return jsonify({'error': 'Alliance farmer job not found'}), 404
+
+            # Ensure kwargs exists
+            if 'kwargs' not in alliance_job:
+                alliance_job['kwargs'] = {}
+
+            # Update specific feature
+            if feature_name == 'gift_claim':
+                alliance_job['kwargs']['gift_claim'] = enabled
+            elif feature_name == 'help_all':
+                alliance_job['kwargs']['help_all'] = enabled
+            elif feature_name == 'research_donate':
+                alliance_job['kwargs']['research_donate'] = enabled
+            elif feature_name == 'shop_auto_buy':
+                if enabled:
+                    alliance_job['kwargs']['shop_auto_buy_item_code_list'] = alliance_job['kwargs'].get('shop_auto_buy_item_code_list', [10101008])
+                else:
+                    alliance_job['kwargs']['shop_auto_buy_item_code_list'] = []
             else:
-                alliance_job['kwargs']['shop_auto_buy_item_code_list'] = []
-        else:
-            return jsonify({'error': 'Invalid feature name'}), 400
+                return jsonify({'error': 'Invalid feature name'}), 400
 
-        # Save config
-        with open(selected_config, 'w') as f:
-            json.dump(config, f, indent=2)
+            # Save config
+            config_store.save(selected_config, config, source=username)
 
         return jsonify({'success': True, 'message': f'Alliance farmer {feature_name} updated successfully'})
 
@@ -4289,8 +4258,7 @@ def handle_socf_objects_config():
 
             # Load the selected config file
             if os.path.exists(selected_config):
-                with open(selected_config, 'r') as f:
-                    config = json.load(f)
+                config = config_store.read(selected_config)
             else:
                 return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
@@ -4330,45 +4298,45 @@ def handle_socf_objects_config():
             if not os.path.exists(selected_config):
                 return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
-            # Load config
-            with open(selected_config, 'r') as f:
-                config = json.load(f)
-
-            # Update socf_thread job targets
-            socf_job_found = False
-            for job in config.get('main', {}).get('jobs', []):
-                if job.get('name') == 'socf_thread':
-                    if 'kwargs' not in job:
-                        job['kwargs'] = {}
-                    job['kwargs']['targets'] = objects
-                    job['kwargs']['radius'] = radius
-                    job['enabled'] = enabled
-                    socf_job_found = True
-                    break
+            with config_store.lock(selected_config):
+                # Load config
+                config = config_store.load(selected_config)
+
+                # Update socf_thread job targets
+                socf_job_found = False
+                for job in config.get('main', {}).get('jobs', []):
+                    if job.get('name') == 'socf_thread':
+                        if 'kwargs' not in job:
+                            job['kwargs'] = {}
+                        job['kwargs']['targets'] = objects
+                        job['kwargs']['radius'] = radius
+                        job['enabled'] = enabled
+                        socf_job_found = True
+                        break
 
-            # If socf_thread job doesn't exist, create it
-            if not socf_job_found:
-                if 'main' not in config:
-                    config['main'] = {}
-                if 'jobs' not in config['main']:
-                    config['main']['jobs'] = []
-
-                config['main']['jobs'].append({
-                    "name": "socf_thread",
-                    "enabled": enabled,
-                    "interval": {"start": 1, "end": 1},
-                    "kwargs": {
-                        "targets": objects,
-                        "radius": radius,
-                        "share_to": {
-                            "chat_channels": [0, 0]
+                # If socf_thread job doesn't exist, create it
+                if not socf_job_found:
+                    if 'main' not in config:
+                        config['main'] = {}
+                    if 'jobs' not in config['main']:
+                        config['main']['jobs'] = []
+
+                    config['main']['jobs'].append({
+                        "name": "socf_thread",
+                        "enabled": enabled,
+                        "interval": {"start": 1, "end": 1},
+                        "kwargs": {
+                            "targets": objects,
+                            "radius": radius,
+                            "share_to": {
+                                "chat_channels": [0, 0]
+                            }
                         }
-                    }
-                })
+                    })
 
-            # Save config
-            with open(selected_config, 'w') as f:
-                json.dump(config, f, indent=2, sort_keys=False, separators=(',', ': '))
+                # Save config
+                config_store.save(selected_config, config, source=username,
+                                  indent=2, sort_keys=False, separators=(',', ': '))
 
             return jsonify({'success': True, 'message': 'Updated socf_thread objects'})
         except Exception as e:
@@ -4399,8 +4367,7 @@ def handle_simple_config():
 
             # Load the selected config file
             if os.path.exists(selected_config):
-                with open(selected_config, 'r') as f:
-                    config = json.load(f)
+                config = config_store.read(selected_config)
             else:
                 return jsonify({'error': f'Config file {selected_config} not found'}), 404
 
@@ -4420,37 +4387,33 @@ def handle_simple_config():
             if not has_config_access(username, selected_config):
                 return jsonify({'error': 'Access denied to this config file'}), 403
 
-            # Load existing config
-            if os.path.exists(selected_config):
-                with open(selected_config, 'r') as f:
-                    full_config = json.load(f)
-            else:
-                full_config = {}
+            with config_store.lock(selected_config):
+                # Load existing config
+                full_config = config_store.load(selected_config, default={})
 
-            # Update the relevant section based on config_type
-            if config_type == 'rally-join':
-                if 'rally' not in full_config:
-                    full_config['rally'] = {}
-                full_config['rally']['join'] = config_data
+                # Update the relevant section based on config_type
+                if config_type == 'rally-join':
+                    if 'rally' not in full_config:
+                        full_config['rally'] = {}
+                    full_config['rally']['join'] = config_data
 
-            elif config_type == 'rally-start':
-                if 'rally' not in full_config:
-                    full_config['rally'] = {}
-                full_config['rally']['start'] = config_data
+                elif config_type == 'rally-start':
+                    if 'rally' not in full_config:
+                        full_config['rally'] = {}
+                    full_config['rally']['start'] = config_data
 
-            elif config_type == 'monster-attack':
-                if 'main' not in full_config:
-                    full_config['main'] = {}
-                full_config['main']['normal_monsters'] = config_data
+                elif config_type == 'monster-attack':
+                    if 'main' not in full_config:
+                        full_config['main'] = {}
+                    full_config['main']['normal_monsters'] = config_data
 
-            elif config_type == 'skills':
-                if 'main' not in full_config:
-                    full_config['main'] = {}
-                full_config['main']['skills'] = config_data
+                elif config_type == 'skills':
+                    if 'main' not in full_config:
+                        full_config['main'] = {}
+                    full_config['main']['skills'] = config_data
 
-            # Save the updated config
-            with open(selected_config, 'w') as f:
-                json.dump(full_config, f, indent=2)
+                # Save the updated config
+                config_store.save(selected_config, full_config, source=username)
 
             return jsonify({'success': True, 'message': f'{config_type} configuration updated successfully'})
 
@@ -4700,16 +4663,8 @@ def create_temp_test_account():
     ]
 
     try:
-        # Load existing assignments
-        assignments = load_user_config_assignments()
-
         # Assign the test config files to this test account
-        assignments[test_id] = ",".join(test_config_files)
-
-        # Save the updated assignments
-        with open("user_config_assignments.txt", 'w') as f:
-            for user, config_files in assignments.items():
-                f.write(f"{user}:{config_files}\n")
+        user_directory.set_assignment(test_id, test_config_files)
 
         logger.info(f"Auto-assigned config files to test account {test_id}: {test_config_files}")
 
@@ -4768,22 +4723,13 @@ def cleanup_expired_test_account(test_id):
             del login_history[test_id]
 
         # Clear notifications
-        if test_id in notifications_history:
-            del notifications_history[test_id]
-        if test_id in notification_queues:
-            del notification_queues[test_id]
+        notification_store.remove_user(test_id)
+        notification_db.delete(test_id)
+        notification_broker.remove_user(test_id)
 
         # Remove config assignments for this test account
         try:
-            assignments = load_user_config_assignments()
-            if test_id in assignments:
-                del assignments[test_id]
-
-                # Save the updated assignments
-                with open("user_config_assignments.txt", 'w') as f:
-                    for user, config_files in assignments.items():
-                        f.write(f"{user}:{config_files}\n")
-
+            if user_directory.remove_assignment(test_id):
                 logger.info(f"Removed config assignments for expired test account {test_id}")
         except Exception as e:
             logger.error(f"Error removing config assignments for test account {test_id}: {str(e)}")
@@ -5059,4 +5005,10 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
 
+    # Listen for bot events from the start rather than on the first launch
+    try:
+        event_server.start()
+    except OSError as e:
+        logger.warning(f"Event channel unavailable, bots will report over HTTP: {e}")
+
     app.run(host='0.0.0.0', port=port, debug=debug_mode, threaded=True)
\ No newline at end of file